@@ -11,6 +11,7 @@ All cached data is PHI-safe (sanitized before storage).
 Now using Azure Cosmos DB (HIPAA BAA compliant).
 """
 
+import time
 import hashlib
 import json
 import logging
@@ -18,7 +19,9 @@ from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
 
 # Azure Cosmos DB (replaces Firebase Firestore)
-from azure_cosmos_db import SERVER_TIMESTAMP
+from cosmos_constants import SERVER_TIMESTAMP
+from ai_telemetry import current_endpoint, record_ai_call
+from ai_model_policy import get_model_policy, run_chat_completion
 
 logger = logging.getLogger("app.ai_cache")
 
@@ -763,7 +766,7 @@ class AICache:
 def get_ai_suggestion_with_cache(
     db,
     prompt: str,
-    model: str = "gpt-4o",
+    model: Optional[str] = None,
     openai_client = None,
     metadata: Optional[Dict[str, Any]] = None,
     patient_context: str = "",
@@ -777,7 +780,7 @@ def get_ai_suggestion_with_cache(
     Args:
         db: Cosmos DB client
         prompt: Sanitized prompt (PHI-safe)
-        model: AI model name (default: gpt-4o)
+        model: Deployment override (default: the endpoint's model policy)
         openai_client: Azure OpenAI client instance
         metadata: Optional metadata for analytics
         patient_context: Patient-specific context (e.g., age/sex demographics) to ensure unique cache per patient profile
@@ -788,10 +791,18 @@ def get_ai_suggestion_with_cache(
     """
     cache = AICache(db)
     patient_id = (metadata or {}).get('patient_id')
+    endpoint = (metadata or {}).get('endpoint') or current_endpoint()
+    policy = get_model_policy(endpoint)
+    if model:
+        policy = policy._replace(deployment=model)
+    model = policy.model
 
     # Try to get from cache first
+    started = time.perf_counter()
     cached_response = cache.get_cached_response(prompt, model, patient_context, patient_id)
     if cached_response:
+        record_ai_call(model=model, latency_ms=(time.perf_counter() - started) * 1000,
+                       cache_tier='cosmos', endpoint=endpoint)
         return cached_response
 
     # Cache miss - call AI API (Azure OpenAI)
@@ -801,8 +812,9 @@ def get_ai_suggestion_with_cache(
 
         # Use create_chat_completion for Azure OpenAI
         # CRITICAL: Use medical/clinical system prompt to avoid content filter false positives
-        resp = openai_client.create_chat_completion(
-            model=model,
+        # Deployment, max_tokens and temperature come from the endpoint's model policy
+        resp = run_chat_completion(
+            openai_client,
             messages=[{
                 "role": "system",
                 "content": (
@@ -819,15 +831,16 @@ def get_ai_suggestion_with_cache(
                 "role": "user",
                 "content": prompt
             }],
-            temperature=0.2,  # Low temperature for consistent, deterministic clinical responses
-            max_tokens=3500  # Increased to 3500 to handle detailed treatment plan outputs
+            endpoint=endpoint,
+            policy=policy,
         )
 
         # Azure OpenAI client returns dict with 'text' field (not 'choices')
         response = resp.get('text', resp.get('content', [{}])[0].get('text', ''))
 
-        # Save to cache for future use
-        cache.save_response(prompt, response, model, metadata, patient_context, user_id)
+        # Save to cache for future use, under the deployment that answered
+        # (the primary, if the small one failed)
+        cache.save_response(prompt, response, resp.get('model') or model, metadata, patient_context, user_id)
 
         return response
 
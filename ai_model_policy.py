@@ -0,0 +1,160 @@
+"""
+Per-endpoint AI model policy: deployment tier, max_tokens, temperature, JSON mode.
+
+Every AI endpoint used to go to the gpt-4o deployment with max_tokens up to
+3500, including one-line dropdown picks and flag classifications. Policies
+are declared here once, matched against the endpoint label used by
+ai_telemetry (metadata 'endpoint', or the Flask view name), first match wins.
+
+Downgrade path: policies marked `downgrade=True` (short, structured outputs)
+run on the small deployment named by AZURE_OPENAI_SMALL_DEPLOYMENT_NAME. If
+that variable is unset, or AI_MODEL_DOWNGRADE=off, everything stays on the
+primary deployment. A failed small-model call is retried once on the primary.
+
+AI_TEMPERATURE and AI_MAX_TOKENS, when set, apply to every endpoint and take
+precedence over the policies' values.
+
+Shadow evaluation: with AI_SHADOW_EVAL_RATE > 0, that fraction of calls on
+downgrade-eligible endpoints is replayed in the background on the other
+tier. Both outputs are written to `ai_shadow_evals` for offline comparison;
+the user only ever sees the served output.
+
+Usage:
+    from ai_model_policy import run_chat_completion
+
+    resp = run_chat_completion(client, messages, endpoint='clinical_flags')
+"""
+
+import os
+import random
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from ai_telemetry import ai_endpoint, current_endpoint
+
+logger = logging.getLogger("app.ai_model_policy")
+
+PRIMARY_DEPLOYMENT = os.environ.get('AZURE_OPENAI_DEPLOYMENT_NAME', 'gpt-4o')
+SMALL_DEPLOYMENT = os.environ.get('AZURE_OPENAI_SMALL_DEPLOYMENT_NAME', '')
+DOWNGRADE_ENABLED = os.environ.get('AI_MODEL_DOWNGRADE', 'on').lower() not in ('off', 'false', '0')
+SHADOW_EVAL_RATE = float(os.environ.get('AI_SHADOW_EVAL_RATE', '0'))
+SHADOW_EVAL_COLLECTION = 'ai_shadow_evals'
+# Deployment-wide overrides of the policies' values (None: use the policy)
+TEMPERATURE_OVERRIDE = float(os.environ['AI_TEMPERATURE']) if os.environ.get('AI_TEMPERATURE') else None
+MAX_TOKENS_OVERRIDE = int(os.environ['AI_MAX_TOKENS']) if os.environ.get('AI_MAX_TOKENS') else None
+
+
+class ModelPolicy(NamedTuple):
+    max_tokens: int
+    temperature: float
+    json_mode: bool = False
+    downgrade: bool = False  # eligible for the small deployment
+    deployment: Optional[str] = None  # pin a specific deployment
+
+    @property
+    def model(self) -> str:
+        """Deployment this policy runs on with the current configuration."""
+        if self.deployment:
+            return self.deployment
+        if self.downgrade and DOWNGRADE_ENABLED and SMALL_DEPLOYMENT:
+            return SMALL_DEPLOYMENT
+        return PRIMARY_DEPLOYMENT
+
+
+DEFAULT_POLICY = ModelPolicy(max_tokens=3500, temperature=0.2)
+
+# (endpoint pattern, policy) -- first match wins
+MODEL_POLICIES = [
+    # Quick Mode JSON pre-fills: short fields and dropdown picks
+    ('quick_mode_*', ModelPolicy(max_tokens=2000, temperature=0.1, json_mode=True, downgrade=True)),
+    # Single-choice classifications
+    ('patho_possible_source', ModelPolicy(max_tokens=800, temperature=0.1, downgrade=True)),
+    ('clinical_flags*', ModelPolicy(max_tokens=1500, temperature=0.2, downgrade=True)),
+    ('chronic_factors*', ModelPolicy(max_tokens=1500, temperature=0.2, downgrade=True)),
+    ('ai_chronic_factors', ModelPolicy(max_tokens=1500, temperature=0.2, downgrade=True)),
+    # Long-form summaries stay on the primary deployment with the full budget
+    ('*summary*', DEFAULT_POLICY),
+]
+
+
+def get_model_policy(endpoint: Optional[str] = None) -> ModelPolicy:
+    endpoint = endpoint or current_endpoint()
+    policy = next((policy for pattern, policy in MODEL_POLICIES if fnmatchcase(endpoint, pattern)),
+                  DEFAULT_POLICY)
+    if TEMPERATURE_OVERRIDE is not None:
+        policy = policy._replace(temperature=TEMPERATURE_OVERRIDE)
+    if MAX_TOKENS_OVERRIDE is not None:
+        policy = policy._replace(max_tokens=MAX_TOKENS_OVERRIDE)
+    return policy
+
+
+def run_chat_completion(client, messages: List[Dict[str, str]], endpoint: Optional[str] = None,
+                        policy: Optional[ModelPolicy] = None, json_mode: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Run a chat completion under the endpoint's policy. Returns the client's
+    response dict; its 'model' is the deployment that actually answered.
+    """
+    endpoint = endpoint or current_endpoint()
+    policy = policy or get_model_policy(endpoint)
+    json_mode = policy.json_mode if json_mode is None else json_mode
+    kwargs = {
+        'messages': messages,
+        'temperature': policy.temperature,
+        'max_tokens': policy.max_tokens,
+        'response_format': {'type': 'json_object'} if json_mode else None,
+    }
+    model = policy.model
+
+    with ai_endpoint(endpoint):
+        try:
+            resp = client.create_chat_completion(model=model, **kwargs)
+        except Exception as e:
+            if model == PRIMARY_DEPLOYMENT:
+                raise
+            logger.warning(f"Small deployment failed for {endpoint} ({type(e).__name__}); retrying on primary")
+            model = PRIMARY_DEPLOYMENT
+            resp = client.create_chat_completion(model=model, **kwargs)
+
+    if policy.downgrade and SMALL_DEPLOYMENT and SHADOW_EVAL_RATE > 0 and random.random() < SHADOW_EVAL_RATE:
+        shadow_model = PRIMARY_DEPLOYMENT if model != PRIMARY_DEPLOYMENT else SMALL_DEPLOYMENT
+        threading.Thread(
+            target=_shadow_eval,
+            args=(client, endpoint, kwargs, resp, shadow_model),
+            daemon=True,
+        ).start()
+    return resp
+
+
+def _shadow_eval(client, endpoint: str, kwargs: Dict[str, Any], served: Dict[str, Any], shadow_model: str) -> None:
+    """Replay a call on the other tier and store both outputs side by side."""
+    try:
+        started = time.perf_counter()
+        with ai_endpoint(f"{endpoint}:shadow"):
+            shadow = client.create_chat_completion(model=shadow_model, **kwargs)
+        shadow_ms = (time.perf_counter() - started) * 1000
+
+        served_text = served.get('text') or ''
+        shadow_text = shadow.get('text') or ''
+        prompt = ''.join(m.get('content', '') for m in kwargs['messages'])
+
+        from azure_cosmos_db import get_cosmos_db
+        get_cosmos_db().collection(SHADOW_EVAL_COLLECTION).add({
+            'endpoint': endpoint,
+            'prompt_hash': hashlib.sha256(prompt.encode('utf-8')).hexdigest(),
+            'served_model': served.get('model'),
+            'served_text': served_text,
+            'served_usage': served.get('usage'),
+            'shadow_model': shadow_model,
+            'shadow_text': shadow_text,
+            'shadow_usage': shadow.get('usage'),
+            'shadow_latency_ms': round(shadow_ms, 1),
+            'exact_match': served_text.strip() == shadow_text.strip(),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        })
+    except Exception as e:
+        logger.warning(f"Shadow evaluation failed for {endpoint}: {e}")
@@ -17,6 +17,7 @@ Design goals:
 - SPECIFIC clinical guidance tied to the exact case presentation
 """
 
+import re
 from typing import Dict, Any, Optional
 
 
@@ -6719,6 +6720,15 @@ IMPORTANT REMINDERS:
 # AI RESPONSE PROCESSING UTILITIES
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Reasoning markers are only recognised at the START of a line, never when
+# embedded in content like "- **Rationale:** ...". Longer labels come first so
+# "Clinical Reasoning Summary:" is not read as "Clinical Reasoning" + text.
+_REASONING_MARKER = re.compile(
+    r'^(?:clinical reasoning summary|clinical reasoning|clinical rationale|rationale|reasoning):',
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
 def split_ai_response(full_text: str) -> Dict[str, Optional[str]]:
     """
     Splits AI output into visible_text (concise suggestions) and reasoning_text (clinical reasoning).
@@ -6756,52 +6766,21 @@ def split_ai_response(full_text: str) -> Dict[str, Optional[str]]:
             "reasoning_text": None
         }
 
-    # Common reasoning section markers (case-insensitive)
-    # NOTE: only match at line-start to avoid splitting on "**Rationale:**" inside content
-    reasoning_markers = [
-        "Clinical Reasoning:",
-        "Clinical Reasoning Summary:",
-        "Rationale:",
-        "Clinical Rationale:",
-        "Reasoning:",
-    ]
-
-    import re
-
-    # Try to find reasoning section marker - only at the START of a line
-    # (not embedded inside bold/list content like "- **Rationale:** ...")
-    split_index = -1
-    matched_marker = None
-
-    for marker in reasoning_markers:
-        # Match marker only at line start, not inside **bold** text
-        pattern = r'(?:^|\n)(' + re.escape(marker) + r')'
-        match = re.search(pattern, full_text, re.IGNORECASE)
-        if match:
-            index = match.start(1)  # position of marker (after the \n)
-            if split_index == -1 or index < split_index:
-                split_index = index
-                matched_marker = marker
-
-    # Split response if reasoning section found
-    if split_index != -1:
-        visible_text = full_text[:split_index].strip()
-
-        # Strip the marker label from reasoning_text
-        # Find the actual start of reasoning content (after the marker and any colons/whitespace)
-        reasoning_start = split_index + len(matched_marker)
-        reasoning_text = full_text[reasoning_start:].strip()
-
+    # Only the first reasoning marker splits; anything after it (including a
+    # references block) stays inside reasoning_text.
+    match = _REASONING_MARKER.search(full_text)
+    if match:
+        reasoning_text = full_text[match.end():].strip()
         return {
-            "visible_text": visible_text,
+            "visible_text": full_text[:match.start()].strip(),
             "reasoning_text": reasoning_text if reasoning_text else None
         }
-    else:
-        # No reasoning section found - return full text as visible
-        return {
-            "visible_text": full_text.strip(),
-            "reasoning_text": None
-        }
+
+    # No reasoning section found - return full text as visible
+    return {
+        "visible_text": full_text.strip(),
+        "reasoning_text": None
+    }
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -0,0 +1,316 @@
+"""
+In-process AI call telemetry: latency, tokens and cost per endpoint.
+
+Every chat completion (and every AI cache hit) is recorded with the endpoint
+it served, the model, prompt/completion tokens, latency, cache tier and
+outcome. Two views are kept per (endpoint, model):
+
+- a rolling window of per-minute histograms (last AI_TELEMETRY_WINDOW_MINUTES),
+  served by get_ai_metrics() for the super-admin metrics endpoint;
+- a cumulative aggregate for the current UTC hour, written to the
+  `ai_telemetry_hourly` container (one document per worker per hour) every
+  AI_TELEMETRY_FLUSH_SECONDS, on hour rollover and at shutdown.
+
+Each Gunicorn worker keeps its own numbers; sum the hourly documents across
+workers for fleet totals. Nothing here ever raises into the AI call path, and
+no prompt or response text is recorded.
+
+Usage:
+    from ai_telemetry import ai_endpoint, record_ai_call
+
+    with ai_endpoint('subjective_present_history'):
+        resp = client.create_chat_completion(...)   # recorded by the client
+
+    record_ai_call(model='gpt-4o', latency_ms=12.0, cache_tier='cosmos')
+"""
+
+import os
+import time
+import atexit
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("app.ai_telemetry")
+
+# USD per million tokens (input, output)
+MODEL_PRICING = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-4': (30.00, 60.00),
+}
+DEFAULT_PRICING = MODEL_PRICING['gpt-4o']
+
+# Histogram bucket upper bounds in milliseconds (last bucket is open-ended)
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 4000, 8000, 15000, 30000, 60000, 120000)
+
+WINDOW_MINUTES = int(os.environ.get('AI_TELEMETRY_WINDOW_MINUTES', '60'))
+FLUSH_SECONDS = float(os.environ.get('AI_TELEMETRY_FLUSH_SECONDS', '300'))
+HOURLY_COLLECTION = 'ai_telemetry_hourly'
+
+_current_endpoint: ContextVar[Optional[str]] = ContextVar('ai_endpoint', default=None)
+
+
+def estimate_cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price_in, price_out = MODEL_PRICING.get(model, DEFAULT_PRICING)
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+@contextmanager
+def ai_endpoint(name: Optional[str]):
+    """Label AI calls made inside the block (e.g. with the metadata 'endpoint')."""
+    if not name:
+        yield
+        return
+    token = _current_endpoint.set(name)
+    try:
+        yield
+    finally:
+        _current_endpoint.reset(token)
+
+
+def current_endpoint() -> str:
+    """Explicit label if set, else the Flask view serving the request."""
+    name = _current_endpoint.get()
+    if name:
+        return name
+    try:
+        from flask import has_request_context, request
+        if has_request_context() and request.endpoint:
+            return request.endpoint
+    except Exception:
+        pass
+    return 'background'
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram with token/cost/outcome counters."""
+
+    __slots__ = ('buckets', 'calls', 'latency_sum_ms', 'latency_max_ms', 'ttft_sum_ms',
+                 'prompt_tokens', 'completion_tokens', 'cost_usd', 'outcomes', 'cache_tiers')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.calls = 0
+        self.latency_sum_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.ttft_sum_ms = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.outcomes: Dict[str, int] = {}
+        self.cache_tiers: Dict[str, int] = {}
+
+    def add(self, latency_ms: float, ttft_ms: float, prompt_tokens: int, completion_tokens: int,
+            cost_usd: float, outcome: str, cache_tier: str) -> None:
+        index = len(LATENCY_BUCKETS_MS)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                index = i
+                break
+        self.buckets[index] += 1
+        self.calls += 1
+        self.latency_sum_ms += latency_ms
+        self.latency_max_ms = max(self.latency_max_ms, latency_ms)
+        self.ttft_sum_ms += ttft_ms
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_usd += cost_usd
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.cache_tiers[cache_tier] = self.cache_tiers.get(cache_tier, 0) + 1
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+        self.calls += other.calls
+        self.latency_sum_ms += other.latency_sum_ms
+        self.latency_max_ms = max(self.latency_max_ms, other.latency_max_ms)
+        self.ttft_sum_ms += other.ttft_sum_ms
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost_usd += other.cost_usd
+        for key, count in other.outcomes.items():
+            self.outcomes[key] = self.outcomes.get(key, 0) + count
+        for key, count in other.cache_tiers.items():
+            self.cache_tiers[key] = self.cache_tiers.get(key, 0) + count
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th percentile (None if empty)."""
+        if not self.calls:
+            return None
+        rank = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else self.latency_max_ms
+        return self.latency_max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        calls = self.calls or 1
+        return {
+            'calls': self.calls,
+            'errors': self.calls - self.outcomes.get('ok', 0),
+            'outcomes': dict(self.outcomes),
+            'cache_tiers': dict(self.cache_tiers),
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cost_usd': round(self.cost_usd, 6),
+            'latency_avg_ms': round(self.latency_sum_ms / calls, 1),
+            'latency_max_ms': round(self.latency_max_ms, 1),
+            'latency_p50_ms': self.percentile(0.50),
+            'latency_p95_ms': self.percentile(0.95),
+            'latency_p99_ms': self.percentile(0.99),
+            'ttft_avg_ms': round(self.ttft_sum_ms / calls, 1),
+            'latency_buckets_ms': list(LATENCY_BUCKETS_MS),
+            'latency_bucket_counts': list(self.buckets),
+        }
+
+
+Key = Tuple[str, str]  # (endpoint, model)
+
+
+class AITelemetry:
+    """Rolling per-minute window plus current-hour aggregate, keyed by (endpoint, model)."""
+
+    def __init__(self, window_minutes: int = WINDOW_MINUTES, flush_seconds: float = FLUSH_SECONDS,
+                 db=None, clock=time.time):
+        self.window_minutes = window_minutes
+        self.flush_seconds = flush_seconds
+        self._db = db
+        self._clock = clock
+        self._lock = threading.Lock()
+        # slot index -> (minute number, {key: histogram})
+        self._minutes: List[Tuple[int, Dict[Key, LatencyHistogram]]] = [(-1, {}) for _ in range(window_minutes)]
+        self._hour = self._hour_key(clock())
+        self._hourly: Dict[Key, LatencyHistogram] = {}
+        self._last_flush = clock()
+        self._worker = f"{socket.gethostname()}-{os.getpid()}"
+
+    @staticmethod
+    def _hour_key(ts: float) -> str:
+        return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y%m%d%H')
+
+    def record(self, endpoint: str, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+               latency_ms: float = 0.0, ttft_ms: Optional[float] = None, cache_tier: str = 'none',
+               outcome: str = 'ok') -> None:
+        now = self._clock()
+        key = (endpoint, model)
+        # Cache hits cost nothing; fresh calls are priced from reported usage
+        cost = estimate_cost_usd(model, prompt_tokens, completion_tokens) if cache_tier == 'none' else 0.0
+        args = (latency_ms, latency_ms if ttft_ms is None else ttft_ms,
+                prompt_tokens, completion_tokens, cost, outcome, cache_tier)
+        to_flush = None
+        with self._lock:
+            minute = int(now // 60)
+            slot = minute % self.window_minutes
+            slot_minute, slot_stats = self._minutes[slot]
+            if slot_minute != minute:
+                slot_stats = {}
+                self._minutes[slot] = (minute, slot_stats)
+            slot_stats.setdefault(key, LatencyHistogram()).add(*args)
+
+            hour = self._hour_key(now)
+            if hour != self._hour:
+                to_flush = (self._hour, self._hourly)
+                self._hour, self._hourly = hour, {}
+                self._last_flush = now
+            self._hourly.setdefault(key, LatencyHistogram()).add(*args)
+
+            if to_flush is None and now - self._last_flush >= self.flush_seconds:
+                to_flush = (self._hour, self._snapshot_hourly())
+                self._last_flush = now
+        if to_flush is not None:
+            threading.Thread(target=self._write_hour, args=to_flush, daemon=True).start()
+
+    def _snapshot_hourly(self) -> Dict[Key, LatencyHistogram]:
+        copy = {}
+        for key, hist in self._hourly.items():
+            clone = LatencyHistogram()
+            clone.merge(hist)
+            copy[key] = clone
+        return copy
+
+    def window(self, minutes: Optional[int] = None) -> Dict[Key, LatencyHistogram]:
+        """Merged histograms for the last `minutes` (default: whole window)."""
+        minutes = min(minutes or self.window_minutes, self.window_minutes)
+        current = int(self._clock() // 60)
+        merged: Dict[Key, LatencyHistogram] = {}
+        with self._lock:
+            for slot_minute, slot_stats in self._minutes:
+                if current - minutes < slot_minute <= current:
+                    for key, hist in slot_stats.items():
+                        merged.setdefault(key, LatencyHistogram()).merge(hist)
+        return merged
+
+    def metrics(self, minutes: Optional[int] = None) -> Dict[str, Any]:
+        """JSON-ready rolling-window metrics, per endpoint/model and in total."""
+        merged = self.window(minutes)
+        total = LatencyHistogram()
+        rows = []
+        for (endpoint, model), hist in merged.items():
+            total.merge(hist)
+            rows.append({'endpoint': endpoint, 'model': model, **hist.to_dict()})
+        rows.sort(key=lambda r: r['cost_usd'], reverse=True)
+        return {
+            'worker': self._worker,
+            'window_minutes': min(minutes or self.window_minutes, self.window_minutes),
+            'total': total.to_dict(),
+            'endpoints': rows,
+        }
+
+    def flush(self) -> None:
+        """Write the current hour's aggregate now (called at shutdown)."""
+        with self._lock:
+            hour, hourly = self._hour, self._snapshot_hourly()
+            self._last_flush = self._clock()
+        self._write_hour(hour, hourly)
+
+    def _write_hour(self, hour: str, hourly: Dict[Key, LatencyHistogram]) -> None:
+        if not hourly:
+            return
+        try:
+            if self._db is None:
+                from azure_cosmos_db import get_cosmos_db
+                self._db = get_cosmos_db()
+            total = LatencyHistogram()
+            endpoints = []
+            for (endpoint, model), hist in hourly.items():
+                total.merge(hist)
+                endpoints.append({'endpoint': endpoint, 'model': model, **hist.to_dict()})
+            # Cumulative for the hour, so rewriting the same document is idempotent
+            self._db.collection(HOURLY_COLLECTION).document(f"{hour}_{self._worker}").set({
+                'hour': hour,
+                'worker': self._worker,
+                'total': total.to_dict(),
+                'endpoints': endpoints,
+                'updated_at': datetime.now(timezone.utc).isoformat(),
+            })
+        except Exception as e:
+            logger.warning(f"Could not write AI telemetry for hour {hour}: {e}")
+
+
+_telemetry = AITelemetry()
+atexit.register(_telemetry.flush)
+
+
+def record_ai_call(model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                   latency_ms: float = 0.0, ttft_ms: Optional[float] = None,
+                   cache_tier: str = 'none', outcome: str = 'ok',
+                   endpoint: Optional[str] = None) -> None:
+    """Record one AI completion or cache hit. Never raises."""
+    try:
+        _telemetry.record(endpoint or current_endpoint(), model or 'unknown',
+                          int(prompt_tokens or 0), int(completion_tokens or 0),
+                          float(latency_ms), ttft_ms, cache_tier, outcome)
+    except Exception as e:
+        logger.debug(f"AI telemetry record failed: {e}")
+
+
+def get_ai_metrics(minutes: Optional[int] = None) -> Dict[str, Any]:
+    return _telemetry.metrics(minutes)
@@ -25,6 +25,8 @@ import firebase_admin
 from firebase_admin import auth, credentials
 from firebase_admin.exceptions import FirebaseError
 from azure_cosmos_db import get_cosmos_db
+from user_cache import get_user_profile, resolve_firebase_user
+from firebase_token_cache import FirebaseTokenCache, TokenRevokedError, UserDisabledError
 
 logger = logging.getLogger("app.auth")
 
@@ -63,10 +65,41 @@ except ValueError:
 
 
 # ─── FIREBASE ID TOKEN VERIFICATION ────────────────────────────────────
+def _verify_token_signature(id_token):
+    """Verify signature, expiry, issuer and audience (no revocation round trip)."""
+    decoded_token = auth.verify_id_token(id_token, check_revoked=False)
+
+    # Validate issuer and audience for additional security
+    expected_issuer = f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
+    if decoded_token.get('iss') != expected_issuer:
+        raise ValueError(f"Invalid token issuer. Expected {expected_issuer}")
+
+    if decoded_token.get('aud') != FIREBASE_PROJECT_ID:
+        raise ValueError(f"Invalid token audience. Expected {FIREBASE_PROJECT_ID}")
+
+    return decoded_token
+
+
+def _fetch_token_states(uids):
+    """Batch-fetch (tokens_valid_after seconds, disabled) for uids from Firebase."""
+    result = auth.get_users([auth.UidIdentifier(uid) for uid in uids])
+    return {
+        user.uid: ((user.tokens_valid_after_timestamp or 0) / 1000, user.disabled)
+        for user in result.users
+    }
+
+
+_token_cache = FirebaseTokenCache(verify=_verify_token_signature, fetch_token_states=_fetch_token_states)
+
+
 def verify_firebase_token(id_token):
     """
     Verify Firebase ID token and return decoded claims.
 
+    Verified tokens are cached until they expire and revocation state comes
+    from a locally synced tokens_valid_after table (firebase_token_cache),
+    so repeat requests don't make a round trip to Firebase.
+
     Args:
         id_token: The Firebase ID token from the Authorization header
 
@@ -76,18 +109,31 @@ def verify_firebase_token(id_token):
     Raises:
         FirebaseError: If token verification fails
     """
-    # Verify the token with revocation check enabled
-    decoded_token = auth.verify_id_token(id_token, check_revoked=True)
+    try:
+        return _token_cache.verify(id_token)
+    except TokenRevokedError:
+        raise auth.RevokedIdTokenError('The Firebase ID token has been revoked.')
+    except UserDisabledError:
+        raise auth.UserDisabledError('The user record is disabled.')
 
-    # Validate issuer and audience for additional security
-    expected_issuer = f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
-    if decoded_token.get('iss') != expected_issuer:
-        raise ValueError(f"Invalid token issuer. Expected {expected_issuer}")
 
-    if decoded_token.get('aud') != FIREBASE_PROJECT_ID:
-        raise ValueError(f"Invalid token audience. Expected {FIREBASE_PROJECT_ID}")
+def revoke_firebase_tokens(firebase_uid):
+    """
+    Revoke a user's refresh tokens (logout everywhere, password change) and
+    reject their existing ID tokens on this worker immediately. Other
+    workers see the revocation on their next poll.
+    """
+    if not firebase_uid:
+        return
+    try:
+        auth.revoke_refresh_tokens(firebase_uid)
+    except Exception as e:
+        logger.warning(f"Failed to revoke Firebase refresh tokens: {type(e).__name__}")
+    _token_cache.mark_revoked(firebase_uid)
 
-    return decoded_token
+
+def get_token_cache_stats():
+    return _token_cache.stats()
 
 
 # ─── AUTHENTICATION DECORATOR ──────────────────────────────────────────
@@ -166,22 +212,9 @@ def require_firebase_auth(f):
             firebase_email = decoded_token.get('email')
             firebase_uid = decoded_token.get('uid')
             try:
-                db = get_cosmos_db()
-                user_data = None
-
-                # Prefer lookup by firebase_uid field
-                users_with_uid = db.collection('users').where(
-                    'firebase_uid', '==', firebase_uid
-                ).limit(1).stream()
-                for doc in users_with_uid:
-                    user_data = doc.to_dict()
-                    break
-
-                # Fall back to email-keyed document
-                if not user_data and firebase_email:
-                    user_doc = db.collection('users').document(firebase_email).get()
-                    if user_doc.exists:
-                        user_data = user_doc.to_dict()
+                # Document carrying this firebase_uid, else the email-keyed
+                # one (cached, see user_cache)
+                user_data = resolve_firebase_user(firebase_uid, firebase_email, get_cosmos_db())
 
                 if user_data is None:
                     user_data = {}
@@ -304,24 +337,11 @@ def require_auth(f):
                     firebase_uid = decoded_token.get('uid')
                     firebase_email = decoded_token.get('email')
 
-                    # Try to find user by Firebase UID first, then by email
-                    db = get_cosmos_db()
-
-                    user_doc = None
-                    # Check if user document exists with firebase_uid field
-                    users_with_uid = db.collection('users').where('firebase_uid', '==', firebase_uid).limit(1).stream()
-                    for doc in users_with_uid:
-                        user_doc = doc
-                        break
-
-                    # Fall back to email lookup
-                    if not user_doc:
-                        user_doc = db.collection('users').document(firebase_email).get()
-                        if not user_doc.exists:
-                            logger.warning(f"User not found in Cosmos DB for Firebase UID {firebase_uid}")
-                            return jsonify({'error': 'User not found'}), 404
-
-                    user_data = user_doc.to_dict()
+                    # Find user by Firebase UID first, then by email (cached)
+                    user_data = resolve_firebase_user(firebase_uid, firebase_email, get_cosmos_db())
+                    if user_data is None:
+                        logger.warning(f"User not found in Cosmos DB for Firebase UID {firebase_uid}")
+                        return jsonify({'error': 'User not found'}), 404
 
                     # Check approval status
                     if user_data.get('is_super_admin', 0) != 1:
@@ -366,16 +386,13 @@ def require_auth(f):
                 return jsonify({'error': 'Authentication required'}), 401
             return redirect('/login') if request.accept_mimetypes.accept_html else (jsonify({'error': 'Authentication required'}), 401)
 
-        # Validate session
-        db = get_cosmos_db()
-        user_doc = db.collection('users').document(user_id).get()
+        # Validate session (profile cached per worker; see user_cache)
+        user_data = get_user_profile(user_id, get_cosmos_db())
 
-        if not user_doc.exists:
+        if user_data is None:
             session.clear()
             return redirect('/login') if request.accept_mimetypes.accept_html else (jsonify({'error': 'User not found'}), 404)
 
-        user_data = user_doc.to_dict()
-
         # Check approval status (super admins bypass this)
         if user_data.get('is_super_admin', 0) != 1:
             if user_data.get('approved', 0) != 1:
@@ -0,0 +1,162 @@
+"""
+Per-patient assessment progress, kept on the patient document.
+
+The patient list used to draw its progress bars by probing every section
+collection for every patient (ten `limit(1)` queries per patient). Each
+patient document now carries a summary of its own progress:
+
+    'assessment_progress': {
+        'mask': <int>,                           # one bit per section saved
+        'updated': {<collection>: <iso time>},   # last save per section
+    }
+
+It is maintained where sections are saved: the web save routes record the
+section in the same conditional patch that bumps context_version (see
+invalidate_patient_context), and the mobile PATCH route records the
+sections it writes with the same patches after its update. New patients
+start with an empty summary.
+
+Patients created before the summary existed have none until
+backfill_assessment_progress.py gives them one; saves never create a
+partial summary, and readers fall back to probing the collections for
+patients without one. The same script checks stored summaries against the
+collections (--check).
+
+Bit positions are stored in the database: only ever append to
+PROGRESS_SECTIONS.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("app.assessment_progress")
+
+PROGRESS_FIELD = 'assessment_progress'
+
+# (collection, flag in patient list responses, nested key written by mobile saves)
+PROGRESS_SECTIONS = (
+    ('subjective_examination', 'subjectiveExamination', 'subjectiveExamination'),
+    ('patient_perspectives', 'patientPerspectives', 'patientPerspectives'),
+    ('patho_mechanism', 'pathoMechanism', 'pathoMechanism'),
+    ('chronic_diseases', 'chronicDiseases', 'chronicDiseaseFactors'),
+    ('clinical_flags', 'clinicalFlags', 'clinicalFlags'),
+    ('objective_assessments', 'objectiveAssessment', 'objectiveAssessment'),
+    ('provisional_diagnosis', 'provisionalDiagnosis', 'provisionalDiagnosis'),
+    ('initial_plan', 'initialPlan', 'initialPlan'),
+    ('smart_goals', 'smartGoals', 'smartGoals'),
+    ('treatment_plan', 'treatmentPlan', 'treatmentPlan'),
+)
+SECTION_BITS = {collection: 1 << i for i, (collection, _, _) in enumerate(PROGRESS_SECTIONS)}
+
+
+def empty_progress() -> Dict[str, Any]:
+    """Summary for a patient with nothing saved yet (set at creation)."""
+    return {'mask': 0, 'updated': {}}
+
+
+def merge_progress(progress: Optional[Dict[str, Any]], collections: Iterable[str],
+                   at: Optional[str] = None) -> Dict[str, Any]:
+    """Return a copy of progress with the given sections marked as saved at `at`."""
+    at = at or datetime.now(timezone.utc).isoformat()
+    progress = progress or empty_progress()
+    mask = int(progress.get('mask', 0))
+    updated = dict(progress.get('updated') or {})
+    for collection in collections:
+        bit = SECTION_BITS.get(collection)
+        if bit is None:
+            continue
+        mask |= bit
+        if at > (updated.get(collection) or ''):
+            updated[collection] = at
+    return {'mask': mask, 'updated': updated}
+
+
+def mobile_sections(fields: Dict[str, Any]) -> List[str]:
+    """Collections whose mobile nested key is present (and non-empty) in fields."""
+    return [collection for collection, _, key in PROGRESS_SECTIONS if fields.get(key)]
+
+
+def progress_flags(patient: Dict[str, Any]) -> Optional[Dict[str, bool]]:
+    """
+    Patient-list progress flags from the patient document alone, or None if
+    the patient has no summary yet (not backfilled).
+    """
+    progress = patient.get(PROGRESS_FIELD)
+    if not isinstance(progress, dict):
+        return None
+    mask = int(progress.get('mask', 0))
+    return {flag: True for collection, flag, key in PROGRESS_SECTIONS
+            if mask & SECTION_BITS[collection] or patient.get(key)}
+
+
+def section_saved(patient: Dict[str, Any], collection: str) -> Optional[bool]:
+    """Whether the summary marks `collection` saved; None if there is no summary."""
+    progress = patient.get(PROGRESS_FIELD)
+    if not isinstance(progress, dict):
+        return None
+    return bool(int(progress.get('mask', 0)) & SECTION_BITS[collection])
+
+
+def record_section_saved(patient_ref: Any, collection: str, at: Optional[str] = None,
+                         increments: Optional[Dict[str, float]] = None) -> bool:
+    """
+    Mark a section saved on the patient's summary with conditional patches
+    (no read): set the bit on first save, otherwise just move the timestamp.
+    `increments` ride along on whichever patch applies. Returns False,
+    without writing, if the patient has no summary yet or the collection
+    isn't a tracked section.
+    """
+    if collection not in SECTION_BITS:
+        return False
+    at = at or datetime.now(timezone.utc).isoformat()
+    updated_path = f'{PROGRESS_FIELD}.updated.{collection}'
+    # First save of this section: usual case during an initial assessment
+    if patient_ref.patch_if({updated_path: at},
+                            [(PROGRESS_FIELD, 'exists', None), (updated_path, 'missing', None)],
+                            increments={**(increments or {}), f'{PROGRESS_FIELD}.mask': SECTION_BITS[collection]}):
+        return True
+    return patient_ref.patch_if({updated_path: at}, [(updated_path, 'exists', None)], increments=increments)
+
+
+def compute_progress(db: Any, patient: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Rebuild a patient's summary from the section collections (and the mobile
+    nested keys on the patient document). One query per section.
+    """
+    patient_id = patient.get('patient_id') or patient.get('id')
+    progress = empty_progress()
+    for collection, _, key in PROGRESS_SECTIONS:
+        docs = db.collection(collection).where('patient_id', '==', patient_id) \
+            .order_by('timestamp', direction='DESCENDING').limit(1).get()
+        if docs:
+            at = docs[0].to_dict().get('timestamp')
+            progress = merge_progress(progress, [collection], at if isinstance(at, str) else None)
+        elif patient.get(key):
+            # Mobile saves aren't timestamped per section: creation time is
+            # a lower bound
+            at = patient.get('created_at')
+            progress = merge_progress(progress, [collection], at if isinstance(at, str) else None)
+    return progress
+
+
+def progress_mismatches(stored: Optional[Dict[str, Any]], expected: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    (collection, problem) pairs where a stored summary disagrees with one
+    rebuilt by compute_progress: 'missing' (saved but not marked),
+    'unexpected' (marked but nothing saved) or 'stale' (older timestamp).
+    """
+    if not isinstance(stored, dict):
+        return [('*', 'no summary')]
+    stored_mask = int(stored.get('mask', 0))
+    stored_updated = stored.get('updated') or {}
+    problems = []
+    for collection, _, _ in PROGRESS_SECTIONS:
+        bit = SECTION_BITS[collection]
+        if expected['mask'] & bit and not stored_mask & bit:
+            problems.append((collection, 'missing'))
+        elif stored_mask & bit and not expected['mask'] & bit:
+            problems.append((collection, 'unexpected'))
+        elif (stored_updated.get(collection) or '') < (expected['updated'].get(collection) or ''):
+            problems.append((collection, 'stale'))
+    return problems
@@ -5,16 +5,36 @@ Provides Firestore-compatible API for minimal code changes
 """
 
 import os
+import json
 import uuid
 import logging
 from datetime import datetime, timezone
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Sequence, Tuple
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
 from azure.cosmos.partition_key import NonePartitionKeyValue
 
+# Constants for Firestore compatibility
+from cosmos_constants import SERVER_TIMESTAMP, DELETE_FIELD
+
 logger = logging.getLogger("app.azure_cosmos_db")
 
 
+def _condition_clauses(conditions: Sequence[Tuple[str, str, Any]]) -> List[str]:
+    """SQL filter clauses for patch conditions (see CosmosDBDocumentReference.patch_if)."""
+    clauses = []
+    for field, op, value in conditions:
+        literal = json.dumps(value)
+        if op == 'exists':
+            clauses.append(f'IS_DEFINED(c.{field})')
+        elif op == 'missing':
+            clauses.append(f'NOT IS_DEFINED(c.{field})')
+        elif op == '!=':
+            clauses.append(f'(NOT IS_DEFINED(c.{field}) OR c.{field} != {literal})')
+        else:
+            clauses.append(f'c.{field} {"=" if op == "==" else op} {literal}')
+    return clauses
+
+
 class CosmosDBDocument:
     """Wrapper class to mimic Firestore DocumentSnapshot"""
 
@@ -49,9 +69,9 @@ class CosmosDBQuery:
         self.container = container
         self.query_parts = []
         self.parameters = parameters or []
-        self.order_field = None
-        self.order_direction = "ASC"
+        self.order_fields: List[Tuple[str, str]] = []
         self.limit_count = None
+        self.projection: Optional[List[str]] = None
 
         if base_query:
             self.query_parts.append(base_query)
@@ -89,9 +109,12 @@ class CosmosDBQuery:
         return self
 
     def order_by(self, field: str, direction: str = "ASCENDING") -> 'CosmosDBQuery':
-        """Add ORDER BY clause (Firestore compatibility)"""
-        self.order_field = field
-        self.order_direction = "ASC" if direction == "ASCENDING" else "DESC"
+        """
+        Add ORDER BY clause (Firestore compatibility). Repeated calls sort by
+        several fields, which needs a matching composite index (see
+        COMPOSITE_INDEXES).
+        """
+        self.order_fields.append((field, "ASC" if direction == "ASCENDING" else "DESC"))
         return self
 
     def limit(self, count: int) -> 'CosmosDBQuery':
@@ -99,19 +122,32 @@ class CosmosDBQuery:
         self.limit_count = count
         return self
 
-    def get(self) -> List[CosmosDBDocument]:
-        """Execute query and return documents"""
-        # Build full SQL query
-        query = "SELECT * FROM c"
+    def select(self, *fields: str) -> 'CosmosDBQuery':
+        """Return only these top-level fields (plus id) instead of whole documents"""
+        self.projection = list(fields)
+        return self
+
+    def _build_sql(self) -> str:
+        if self.projection is not None:
+            fields = ['id'] + [field for field in self.projection if field != 'id']
+            query = "SELECT " + ", ".join(f"c.{field}" for field in fields) + " FROM c"
+        else:
+            query = "SELECT * FROM c"
 
         if self.query_parts:
             query += " WHERE " + " AND ".join(self.query_parts)
 
-        if self.order_field:
-            query += f" ORDER BY c.{self.order_field} {self.order_direction}"
+        if self.order_fields:
+            query += " ORDER BY " + ", ".join(f"c.{field} {direction}" for field, direction in self.order_fields)
 
         if self.limit_count:
             query += f" OFFSET 0 LIMIT {self.limit_count}"
+        return query
+
+    def get(self) -> List[CosmosDBDocument]:
+        """Execute query and return documents"""
+        # Build full SQL query
+        query = self._build_sql()
 
         # Log the query for debugging (especially for notifications)
         logger.debug(f"[COSMOS QUERY] SQL: {query}")
@@ -136,6 +172,34 @@ class CosmosDBQuery:
         """Stream query results (Firestore compatibility)"""
         return self.get()
 
+    def count(self) -> int:
+        """Number of matching documents (served from the index; ignores order and limit)"""
+        query = "SELECT VALUE COUNT(1) FROM c"
+        if self.query_parts:
+            query += " WHERE " + " AND ".join(self.query_parts)
+        items = list(self.container.query_items(
+            query=query,
+            parameters=self.parameters,
+            enable_cross_partition_query=True
+        ))
+        return int(items[0]) if items else 0
+
+    def page(self, page_size: int, continuation_token: Optional[str] = None) -> Tuple[List[CosmosDBDocument], Optional[str]]:
+        """
+        One page of results plus the continuation token for the next page
+        (None after the last page). For jobs that walk large result sets
+        and need to resume where they stopped.
+        """
+        items = self.container.query_items(
+            query=self._build_sql(),
+            parameters=self.parameters,
+            enable_cross_partition_query=True,
+            max_item_count=page_size,
+        )
+        pager = items.by_page(continuation_token)
+        page = list(next(pager, []))
+        return [CosmosDBDocument(item['id'], item, True) for item in page], pager.continuation_token
+
 
 class CosmosDBDocumentReference:
     """Document reference for Cosmos DB (Firestore compatibility)"""
@@ -144,8 +208,14 @@ class CosmosDBDocumentReference:
         self.container = container
         self.id = document_id
 
-    def get(self) -> CosmosDBDocument:
-        """Get document by ID"""
+    def get(self, id_is_partition_key: bool = False) -> CosmosDBDocument:
+        """
+        Get document by ID.
+
+        id_is_partition_key: the container is partitioned on /id, so a miss
+        on the point read means the document doesn't exist -- skip the
+        cross-partition fallback query.
+        """
         try:
             # For users collection, partition key is /userId (same as id/email)
             # For other collections, partition key is /id
@@ -155,6 +225,8 @@ class CosmosDBDocumentReference:
             )
             return CosmosDBDocument(self.id, item, True)
         except exceptions.CosmosResourceNotFoundError:
+            if id_is_partition_key:
+                return CosmosDBDocument(self.id, {}, False)
             # Document not found with direct read, try query as fallback
             try:
                 query = f"SELECT * FROM c WHERE c.id = @id"
@@ -226,6 +298,21 @@ class CosmosDBDocumentReference:
         """Update document fields"""
         self.set(data, merge=True)
 
+    def create(self, data: Dict[str, Any]) -> bool:
+        """
+        Create the document only if it doesn't exist yet (no read). Returns
+        False if a document with this id is already there, so two racing
+        creators can't overwrite each other the way set() would.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        doc_data = {k: now if v == SERVER_TIMESTAMP else v for k, v in data.items() if v is not None}
+        doc_data['id'] = self.id
+        try:
+            self.container.create_item(body=doc_data)
+            return True
+        except exceptions.CosmosResourceExistsError:
+            return False
+
     def _find_actual_partition_key(self) -> Optional[Any]:
         """
         Point operations (patch_item/delete_item) 404 if the supplied
@@ -275,6 +362,7 @@ class CosmosDBDocumentReference:
         min_value: Optional[float] = None,
         max_value: Optional[float] = None,
         also_set: Optional[Dict[str, Any]] = None,
+        conditions: Sequence[Tuple[str, str, Any]] = (),
     ) -> "tuple[bool, Optional[float]]":
         """
         Atomically increment (or decrement) a numeric field via a Cosmos DB
@@ -288,7 +376,8 @@ class CosmosDBDocumentReference:
         evaluated and applied by Cosmos DB itself against the value at the
         moment the patch executes -- not a value read moments earlier in
         Python -- so two concurrent callers can't both succeed past the
-        limit.
+        limit. `conditions` adds further checks on other fields, in the
+        same form as patch_if().
 
         Returns (applied, new_value). new_value is None when the increment
         was rejected.
@@ -298,12 +387,13 @@ class CosmosDBDocumentReference:
             for key, value in also_set.items():
                 patch_operations.append({"op": "set", "path": f"/{key}", "value": value})
 
-        conditions = []
+        clauses = []
         if min_value is not None:
-            conditions.append(f'(IS_DEFINED(c.{field}) ? c.{field} : 0) >= {min_value}')
+            clauses.append(f'(IS_DEFINED(c.{field}) ? c.{field} : 0) >= {min_value}')
         if max_value is not None:
-            conditions.append(f'(IS_DEFINED(c.{field}) ? c.{field} : 0) < {max_value}')
-        filter_predicate = f'FROM c WHERE {" AND ".join(conditions)}' if conditions else None
+            clauses.append(f'(IS_DEFINED(c.{field}) ? c.{field} : 0) < {max_value}')
+        clauses.extend(_condition_clauses(conditions))
+        filter_predicate = f'FROM c WHERE {" AND ".join(clauses)}' if clauses else None
 
         try:
             updated_item = self.container.patch_item(
@@ -339,14 +429,69 @@ class CosmosDBDocumentReference:
             logger.error(f"Error incrementing {field} on document {self.id}: {e}", exc_info=True)
             raise
 
-    def delete(self) -> None:
-        """Delete document"""
+    def patch_if(self, fields: Dict[str, Any], conditions: Sequence[Tuple[str, str, Any]] = (),
+                 increments: Optional[Dict[str, float]] = None) -> bool:
+        """
+        Set fields (and add to numeric `increments`) with one conditional
+        patch (no read). conditions are (field, op, value) tuples that must
+        all hold on the stored document when Cosmos DB applies the patch;
+        '!=' also matches a missing field, and the 'exists' / 'missing' ops
+        ignore the value. Dotted names ('a.b') address nested fields.
+        At most 10 operations per patch (Cosmos DB limit).
+
+        Returns False if a condition wasn't met or the document doesn't exist.
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        patch_operations = [
+            {"op": "set", "path": "/" + key.replace('.', '/'), "value": now if value == SERVER_TIMESTAMP else value}
+            for key, value in fields.items()
+        ]
+        for key, delta in (increments or {}).items():
+            patch_operations.append({"op": "incr", "path": "/" + key.replace('.', '/'), "value": delta})
+        clauses = _condition_clauses(conditions)
+        filter_predicate = f'FROM c WHERE {" AND ".join(clauses)}' if clauses else None
+
+        try:
+            self.container.patch_item(
+                item=self.id,
+                partition_key=self.id,
+                patch_operations=patch_operations,
+                filter_predicate=filter_predicate,
+            )
+            return True
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code == 412:
+                return False
+            if e.status_code == 404:
+                # Same partition-key fallback as increment_if()
+                actual_pk = self._find_actual_partition_key()
+                if actual_pk is None:
+                    return False
+                try:
+                    self.container.patch_item(
+                        item=self.id,
+                        partition_key=actual_pk,
+                        patch_operations=patch_operations,
+                        filter_predicate=filter_predicate,
+                    )
+                    return True
+                except exceptions.CosmosHttpResponseError as retry_e:
+                    if retry_e.status_code == 412:
+                        return False
+                    raise
+            logger.error(f"Error patching document {self.id}: {e}", exc_info=True)
+            raise
+
+    def delete(self, id_is_partition_key: bool = False) -> None:
+        """Delete document (a missing one is a no-op); id_is_partition_key as for get()"""
         try:
             self.container.delete_item(
                 item=self.id,
                 partition_key=self.id
             )
         except exceptions.CosmosResourceNotFoundError:
+            if id_is_partition_key:
+                return
             # self.id may not be this document's real partition key (see
             # get()'s identical fallback) -- confirm it's actually missing
             # before treating the delete as a no-op, otherwise a
@@ -363,6 +508,27 @@ class CosmosDBDocumentReference:
             raise
 
 
+# Containers whose documents expire through their own `ttl` field
+TTL_CONTAINERS = {'login_lockouts', 'followup_schedule'}
+
+# Multi-field ORDER BY needs a composite index; one index serves its own
+# order and the exact reverse. Existing containers pick these up through
+# CosmosDBCollection.ensure_composite_indexes().
+COMPOSITE_INDEXES = {
+    'patients': [
+        [('created_at', 'ascending'), ('id', 'ascending')],
+        [('name_sort', 'ascending'), ('id', 'ascending')],
+        [('status', 'ascending'), ('created_at', 'ascending'), ('id', 'ascending')],
+        [('status', 'ascending'), ('name_sort', 'ascending'), ('id', 'ascending')],
+    ],
+}
+
+
+def _composite_index_policy(container_name: str) -> List[List[Dict[str, str]]]:
+    return [[{'path': f'/{field}', 'order': order} for field, order in index]
+            for index in COMPOSITE_INDEXES.get(container_name, [])]
+
+
 class CosmosDBCollection:
     """Collection reference for Cosmos DB (Firestore compatibility)"""
 
@@ -378,11 +544,40 @@ class CosmosDBCollection:
         except exceptions.CosmosResourceNotFoundError:
             # Container doesn't exist, create it
             logger.info(f"Container {container_name} not found, creating...")
+            options = {}
+            if container_name in TTL_CONTAINERS:
+                # Per-item expiry via a `ttl` field, no container-wide default
+                options['default_ttl'] = -1
+            if container_name in COMPOSITE_INDEXES:
+                options['indexing_policy'] = {
+                    'indexingMode': 'consistent',
+                    'includedPaths': [{'path': '/*'}],
+                    'excludedPaths': [{'path': '/"_etag"/?'}],
+                    'compositeIndexes': _composite_index_policy(container_name),
+                }
             self.container = database.create_container(
                 id=container_name,
-                partition_key=PartitionKey(path="/id")
+                partition_key=PartitionKey(path="/id"),
+                **options
             )
 
+    def ensure_composite_indexes(self) -> bool:
+        """
+        Add any missing COMPOSITE_INDEXES for this container to its indexing
+        policy (the index builds in the background). Returns True if the
+        policy was changed.
+        """
+        wanted = _composite_index_policy(self.container_name)
+        policy = self.container.read().get('indexingPolicy') or {}
+        existing = policy.get('compositeIndexes') or []
+        missing = [index for index in wanted if index not in existing]
+        if not missing:
+            return False
+        policy['compositeIndexes'] = existing + missing
+        self.database.replace_container(self.container, partition_key=PartitionKey(path="/id"),
+                                        indexing_policy=policy)
+        return True
+
     def document(self, document_id: str) -> CosmosDBDocumentReference:
         """Get document reference by ID"""
         return CosmosDBDocumentReference(self.container, document_id)
@@ -406,6 +601,14 @@ class CosmosDBCollection:
         """Start query with WHERE clause"""
         return CosmosDBQuery(self.container).where(field, op, value)
 
+    def query(self, condition: str, parameters: List[Dict[str, Any]]) -> CosmosDBQuery:
+        """
+        Start query from a raw SQL condition on `c` with its own named
+        parameters, for what where() can't express (OR, CONTAINS, ...).
+        Parameter names must not start with @param.
+        """
+        return CosmosDBQuery(self.container, condition, list(parameters))
+
     def order_by(self, field: str, direction: str = "ASCENDING") -> CosmosDBQuery:
         """Start query with ORDER BY clause"""
         return CosmosDBQuery(self.container).order_by(field, direction)
@@ -496,9 +699,6 @@ class CosmosBatch:
         self.operations = []
 
 
-# Constants for Firestore compatibility
-SERVER_TIMESTAMP = 'SERVER_TIMESTAMP'
-DELETE_FIELD = None  # Cosmos DB: setting to None deletes the field
 
 
 class Increment:
@@ -6,11 +6,15 @@ Provides similar API for minimal code changes
 
 import os
 import json
+import time
 import logging
 from typing import Dict, List, Any, Optional
 from openai import AzureOpenAI
 from openai.types.chat import ChatCompletion
 
+from ai_telemetry import record_ai_call
+from ai_model_policy import get_model_policy, run_chat_completion
+
 logger = logging.getLogger("app.azure_openai_client")
 
 
@@ -78,12 +82,13 @@ class AzureOpenAIClient:
         Returns:
             Dict with response data compatible with Vertex AI format
         """
-        try:
-            # Use defaults if not provided
-            model = model or self.deployment_name
-            temperature = temperature if temperature is not None else self.temperature
-            max_tokens = max_tokens or self.max_tokens
+        # Use defaults if not provided
+        model = model or self.deployment_name
+        temperature = temperature if temperature is not None else self.temperature
+        max_tokens = max_tokens or self.max_tokens
 
+        started = time.perf_counter()
+        try:
             # Create chat completion
             kwargs = {
                 "model": model,
@@ -109,6 +114,14 @@ class AzureOpenAIClient:
                 "total_tokens": response.usage.total_tokens
             }
 
+            record_ai_call(
+                model=model,
+                prompt_tokens=usage["input_tokens"],
+                completion_tokens=usage["output_tokens"],
+                latency_ms=(time.perf_counter() - started) * 1000,
+                outcome='ok' if finish_reason in (None, 'stop') else finish_reason,
+            )
+
             # Return in Vertex AI compatible format
             return {
                 "content": [{"text": content}],  # Anthropic format
@@ -120,6 +133,11 @@ class AzureOpenAIClient:
             }
 
         except Exception as e:
+            record_ai_call(
+                model=model,
+                latency_ms=(time.perf_counter() - started) * 1000,
+                outcome=type(e).__name__,
+            )
             print(f"Azure OpenAI API error: {e}")
             raise
 
@@ -129,7 +147,8 @@ class AzureOpenAIClient:
         user_prompt: str,
         patient_context: Optional[Dict[str, Any]] = None,
         temperature: float = None,
-        return_json: bool = False
+        return_json: bool = False,
+        endpoint: str = None
     ) -> str:
         """
         Generate clinical suggestion using GPT-4o
@@ -141,6 +160,7 @@ class AzureOpenAIClient:
             patient_context: Optional patient data to include
             temperature: Override default temperature
             return_json: Whether to enforce JSON output format
+            endpoint: Endpoint label selecting the model policy (ai_model_policy)
 
         Returns:
             Generated suggestion text (or JSON string if return_json=True)
@@ -157,14 +177,18 @@ class AzureOpenAIClient:
 
         messages.append({"role": "user", "content": user_prompt})
 
-        # Set response format
-        response_format = {"type": "json_object"} if return_json else None
+        # Deployment and max_tokens come from the endpoint's model policy
+        policy = get_model_policy(endpoint)
+        if temperature is not None:
+            policy = policy._replace(temperature=temperature)
 
         # Generate response
-        response = self.create_chat_completion(
-            messages=messages,
-            temperature=temperature,
-            response_format=response_format
+        response = run_chat_completion(
+            self,
+            messages,
+            endpoint=endpoint,
+            policy=policy,
+            json_mode=return_json
         )
 
         return response["text"]
@@ -173,7 +197,8 @@ class AzureOpenAIClient:
         self,
         system_prompt: str,
         user_prompt: str,
-        patient_context: Optional[Dict[str, Any]] = None
+        patient_context: Optional[Dict[str, Any]] = None,
+        endpoint: str = None
     ) -> Dict[str, Any]:
         """
         Generate JSON response (enforces JSON output)
@@ -182,6 +207,7 @@ class AzureOpenAIClient:
             system_prompt: System instructions
             user_prompt: User's request
             patient_context: Optional patient context
+            endpoint: Endpoint label selecting the model policy (ai_model_policy)
 
         Returns:
             Parsed JSON response as dictionary
@@ -190,7 +216,8 @@ class AzureOpenAIClient:
             system_prompt=system_prompt,
             user_prompt=user_prompt,
             patient_context=patient_context,
-            return_json=True
+            return_json=True,
+            endpoint=endpoint
         )
 
         try:
@@ -0,0 +1,105 @@
+"""
+Backfill and check the 'assessment_progress' summary on patient documents.
+
+The patient list draws its progress bars from this summary (see
+assessment_progress.py). Patients created before it existed don't have one;
+until they do, the list probes the section collections for them, one query
+per section. This gives every such patient a summary rebuilt from the
+collections.
+
+With --check it instead compares every stored summary against one rebuilt
+from the collections and prints the disagreements. With --check --apply the
+rebuilt summary replaces a disagreeing one, unless a save changed it in the
+meantime (re-run to pick those up). Disagreements come from saves whose
+progress patch failed, or that raced the backfill.
+
+Usage:
+    python backfill_assessment_progress.py                    # dry run, prints only
+    python backfill_assessment_progress.py --apply            # writes missing summaries
+    python backfill_assessment_progress.py --check            # consistency report
+    python backfill_assessment_progress.py --check --apply    # ...and repair
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db
+from assessment_progress import PROGRESS_FIELD, compute_progress, progress_mismatches
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+CHECK = '--check' in sys.argv
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running {'consistency check' if CHECK else 'backfill'} in {mode} mode\n")
+
+    scanned = 0
+    written = 0
+    consistent = 0
+    mismatched = 0
+    raced = 0
+
+    for patient_doc in db.collection('patients').stream():
+        patient = patient_doc.to_dict()
+        stored = patient.get(PROGRESS_FIELD)
+        if CHECK != isinstance(stored, dict):
+            # Backfill: only patients without a summary. Check: only those with one.
+            continue
+
+        scanned += 1
+        patient.setdefault('patient_id', patient_doc.id)
+        expected = compute_progress(db, patient)
+        patient_ref = db.collection('patients').document(patient_doc.id)
+
+        if not CHECK:
+            print(f"  [{'apply' if APPLY else 'would apply'}] patient {patient_doc.id}: "
+                  f"mask {expected['mask']:#05x}, {len(expected['updated'])} section(s)")
+            if APPLY:
+                # A save can't create a summary, so losing this race is unlikely;
+                # if we do, --check reports the difference
+                if patient_ref.patch_if({PROGRESS_FIELD: expected}, [(PROGRESS_FIELD, 'missing', None)]):
+                    written += 1
+                else:
+                    raced += 1
+            else:
+                written += 1
+            continue
+
+        problems = progress_mismatches(stored, expected)
+        if not problems:
+            consistent += 1
+            continue
+        mismatched += 1
+        print(f"  [mismatch] patient {patient_doc.id}: "
+              + ", ".join(f"{collection} {problem}" for collection, problem in problems))
+        if APPLY:
+            # Only if no save marked a new section since we read it
+            if patient_ref.patch_if({PROGRESS_FIELD: expected},
+                                    [(f'{PROGRESS_FIELD}.mask', '==', stored.get('mask', 0))]):
+                written += 1
+            else:
+                raced += 1
+        else:
+            written += 1
+
+    if CHECK:
+        print(f"\nChecked: {scanned}")
+        print(f"Consistent: {consistent}")
+        print(f"Mismatched: {mismatched}")
+    else:
+        print(f"\nScanned (missing summary): {scanned}")
+    print(f"{'Written' if APPLY else 'Would write'}: {written}")
+    if raced:
+        print(f"Changed by a save while running (re-run to pick up): {raced}")
+    if not APPLY and (written or mismatched):
+        print("\nDry run only -- re-run with --apply to write these updates.")
+
+
+if __name__ == '__main__':
+    main()
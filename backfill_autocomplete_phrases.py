@@ -0,0 +1,99 @@
+"""
+Build every user's autocomplete phrase document (see phrase_index.py) from
+the notes already saved.
+
+Phrases are counted as notes are saved from now on; this seeds the counts
+for everything saved before. It reads each source with a projected query,
+attributes a record to the physio who owns the patient, and counts its
+sentences the same way record_phrases() does:
+
+    patients               present_history, past_history, chief_complaint, medical_history
+    subjective_examination body_structure ... contextual_personal
+    smart_goals            patient_goal, outcome_timeframe
+    treatment_plan         treatment_plan, reasoning
+    follow_ups             feedback -> belief_feedback, treatment_plan -> plan_next
+
+--apply replaces each user's document, so counts recorded by saves made while
+it runs can be lost; run it before or shortly after deploying.
+
+Usage:
+    python backfill_autocomplete_phrases.py            # dry run, prints only
+    python backfill_autocomplete_phrases.py --apply     # actually writes documents
+"""
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db, SERVER_TIMESTAMP
+from phrase_index import COLLECTION, apply_deltas, phrase_deltas, table_to_doc
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+
+# Count everything first, cap per field at the end
+UNCAPPED = sys.maxsize
+
+PATIENT_FIELDS = ('present_history', 'past_history', 'chief_complaint', 'medical_history')
+
+# collection -> {stored field: autocomplete field}
+SECTION_FIELDS = {
+    'subjective_examination': {f: f for f in (
+        'body_structure', 'body_function', 'activity_performance',
+        'activity_capacity', 'contextual_environmental', 'contextual_personal')},
+    'smart_goals': {'patient_goal': 'patient_goal', 'outcome_timeframe': 'outcome_timeframe'},
+    'treatment_plan': {'treatment_plan': 'treatment_plan', 'reasoning': 'reasoning'},
+    'follow_ups': {'feedback': 'belief_feedback', 'treatment_plan': 'plan_next'},
+}
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running in {mode} mode\n")
+
+    tables = defaultdict(dict)
+    owners = {}
+
+    for patient_doc in db.collection('patients').query('true', []).select('physio_id', *PATIENT_FIELDS).stream():
+        patient = patient_doc.to_dict()
+        physio_id = patient.get('physio_id')
+        if not physio_id:
+            continue
+        owners[patient_doc.id] = physio_id
+        apply_deltas(tables[physio_id], phrase_deltas({f: patient.get(f) for f in PATIENT_FIELDS}), UNCAPPED)
+    print(f"Patients: {len(owners)}")
+
+    for collection_name, fields in SECTION_FIELDS.items():
+        counted = 0
+        for doc in db.collection(collection_name).query('true', []).select('patient_id', *fields).stream():
+            data = doc.to_dict()
+            physio_id = owners.get(data.get('patient_id'))
+            if not physio_id:
+                continue
+            apply_deltas(tables[physio_id], phrase_deltas({name: data.get(f) for f, name in fields.items()}), UNCAPPED)
+            counted += 1
+        print(f"{collection_name}: {counted} records")
+
+    print()
+    for user_id, table in sorted(tables.items()):
+        # Keep the most used phrases, as a live table would
+        apply_deltas(table, {field: {} for field in table})
+        phrases = sum(len(counts) for counts in table.values())
+        print(f"  [{'apply' if APPLY else 'would apply'}] {user_id}: {phrases} phrases in {len(table)} fields")
+        if APPLY:
+            ref = db.collection(COLLECTION).document(user_id)
+            existing = ref.get()
+            version = int(existing.to_dict().get('version') or 0) if existing.exists else 0
+            ref.set({'fields': table_to_doc(table), 'version': version + 1, 'updated_at': SERVER_TIMESTAMP})
+
+    print(f"\nUsers: {len(tables)}")
+    if not APPLY:
+        print("\nDry run only -- re-run with --apply to write these documents.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Build every patient's current clinical record (see clinical_record.py) from
+the append-only section containers.
+
+New patients get an empty record and each save updates it from now on; this
+fills in the patients from before, so their first report or form read is a
+point read instead of ten queries. For each patient it queries the latest
+record of every section (ten queries) and writes the ones the aggregate lacks
+or holds an older version of. The writes are the same timestamp-conditional
+patches a save makes, so a save that runs concurrently is never overwritten.
+Re-running it corrects any drift, e.g. from an aggregate write that failed
+after its history record was saved.
+
+Usage:
+    python backfill_clinical_records.py            # dry run, prints only
+    python backfill_clinical_records.py --apply     # actually writes documents
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db
+from clinical_record import COLLECTION, SECTION_COLLECTIONS, get_clinical_records
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+
+
+def latest_records(patient_id):
+    latest = {}
+    for collection in SECTION_COLLECTIONS:
+        docs = db.collection(collection).where('patient_id', '==', patient_id) \
+            .order_by('timestamp', direction='DESCENDING').limit(1).get()
+        if docs:
+            latest[collection] = docs[0].to_dict()
+    return latest
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running in {mode} mode\n")
+
+    records = get_clinical_records()
+    scanned = changed = sections_written = 0
+    for patient_doc in db.collection('patients').query('true', []).select('id').stream():
+        scanned += 1
+        patient_id = patient_doc.id
+        ref = db.collection(COLLECTION).document(patient_id)
+        existing = ref.get()
+        stored = existing.to_dict() if existing.exists else {}
+        stored_sections = stored.get('sections') or {}
+
+        latest = latest_records(patient_id)
+        stale = [collection for collection, entry in latest.items()
+                 if collection not in stored_sections
+                 or str(stored_sections[collection].get('timestamp') or '') < str(entry.get('timestamp') or '')]
+        if existing.exists and stored.get('complete') and not stale:
+            continue
+
+        changed += 1
+        sections_written += len(stale)
+        print(f"  [{'apply' if APPLY else 'would apply'}] {patient_id}: "
+              f"{len(stale)} sections{'' if existing.exists else ' (new record)'}")
+        if APPLY:
+            for collection in stale:
+                records.record(patient_id, collection, latest[collection])
+            # Every saved section is in the record now; later saves only add
+            if not records.create(patient_id):
+                ref.patch_if({'complete': True, 'stale': False})
+
+    print(f"\nScanned patients: {scanned}")
+    print(f"Records        : {changed} to update ({sections_written} sections)")
+    if not APPLY:
+        print("\nDry run only -- re-run with --apply to write these documents.")
+
+
+if __name__ == '__main__':
+    main()
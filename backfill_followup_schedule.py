@@ -0,0 +1,66 @@
+"""
+Build the follow-up schedule index (see followup_schedule.py) from the
+patients container.
+
+Routes index follow-ups as they are set from now on; this indexes every
+patient whose next_followup_date is today or later (one projected query)
+and rewrites their entries. Re-running it repairs entries a failed write
+missed. Past follow-ups aren't indexed: the widget and reminders only read
+today onwards.
+
+Usage:
+    python backfill_followup_schedule.py            # dry run, prints only
+    python backfill_followup_schedule.py --apply     # actually writes entries
+"""
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db
+from followup_schedule import COLLECTION, FollowupSchedule, parse_day
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running in {mode} mode\n")
+
+    schedule = FollowupSchedule(db.collection(COLLECTION))
+    today = datetime.now().date().isoformat()
+
+    scanned = 0
+    indexed = 0
+    skipped = 0
+    query = db.collection('patients').where('next_followup_date', '>=', today).select(
+        'next_followup_date', 'physio_id', 'institute', 'name', 'contact',
+        'followup_notified', 'followup_notification_sent_at')
+    for patient_doc in query.stream():
+        scanned += 1
+        patient = patient_doc.to_dict()
+        day_value = patient.get('next_followup_date')
+        if parse_day(day_value) is None:
+            print(f"  [skip] patient {patient_doc.id}: unparseable date {day_value!r}")
+            skipped += 1
+            continue
+
+        print(f"  [{'apply' if APPLY else 'would apply'}] patient {patient_doc.id} on {day_value}")
+        if APPLY:
+            schedule.schedule(patient_doc.id, patient, day_value)
+        indexed += 1
+
+    print(f"\nScanned: {scanned}")
+    print(f"Indexed: {indexed}")
+    print(f"Skipped: {skipped}")
+    if not APPLY:
+        print("\nDry run only -- re-run with --apply to write these entries.")
+
+
+if __name__ == '__main__':
+    main()
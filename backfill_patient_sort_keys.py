@@ -0,0 +1,65 @@
+"""
+Prepare the patients container for server-side patient list queries.
+
+The patient lists sort by name with `ORDER BY c.name_sort` (the lowercased
+name, see patient_list_query.py), and sort/paginate with multi-field
+ORDER BYs that need composite indexes. This:
+
+1. adds any missing COMPOSITE_INDEXES to the patients container's indexing
+   policy (Cosmos DB builds them in the background), and
+2. stamps `name_sort` onto every patient whose value is missing or out of
+   date (patients created or renamed before it was written).
+
+Usage:
+    python backfill_patient_sort_keys.py            # dry run, prints only
+    python backfill_patient_sort_keys.py --apply     # actually writes updates
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db
+from patient_list_query import name_sort_key
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running in {mode} mode\n")
+
+    patients = db.collection('patients')
+    if APPLY:
+        changed = patients.ensure_composite_indexes()
+        print(f"Composite indexes: {'added (building in the background)' if changed else 'already present'}\n")
+    else:
+        print("Composite indexes: would add any missing\n")
+
+    scanned = 0
+    updated = 0
+
+    for patient_doc in patients.query('true', []).select('name', 'name_sort').stream():
+        scanned += 1
+        patient = patient_doc.to_dict()
+        sort_key = name_sort_key(patient.get('name'))
+        if patient.get('name_sort') == sort_key:
+            continue
+
+        print(f"  [{'apply' if APPLY else 'would apply'}] patient {patient_doc.id}")
+        if APPLY:
+            patients.document(patient_doc.id).patch_if({'name_sort': sort_key})
+        updated += 1
+
+    print(f"\nScanned: {scanned}")
+    print(f"Updated{'':1}: {updated}")
+    if not APPLY:
+        print("\nDry run only -- re-run with --apply to write these updates.")
+
+
+if __name__ == '__main__':
+    main()
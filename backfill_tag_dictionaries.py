@@ -0,0 +1,69 @@
+"""
+Build the per-physio and per-institute tag dictionaries (see
+tag_dictionary.py) from the patients container.
+
+Tag changes are counted as they happen from now on; this counts the tags of
+every existing patient (one projected query) and replaces each owner's
+dictionary with the result. Re-running it corrects any drift, e.g. from a
+dictionary update that failed after its patient write. last_used is kept
+from the existing dictionary where there is one.
+
+Usage:
+    python backfill_tag_dictionaries.py            # dry run, prints only
+    python backfill_tag_dictionaries.py --apply     # actually writes documents
+"""
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from azure_cosmos_db import get_cosmos_db, SERVER_TIMESTAMP
+from tag_dictionary import COLLECTION, document_id, patient_owners
+db = get_cosmos_db()
+
+APPLY = '--apply' in sys.argv
+
+
+def main():
+    mode = "APPLY" if APPLY else "DRY RUN"
+    print(f"Running in {mode} mode\n")
+
+    counts = defaultdict(lambda: defaultdict(int))
+    scanned = 0
+    for patient_doc in db.collection('patients').query('true', []).select('physio_id', 'institute', 'tags').stream():
+        scanned += 1
+        patient = patient_doc.to_dict()
+        for owner in patient_owners(patient):
+            counts[owner]
+            for tag in set(patient.get('tags') or []):
+                counts[owner][tag] += 1
+
+    changed = 0
+    for owner, tag_counts in sorted(counts.items()):
+        ref = db.collection(COLLECTION).document(document_id(owner))
+        existing = ref.get()
+        stored = existing.to_dict() if existing.exists else {}
+        old_tags = stored.get('tags') or {}
+        if {tag: entry.get('count') for tag, entry in old_tags.items()} == dict(tag_counts):
+            continue
+
+        changed += 1
+        print(f"  [{'apply' if APPLY else 'would apply'}] {document_id(owner)}: {len(tag_counts)} tags")
+        if APPLY:
+            tags = {tag: {'count': count, 'last_used': (old_tags.get(tag) or {}).get('last_used')}
+                    for tag, count in tag_counts.items()}
+            ref.set({'owner_field': owner[0], 'owner': owner[1], 'tags': tags,
+                     'version': int(stored.get('version') or 0) + 1, 'updated_at': SERVER_TIMESTAMP})
+
+    print(f"\nScanned patients: {scanned}")
+    print(f"Dictionaries   : {len(counts)} ({changed} to update)")
+    if not APPLY:
+        print("\nDry run only -- re-run with --apply to write these documents.")
+
+
+if __name__ == '__main__':
+    main()
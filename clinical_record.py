@@ -0,0 +1,247 @@
+"""
+Current clinical record: the latest saved version of every assessment
+section of a patient, in one document.
+
+Assessment sections are append-only: each save `.add()`s a new document to
+the section's container (subjective_examination, initial_plan, ...), and
+every reader had to run `order_by('timestamp', DESCENDING).limit(1)` per
+section it needed -- up to ten queries for a report. Each save now also
+writes the section into the patient's aggregate in `clinical_records`:
+
+    {'id': <patient id>, 'patient_id': ..., 'version': 7, 'complete': True,
+     'sections': {'subjective_examination': {...latest record...}, ...}}
+
+so most reads are one point read. The append-only containers stay the
+history and the source of truth.
+
+- Saves go through add_section_record(), which writes the history record
+  and then the aggregate. The aggregate write is conditional on the stored
+  section's timestamp, so a slower, older save can't replace a newer one,
+  and it increments `version`.
+- `complete` means every section is in the aggregate (a missing section was
+  never saved). New patients get a complete, empty record. Patients from
+  before the aggregate existed are completed by
+  backfill_clinical_records.py, or by their first read: it queries the
+  sections the aggregate lacks and patches them in, but only if `version`
+  hasn't moved in the meantime.
+- add_section_record() never fails a save over the aggregate: its write is
+  retried once, and if that fails too the record is marked `stale` (and
+  incomplete), so the next read re-queries every section from the
+  containers instead of returning the previous version.
+
+Usage:
+    add_section_record('smart_goals', entry)            # instead of db.collection('smart_goals').add(entry)
+    sections = latest_sections(patient_id, ['patho_mechanism', 'initial_plan'])
+"""
+
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from cosmos_constants import SERVER_TIMESTAMP
+
+logger = logging.getLogger("app.clinical_record")
+
+COLLECTION = 'clinical_records'
+
+# Append-only containers whose latest record the aggregate holds
+SECTION_COLLECTIONS = (
+    'subjective_examination',
+    'patient_perspectives',
+    'initial_plan',
+    'patho_mechanism',
+    'chronic_diseases',
+    'clinical_flags',
+    'objective_assessments',
+    'provisional_diagnosis',
+    'smart_goals',
+    'treatment_plan',
+)
+
+
+def resolve_timestamps(entry: Dict[str, Any], now: Optional[str] = None) -> Dict[str, Any]:
+    """Copy of a section record with SERVER_TIMESTAMP values replaced by the current time."""
+    now = now or datetime.now(timezone.utc).isoformat()
+    return {key: now if value == SERVER_TIMESTAMP else value for key, value in entry.items()}
+
+
+class ClinicalRecords:
+    """
+    Args:
+        collection: the clinical_records collection (CosmosDBCollection).
+        query_latest: query_latest(section_collection, patient_id) -> dict or
+            None; the legacy per-section query, used to complete records.
+    """
+
+    def __init__(self, collection: Any, query_latest: Callable[[str, str], Optional[Dict[str, Any]]]):
+        self._collection = collection
+        self._query_latest = query_latest
+        self._lock = threading.Lock()
+        self._stats = {'reads': 0, 'completed': 0, 'fallback_queries': 0, 'writes': 0,
+                       'older_skipped': 0, 'write_retries': 0, 'marked_stale': 0}
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    # ── Writes ───────────────────────────────────────────────────────────
+
+    def create(self, patient_id: str) -> bool:
+        """Empty, complete record for a new patient (False if one exists)."""
+        return self._collection.document(patient_id).create(
+            {'patient_id': patient_id, 'version': 0, 'complete': True, 'sections': {}})
+
+    def record(self, patient_id: str, collection: str, entry: Dict[str, Any]) -> bool:
+        """
+        Make entry (already timestamped) the latest record of the section,
+        unless a newer one is already there. Returns whether it was written.
+        """
+        ref = self._collection.document(patient_id)
+        fields = {f'sections.{collection}': entry}
+        timestamp = entry.get('timestamp')
+
+        def replace():
+            return bool(timestamp and ref.patch_if(
+                fields, [(f'sections.{collection}.timestamp', '<=', timestamp)], increments={'version': 1})
+            ) or ref.patch_if(fields, [(f'sections.{collection}', 'missing', None)], increments={'version': 1})
+
+        # If there's no record yet, create it; if another save created it
+        # first, patch that one
+        if (replace() or ref.create({'patient_id': patient_id, 'version': 1, 'complete': False,
+                                     'sections': {collection: entry}}) or replace()):
+            self._count('writes')
+            return True
+        self._count('older_skipped')
+        return False
+
+    def save(self, patient_id: str, collection: str, entry: Dict[str, Any]) -> None:
+        """
+        record(), retried once; if both attempts fail, mark the record stale so
+        reads go back to the containers. Raises only if that fails too.
+        """
+        try:
+            self.record(patient_id, collection, entry)
+            return
+        except Exception as e:
+            logger.warning(f"Clinical record update for {collection} failed, retrying: {type(e).__name__}: {e}")
+        self._count('write_retries')
+        try:
+            self.record(patient_id, collection, entry)
+        except Exception as e:
+            logger.warning(f"Clinical record update for {collection} failed again: {type(e).__name__}: {e}")
+            self.mark_stale(patient_id)
+
+    def mark_stale(self, patient_id: str) -> None:
+        """Make the next read re-query every section (a missing record is completed anyway)."""
+        if self._collection.document(patient_id).patch_if({'complete': False, 'stale': True},
+                                                          increments={'version': 1}):
+            self._count('marked_stale')
+
+    def delete(self, patient_id: str) -> None:
+        self._collection.document(patient_id).delete()
+
+    # ── Reads ────────────────────────────────────────────────────────────
+
+    def sections(self, patient_id: str,
+                 collections: Iterable[str] = SECTION_COLLECTIONS) -> Dict[str, Dict[str, Any]]:
+        """Latest record of each requested section ({} if never saved)."""
+        self._count('reads')
+        ref = self._collection.document(patient_id)
+        snapshot = ref.get()
+        doc = snapshot.to_dict() if snapshot.exists else {}
+        stored = dict(doc.get('sections') or {})
+        if not doc.get('complete'):
+            stored.update(self._complete(ref, patient_id, snapshot.exists, doc, stored))
+        return {collection: dict(stored.get(collection) or {}) for collection in collections}
+
+    def _complete(self, ref: Any, patient_id: str, exists: bool, doc: Dict[str, Any],
+                  stored: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Query the sections the record lacks (all of them if it's stale) and
+        store them, unless a save got there first.
+        """
+        missing = [collection for collection in SECTION_COLLECTIONS
+                   if doc.get('stale') or collection not in stored]
+        self._count('fallback_queries', len(missing))
+        found = {}
+        for collection in missing:
+            latest = self._query_latest(collection, patient_id)
+            if latest:
+                found[collection] = latest
+
+        if not exists:
+            completed = ref.create({'patient_id': patient_id, 'version': 0, 'complete': True, 'sections': found})
+        else:
+            # The whole map in one operation: every save bumps `version`,
+            # so nothing written since the read is overwritten
+            completed = ref.patch_if({'sections': {**stored, **found}, 'complete': True, 'stale': False},
+                                     [('version', '==', doc.get('version', 0))])
+        if completed:
+            self._count('completed')
+        return found
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+def _query_latest_from_cosmos(collection: str, patient_id: str) -> Optional[Dict[str, Any]]:
+    from azure_cosmos_db import get_cosmos_db
+    docs = (get_cosmos_db().collection(collection).where('patient_id', '==', patient_id)
+            .order_by('timestamp', direction='DESCENDING').limit(1).get())
+    return docs[0].to_dict() if docs else None
+
+
+_records: Optional[ClinicalRecords] = None
+_records_lock = threading.Lock()
+
+
+def get_clinical_records() -> ClinicalRecords:
+    global _records
+    if _records is None:
+        with _records_lock:
+            if _records is None:
+                from azure_cosmos_db import get_cosmos_db
+                _records = ClinicalRecords(get_cosmos_db().collection(COLLECTION), _query_latest_from_cosmos)
+    return _records
+
+
+def add_section_record(collection: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Save an assessment section: append it to its history container, then make
+    it the patient's current record. Returns the record as stored.
+    """
+    from azure_cosmos_db import get_cosmos_db
+    entry = resolve_timestamps(entry)
+    get_cosmos_db().collection(collection).add(entry)
+    try:
+        get_clinical_records().save(entry['patient_id'], collection, entry)
+    except Exception as e:
+        # Neither written nor marked stale: reads return the previous
+        # version of the section until it's saved again or the backfill runs
+        logger.error(f"Clinical record update for {collection} failed: {type(e).__name__}: {e}")
+    return entry
+
+
+def latest_sections(patient_id: str, collections: Iterable[str] = SECTION_COLLECTIONS) -> Dict[str, Dict[str, Any]]:
+    return get_clinical_records().sections(patient_id, collections)
+
+
+def create_clinical_record(patient_id: str) -> None:
+    try:
+        get_clinical_records().create(patient_id)
+    except Exception as e:
+        # Without it the first read completes the record from the containers
+        logger.warning(f"Clinical record creation for {patient_id} failed: {type(e).__name__}: {e}")
+
+
+def delete_clinical_record(patient_id: str) -> None:
+    try:
+        get_clinical_records().delete(patient_id)
+    except Exception as e:
+        logger.warning(f"Clinical record deletion for {patient_id} failed: {type(e).__name__}: {e}")
+
+
+def get_clinical_record_stats() -> Dict[str, Any]:
+    return _records.stats() if _records is not None else {}
@@ -0,0 +1,11 @@
+"""
+Sentinels of the Cosmos DB wrapper (re-exported by azure_cosmos_db).
+
+Kept free of the Azure SDK so modules that only build or inspect documents
+can use them without importing the client.
+"""
+
+# Written as a field value; the wrapper stores the write time instead
+SERVER_TIMESTAMP = 'SERVER_TIMESTAMP'
+# Cosmos DB: setting a field to None deletes it
+DELETE_FIELD = None
@@ -4,6 +4,106 @@ HIPAA-compliant PHI sanitization for AI prompts and external services
 """
 
 import re
+import unicodedata
+from typing import List, NamedTuple, Tuple
+
+# ─── SANITIZER ENGINE ─────────────────────────────────────────────────
+# Single shared implementation used by main.py, mobile_api.py and
+# mobile_api_ai.py. Everything below is compiled/frozen once at import so
+# each call is one regex scan over the text rather than several regexes
+# per word.
+
+# Words that look like proper names (Title-case) but carry clinical meaning.
+# Stored lower-case; matching is case-insensitive.
+MEDICAL_VOCABULARY = frozenset(term.lower() for term in (
+    # Medical abbreviations and facilities
+    'MRI', 'CT', 'Xray', 'PT', 'OT', 'Dr', 'Hospital', 'Clinic', 'Emergency', 'Department',
+    'Referred', 'Patient', 'Injury', 'Surgery', 'Scan', 'Shows', 'Underwent',
+    # Body parts - general
+    'Pain', 'Back', 'Knee', 'Shoulder', 'Hip', 'Neck', 'Arm', 'Leg', 'Ankle', 'Foot', 'Hand',
+    'Wrist', 'Elbow', 'Spine', 'Lumbar', 'Thoracic', 'Cervical', 'Chest', 'Abdomen', 'Head',
+    'Finger', 'Thumb', 'Toe', 'Heel', 'Calf', 'Thigh', 'Forearm', 'Pelvis', 'Groin', 'Buttock',
+    # Directional terms
+    'Right', 'Left', 'Bilateral', 'Anterior', 'Posterior', 'Lateral', 'Medial', 'Upper', 'Lower',
+    'Proximal', 'Distal', 'Superior', 'Inferior', 'Dorsal', 'Ventral', 'Superficial', 'Deep',
+    # Spinal regions
+    'Sacral', 'Coccyx', 'Sacrum', 'Vertebral', 'Intervertebral', 'Disc',
+    # Joints and structures
+    'Joint', 'Muscle', 'Tendon', 'Ligament', 'Bone', 'Tissue', 'Nerve', 'Fascia',
+    # Common sentence openers in address/contact notes
+    'Contact', 'Office', 'Residence', 'Lives', 'First', 'Call', 'Flat', 'House', 'Plot', 'Apartment',
+))
+
+_MONTHS = 'January|February|March|April|May|June|July|August|September|October|November|December'
+_STREET_SUFFIXES = 'Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln|Marg|Nagar|Colony|Block|Sector|Phase'
+_PHONE_BODY = r'\d{3}[-.\s]?\d{3}[-.\s]?\d{4}|\d{5}[-.\s]?\d{5}'
+
+
+def _char_class(predicate):
+    """Body of a regex character class of the BMP characters matching predicate, as ranges."""
+    ranges, start, prev = [], None, None
+    for code in range(0x10000):
+        if predicate(chr(code)):
+            if start is None:
+                start = code
+            prev = code
+        elif start is not None:
+            ranges.append((start, prev))
+            start = None
+    return ''.join(re.escape(chr(a)) if a == b else f'{re.escape(chr(a))}-{re.escape(chr(b))}'
+                   for a, b in ranges)
+
+
+# Upper/lower-case letters of every cased script, so names like 'José',
+# 'Müller' or 'Élodie' are caught too. Lower includes combining marks for
+# decomposed text ('Jose\u0301').
+_UPPER = _char_class(lambda c: c.isupper())
+_LOWER = _char_class(lambda c: c.islower() or unicodedata.category(c) == 'Mn')
+
+# One alternation, anchored at token starts so the engine only tries the
+# alternatives where a new word begins. Order matters where alternatives can
+# start at the same character (e.g. an address starts with digits that could
+# also begin a phone number).
+_PHI_PATTERN = re.compile(
+    r'(?<![\w.%+-])(?:'
+    r'(?P<email>[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b)'
+    r'|(?P<date>\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b'
+    rf'|(?i:{_MONTHS})\s+\d{{1,2}},?\s+\d{{2,4}}\b)'
+    rf'|(?P<address>\d+\s+\w+\s+(?i:{_STREET_SUFFIXES})\b'
+    r'|(?i:Flat|House|Plot|Apartment|Apt|Room|Unit)\s*(?i:No\.?|Number|#)?\s*\d+\b)'
+    rf'|(?P<phone>(?:\+\d{{1,3}}[-.\s]?)?(?:{_PHONE_BODY})(?!\d))'
+    rf"|(?P<name>(?:[{_UPPER}]['’])?[{_UPPER}][{_LOWER}]+(?:[{_UPPER}][{_LOWER}]+)*"
+    rf"(?:-[{_UPPER}]?[{_LOWER}]+)*(?!\w))"
+    r')'
+)
+
+# Every alternative above needs a digit, an upper-case letter or an '@' to
+# match, so text without any of them can skip the scan entirely.
+_NEEDS_SCAN = re.compile(rf'[\d@{_UPPER}]')
+
+_AGE_SEX_PATTERN = re.compile(r'(\d+)\s*/?\s*([MF]|male|female)', re.IGNORECASE)
+
+REDACTION_LABELS = {
+    'email': '[email removed]',
+    'date': '[date removed]',
+    'address': '[address removed]',
+    'phone': '[phone removed]',
+    'name': '[name removed]',
+}
+
+
+class Redaction(NamedTuple):
+    """A span of the *original* text that was replaced, for audit logging."""
+    start: int
+    end: int
+    kind: str
+
+
+def _is_clinical_word(word):
+    word = word.replace('’', "'").lower()
+    if len(word) <= 2 or word in MEDICAL_VOCABULARY:
+        return True
+    return '-' in word and all(part in MEDICAL_VOCABULARY for part in word.split('-'))
 
 
 def sanitize_age_sex(age_sex_str):
@@ -11,8 +111,8 @@ def sanitize_age_sex(age_sex_str):
     if not age_sex_str:
         return "Age/Sex not specified"
 
-    # Extract age and sex
-    match = re.search(r'(\d+)\s*([MF]|male|female)', age_sex_str.strip(), re.IGNORECASE)
+    # Extract age and sex (handle various formats: "35 M", "35/M", "35 / Male", etc.)
+    match = _AGE_SEX_PATTERN.search(age_sex_str.strip())
     if not match:
         return "Demographics: Adult"
 
@@ -38,72 +138,63 @@ def sanitize_age_sex(age_sex_str):
     return f"{age_range} {sex}"
 
 
-def sanitize_clinical_text(text):
-    """Remove PHI from clinical text while preserving clinical information."""
+def sanitize_clinical_text_with_spans(text) -> Tuple[str, List[Redaction]]:
+    """Remove PHI from clinical text and report what was removed.
+
+    Returns (sanitized_text, redactions), where each redaction's start/end
+    index into the input text. Whitespace runs are collapsed in the output.
+    """
     if not text:
-        return ""
-
-    # Remove common PHI patterns
-    sanitized = text
-
-    # Remove specific dates (but keep relative time references)
-    sanitized = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', '[date removed]', sanitized)
-    sanitized = re.sub(r'\b(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{2,4}\b', '[date removed]', sanitized, flags=re.IGNORECASE)
-
-    # Remove proper names (preserve medical and anatomical terms)
-    medical_terms = {
-        # Medical abbreviations and facilities
-        'MRI', 'CT', 'X-ray', 'PT', 'OT', 'Dr', 'Hospital', 'Clinic', 'Emergency', 'Department',
-        # Body parts - general
-        'Pain', 'Back', 'Knee', 'Shoulder', 'Hip', 'Neck', 'Arm', 'Leg', 'Ankle', 'Foot', 'Hand',
-        'Wrist', 'Elbow', 'Spine', 'Lumbar', 'Thoracic', 'Cervical', 'Chest', 'Abdomen', 'Head',
-        'Finger', 'Thumb', 'Toe', 'Heel', 'Calf', 'Thigh', 'Forearm', 'Pelvis', 'Groin', 'Buttock',
-        # Directional terms
-        'Right', 'Left', 'Bilateral', 'Anterior', 'Posterior', 'Lateral', 'Medial', 'Upper', 'Lower',
-        'Proximal', 'Distal', 'Superior', 'Inferior', 'Dorsal', 'Ventral', 'Superficial', 'Deep',
-        # Spinal regions
-        'Sacral', 'Coccyx', 'Sacrum', 'Vertebral', 'Intervertebral', 'Disc',
-        # Joints and structures
-        'Joint', 'Muscle', 'Tendon', 'Ligament', 'Bone', 'Tissue', 'Nerve', 'Fascia'
-    }
-    words = sanitized.split()
-    sanitized_words = []
-    # Convert medical_terms to lowercase for case-insensitive matching
-    medical_terms_lower = {term.lower() for term in medical_terms}
-    for word in words:
-        clean_word = re.sub(r'[^\w]', '', word)
-        # Check if it's a capitalized word that's not a medical term
-        if clean_word.istitle() and clean_word.lower() not in medical_terms_lower and len(clean_word) > 2:
-            sanitized_words.append('[name removed]')
-        else:
-            sanitized_words.append(word)
-    sanitized = ' '.join(sanitized_words)
+        return "", []
 
-    # Remove phone numbers
-    sanitized = re.sub(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', '[phone removed]', sanitized)
+    if not _NEEDS_SCAN.search(text):
+        return ' '.join(text.split()), []
 
-    # Remove addresses (simple pattern)
-    sanitized = re.sub(r'\b\d+\s+\w+\s+(Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln)\b', '[address removed]', sanitized, flags=re.IGNORECASE)
+    redactions = []
+    parts = []
+    last = 0
+    for match in _PHI_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind == 'name' and _is_clinical_word(match.group()):
+            continue
+        start, end = match.span()
+        parts.append(text[last:start])
+        parts.append(REDACTION_LABELS[kind])
+        redactions.append(Redaction(start, end, kind))
+        last = end
 
-    # Clean up multiple spaces
-    sanitized = re.sub(r'\s+', ' ', sanitized).strip()
+    if not redactions:
+        return ' '.join(text.split()), []
 
-    return sanitized
+    parts.append(text[last:])
+    return ' '.join(''.join(parts).split()), redactions
+
+
+def sanitize_clinical_text(text):
+    """Remove PHI from clinical text while preserving clinical information."""
+    return sanitize_clinical_text_with_spans(text)[0]
 
 
 def sanitize_subjective_data(inputs_dict):
-    """Sanitize subjective examination data to remove PHI."""
+    """Sanitize subjective examination data to remove PHI.
+
+    Recurses into nested dicts/lists so sub-sections of form data are
+    sanitized as well as top-level string values.
+    """
     if not inputs_dict:
         return {}
 
-    sanitized = {}
-    for key, value in inputs_dict.items():
+    def sanitize_value(value):
         if isinstance(value, str):
-            sanitized[key] = sanitize_clinical_text(value)
+            return sanitize_clinical_text(value)
+        elif isinstance(value, dict):
+            return {k: sanitize_value(v) for k, v in value.items()}
+        elif isinstance(value, list):
+            return [sanitize_value(item) for item in value]
         else:
-            sanitized[key] = value
+            return value
 
-    return sanitized
+    return {key: sanitize_value(value) for key, value in inputs_dict.items()}
 
 
 def sanitize_patient_data(data_dict):
@@ -0,0 +1,177 @@
+"""
+Verified Firebase ID token cache with background revocation sync.
+
+verify_id_token(check_revoked=True) makes a network call to Firebase for
+the user's revocation state on every request. Instead:
+
+- A verified token's claims are cached by SHA-256 of the token until the
+  token's own `exp`, so a repeat request skips signature verification.
+  Misses are verified locally (firebase_admin checks the signature against
+  Google's public keys, which it caches per their Cache-Control headers).
+- Revocation comes from a per-uid table of (tokens_valid_after, disabled),
+  filled on first sight of a uid and refreshed in batches by a daemon
+  poller every FIREBASE_REVOCATION_POLL_SECONDS. Entries older than
+  FIREBASE_REVOCATION_MAX_STALENESS are refreshed inline, so a stuck
+  poller can't keep a revoked token alive indefinitely.
+- mark_revoked() applies a revocation locally at once (logout, password
+  change); other workers pick it up on their next poll.
+
+Firebase-specific calls are injected (see app_auth), so this module has no
+firebase_admin dependency.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.firebase_token_cache")
+
+TOKEN_CACHE_SIZE = int(os.environ.get('FIREBASE_TOKEN_CACHE_SIZE', '10000'))
+REVOCATION_POLL_SECONDS = float(os.environ.get('FIREBASE_REVOCATION_POLL_SECONDS', '60'))
+REVOCATION_MAX_STALENESS = float(os.environ.get('FIREBASE_REVOCATION_MAX_STALENESS', '300'))
+# uids not seen for this long are dropped from the table (and no longer polled)
+REVOCATION_IDLE_SECONDS = 2 * 3600
+# Firebase get_users() accepts at most 100 identifiers per call
+FETCH_BATCH_SIZE = 100
+
+# uid -> (tokens_valid_after in epoch seconds, disabled)
+TokenState = Tuple[float, bool]
+
+
+class TokenRevokedError(Exception):
+    """Token was issued before the user's tokens_valid_after."""
+
+
+class UserDisabledError(Exception):
+    """The user's Firebase account is disabled."""
+
+
+class FirebaseTokenCache:
+    """
+    Args:
+        verify: id_token -> decoded claims (signature/issuer/audience checked,
+            no revocation check); raises on invalid or expired tokens.
+        fetch_token_states: iterable of uids -> {uid: (tokens_valid_after, disabled)}.
+    """
+
+    def __init__(self, verify: Callable[[str], Dict[str, Any]],
+                 fetch_token_states: Callable[[Iterable[str]], Dict[str, TokenState]],
+                 maxsize: int = TOKEN_CACHE_SIZE,
+                 poll_seconds: float = REVOCATION_POLL_SECONDS,
+                 max_staleness: float = REVOCATION_MAX_STALENESS,
+                 start_poller: bool = True,
+                 clock: Callable[[], float] = time.time):
+        self._verify = verify
+        self._fetch = fetch_token_states
+        self._tokens = TTLCache(maxsize=maxsize, ttl=3600, name='firebase_token')
+        self.poll_seconds = poll_seconds
+        self.max_staleness = max_staleness
+        self._start_poller = start_poller
+        self._clock = clock
+        self._lock = threading.Lock()
+        # uid -> [tokens_valid_after, disabled, refreshed_at, last_seen]
+        self._states: Dict[str, list] = {}
+        self._poller: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+
+    def verify(self, id_token: str) -> Dict[str, Any]:
+        """Decoded claims for a valid, unrevoked token; raises otherwise."""
+        if self._start_poller and self._poller is None:
+            self._ensure_poller()
+
+        now = self._clock()
+        key = self._key(id_token)
+        claims = self._tokens.get(key)
+        if claims is None or claims.get('exp', 0) <= now:
+            claims = self._verify(id_token)
+            ttl = claims.get('exp', 0) - now
+            if ttl > 0:
+                self._tokens.set(key, claims, ttl=ttl)
+
+        self._check_revocation(claims, now)
+        return dict(claims)
+
+    def _check_revocation(self, claims: Dict[str, Any], now: float) -> None:
+        uid = claims.get('uid') or claims.get('sub')
+        with self._lock:
+            state = self._states.get(uid)
+            if state is not None:
+                state[3] = now
+        if state is None or now - state[2] > self.max_staleness:
+            self.refresh([uid])
+            with self._lock:
+                state = self._states.get(uid)
+        if state is None:
+            # Firebase has no such user: treat like a revoked token
+            raise TokenRevokedError('User no longer exists')
+        valid_after, disabled = state[0], state[1]
+        if disabled:
+            raise UserDisabledError('The user record is disabled')
+        if claims.get('iat', 0) < valid_after:
+            raise TokenRevokedError('The Firebase ID token has been revoked')
+
+    def refresh(self, uids: Iterable[str]) -> None:
+        """Fetch revocation state for uids from Firebase (batched)."""
+        uids = [uid for uid in dict.fromkeys(uids) if uid]
+        for i in range(0, len(uids), FETCH_BATCH_SIZE):
+            batch = uids[i:i + FETCH_BATCH_SIZE]
+            fetched = self._fetch(batch)
+            now = self._clock()
+            with self._lock:
+                for uid in batch:
+                    if uid in fetched:
+                        valid_after, disabled = fetched[uid]
+                        last_seen = self._states.get(uid, [0, False, 0, now])[3]
+                        self._states[uid] = [float(valid_after or 0), bool(disabled), now, last_seen]
+                    else:
+                        self._states.pop(uid, None)
+
+    def mark_revoked(self, uid: str, at: Optional[float] = None) -> None:
+        """Reject this uid's tokens issued before `at` (default: now) on this worker."""
+        now = self._clock()
+        # whole seconds, like Firebase's own tokens_valid_after
+        at = int(now if at is None else at)
+        with self._lock:
+            state = self._states.get(uid)
+            if state is None:
+                self._states[uid] = [at, False, now, now]
+            else:
+                state[0] = max(state[0], at)
+                state[2] = now
+
+    def poll_once(self) -> None:
+        """Drop idle uids and refresh the rest."""
+        now = self._clock()
+        with self._lock:
+            for uid in [u for u, s in self._states.items() if now - s[3] > REVOCATION_IDLE_SECONDS]:
+                del self._states[uid]
+            uids = list(self._states)
+        self.refresh(uids)
+
+    def _ensure_poller(self) -> None:
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=self._poll_loop, name='firebase-revocation-poller', daemon=True)
+            self._poller.start()
+
+    def _poll_loop(self) -> None:
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.warning(f"Firebase revocation poll failed: {type(e).__name__}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tracked = len(self._states)
+        return {**self._tokens.stats(), 'tracked_uids': tracked}
@@ -0,0 +1,195 @@
+"""
+Follow-up schedule index, bucketed by due day.
+
+A patient's next follow-up is `next_followup_date` (YYYY-MM-DD) on the
+patient document. The upcoming-follow-ups widget used to stream every
+patient of the user or institute to find those due in the next few days,
+and the reminder check streamed the whole patients container across all
+tenants. Each scheduled follow-up now also has an entry in
+`followup_schedule`:
+
+    {'id': '2026-03-14:<patient id>', 'day': '2026-03-14', 'due_time': '10:00',
+     'patient_id': ..., 'physio_id': ..., 'institute': ...,
+     'patient_name': ..., 'contact': ..., 'notified': False, 'ttl': ...}
+
+`day` is the bucket: the widget reads the buckets from today to the cutoff
+for one physio or institute, and the reminder check reads only the buckets
+its reminder offsets land on. Entry ids are derived from (day, patient), so
+rescheduling deletes the old day's entry and writes the new one, and
+replaying a write is harmless. Entries expire FOLLOWUP_SCHEDULE_RETAIN_DAYS
+after their day through Cosmos DB per-item TTL.
+
+The patient document stays the source of truth: routes that set, move or
+acknowledge a follow-up, rename a patient or delete one update the entry
+after the patient, and backfill_followup_schedule.py rebuilds entries from
+the patients container.
+
+Usage:
+    schedule = get_followup_schedule()
+    schedule.schedule(patient_id, patient, '2026-03-14', old_day=patient.get('next_followup_date'))
+    upcoming = schedule.upcoming('physio_id', email, today, days_ahead=7)
+"""
+
+import os
+import logging
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("app.followup_schedule")
+
+COLLECTION = 'followup_schedule'
+RETAIN_DAYS = int(os.environ.get('FOLLOWUP_SCHEDULE_RETAIN_DAYS', '30'))
+
+# Patient fields copied onto entries (for the widget), refreshed when they change
+PATIENT_FIELDS = ('physio_id', 'institute', 'name', 'contact')
+
+
+def parse_day(value: Any) -> Optional[date]:
+    """The due day of a next_followup_date value, or None if it isn't YYYY-MM-DD."""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def entry_id(day: str, patient_id: str) -> str:
+    return f'{day}:{patient_id}'
+
+
+def day_buckets(start: date, days: Iterable[int]) -> List[str]:
+    return [(start + timedelta(days=offset)).isoformat() for offset in days]
+
+
+def expiry_seconds(day: date, now: Optional[datetime] = None) -> int:
+    """Per-item TTL that keeps an entry until RETAIN_DAYS after its day."""
+    now = now or datetime.now(timezone.utc)
+    expires = datetime.combine(day + timedelta(days=RETAIN_DAYS), dt_time.min, tzinfo=timezone.utc)
+    return max(3600, int((expires - now).total_seconds()))
+
+
+def make_entry(patient_id: str, patient: Dict[str, Any], day: date,
+               due_time: Optional[str] = None, now: Optional[datetime] = None) -> Dict[str, Any]:
+    return {
+        'day': day.isoformat(),
+        'due_time': due_time,
+        'patient_id': patient_id,
+        'physio_id': patient.get('physio_id'),
+        'institute': patient.get('institute') or None,
+        'patient_name': patient.get('name', 'Unknown'),
+        'contact': patient.get('contact', ''),
+        'notified': bool(patient.get('followup_notified', False)),
+        'notified_at': patient.get('followup_notification_sent_at'),
+        'ttl': expiry_seconds(day, now),
+    }
+
+
+def upcoming_item(entry: Dict[str, Any], today: date) -> Dict[str, Any]:
+    """An entry as the upcoming-follow-ups API returns it."""
+    day = parse_day(entry.get('day'))
+    days_until = (day - today).days
+    return {
+        'patient_id': entry.get('patient_id'),
+        'patient_name': entry.get('patient_name', 'Unknown'),
+        'contact': entry.get('contact', ''),
+        'next_followup_date': entry.get('day'),
+        'days_until': days_until,
+        'followup_notified': entry.get('notified', False),
+        'notification_sent_at': entry.get('notified_at'),
+        'is_today': days_until == 0,
+        'is_overdue': day < today,
+    }
+
+
+class FollowupSchedule:
+    """
+    Args:
+        collection: the followup_schedule collection (CosmosDBCollection).
+    """
+
+    def __init__(self, collection: Any):
+        self._collection = collection
+
+    # ── Writes ───────────────────────────────────────────────────────────
+
+    def schedule(self, patient_id: str, patient: Dict[str, Any], day_value: Any,
+                 old_day: Any = None, due_time: Optional[str] = None) -> bool:
+        """
+        Index the patient's follow-up on day_value (moving it off old_day).
+        patient is the document as it now stands. Returns False (and only
+        removes the old entry) if day_value isn't a YYYY-MM-DD date.
+        """
+        day = parse_day(day_value)
+        if old_day and old_day != day_value:
+            self.unschedule(patient_id, old_day)
+        if day is None:
+            return False
+        self._collection.document(entry_id(day.isoformat(), patient_id)).set(
+            make_entry(patient_id, patient, day, due_time))
+        return True
+
+    def unschedule(self, patient_id: str, day_value: Any) -> None:
+        if parse_day(day_value) is not None:
+            self._collection.document(entry_id(day_value, patient_id)).delete()
+
+    def mark_notified(self, patient_id: str, day_value: Any, at: str) -> None:
+        if parse_day(day_value) is not None:
+            self._collection.document(entry_id(day_value, patient_id)).patch_if(
+                {'notified': True, 'notified_at': at})
+
+    def refresh_patient(self, patient_id: str, patient: Dict[str, Any]) -> None:
+        """Copy changed patient fields (name, contact, owner) onto its entry."""
+        day_value = patient.get('next_followup_date')
+        if parse_day(day_value) is not None:
+            self._collection.document(entry_id(day_value, patient_id)).patch_if(
+                {'physio_id': patient.get('physio_id'), 'institute': patient.get('institute') or None,
+                 'patient_name': patient.get('name', 'Unknown'), 'contact': patient.get('contact', '')})
+
+    # ── Reads ────────────────────────────────────────────────────────────
+
+    def upcoming(self, owner_field: str, owner_value: str, today: date,
+                 days_ahead: int = 7) -> List[Dict[str, Any]]:
+        """Follow-ups of one physio ('physio_id') or institute due today..today+days_ahead, soonest first."""
+        query = (self._collection.where(owner_field, '==', owner_value)
+                 .where('day', '>=', today.isoformat())
+                 .where('day', '<=', (today + timedelta(days=days_ahead)).isoformat()))
+        items = [upcoming_item(doc.to_dict(), today) for doc in query.stream()]
+        items.sort(key=lambda item: (item['days_until'], item['patient_name'] or ''))
+        return items
+
+    def due_unnotified(self, days: List[str]) -> List[Dict[str, Any]]:
+        """Entries in the given day buckets whose patient hasn't been notified."""
+        query = self._collection.where('day', 'in', days).where('notified', '==', False)
+        return [doc.to_dict() for doc in query.stream()]
+
+
+def get_followup_schedule() -> FollowupSchedule:
+    from azure_cosmos_db import get_cosmos_db
+    return FollowupSchedule(get_cosmos_db().collection(COLLECTION))
+
+
+def _safely(action: str, fn) -> None:
+    # The patient document is already written; a missed entry is repaired
+    # by backfill_followup_schedule.py
+    try:
+        fn()
+    except Exception as e:
+        logger.warning(f"Follow-up schedule {action} failed: {type(e).__name__}: {e}")
+
+
+def schedule_followup(patient_id: str, patient: Dict[str, Any], day_value: Any,
+                      old_day: Any = None, due_time: Optional[str] = None) -> None:
+    _safely('update', lambda: get_followup_schedule().schedule(patient_id, patient, day_value, old_day, due_time))
+
+
+def unschedule_followup(patient_id: str, day_value: Any) -> None:
+    _safely('removal', lambda: get_followup_schedule().unschedule(patient_id, day_value))
+
+
+def record_followup_notified(patient_id: str, day_value: Any, at: str) -> None:
+    _safely('notified flag', lambda: get_followup_schedule().mark_notified(patient_id, day_value, at))
+
+
+def refresh_followup_patient(patient_id: str, patient: Dict[str, Any]) -> None:
+    _safely('refresh', lambda: get_followup_schedule().refresh_patient(patient_id, patient))
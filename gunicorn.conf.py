@@ -0,0 +1,13 @@
+"""
+Gunicorn server hooks. Command-line flags (see Dockerfile) still set the
+worker count, class, bind address and timeout; this file only adds hooks.
+"""
+
+
+def worker_exit(server, worker):
+    # Write out buffered audit/usage log records before the worker goes away
+    from log_sink import flush_logs
+    flush_logs()
+    # Same for login lockout state batched for Cosmos DB
+    from rate_limiter import flush_login_lockouts
+    flush_login_lockouts()
@@ -0,0 +1,304 @@
+"""
+Hybrid rate limiting: per-worker allowances reserved from a shared GCRA.
+
+Flask-Limiter's fixed-window strategy made one or more Redis round trips on
+every limited request (the default limits apply to every route), and the
+in-memory fallback let up to twice the limit through around window edges.
+
+Here each limit is a GCRA (generic cell rate algorithm) in the shared store:
+one "theoretical arrival time" per key, advanced by period/limit for every
+unit taken. There are no window edges; a key may burst up to `limit` units
+and then gets one more every period/limit seconds.
+
+Workers don't consult the store per request. A worker reserves an
+allowance -- a block of 1/(2 * WORKERS) of the limit, taken from the GCRA
+atomically -- and admits requests locally until the allowance is spent.
+Equal-sized blocks, shrinking to an even split of what's left as a key
+nears its limit, keep workers with equal demand at roughly equal shares.
+
+Every RATE_LIMIT_SYNC_SECONDS a worker hands unused units back and reserves
+a fresh block for each key it saw traffic on, all in one pipelined round
+trip; a worker whose allowance runs out reserves again right away. Since a
+unit is only ever admitted after the store granted it, the shared limit is
+exact. A busy worker can still use the whole budget, a block at a time;
+small limits (login: 3 per 15 minutes) are effectively checked against the
+store on every request; and a key that is over its limit is denied locally
+until the GCRA says a unit is free again.
+
+If the store errors, the worker falls back to its share of the limit in a
+process-local GCRA until the store answers again.
+
+Usage:
+    limiter = HybridRateLimiter(RedisGCRAStore(redis_client))
+    if not limiter.hit('user:abc|100/60', 100, 60):
+        ...  # 429
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("app.hybrid_rate_limit")
+
+# Gunicorn worker count (Dockerfile: -w 3)
+WORKERS = int(os.environ.get('RATE_LIMIT_WORKERS', '3'))
+SYNC_SECONDS = float(os.environ.get('RATE_LIMIT_SYNC_SECONDS', '1'))
+
+# (key, limit, period seconds, unused units handed back, units wanted now)
+Reservation = Tuple[str, int, float, int, int]
+# (units granted, units still available after the grant, seconds until `wanted` would fit)
+Grant = Tuple[int, int, float]
+
+
+def gcra_reserve(tat: Optional[float], now: float, limit: int, period: float,
+                 refund: int, want: int, workers: int) -> Tuple[float, Grant]:
+    """
+    Hand `refund` units back to a GCRA and reserve a block of
+    limit // (2 * workers) units -- or available // workers once the key
+    runs low, or `want` if that's more -- as far as available. Returns the
+    new theoretical arrival time and the grant.
+    """
+    interval = period / limit
+    tat = max(now, max(tat or now, now) - refund * interval)
+    available = max(0, int(math.floor((period - (tat - now)) / interval + 1e-9)))
+    block = min(limit // (2 * workers), available // workers)
+    granted = min(available, max(block, want)) if want else 0
+    tat += granted * interval
+    wait = max(0.0, want * interval - (period - (tat - now)))
+    return tat, (granted, available - granted, wait)
+
+
+class LocalGCRAStore:
+    """In-process GCRA store: the fallback when Redis isn't configured or is down."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tats: Dict[str, float] = {}
+
+    def reserve(self, reservations: Sequence[Reservation], now: float, workers: int) -> List[Grant]:
+        grants = []
+        with self._lock:
+            for key, limit, period, refund, want in reservations:
+                tat, grant = gcra_reserve(self._tats.get(key), now, limit, period, refund, want, workers)
+                self._tats[key] = tat
+                grants.append(grant)
+            # Keys whose arrival time has passed are back at full burst
+            if len(self._tats) > 10000:
+                self._tats = {k: t for k, t in self._tats.items() if t > now}
+        return grants
+
+
+# Same arithmetic as gcra_reserve(); the key expires once fully drained.
+# The wait is returned as a string because Lua numbers become Redis integers.
+_GCRA_LUA = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local period = tonumber(ARGV[3])
+local refund = tonumber(ARGV[4])
+local want = tonumber(ARGV[5])
+local limit = tonumber(ARGV[6])
+local workers = tonumber(ARGV[7])
+local tat = tonumber(redis.call('GET', KEYS[1]) or ARGV[1])
+tat = math.max(tat, now) - refund * interval
+if tat < now then tat = now end
+local available = math.floor((period - (tat - now)) / interval + 1e-9)
+if available < 0 then available = 0 end
+local block = math.min(math.floor(limit / (2 * workers)), math.floor(available / workers))
+local granted = 0
+if want > 0 then
+    granted = math.min(available, math.max(block, want))
+end
+tat = tat + granted * interval
+local ttl = math.ceil((tat - now) * 1000)
+if ttl > 0 then
+    redis.call('SET', KEYS[1], tostring(tat), 'PX', ttl)
+else
+    redis.call('DEL', KEYS[1])
+end
+local wait = want * interval - (period - (tat - now))
+if wait < 0 then wait = 0 end
+return {granted, available - granted, tostring(wait)}
+"""
+
+
+class RedisGCRAStore:
+    """GCRA store shared by all workers; one pipelined round trip per sync."""
+
+    KEY_PREFIX = 'rl:gcra:'
+
+    def __init__(self, client: Any):
+        self._client = client
+        self._script = client.register_script(_GCRA_LUA)
+
+    def reserve(self, reservations: Sequence[Reservation], now: float, workers: int) -> List[Grant]:
+        pipe = self._client.pipeline(transaction=False)
+        for key, limit, period, refund, want in reservations:
+            self._script(keys=[self.KEY_PREFIX + key],
+                         args=[repr(now), repr(period / limit), repr(period), refund, want, limit, workers],
+                         client=pipe)
+        return [(int(granted), int(available), float(wait)) for granted, available, wait in pipe.execute()]
+
+
+class _Allowance:
+    __slots__ = ('allowance', 'remaining', 'used_at', 'synced_at', 'retry_at')
+
+    def __init__(self):
+        self.allowance = 0      # reserved units this worker may still admit
+        self.remaining = None   # shared estimate, for X-RateLimit-Remaining
+        self.used_at = 0.0
+        self.synced_at = 0.0
+        self.retry_at = 0.0     # over the limit: no point asking the store before this
+
+
+class HybridRateLimiter:
+    """
+    Args:
+        store: shared GCRA store with reserve(reservations, now, workers) -> grants.
+        workers: processes sharing the store; sets the reservation block size.
+    """
+
+    def __init__(self, store: Any, workers: int = WORKERS,
+                 sync_seconds: float = SYNC_SECONDS,
+                 start_syncer: bool = True,
+                 clock: Callable[[], float] = time.time):
+        self._store = store
+        self._fallback = LocalGCRAStore()
+        self.workers = max(1, workers)
+        self.sync_seconds = sync_seconds
+        self._start_syncer = start_syncer
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._allowances: Dict[Tuple[str, int, float], _Allowance] = {}
+        self._syncer: Optional[threading.Thread] = None
+        self.local_hits = 0
+        self.denied = 0
+        self.inline_syncs = 0
+        self.background_syncs = 0
+        self.store_errors = 0
+
+    def hit(self, key: str, limit: int, period: float, cost: int = 1) -> bool:
+        """Admit `cost` units for key under `limit` per `period` seconds."""
+        if self._start_syncer and self._syncer is None:
+            self._ensure_syncer()
+
+        slot = (key, limit, period)
+        with self._lock:
+            state = self._allowances.get(slot)
+            if state is None:
+                state = self._allowances[slot] = _Allowance()
+            now = state.used_at = self._clock()
+            if self._take(state, cost):
+                self.local_hits += 1
+                return True
+            if now < state.retry_at:
+                # Over the limit as of the last reservation: deny without a round trip
+                self.denied += 1
+                return False
+            refund, state.allowance = state.allowance, 0
+            self.inline_syncs += 1
+
+        # Allowance used up: hand back the remainder and reserve a new share
+        grant = self._reserve([(key, limit, period, refund, cost)], now)[0]
+        with self._lock:
+            self._apply(state, grant, now)
+            if self._take(state, cost):
+                return True
+            self.denied += 1
+            return False
+
+    def remaining(self, key: str, limit: int, period: float) -> int:
+        """Best local estimate of the key's remaining units (for headers)."""
+        with self._lock:
+            state = self._allowances.get((key, limit, period))
+            if state is None or state.remaining is None:
+                return limit
+            return max(0, state.remaining)
+
+    def sync(self) -> int:
+        """
+        Refresh the allowance of every key used since its last reservation,
+        and hand back those of keys idle for a whole period, in one batch.
+        Returns the number of keys synced.
+        """
+        now = self._clock()
+        with self._lock:
+            due = []
+            for slot, state in list(self._allowances.items()):
+                if state.used_at > state.synced_at:
+                    due.append((slot, state, state.allowance, 1))
+                    state.allowance = 0
+                elif now - state.used_at > slot[2]:
+                    del self._allowances[slot]
+                    if state.allowance:
+                        due.append((slot, None, state.allowance, 0))
+            if due:
+                self.background_syncs += 1
+        if not due:
+            return 0
+        grants = self._reserve([(key, limit, period, refund, want)
+                                for (key, limit, period), _, refund, want in due], now)
+        with self._lock:
+            for (_, state, _, _), grant in zip(due, grants):
+                if state is not None:
+                    self._apply(state, grant, now)
+        return len(due)
+
+    def _take(self, state: _Allowance, cost: int) -> bool:
+        if state.allowance < cost:
+            return False
+        state.allowance -= cost
+        if state.remaining is not None:
+            state.remaining -= cost
+        return True
+
+    def _reserve(self, reservations: List[Reservation], now: float) -> List[Grant]:
+        try:
+            return self._store.reserve(reservations, now, self.workers)
+        except Exception as e:
+            with self._lock:
+                self.store_errors += 1
+            logger.warning(f"Rate limit store unavailable ({type(e).__name__}), limiting this worker locally")
+            # This worker's share of each limit, in a process-local GCRA.
+            # Units held in the shared store come back there on their own.
+            local = [(key, max(1, limit // self.workers), period, 0, want)
+                     for key, limit, period, _, want in reservations]
+            return self._fallback.reserve(local, now, 1)
+
+    def _apply(self, state: _Allowance, grant: Grant, now: float) -> None:
+        """Add a grant to the local allowance (caller holds _lock)."""
+        granted, available, wait = grant
+        state.allowance += granted
+        state.remaining = state.allowance + available
+        state.synced_at = now
+        state.retry_at = now + wait if not state.allowance else 0.0
+
+    def _ensure_syncer(self) -> None:
+        with self._lock:
+            if self._syncer is not None:
+                return
+            self._syncer = threading.Thread(target=self._sync_loop, name='rate-limit-syncer', daemon=True)
+            self._syncer.start()
+
+    def _sync_loop(self) -> None:
+        while True:
+            time.sleep(self.sync_seconds)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.warning(f"Rate limit sync failed: {type(e).__name__}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'tracked_keys': len(self._allowances),
+                'reserved_units': sum(s.allowance for s in self._allowances.values()),
+                'local_hits': self.local_hits,
+                'inline_syncs': self.inline_syncs,
+                'background_syncs': self.background_syncs,
+                'denied': self.denied,
+                'store_errors': self.store_errors,
+            }
@@ -0,0 +1,296 @@
+"""
+Buffered append sink for write-only log collections.
+
+ai_usage_logs, voice_usage_logs and audit_logs are append-only: nothing on
+the request path ever reads a record back. Each record used to be a
+synchronous `.add()` inside the request. Now append_log() buffers it in
+memory and returns; a background flusher writes buffered records every
+LOG_SINK_FLUSH_SECONDS, or as soon as LOG_SINK_FLUSH_SIZE are waiting.
+
+- Crash safety: every record is also appended to a per-process spool file
+  (JSON lines under LOG_SPOOL_DIR) before append_log() returns, and the file
+  is rewritten to hold only unwritten records after each flush. A worker
+  that starts up replays spool files left behind by dead processes.
+- Idempotent replay: record ids are assigned at append time and written
+  with upserts, so a record flushed just before a crash isn't duplicated.
+- Bounded memory: at most LOG_SINK_MAX_BUFFER records are kept; past that
+  (only possible while Cosmos is failing) the oldest are dropped with a
+  warning.
+- Shutdown: remaining records are flushed at interpreter exit and from the
+  Gunicorn worker_exit hook (gunicorn.conf.py).
+
+Cosmos DB containers here are partitioned by /id, so records never share a
+partition and can't go in one transactional batch; a flush writes them with
+bounded concurrency instead.
+
+Usage:
+    from log_sink import append_log
+
+    append_log('audit_logs', {'user_id': uid, 'action': action, 'timestamp': SERVER_TIMESTAMP})
+"""
+
+import os
+import json
+import uuid
+import atexit
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cosmos_constants import SERVER_TIMESTAMP
+
+logger = logging.getLogger("app.log_sink")
+
+SPOOL_DIR = os.environ.get('LOG_SPOOL_DIR') or os.path.join(tempfile.gettempdir(), 'prism-log-spool')
+FLUSH_SECONDS = float(os.environ.get('LOG_SINK_FLUSH_SECONDS', '5'))
+FLUSH_SIZE = int(os.environ.get('LOG_SINK_FLUSH_SIZE', '200'))
+MAX_BUFFER = int(os.environ.get('LOG_SINK_MAX_BUFFER', '10000'))
+WRITE_CONCURRENCY = int(os.environ.get('LOG_SINK_WRITE_CONCURRENCY', '8'))
+
+# Fields the Cosmos wrapper would fill in at write time; resolved at append
+# time instead so buffering doesn't shift them
+_TIMESTAMP_FIELDS = ('timestamp', 'created_at', 'updated_at')
+
+# (collection, document id, record)
+LogEntry = Tuple[str, str, Dict[str, Any]]
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class BufferedAppendSink:
+    """
+    Args:
+        write: list of entries -> entries that could not be written (retried
+            on the next flush).
+    """
+
+    def __init__(self, write: Callable[[List[LogEntry]], List[LogEntry]],
+                 spool_dir: str = SPOOL_DIR,
+                 flush_size: int = FLUSH_SIZE,
+                 flush_seconds: float = FLUSH_SECONDS,
+                 max_buffer: int = MAX_BUFFER,
+                 start_flusher: bool = True,
+                 name: str = 'log_sink'):
+        self._write = write
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._start_flusher = start_flusher
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._buffer: List[LogEntry] = []
+        self._flusher: Optional[threading.Thread] = None
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._spool_dir = spool_dir
+        self._prefix = name
+        self._spool_path = os.path.join(spool_dir, f'{name}-{os.getpid()}.jsonl')
+        self._recover()
+        self._spool = open(self._spool_path, 'a', encoding='utf-8')
+        atexit.register(self.close)
+
+    def append(self, collection: str, record: Dict[str, Any]) -> None:
+        """Buffer one record for `collection`. Never raises."""
+        try:
+            now = datetime.now(timezone.utc).isoformat()
+            record = {k: (now if k in _TIMESTAMP_FIELDS and v == SERVER_TIMESTAMP else v)
+                      for k, v in record.items()}
+            entry = (collection, str(uuid.uuid4()), record)
+            line = json.dumps(entry, default=str)
+            with self._lock:
+                self._buffer.append(entry)
+                self.appended += 1
+                try:
+                    self._spool.write(line + '\n')
+                    self._spool.flush()
+                except (OSError, ValueError) as e:
+                    # Still buffered, just not crash-safe
+                    logger.warning(f"Could not spool {collection} record: {e}")
+                if len(self._buffer) > self.max_buffer:
+                    overflow = len(self._buffer) - self.max_buffer
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+                    logger.warning(f"Log sink over {self.max_buffer} records, dropped {overflow} oldest")
+                due = len(self._buffer) >= self.flush_size
+        except Exception as e:
+            logger.error(f"Could not buffer {collection} record: {type(e).__name__}: {e}")
+            return
+
+        if self._start_flusher:
+            if self._flusher is None:
+                self._ensure_flusher()
+            if due:
+                self._wake.set()
+        elif due:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write everything buffered so far. Returns the number of records written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                failed = self._write(batch)
+            except Exception as e:
+                logger.error(f"Log sink flush failed: {type(e).__name__}: {e}")
+                failed = batch
+            with self._lock:
+                self._buffer[:0] = failed
+                self.written += len(batch) - len(failed)
+                self.flushes += 1
+                try:
+                    self._rewrite_spool()
+                except OSError as e:
+                    logger.warning(f"Could not rewrite log spool: {e}")
+            if failed:
+                logger.warning(f"Log sink: {len(failed)} of {len(batch)} records not written, will retry")
+            return len(batch) - len(failed)
+
+    def _rewrite_spool(self) -> None:
+        """Replace the spool file with the records still buffered (caller holds _lock)."""
+        tmp_path = self._spool_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            for entry in self._buffer:
+                tmp.write(json.dumps(entry, default=str) + '\n')
+        self._spool.close()
+        os.replace(tmp_path, self._spool_path)
+        self._spool = open(self._spool_path, 'a', encoding='utf-8')
+
+    def _recover(self) -> None:
+        """Load spool files of processes that died before flushing."""
+        for filename in os.listdir(self._spool_dir):
+            if not (filename.startswith(self._prefix + '-') and filename.endswith('.jsonl')):
+                continue
+            path = os.path.join(self._spool_dir, filename)
+            try:
+                pid = int(filename[len(self._prefix) + 1:-len('.jsonl')])
+            except ValueError:
+                continue
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+            recovered = 0
+            try:
+                with open(path, encoding='utf-8') as spool:
+                    for line in spool:
+                        try:
+                            collection, doc_id, record = json.loads(line)
+                        except ValueError:
+                            continue  # torn last line from the crash
+                        self._buffer.append((collection, doc_id, record))
+                        recovered += 1
+                if path != self._spool_path:
+                    # Carried over into this process's spool below
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not recover log spool {filename}: {e}")
+                continue
+            if recovered:
+                logger.info(f"Recovered {recovered} unwritten log records from {filename}")
+        if self._buffer:
+            with open(self._spool_path, 'w', encoding='utf-8') as spool:
+                for entry in self._buffer:
+                    spool.write(json.dumps(entry, default=str) + '\n')
+
+    def _ensure_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='log-sink-flusher', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Log sink flush loop error: {type(e).__name__}")
+
+    def close(self) -> None:
+        """Flush what's left (shutdown). Leaves the spool behind only if writes failed."""
+        self.flush()
+        with self._lock:
+            self._spool.close()
+            if not self._buffer:
+                try:
+                    os.remove(self._spool_path)
+                except OSError:
+                    pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'buffered': len(self._buffer),
+                'appended': self.appended,
+                'written': self.written,
+                'dropped': self.dropped,
+                'flushes': self.flushes,
+            }
+
+
+def _write_to_cosmos(entries: List[LogEntry]) -> List[LogEntry]:
+    from azure_cosmos_db import get_cosmos_db
+    db = get_cosmos_db()
+
+    def write_one(entry: LogEntry) -> Optional[LogEntry]:
+        collection, doc_id, record = entry
+        try:
+            db.collection(collection).document(doc_id).set(record)
+            return None
+        except Exception:
+            return entry
+
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as pool:
+        return [entry for entry in pool.map(write_one, entries) if entry is not None]
+
+
+_sink: Optional[BufferedAppendSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_log_sink() -> BufferedAppendSink:
+    """This process's sink, created on first use (after any Gunicorn fork)."""
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                _sink = BufferedAppendSink(_write_to_cosmos)
+    return _sink
+
+
+def append_log(collection: str, record: Dict[str, Any]) -> None:
+    """Queue a record for an append-only log collection. Never raises."""
+    try:
+        sink = get_log_sink()
+    except Exception as e:
+        # No spool directory etc.: fall back to a direct write
+        logger.error(f"Log sink unavailable ({type(e).__name__}: {e}), writing {collection} record directly")
+        if _write_to_cosmos([(collection, str(uuid.uuid4()), record)]):
+            logger.error(f"Failed to write {collection} record")
+        return
+    sink.append(collection, record)
+
+
+def flush_logs() -> None:
+    """Flush this process's sink if it was ever used (Gunicorn worker_exit hook)."""
+    if _sink is not None:
+        _sink.close()
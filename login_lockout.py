@@ -0,0 +1,365 @@
+"""
+Login lockout tracking, kept off the user document.
+
+Failed-login counts and locks used to live on users/{email}: every login
+read it, every failure patched it, so a credential-stuffing run against an
+account turned into write contention on the most-read document we have.
+Lockout state now lives in its own store:
+
+- In-memory fast path: each worker caches lockout state per account for
+  LOGIN_LOCKOUT_CACHE_SECONDS, so a locked account is rejected from memory
+  with at most one backing-store read per worker in that time. The cache is
+  never trusted for longer: a password reset on another worker deletes the
+  shared state, and every worker sees it once its entry expires.
+- Backing store: Redis when configured (each failure is one atomic
+  read-modify-write, so all workers count together), otherwise the
+  `login_lockouts` Cosmos DB container with per-item TTL. Writes to Cosmos
+  are batched: failures are coalesced per account in memory and applied
+  every LOGIN_LOCKOUT_FLUSH_SECONDS, and a new lock is applied right away.
+  Each flush is a conditional patch against the stored state (retried on
+  conflict), so failures and strikes from all workers add up.
+- Exponential windows: MAX failures lock an account for
+  LOGIN_LOCKOUT_BASE_SECONDS, doubling with every further lock up to
+  LOGIN_LOCKOUT_MAX_SECONDS. Strikes are forgotten after
+  LOGIN_LOCKOUT_MEMORY_SECONDS without failures.
+
+Documents and keys are named by a hash of the email, so the store holds no
+addresses. The policy (register_failure) is a pure function and the
+backends are injected, so the store is testable without either database.
+
+Usage:
+    lockouts = LoginLockoutStore(RedisLockoutBackend(redis_client), max_failures=3)
+    allowed, retry_after = lockouts.check(email)
+    just_locked = lockouts.record_failure(email)
+    lockouts.clear(email)
+"""
+
+import os
+import json
+import math
+import time
+import atexit
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.login_lockout")
+
+LOCKOUT_BASE_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_BASE_SECONDS', '900'))
+LOCKOUT_MAX_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_MAX_SECONDS', '86400'))
+LOCKOUT_MEMORY_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_MEMORY_SECONDS', '86400'))
+LOCKOUT_CACHE_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_CACHE_SECONDS', '30'))
+LOCKOUT_FLUSH_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_FLUSH_SECONDS', '5'))
+LOCKOUT_CACHE_SIZE = int(os.environ.get('LOGIN_LOCKOUT_CACHE_SIZE', '50000'))
+
+# Cached marker for "the backing store has nothing for this account"
+_CLEAN = 'clean'
+
+
+class LockoutState:
+    __slots__ = ('failures', 'strikes', 'locked_until', 'updated_at')
+
+    def __init__(self, failures: int = 0, strikes: int = 0,
+                 locked_until: float = 0.0, updated_at: float = 0.0):
+        self.failures = failures
+        self.strikes = strikes
+        self.locked_until = locked_until
+        self.updated_at = updated_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'failures': self.failures,
+            'strikes': self.strikes,
+            'locked_until': self.locked_until,
+            'updated_at': self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'LockoutState':
+        return cls(int(data.get('failures', 0)), int(data.get('strikes', 0)),
+                   float(data.get('locked_until', 0.0)), float(data.get('updated_at', 0.0)))
+
+
+def lockout_key(email: str) -> str:
+    return hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()
+
+
+def register_failure(state: Optional[LockoutState], now: float, max_failures: int,
+                     base_seconds: float = LOCKOUT_BASE_SECONDS,
+                     max_seconds: float = LOCKOUT_MAX_SECONDS,
+                     memory_seconds: float = LOCKOUT_MEMORY_SECONDS) -> Tuple[LockoutState, bool]:
+    """
+    Count one failed login. Returns the new state and whether this failure
+    just locked the account. Failures while locked don't count.
+    """
+    if state is None or now - state.updated_at > memory_seconds:
+        state = LockoutState()
+    else:
+        state = LockoutState(state.failures, state.strikes, state.locked_until, state.updated_at)
+    if state.locked_until > now:
+        return state, False
+    state.failures += 1
+    state.updated_at = now
+    if state.failures < max_failures:
+        return state, False
+    state.strikes += 1
+    state.failures = 0
+    state.locked_until = now + min(base_seconds * 2 ** (state.strikes - 1), max_seconds)
+    return state, True
+
+
+class RedisLockoutBackend:
+    """Shared across workers; every failure is applied atomically (WATCH/MULTI)."""
+
+    KEY_PREFIX = 'lockout:'
+    atomic_updates = True
+
+    def __init__(self, client: Any):
+        self._client = client
+
+    def get(self, key: str) -> Optional[LockoutState]:
+        raw = self._client.get(self.KEY_PREFIX + key)
+        return LockoutState.from_dict(json.loads(raw)) if raw else None
+
+    def update(self, key: str, apply: Callable[[Optional[LockoutState]], Tuple[LockoutState, bool, float]]
+               ) -> Tuple[LockoutState, bool]:
+        redis_key = self.KEY_PREFIX + key
+
+        def transaction(pipe):
+            raw = pipe.get(redis_key)
+            state, just_locked, ttl = apply(LockoutState.from_dict(json.loads(raw)) if raw else None)
+            pipe.multi()
+            pipe.set(redis_key, json.dumps(state.to_dict()), ex=max(1, int(ttl)))
+            return state, just_locked
+
+        return self._client.transaction(transaction, redis_key, value_from_callable=True)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self.KEY_PREFIX + key)
+
+
+class CosmosLockoutBackend:
+    """
+    login_lockouts container (per-item TTL). The store batches failures and
+    applies each account's batch with update(): a patch conditioned on the
+    stored fields being what was read (compare-and-swap), retried on conflict.
+
+    The container is partitioned on /id, so reads and deletes are point
+    operations: most accounts have no document, and a miss must not fall
+    back to a cross-partition query on the login path.
+    """
+
+    COLLECTION = 'login_lockouts'
+    atomic_updates = False
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, db: Any):
+        self._db = db
+
+    def get(self, key: str) -> Optional[LockoutState]:
+        doc = self._db.collection(self.COLLECTION).document(key).get(id_is_partition_key=True)
+        return LockoutState.from_dict(doc.to_dict()) if doc.exists else None
+
+    def update(self, key: str, apply: Callable[[Optional[LockoutState]], Tuple[LockoutState, bool, float]]
+               ) -> Tuple[LockoutState, bool]:
+        ref = self._db.collection(self.COLLECTION).document(key)
+        for _ in range(self.MAX_ATTEMPTS):
+            doc = ref.get(id_is_partition_key=True)
+            stored = doc.to_dict() if doc.exists else None
+            state, just_locked, ttl = apply(LockoutState.from_dict(stored) if stored is not None else None)
+            data = {**state.to_dict(), 'ttl': max(1, int(ttl))}
+            if stored is None:
+                written = ref.create(data)
+            else:
+                written = ref.patch_if(data, [
+                    (field, '==', stored[field]) if field in stored else (field, 'missing', None)
+                    for field in LockoutState.__slots__
+                ])
+            if written:
+                return state, just_locked
+        raise RuntimeError("login lockout update kept conflicting")
+
+    def delete(self, key: str) -> None:
+        self._db.collection(self.COLLECTION).document(key).delete(id_is_partition_key=True)
+
+
+class LoginLockoutStore:
+    """
+    Args:
+        backend: RedisLockoutBackend or CosmosLockoutBackend (anything with
+            get/update/delete). With atomic_updates every failure is applied
+            right away; otherwise failures are batched and flushed.
+    """
+
+    def __init__(self, backend: Any, max_failures: int,
+                 base_seconds: float = LOCKOUT_BASE_SECONDS,
+                 max_seconds: float = LOCKOUT_MAX_SECONDS,
+                 memory_seconds: float = LOCKOUT_MEMORY_SECONDS,
+                 cache_seconds: float = LOCKOUT_CACHE_SECONDS,
+                 flush_seconds: float = LOCKOUT_FLUSH_SECONDS,
+                 start_flusher: bool = True,
+                 clock: Callable[[], float] = time.time):
+        self._backend = backend
+        self.max_failures = max_failures
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.memory_seconds = memory_seconds
+        self.cache_seconds = cache_seconds
+        self.flush_seconds = flush_seconds
+        self._start_flusher = start_flusher
+        self._clock = clock
+        self._cache = TTLCache(maxsize=LOCKOUT_CACHE_SIZE, ttl=cache_seconds, name='login_lockout')
+        self._lock = threading.Lock()
+        # Failure times not yet applied to the backend, per account
+        self._dirty: Dict[str, List[float]] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self.rejected_locally = 0
+        self.backend_reads = 0
+        self.backend_writes = 0
+        self.locks = 0
+
+    def check(self, email: str) -> Tuple[bool, int]:
+        """(allowed, seconds until the lock ends). Fails open if the store is down."""
+        state = self._state(lockout_key(email))
+        now = self._clock()
+        if state is not None and state.locked_until > now:
+            with self._lock:
+                self.rejected_locally += 1
+            return False, int(math.ceil(state.locked_until - now))
+        return True, 0
+
+    def record_failure(self, email: str) -> bool:
+        """Count a failed login. True only for the failure that locked the account."""
+        key = lockout_key(email)
+        now = self._clock()
+
+        if self._backend.atomic_updates:
+            state, just_locked = self._backend.update(key, self._applier([now]))
+            with self._lock:
+                self.backend_writes += 1
+        else:
+            current = self._state(key)
+            with self._lock:
+                # Re-read under the lock: concurrent failures in this worker
+                # must build on each other
+                cached = self._cache.peek(key)
+                if isinstance(cached, LockoutState):
+                    current = cached
+                if current is not None and current.locked_until > now:
+                    # Failures while locked don't count: nothing to apply, no I/O
+                    return False
+                state, just_locked = self._register(current, now)
+                self._dirty.setdefault(key, []).append(now)
+            if self._start_flusher and self._flusher is None:
+                self._ensure_flusher()
+
+        self._remember(key, state, now)
+        if just_locked:
+            with self._lock:
+                self.locks += 1
+            if not self._backend.atomic_updates:
+                # Other workers should see a new lock without waiting for the batch
+                self.flush()
+        return just_locked
+
+    def clear(self, email: str) -> None:
+        """Forget failures and locks (successful login, password reset)."""
+        key = lockout_key(email)
+        with self._lock:
+            self._dirty.pop(key, None)
+        # Always the shared state too: this worker's cache may not have seen
+        # failures or a lock recorded by another worker
+        self._backend.delete(key)
+        self._cache.set(key, _CLEAN)
+        with self._lock:
+            self.backend_writes += 1
+
+    def flush(self) -> int:
+        """Apply coalesced failures (Cosmos backend). Returns accounts written."""
+        if self._backend.atomic_updates:
+            return 0
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        written = 0
+        for key, failures in batch.items():
+            try:
+                state, _ = self._backend.update(key, self._applier(failures))
+            except Exception as e:
+                logger.warning(f"Could not persist login lockout state: {type(e).__name__}")
+                with self._lock:
+                    self._dirty[key] = failures + self._dirty.get(key, [])
+                continue
+            written += 1
+            # The shared state includes other workers' failures
+            self._remember(key, state, self._clock())
+        with self._lock:
+            self.backend_writes += written
+        return written
+
+    def _register(self, state: Optional[LockoutState], at: float) -> Tuple[LockoutState, bool]:
+        return register_failure(state, at, self.max_failures, self.base_seconds,
+                                self.max_seconds, self.memory_seconds)
+
+    def _applier(self, failures: List[float]
+                 ) -> Callable[[Optional[LockoutState]], Tuple[LockoutState, bool, float]]:
+        """apply() for backend.update: count these failures on top of the stored state."""
+        def apply(state):
+            just_locked = False
+            for at in failures:
+                state, locked = self._register(state, at)
+                just_locked = just_locked or locked
+            return state, just_locked, self._ttl(state, self._clock())
+        return apply
+
+    def _state(self, key: str) -> Optional[LockoutState]:
+        cached = self._cache.get(key)
+        if cached is not None:
+            return None if cached == _CLEAN else cached
+        try:
+            state = self._backend.get(key)
+        except Exception as e:
+            logger.error(f"Login lockout store unavailable: {type(e).__name__}: {e}")
+            return None
+        with self._lock:
+            self.backend_reads += 1
+        self._remember(key, state, self._clock())
+        return state
+
+    def _remember(self, key: str, state: Optional[LockoutState], now: float) -> None:
+        # Locks too are only cached for cache_seconds, so a reset on another
+        # worker (which deletes the shared state) unlocks everywhere
+        self._cache.set(key, _CLEAN if state is None else state)
+
+    def _ttl(self, state: LockoutState, now: float) -> float:
+        return max(state.locked_until - now, 0.0) + self.memory_seconds
+
+    def _ensure_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='login-lockout-flusher', daemon=True)
+            self._flusher.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Login lockout flush failed: {type(e).__name__}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': type(self._backend).__name__,
+                'cached_accounts': len(self._cache),
+                'pending_writes': len(self._dirty),
+                'rejected_locally': self.rejected_locally,
+                'backend_reads': self.backend_reads,
+                'backend_writes': self.backend_writes,
+                'locks': self.locks,
+            }
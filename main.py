@@ -103,11 +103,36 @@ from xhtml2pdf import pisa
 from functools import wraps
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
-from app_auth import require_firebase_auth, require_auth
+from app_auth import require_firebase_auth, require_auth, revoke_firebase_tokens, get_token_cache_stats
+from user_cache import forget_firebase_uid, get_user_cache_stats, index_firebase_uid, invalidate_user
+from log_sink import append_log, get_log_sink
+from assessment_progress import PROGRESS_FIELD, empty_progress, section_saved
+from patient_list_query import PatientListFilters, PatientListQuery, PatientScope, name_sort_key
+from patient_search_index import get_patient_search_index, get_patient_search_stats
+from phrase_index import get_phrase_index, get_phrase_index_stats, record_phrases
+from followup_schedule import (
+    day_buckets, get_followup_schedule, record_followup_notified, refresh_followup_patient,
+    schedule_followup, unschedule_followup,
+)
+from tag_dictionary import (
+    delete_tag_dictionary, get_tag_dictionary, get_tag_dictionary_stats, record_tag_change, set_patient_tags,
+)
+from report_summaries import get_report_summary_stats, get_report_summary_store
+from report_assembly import get_patient_report, get_report_assembly_stats
+from clinical_record import (
+    add_section_record, create_clinical_record, delete_clinical_record, get_clinical_record_stats,
+)
+from patient_numbers import allocate_patient_number, get_patient_number_stats
 from patient_access import patient_access_allowed as _shared_patient_access_allowed
+from patient_context import (
+    COLLECTION_SECTIONS, get_patient_context_cache_stats, get_patient_context_snapshot,
+    invalidate_patient_context,
+)
 from quota_middleware import require_ai_quota, require_patient_quota, require_voice_quota
+from subscription_manager import get_quota_lease_stats, get_subscription_cache_stats, invalidate_subscription
 from firebase_admin import auth
 from ai_cache import AICache, get_ai_suggestion_with_cache
+from ai_telemetry import get_ai_metrics
 from rate_limiter import (
     limiter,
     check_login_attempts,
@@ -410,15 +435,12 @@ def get_ai_suggestion(prompt: str, metadata: Optional[Dict[str, Any]] = None, pa
         return "AI service is not available. Please check configuration."
 
     try:
-        # Azure OpenAI GPT-4o model
-        model = "gpt-4o"
-
+        # Deployment comes from the endpoint's model policy (ai_model_policy)
         # Use intelligent caching system
         # This will check cache first, then call AI API if cache miss
         response = get_ai_suggestion_with_cache(
             db=db,
             prompt=prompt,
-            model=model,
             openai_client=client,
             metadata=metadata or {},
             patient_context=patient_context
@@ -444,6 +466,23 @@ def get_ai_suggestion(prompt: str, metadata: Optional[Dict[str, Any]] = None, pa
             return "AI service temporarily unavailable. Please try again."
 
 
+def generate_report_summary(prompt: str, patient_context: str) -> str:
+    """
+    AI completion for a stored report summary (report_summaries). Unlike
+    get_ai_suggestion() this raises on failure, so an error message is never
+    stored as a patient's summary.
+    """
+    if client is None:
+        raise RuntimeError("AI service is not configured")
+    return get_ai_suggestion_with_cache(
+        db=db,
+        prompt=prompt,
+        openai_client=client,
+        metadata={'endpoint': 'patient_report'},
+        patient_context=patient_context
+    )
+
+
 def log_action(user_id: str, action: str, details: Optional[Dict[str, Any]] = None) -> None:
     """Append an entry into Firestore `audit_logs` collection."""
     entry = {
@@ -452,7 +491,7 @@ def log_action(user_id: str, action: str, details: Optional[Dict[str, Any]] = No
         'details': details,
         'timestamp': SERVER_TIMESTAMP
     }
-    db.collection('audit_logs').add(entry)
+    append_log('audit_logs', entry)
 
 def generate_temp_password(length: int = 12) -> str:
     """Generate a secure temporary password."""
@@ -668,114 +707,7 @@ def fetch_patient(patient_id):
 
 # â”€â”€â”€ PHI SANITIZATION FUNCTIONS â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 import re
-
-def sanitize_age_sex(age_sex_str):
-    """Convert exact age to age range to protect PHI."""
-    if not age_sex_str:
-        return "Age/Sex not specified"
-    
-    # Extract age and sex
-    match = re.search(r'(\d+)\s*([MF]|male|female)', age_sex_str.strip(), re.IGNORECASE)
-    if not match:
-        return "Demographics: Adult"
-    
-    age = int(match.group(1))
-    sex = match.group(2).upper()[0]  # M or F
-    
-    # Convert to age ranges
-    if age < 18:
-        age_range = "Under 18"
-    elif age < 30:
-        age_range = "20s"
-    elif age < 40:
-        age_range = "30s"
-    elif age < 50:
-        age_range = "40s"
-    elif age < 60:
-        age_range = "50s"
-    elif age < 70:
-        age_range = "60s"
-    else:
-        age_range = "70+"
-    
-    return f"{age_range} {sex}"
-
-
-def sanitize_clinical_text(text):
-    """Remove PHI from clinical text while preserving clinical information."""
-    if not text:
-        return ""
-    
-    # Remove common PHI patterns
-    sanitized = text
-    
-    # Remove specific dates (but keep relative time references)
-    sanitized = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', '[date removed]', sanitized)
-    sanitized = re.sub(r'\b(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{2,4}\b', '[date removed]', sanitized, flags=re.IGNORECASE)
-    
-    # Remove proper names (preserve medical and anatomical terms)
-    medical_terms = {
-        # Medical abbreviations and facilities
-        'MRI', 'CT', 'X-ray', 'PT', 'OT', 'Dr', 'Hospital', 'Clinic', 'Emergency', 'Department',
-        # Body parts - general
-        'Pain', 'Back', 'Knee', 'Shoulder', 'Hip', 'Neck', 'Arm', 'Leg', 'Ankle', 'Foot', 'Hand',
-        'Wrist', 'Elbow', 'Spine', 'Lumbar', 'Thoracic', 'Cervical', 'Chest', 'Abdomen', 'Head',
-        'Finger', 'Thumb', 'Toe', 'Heel', 'Calf', 'Thigh', 'Forearm', 'Pelvis', 'Groin', 'Buttock',
-        # Directional terms
-        'Right', 'Left', 'Bilateral', 'Anterior', 'Posterior', 'Lateral', 'Medial', 'Upper', 'Lower',
-        'Proximal', 'Distal', 'Superior', 'Inferior', 'Dorsal', 'Ventral', 'Superficial', 'Deep',
-        # Spinal regions
-        'Sacral', 'Coccyx', 'Sacrum', 'Vertebral', 'Intervertebral', 'Disc',
-        # Joints and structures
-        'Joint', 'Muscle', 'Tendon', 'Ligament', 'Bone', 'Tissue', 'Nerve', 'Fascia'
-    }
-    words = sanitized.split()
-    sanitized_words = []
-    # Convert medical_terms to lowercase for case-insensitive matching
-    medical_terms_lower = {term.lower() for term in medical_terms}
-    for word in words:
-        clean_word = re.sub(r'[^\w]', '', word)
-        # Check if it's a capitalized word that's not a medical term
-        if clean_word.istitle() and clean_word.lower() not in medical_terms_lower and len(clean_word) > 2:
-            sanitized_words.append('[name removed]')
-        else:
-            sanitized_words.append(word)
-    sanitized = ' '.join(sanitized_words)
-    
-    # Remove phone numbers
-    sanitized = re.sub(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', '[phone removed]', sanitized)
-    
-    # Remove addresses (simple pattern)
-    sanitized = re.sub(r'\b\d+\s+\w+\s+(Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln)\b', '[address removed]', sanitized, flags=re.IGNORECASE)
-    
-    # Clean up multiple spaces
-    sanitized = re.sub(r'\s+', ' ', sanitized).strip()
-    
-    return sanitized
-
-
-def sanitize_subjective_data(inputs_dict):
-    """Sanitize subjective examination data to remove PHI.
-
-    Recurses into nested dicts/lists -- a value that was itself a dict or
-    list (e.g. a sub-section of form data) previously passed through
-    untouched, since only top-level string values were sanitized, letting
-    unsanitized clinical text reach the Azure OpenAI prompt.
-    """
-    if not inputs_dict:
-        return {}
-
-    def sanitize_value(value):
-        if isinstance(value, str):
-            return sanitize_clinical_text(value)
-        elif isinstance(value, dict):
-            return {k: sanitize_value(v) for k, v in value.items()}
-        elif isinstance(value, list):
-            return [sanitize_value(item) for item in value]
-        else:
-            return value
-
-    return {key: sanitize_value(value) for key, value in inputs_dict.items()}
+from data_sanitization import sanitize_age_sex, sanitize_clinical_text, sanitize_subjective_data
 
 
 # ============================================================================
@@ -2232,6 +2164,8 @@ def reset_password_api():
             except Exception as firebase_error:
                 logger.warning(f"Failed to update Firebase Auth password for {email}: {str(firebase_error)}")
                 # Continue - Firestore password is updated, which is primary
+            # Existing sessions must not outlive the old password
+            revoke_firebase_tokens(firebase_uid)
 
         # Clear reset token
         clear_reset_token(db, email)
@@ -2325,6 +2259,8 @@ def reset_password_page(token):
                 except Exception as firebase_error:
                     logger.warning(f"Failed to update Firebase Auth password for {email}: {str(firebase_error)}")
                     # Continue - Firestore password is updated
+                # Existing sessions must not outlive the old password
+                revoke_firebase_tokens(firebase_uid)
 
             # Clear reset token and any login lockout
             clear_reset_token(db, email)
@@ -2596,6 +2532,7 @@ def sync_user_to_firestore():
         }
 
         db.collection('users').document(firebase_email).set(user_data)
+        index_firebase_uid(firebase_uid, firebase_email)
 
         log_action(None, 'Firebase Register', f"{data['name']} ({firebase_email}) registered via Firebase Auth - pending approval")
 
@@ -3367,6 +3304,7 @@ def api_invite_team_member():
             'user_type': 'institute_staff',
             'email_verified': True,  # Admin is vouching for this address
         })
+        index_firebase_uid(firebase_uid, email)
 
         reset_token = generate_reset_token()
         store_reset_token(db, email, reset_token)
@@ -3576,6 +3514,7 @@ def api_accept_updated_tos():
             'tos_accepted_at': SERVER_TIMESTAMP,
             'consent_terms': 1
         })
+        invalidate_user(firebase_email)
 
         # Log the action
         log_action(firebase_email, 'ToS Acceptance', f"Accepted Terms of Service version {TOS_VERSION}")
@@ -3648,6 +3587,7 @@ def edit_profile():
 
             # Security: Update user document
             user_ref.update(updates)
+            invalidate_user(user_email)
 
             # Update Firebase Auth password if account exists
             firebase_uid = user_data.get('firebase_uid')
@@ -3661,6 +3601,8 @@ def edit_profile():
                 except Exception as firebase_error:
                     logger.warning(f"Failed to update Firebase Auth password for {user_email}: {str(firebase_error)}")
                     # Continue - Cosmos DB password is updated
+                # Existing sessions must not outlive the old password
+                revoke_firebase_tokens(firebase_uid)
 
             # Security: Force logout after password change (best practice)
             # This invalidates the current session and requires re-login with new password
@@ -3670,6 +3612,7 @@ def edit_profile():
 
         # Update user document (no password change)
         user_ref.update(updates)
+        invalidate_user(user_email)
 
         # Update session if name changed
         if updates['name'] != session.get('user_name'):
@@ -4401,6 +4344,7 @@ def request_data_deletion():
             'deletion_reason': deletion_reason,
             'active': 0  # Deactivate account immediately
         })
+        invalidate_user(user_email)
 
         # Log the deletion request
         log_action(user_email, 'Account Deletion Request', f"User requested account deletion. Reason: {deletion_reason or 'Not provided'}. Scheduled for: {scheduled_deletion.strftime('%Y-%m-%d')}")
@@ -4447,6 +4391,7 @@ def cancel_data_deletion():
         'deletion_cancelled_at': SERVER_TIMESTAMP,
         'active': 1  # Reactivate account
     })
+    invalidate_user(user_email)
 
     # Log the cancellation
     log_action(user_email, 'Account Deletion Cancelled', 'User cancelled account deletion request during grace period')
@@ -4946,204 +4891,126 @@ def view_patients():
         quick_filter = request.args.get('quick_filter', '').strip()
 
         try:
-            # 1) Base query - fetch all patients for this user
-            coll = db.collection('patients')
-
-            # 2) Restrict by institute or physio. Super admins get everything;
-            # everyone else gets their own patients plus any teammate's patients
-            # in the same institute (team-wide access). Cosmos .where() only
-            # AND-chains, so institute+physio is two queries merged/deduped by id.
+            # 1) Scope: super admins see everyone; everyone else gets their own
+            # patients plus any teammate's patients in the same institute
+            # (team-wide access)
             if session.get('is_super_admin') == 1:
-                docs = list(coll.stream())
+                scope = PatientScope(everyone=True)
             else:
-                seen_ids = set()
-                docs = []
-                for doc in coll.where('physio_id', '==', session.get('user_id')).stream():
-                    seen_ids.add(doc.id)
-                    docs.append(doc)
-                session_institute = session.get('institute')
-                if session_institute:
-                    for doc in coll.where('institute', '==', session_institute).stream():
-                        if doc.id not in seen_ids:
-                            seen_ids.add(doc.id)
-                            docs.append(doc)
-
-            # 3) Convert to dicts
-            patients = [doc.to_dict() for doc in docs]
-
-            # Note: Removed N+1 query problem - assessment status is now loaded on demand via frontend
-
-            # Helper function to parse created_at (stored as ISO string in Cosmos DB)
-            def parse_created_at(patient):
-                """Parse created_at from ISO string to datetime object"""
-                created_at = patient.get('created_at')
-                if not created_at:
-                    return None
-                if isinstance(created_at, str):
-                    try:
-                        # Parse ISO format: "2026-01-18T15:39:55.123456+00:00"
-                        return datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                    except (ValueError, AttributeError):
-                        return None
-                # Already a datetime object
-                return created_at
-
-            # 4) Apply client-side filtering (to avoid Firestore query limitations)
-            filtered_patients = patients
-
-            if id_filter:
-                filtered_patients = [p for p in filtered_patients
-                                    if id_filter.lower() in (p.get('patient_id') or '').lower()]
-
-            # Filter by treatment status
-            if status_filter:
-                filtered_patients = [p for p in filtered_patients
-                                    if p.get('status', 'active') == status_filter]
-
-            # Filter by tags (patient must have at least one of the selected tags)
-            if tags_filter:
-                filtered_patients = [p for p in filtered_patients
-                                    if any(tag in (p.get('tags') or []) for tag in tags_filter)]
-
-            # NEW: Age range filtering
-            if age_min or age_max:
-                def extract_age(age_sex_str):
-                    """Extract age from 'age/sex' format (e.g., '25/M' -> 25)"""
-                    if not age_sex_str:
-                        return None
-                    try:
-                        age_part = age_sex_str.split('/')[0].strip()
-                        return int(age_part)
-                    except (ValueError, IndexError):
-                        return None
+                scope = PatientScope(physio_id=session.get('user_id'), institute=session.get('institute'))
 
-                if age_min:
-                    try:
-                        min_age = int(age_min)
-                        filtered_patients = [p for p in filtered_patients
-                                            if extract_age(p.get('age_sex')) is not None
-                                            and extract_age(p.get('age_sex')) >= min_age]
-                    except ValueError:
-                        pass  # Invalid age, skip filter
-
-                if age_max:
-                    try:
-                        max_age = int(age_max)
-                        filtered_patients = [p for p in filtered_patients
-                                            if extract_age(p.get('age_sex')) is not None
-                                            and extract_age(p.get('age_sex')) <= max_age]
-                    except ValueError:
-                        pass  # Invalid age, skip filter
-
-            # NEW: Gender filtering
-            if gender_filter:
-                def extract_gender(age_sex_str):
-                    """Extract gender from 'age/sex' format (e.g., '25/M' -> 'M')"""
-                    if not age_sex_str:
-                        return None
-                    try:
-                        gender_part = age_sex_str.split('/')[1].strip().upper()
-                        return gender_part
-                    except IndexError:
-                        return None
+            # 2) Filters the query applies itself (see patient_list_query.py)
+            filters = PatientListFilters(patient_id=id_filter, status=status_filter, tags=tags_filter,
+                                         date_from=date_from, date_to=date_to)
 
-                filtered_patients = [p for p in filtered_patients
-                                    if extract_gender(p.get('age_sex')) == gender_filter.upper()]
+            # 3) Filters applied to the fetched patients: age/sex is free text and
+            # the quick filters look at other collections
+            checks = []
 
-            # 5) Date range filtering
-            if date_from:
+            def extract_age(age_sex_str):
+                """Extract age from 'age/sex' format (e.g., '25/M' -> 25)"""
+                if not age_sex_str:
+                    return None
                 try:
-                    from_date = datetime.strptime(date_from, '%Y-%m-%d')
-                    filtered_patients = [p for p in filtered_patients
-                                        if parse_created_at(p) and parse_created_at(p) >= from_date]
-                except ValueError:
-                    pass  # Invalid date format, skip filter
+                    age_part = age_sex_str.split('/')[0].strip()
+                    return int(age_part)
+                except (ValueError, IndexError):
+                    return None
 
-            if date_to:
+            def extract_gender(age_sex_str):
+                """Extract gender from 'age/sex' format (e.g., '25/M' -> 'M')"""
+                if not age_sex_str:
+                    return None
                 try:
-                    to_date = datetime.strptime(date_to, '%Y-%m-%d')
-                    # Add 1 day to include the entire end date
-                    to_date = to_date + timedelta(days=1)
-                    filtered_patients = [p for p in filtered_patients
-                                        if parse_created_at(p) and parse_created_at(p) < to_date]
-                except ValueError:
-                    pass  # Invalid date format, skip filter
-
-            # NEW: Quick filters
+                    gender_part = age_sex_str.split('/')[1].strip().upper()
+                    return gender_part
+                except IndexError:
+                    return None
+
+            try:
+                min_age = int(age_min) if age_min else None
+            except ValueError:
+                min_age = None  # Invalid age, skip filter
+            try:
+                max_age = int(age_max) if age_max else None
+            except ValueError:
+                max_age = None  # Invalid age, skip filter
+            if min_age is not None or max_age is not None:
+                def age_in_range(p):
+                    age = extract_age(p.get('age_sex'))
+                    return (age is not None
+                            and (min_age is None or age >= min_age)
+                            and (max_age is None or age <= max_age))
+                checks.append(age_in_range)
+
+            if gender_filter:
+                checks.append(lambda p: extract_gender(p.get('age_sex')) == gender_filter.upper())
+
             if quick_filter == 'assessment_incomplete':
-                # Filter patients without completed treatment plans
-                incomplete_patients = []
-                for patient in filtered_patients:
+                # Patients without a treatment plan
+                def treatment_plan_missing(patient):
+                    saved = section_saved(patient, 'treatment_plan')
+                    if saved is not None:
+                        # Answered by the patient's progress summary
+                        return not saved
                     patient_id = patient.get('patient_id')
                     try:
-                        # Check if treatment plan exists
-                        treatment_doc = db.collection('treatment_plan').where('patient_id', '==', patient_id).limit(1).stream()
-                        has_treatment = False
-                        for _ in treatment_doc:
-                            has_treatment = True
-                            break
-                        if not has_treatment:
-                            incomplete_patients.append(patient)
+                        return not db.collection('treatment_plan').where('patient_id', '==', patient_id).limit(1).get()
                     except Exception as e:
                         logger.warning(f"Error checking treatment plan for {patient_id}: {e}")
-                        continue
-                filtered_patients = incomplete_patients
+                        return False
+                checks.append(treatment_plan_missing)
 
             elif quick_filter == 'no_follow_up':
-                # Filter patients without follow-ups
-                no_followup_patients = []
-                for patient in filtered_patients:
+                def follow_up_missing(patient):
                     patient_id = patient.get('patient_id')
                     try:
-                        # Check if follow-ups exist
-                        followup_docs = db.collection('follow_ups').where('patient_id', '==', patient_id).limit(1).stream()
-                        has_followup = False
-                        for _ in followup_docs:
-                            has_followup = True
-                            break
-                        if not has_followup:
-                            no_followup_patients.append(patient)
+                        return not db.collection('follow_ups').where('patient_id', '==', patient_id).limit(1).get()
                     except Exception as e:
                         logger.warning(f"Error checking follow-ups for {patient_id}: {e}")
-                        continue
-                filtered_patients = no_followup_patients
-
-            # 6) Apply sorting
-            if sort_by == 'newest':
-                filtered_patients.sort(key=lambda p: parse_created_at(p) or datetime.min, reverse=True)
-            elif sort_by == 'oldest':
-                filtered_patients.sort(key=lambda p: parse_created_at(p) or datetime.min)
-            elif sort_by == 'name_asc':
-                filtered_patients.sort(key=lambda p: (p.get('name') or '').lower())
-            elif sort_by == 'name_desc':
-                filtered_patients.sort(key=lambda p: (p.get('name') or '').lower(), reverse=True)
-
-            # 7) Apply pagination (limit to 50 patients per page)
-            page = request.args.get('page', 1, type=int)
-            per_page = 50
-            total_pages = (len(filtered_patients) + per_page - 1) // per_page
-            start_idx = (page - 1) * per_page
-            end_idx = start_idx + per_page
-            paginated_patients = filtered_patients[start_idx:end_idx]
+                        return False
+                checks.append(follow_up_missing)
+
+            residual = (lambda p: all(check(p) for check in checks)) if checks else None
+
+            # 4) One page of 50, sorted by the query and continuing from the
+            # cursor (keyset pagination: no OFFSET, every page costs the same)
+            cursor = request.args.get('cursor') or None
+            engine = PatientListQuery(db.collection('patients'), search=get_patient_search_index().search)
+            paginated_patients, next_cursor = engine.page(scope, filters, sort_by, cursor,
+                                                          page_size=50, residual=residual)
+
+            page_args = {k: v for k, v in request.args.to_dict(flat=False).items() if k not in ('cursor', 'page')}
+            next_url = url_for('view_patients', cursor=next_cursor, **page_args) if next_cursor else None
+            first_url = url_for('view_patients', **page_args) if cursor else None
+
+            # 5) Counts on the first page only; filters run in Python can't be
+            # counted without reading every patient
+            total_count = filtered_count = None
+            if not cursor:
+                total_count = engine.count(scope)
+                if residual is None:
+                    filtered_count = engine.count(scope, filters) if filters.active() else total_count
+
+            # 6) Tags used on this user's patients, for the filter dropdown
+            # (super admins have no dictionary covering everyone)
+            if scope.everyone:
+                all_tags = engine.tags(scope)
+            else:
+                all_tags = get_tag_dictionary().tags([('physio_id', scope.physio_id), ('institute', scope.institute)])
 
         except GoogleAPIError as e:
             logger.error(f"Firestore error in view_patients: {e}", exc_info=True)
             flash("Could not load your patients list. Please try again later.", "error")
             return redirect(url_for('dashboard'))
 
-        # 8) Collect unique tags from all patients for filter dropdown
-        all_tags = set()
-        for p in patients:
-            all_tags.update(p.get('tags') or [])
-        all_tags = sorted(list(all_tags))
-
-        # 9) Check if any filters are active
+        # 7) Check if any filters are active
         has_active_filters = any([
             id_filter, date_from, date_to, status_filter, tags_filter,
             age_min, age_max, gender_filter, quick_filter
         ])
 
-        # 10) Fetch saved searches for this user
+        # 8) Fetch saved searches for this user
         saved_searches = []
         try:
             saved_searches_docs = db.collection('saved_searches').where('user_id', '==', session.get('user_id')).limit(20).stream()
@@ -5158,16 +5025,16 @@ def view_patients():
             logger.warning(f"Error fetching saved searches: {e}")
             # Continue without saved searches
 
-        # 11) Render on success
+        # 9) Render on success
         return render_template('view_patients.html',
                              patients=paginated_patients,
-                             total_count=len(patients),
-                             filtered_count=len(filtered_patients),
+                             total_count=total_count,
+                             filtered_count=filtered_count,
                              all_tags=all_tags,
                              current_status=status_filter,
                              current_tags=tags_filter,
-                             page=page,
-                             total_pages=total_pages,
+                             next_url=next_url,
+                             first_url=first_url,
                              has_active_filters=has_active_filters,
                              saved_searches=saved_searches)
 
@@ -5621,6 +5488,7 @@ def approve_user(user_email):
             'approved_by_institute_at': SERVER_TIMESTAMP,
             'approved_by_institute_email': session.get('user_id')
         })
+        invalidate_user(user_email)
 
         flash(
             f"Tier 1 Approval Complete! User {user_email} has been approved by you. "
@@ -5740,30 +5608,6 @@ def export_audit_logs():
     return response
 
 
-def get_next_patient_number_atomic(physio_id):
-    """
-    Atomically get the next patient number for a given physiotherapist.
-    This prevents race conditions when multiple patients are created simultaneously.
-
-    Args:
-        physio_id: The physiotherapist's email/ID
-
-    Returns:
-        int: The next sequential patient number
-    """
-    # Use a separate counters collection to track patient numbers per physio
-    counter_ref = db.collection('patient_counters').document(physio_id)
-
-    # Atomic conditional increment (Cosmos DB conditional patch), not the
-    # old set({'count': Increment(1)}) which read the current value in
-    # Python and wrote current+1 back -- a read-then-write race where two
-    # concurrent patient creations could get the same "next" number.
-    if not counter_ref.get().exists:
-        counter_ref.set({'count': 0})
-    _, new_count = counter_ref.increment_if('count', 1)
-    return int(new_count) if new_count is not None else 1
-
-
 @app.route('/api/check_duplicate_patient', methods=['POST'])
 @require_auth
 def check_duplicate_patient():
@@ -5780,36 +5624,10 @@ def check_duplicate_patient():
 
         physio_id = session.get('user_id')
 
-        # Get all patients for this physio
-        patients_ref = db.collection('patients').where('physio_id', '==', physio_id)
-        patients = patients_ref.stream()
-
-        # Find exact and similar matches
-        duplicates = []
-        for patient in patients:
-            patient_data = patient.to_dict()
-            existing_name = patient_data.get('name', '').strip().lower()
-
-            # Check for exact match (case-insensitive)
-            if existing_name == patient_name:
-                duplicates.append({
-                    'patient_id': patient_data.get('patient_id'),
-                    'name': patient_data.get('name'),
-                    'age_sex': patient_data.get('age_sex'),
-                    'contact': patient_data.get('contact'),
-                    'created_at': patient_data.get('created_at'),
-                    'match_type': 'exact'
-                })
-            # Check for very similar names (contains or is contained)
-            elif (patient_name in existing_name or existing_name in patient_name) and len(patient_name) > 3:
-                duplicates.append({
-                    'patient_id': patient_data.get('patient_id'),
-                    'name': patient_data.get('name'),
-                    'age_sex': patient_data.get('age_sex'),
-                    'contact': patient_data.get('contact'),
-                    'created_at': patient_data.get('created_at'),
-                    'match_type': 'similar'
-                })
+        # Exact, similar (contained or fuzzy) and same-contact matches among
+        # this physio's patients, from the in-process search index
+        duplicates = get_patient_search_index().find_duplicates(
+            PatientScope(physio_id=physio_id), patient_name, data.get('contact', ''))
 
         return jsonify({
             'duplicates': duplicates,
@@ -5867,8 +5685,8 @@ def add_patient():
         # Remove dots, underscores, hyphens and take first 8 chars
         clean_prefix = ''.join(c for c in email_prefix if c.isalnum())[:8].lower()
 
-        # Get next patient number using atomic counter (prevents race conditions)
-        patient_count = get_next_patient_number_atomic(physio_id)
+        # Next patient number from this worker's reserved block (see patient_numbers.py)
+        patient_count = allocate_patient_number(physio_id)
 
         # Format: prefix-001, prefix-002, etc.
         patient_id = f"{clean_prefix}-{patient_count:03d}"
@@ -5892,10 +5710,17 @@ def add_patient():
             'status':               'active',  # Treatment status: active, completed, archived
             'tags':                 request.form.getlist('tags') if request.form.getlist('tags') else [],  # Patient tags
             'quick_mode_enabled':   quick_mode_enabled,  # Quick Mode flag
+            'name_sort':            name_sort_key(validated['name']),
+            PROGRESS_FIELD:         empty_progress(),
         }
 
         # Write the patient document
         db.collection('patients').document(patient_id).set(data)
+        create_clinical_record(patient_id)
+        get_patient_search_index().upsert({**data, 'id': patient_id})
+        record_phrases(physio_id, {'present_history': data.get('present_history'),
+                                   'past_history': data.get('past_history')})
+        record_tag_change(data, None, data['tags'])
 
         log_action(
             session.get('user_id'),
@@ -5998,10 +5823,9 @@ def update_patient_tags(patient_id):
         # Use validated and cleaned tags
         cleaned_tags = result['tags']
 
-        # Update tags
-        patient_ref.update({
-            'tags': cleaned_tags
-        })
+        # Update tags (and the owners' tag dictionaries)
+        if not set_patient_tags(patient_ref, patient, cleaned_tags):
+            return jsonify({'success': False, 'error': 'Patient was changed or deleted, please retry'}), 409
 
         log_action(session.get('user_id'), 'Update Patient Tags',
                    f"Updated tags for {patient_id}: {', '.join(cleaned_tags)}")
@@ -6020,30 +5844,15 @@ def get_tag_suggestions():
     try:
         user_email = session.get('user_id')
 
-        # Get all patients for this user
+        # Tags used on this user's patients (their institute's, for admins),
+        # plus the default suggestions
         if session.get('is_admin') == 1:
-            patients = db.collection('patients').where('institute', '==', session.get('institute')).stream()
+            owner = ('institute', session.get('institute'))
         else:
-            patients = db.collection('patients').where('physio_id', '==', user_email).stream()
-
-        # Collect unique tags
-        all_tags = set()
-        for doc in patients:
-            patient = doc.to_dict()
-            all_tags.update(patient.get('tags') or [])
-
-        # Add some default/suggested tags
-        default_tags = [
-            'Sports Injury', 'Post-Surgery', 'Chronic Pain', 'Acute Pain',
-            'Neurological', 'Orthopedic', 'Pediatric', 'Geriatric',
-            'Work-Related', 'Motor Vehicle Accident', 'Falls',
-            'Upper Extremity', 'Lower Extremity', 'Spine',
-            'High Priority', 'Follow-Up Required', 'Discharged'
-        ]
+            owner = ('physio_id', user_email)
+        all_tags = get_tag_dictionary().tags([owner], include_defaults=True)
 
-        all_tags.update(default_tags)
-
-        return jsonify({'success': True, 'tags': sorted(list(all_tags))})
+        return jsonify({'success': True, 'tags': all_tags})
 
     except Exception as e:
         logger.error(f"Error getting tag suggestions: {e}", exc_info=True)
@@ -6085,26 +5894,17 @@ def subjective(patient_id):
         entry = {f: request.form[f] for f in fields}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('subjective_examination').add(entry)
+        add_section_record('subjective_examination', entry)
+        invalidate_patient_context(patient_id, section='subjective_examination')
+        record_phrases(session.get('user_id'), {f: entry[f] for f in fields})
         log_action(session.get('user_id'), 'Subjective Examination Saved', f"Saved for patient {patient_id}")
         return redirect(f'/perspectives/{patient_id}')
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
-    existing = None
-    try:
-        docs = db.collection('subjective_examination').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing subjective_examination for {patient_id}: {e}")
+    existing = snapshot.section('subjective') or None
     return render_template('subjective.html', patient_id=patient_id, patient=patient, patho_data=patho_data, existing=existing)
 
 
@@ -6141,7 +5941,8 @@ def perspectives(patient_id):
         })
 
         # save to your collection
-        db.collection('patient_perspectives').add(entry)
+        add_section_record('patient_perspectives', entry)
+        invalidate_patient_context(patient_id, section='patient_perspectives')
         log_action(session.get('user_id'), 'Patient Perspectives Saved', f"Saved for patient {patient_id}")
 
         # Quick Mode patients continue to the QM initial plan screen
@@ -6149,26 +5950,15 @@ def perspectives(patient_id):
             return redirect(url_for('qm_initial_plan', patient_id=patient_id))
         return redirect(url_for('initial_plan', patient_id=patient_id))
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
     # GET: render the form
     # Use patient doc flag OR session fallback (covers patients created before
     # quick_mode_enabled field was added to the schema).
     quick_mode = patient.get('quick_mode_enabled', False) or (session.get('qm_active_patient') == patient_id)
-    existing = None
-    try:
-        docs = db.collection('patient_perspectives').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing patient_perspectives for {patient_id}: {e}")
+    existing = snapshot.section('perspectives') or None
     return render_template('perspectives.html', patient_id=patient_id, patho_data=patho_data, quick_mode=quick_mode, existing=existing)
 
 
@@ -6188,27 +5978,17 @@ def initial_plan(patient_id):
         for s in sections:
             entry[s] = request.form.get(s)
             entry[f"{s}_details"] = request.form.get(f"{s}_details", '')
-        db.collection('initial_plan').add(entry)
+        add_section_record('initial_plan', entry)
+        invalidate_patient_context(patient_id, section='initial_plan')
         log_action(session.get('user_id'), 'Initial Plan Saved', f"Saved for patient {patient_id}")
         # Redirect to merged Risk Factors & Clinical Flags screen
         return redirect(url_for('risk_factors_clinical_flags', patient_id=patient_id))
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
-    existing = None
-    try:
-        docs = db.collection('initial_plan').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing initial_plan for {patient_id}: {e}")
+    existing = snapshot.section('initial_plan') or None
     return render_template('initial_plan.html', patient_id=patient_id, patho_data=patho_data, existing=existing)
 
 
@@ -6232,17 +6012,12 @@ def patho_mechanism(patient_id):
         entry = {k: request.form[k] for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('patho_mechanism').add(entry)
+        add_section_record('patho_mechanism', entry)
+        invalidate_patient_context(patient_id, section='patho_mechanism')
         log_action(session.get('user_id'), 'Patho Mechanism Saved', f"Saved for patient {patient_id}")
         # Redirect to subjective examination (NEW: patho moved to position 2)
         return redirect(url_for('subjective', patient_id=patient_id))
-    existing = None
-    try:
-        docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing patho_mechanism for {patient_id}: {e}")
+    existing = get_patient_context_snapshot(patient_id, doc).section('patho_mechanism') or None
     return render_template('patho_mechanism.html', patient_id=patient_id, existing=existing)
 
 
@@ -6272,7 +6047,8 @@ def qm_patho_mechanism(patient_id):
         entry = {k: request.form.get(k, '') for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp']  = SERVER_TIMESTAMP
-        db.collection('patho_mechanism').add(entry)
+        add_section_record('patho_mechanism', entry)
+        invalidate_patient_context(patient_id, section='patho_mechanism')
         log_action(session.get('user_id'), 'Quick Mode Patho Mechanism Saved',
                    f"QM patho saved for {patient_id}")
         return redirect(url_for('qm_subjective', patient_id=patient_id))
@@ -6312,7 +6088,9 @@ def qm_subjective(patient_id):
         entry = {f: request.form.get(f, '') for f in fields}
         entry['patient_id'] = patient_id
         entry['timestamp']  = SERVER_TIMESTAMP
-        db.collection('subjective_examination').add(entry)
+        add_section_record('subjective_examination', entry)
+        invalidate_patient_context(patient_id, section='subjective_examination')
+        record_phrases(session.get('user_id'), {f: entry[f] for f in fields})
         log_action(session.get('user_id'), 'Quick Mode Subjective Saved',
                    f"QM subjective saved for {patient_id}")
         # Mark this patient as QM-active in session so perspectives.html
@@ -6322,19 +6100,7 @@ def qm_subjective(patient_id):
         return redirect(url_for('perspectives', patient_id=patient_id))
 
     # GET â€” fetch patho data for richer question generation, then call AI
-    patho_data = {}
-    try:
-        patho_docs = (
-            db.collection('patho_mechanism')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"QM subjective: could not fetch patho_data for {patient_id}: {e}")
+    patho_data = get_patient_context_snapshot(patient_id, doc).section('patho_mechanism')
 
     questions = generate_subjective_questions(patient, patho_data)
 
@@ -6383,25 +6149,14 @@ def qm_initial_plan(patient_id):
                 )
             else:
                 entry[f"{t}_details"] = request.form.get(f"{t}_details", '')
-        db.collection('initial_plan').add(entry)
+        add_section_record('initial_plan', entry)
+        invalidate_patient_context(patient_id, section='initial_plan')
         log_action(session.get('user_id'), 'Quick Mode Initial Plan Saved',
                    f"QM initial plan saved for {patient_id}")
         return redirect(url_for('qm_risk_factors_clinical_flags', patient_id=patient_id))
 
     # GET â€” fetch patho data then generate AI category recommendations
-    patho_data = {}
-    try:
-        patho_docs = (
-            db.collection('patho_mechanism')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"QM initial plan: could not fetch patho_data for {patient_id}: {e}")
+    patho_data = get_patient_context_snapshot(patient_id, doc).section('patho_mechanism')
 
     prefills = generate_initial_plan_prefills(patient, patho_data)
 
@@ -6436,7 +6191,7 @@ def qm_risk_factors_clinical_flags(patient_id):
             'specific_factors': request.form.get('specific_factors', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('chronic_diseases').add(chronic_entry)
+        add_section_record('chronic_diseases', chronic_entry)
 
         # Save Clinical Flags (same collection as normal route)
         flags_entry = {
@@ -6448,43 +6203,19 @@ def qm_risk_factors_clinical_flags(patient_id):
             'blue_flags':   request.form.get('blue_flags', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('clinical_flags').add(flags_entry)
+        add_section_record('clinical_flags', flags_entry)
+        invalidate_patient_context(patient_id, section=('chronic_diseases', 'clinical_flags'))
 
         log_action(session.get('user_id'), 'Quick Mode Risk Flags Saved',
                    f"QM risk factors & flags saved for {patient_id}")
         return redirect(url_for('qm_objective_assessment', patient_id=patient_id))
 
     # GET â€” fetch patho data then generate AI prefills
-    patho_data = {}
-    try:
-        patho_docs = (
-            db.collection('patho_mechanism')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-            logger.info(f"QM risk flags: patho_data keys = {list(patho_data.keys())}")
-        else:
-            logger.warning(f"QM risk flags: no patho_mechanism doc found for {patient_id}")
-    except Exception as e:
-        logger.warning(f"QM risk flags: could not fetch patho_data for {patient_id}: {e}")
-
-    subjective_data = {}
-    try:
-        subjective_docs = (
-            db.collection('subjective_examination')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if subjective_docs:
-            subjective_data = subjective_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"QM risk flags: could not fetch subjective_data for {patient_id}: {e}")
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
+    if not patho_data:
+        logger.warning(f"QM risk flags: no patho_mechanism doc found for {patient_id}")
+    subjective_data = snapshot.section('subjective')
 
     logger.info(f"QM risk flags: present_history present = {bool(patient.get('present_history'))}")
     prefills = generate_risk_flags_prefills(patient, patho_data, subjective_data)
@@ -6530,39 +6261,16 @@ def qm_objective_assessment(patient_id):
             'plan_details': request.form.get('plan_details', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('objective_assessments').add(entry)
+        add_section_record('objective_assessments', entry)
+        invalidate_patient_context(patient_id, section='objective_assessments')
         log_action(session.get('user_id'), 'Quick Mode Objective Assessment Saved',
                    f"QM objective assessment saved for {patient_id}")
         return redirect(url_for('qm_provisional_diagnosis', patient_id=patient_id))
 
     # GET â€” fetch patho data + most recent initial plan data for Stage 2
-    patho_data = {}
-    try:
-        patho_docs = (
-            db.collection('patho_mechanism')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"QM obj assessment: could not fetch patho_data for {patient_id}: {e}")
-
-    initial_plan_data = {}
-    try:
-        ip_docs = (
-            db.collection('initial_plan')
-            .where('patient_id', '==', patient_id)
-            .order_by('timestamp', direction='DESCENDING')
-            .limit(1)
-            .get()
-        )
-        if ip_docs:
-            initial_plan_data = ip_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"QM obj assessment: could not fetch initial_plan for {patient_id}: {e}")
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
+    initial_plan_data = snapshot.section('initial_plan')
 
     prefills = generate_obj_assessment_prefills(patient, patho_data, initial_plan_data)
 
@@ -6599,26 +6307,18 @@ def qm_provisional_diagnosis(patient_id):
             'hypothesis_supported': request.form.get('hypothesis_supported', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('provisional_diagnosis').add(form_data)
+        add_section_record('provisional_diagnosis', form_data)
+        invalidate_patient_context(patient_id, section='provisional_diagnosis')
         log_action(session.get('user_id'), 'Quick Mode Provisional Diagnosis Saved',
                    f"QM provisional diagnosis saved for {patient_id}")
         return redirect(url_for('qm_smart_goals', patient_id=patient_id))
 
     # GET â€” fetch all Stage 2 context
-    def _fetch_latest(collection):
-        try:
-            docs = (db.collection(collection)
-                    .where('patient_id', '==', patient_id)
-                    .order_by('timestamp', direction='DESCENDING')
-                    .limit(1).get())
-            return docs[0].to_dict() if docs else {}
-        except Exception as e:
-            logger.warning(f"QM prov diag: could not fetch {collection} for {patient_id}: {e}")
-            return {}
+    snapshot = get_patient_context_snapshot(patient_id, doc)
 
-    patho_data       = _fetch_latest('patho_mechanism')
-    initial_plan_data = _fetch_latest('initial_plan')
-    obj_data         = _fetch_latest('objective_assessments')
+    patho_data       = snapshot.section('patho_mechanism')
+    initial_plan_data = snapshot.section('initial_plan')
+    obj_data         = snapshot.section('objective')
 
     prefills = generate_prov_diag_prefills(patient, patho_data, initial_plan_data, obj_data)
 
@@ -6651,26 +6351,19 @@ def qm_smart_goals(patient_id):
             'outcome_timeframe': request.form.get('outcome_timeframe', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('smart_goals').add(form_data)
+        add_section_record('smart_goals', form_data)
+        invalidate_patient_context(patient_id, section='smart_goals')
+        record_phrases(session.get('user_id'), {k: form_data[k] for k in ('patient_goal', 'outcome_timeframe')})
         log_action(session.get('user_id'), 'Quick Mode SMART Goals Saved',
                    f"QM SMART goals saved for {patient_id}")
         return redirect(url_for('qm_treatment_plan', patient_id=patient_id))
 
     # GET â€” fetch Stage 2 context
-    def _fetch_latest(collection):
-        try:
-            docs = (db.collection(collection)
-                    .where('patient_id', '==', patient_id)
-                    .order_by('timestamp', direction='DESCENDING')
-                    .limit(1).get())
-            return docs[0].to_dict() if docs else {}
-        except Exception as e:
-            logger.warning(f"QM smart goals: could not fetch {collection} for {patient_id}: {e}")
-            return {}
+    snapshot = get_patient_context_snapshot(patient_id, doc)
 
-    patho_data        = _fetch_latest('patho_mechanism')
-    prov_diag_data    = _fetch_latest('provisional_diagnosis')
-    perspectives_data = _fetch_latest('patient_perspectives')
+    patho_data        = snapshot.section('patho_mechanism')
+    prov_diag_data    = snapshot.section('provisional_diagnosis')
+    perspectives_data = snapshot.section('perspectives')
 
     prefills = generate_smart_goals_prefills(patient, patho_data, prov_diag_data, perspectives_data)
 
@@ -6699,26 +6392,19 @@ def qm_treatment_plan(patient_id):
             'reasoning':      request.form.get('reasoning', ''),
             'timestamp': SERVER_TIMESTAMP,
         }
-        db.collection('treatment_plan').add(form_data)
+        add_section_record('treatment_plan', form_data)
+        invalidate_patient_context(patient_id, section='treatment_plan')
+        record_phrases(session.get('user_id'), {k: form_data[k] for k in ('treatment_plan', 'reasoning')})
         log_action(session.get('user_id'), 'Quick Mode Treatment Plan Saved',
                    f"QM treatment plan saved for {patient_id}")
         return redirect(url_for('dashboard'))
 
     # GET â€” fetch Stage 2 context
-    def _fetch_latest(collection):
-        try:
-            docs = (db.collection(collection)
-                    .where('patient_id', '==', patient_id)
-                    .order_by('timestamp', direction='DESCENDING')
-                    .limit(1).get())
-            return docs[0].to_dict() if docs else {}
-        except Exception as e:
-            logger.warning(f"QM treatment plan: could not fetch {collection} for {patient_id}: {e}")
-            return {}
+    snapshot = get_patient_context_snapshot(patient_id, doc)
 
-    subj_data         = _fetch_latest('subjective_examination')
-    prov_diag_data    = _fetch_latest('provisional_diagnosis')
-    smart_goals_data  = _fetch_latest('smart_goals')
+    subj_data         = snapshot.section('subjective')
+    prov_diag_data    = snapshot.section('provisional_diagnosis')
+    smart_goals_data  = snapshot.section('smart_goals')
 
     # Use the same centralized, phase-based prompt as the "Generate Summary" button,
     # so the automatic prefill and the on-demand summary are the same response
@@ -6779,7 +6465,8 @@ def chronic_disease(patient_id):
             'specific_factors': request.form.get('specific_factors', ''),
             'timestamp': SERVER_TIMESTAMP
         }
-        db.collection('chronic_diseases').add(entry)
+        add_section_record('chronic_diseases', entry)
+        invalidate_patient_context(patient_id, section='chronic_diseases')
         return redirect(f'/clinical_flags/{patient_id}')
     return render_template('chronic_disease.html', patient_id=patient_id)
 
@@ -6805,7 +6492,8 @@ def clinical_flags(patient_id):
             'blue_flags':    request.form.get('blue_flags', ''),
             'timestamp':     SERVER_TIMESTAMP
         }
-        db.collection('clinical_flags').add(entry)
+        add_section_record('clinical_flags', entry)
+        invalidate_patient_context(patient_id, section='clinical_flags')
         log_action(session.get('user_id'), 'Clinical Flags Saved', f"Saved for patient {patient_id}")
         return redirect(url_for('objective_assessment', patient_id=patient_id))
 
@@ -6837,7 +6525,7 @@ def risk_factors_clinical_flags(patient_id):
             'specific_factors': request.form.get('specific_factors', ''),
             'timestamp': SERVER_TIMESTAMP
         }
-        db.collection('chronic_diseases').add(chronic_entry)
+        add_section_record('chronic_diseases', chronic_entry)
 
         # Save Clinical Flags
         flags_entry = {
@@ -6849,26 +6537,16 @@ def risk_factors_clinical_flags(patient_id):
             'blue_flags':    request.form.get('blue_flags', ''),
             'timestamp':     SERVER_TIMESTAMP
         }
-        db.collection('clinical_flags').add(flags_entry)
+        add_section_record('clinical_flags', flags_entry)
+        invalidate_patient_context(patient_id, section=('chronic_diseases', 'clinical_flags'))
         log_action(session.get('user_id'), 'Risk Factors & Clinical Flags Saved', f"Saved for patient {patient_id}")
 
         # Redirect to objective assessment
         return redirect(url_for('objective_assessment', patient_id=patient_id))
 
-    existing_chronic = None
-    existing_flags = None
-    try:
-        chronic_docs = db.collection('chronic_diseases').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if chronic_docs:
-            existing_chronic = chronic_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing chronic_diseases for {patient_id}: {e}")
-    try:
-        flags_docs = db.collection('clinical_flags').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if flags_docs:
-            existing_flags = flags_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing clinical_flags for {patient_id}: {e}")
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    existing_chronic = snapshot.section('chronic_diseases') or None
+    existing_flags = snapshot.section('clinical_flags') or None
     return render_template('risk_factors_clinical_flags.html', patient_id=patient_id, existing_chronic=existing_chronic, existing_flags=existing_flags)
 
 
@@ -6890,26 +6568,16 @@ def objective_assessment(patient_id):
             'plan_details':  request.form.get('plan_details',''),
             'timestamp':     SERVER_TIMESTAMP
         }
-        db.collection('objective_assessments').add(entry)
+        add_section_record('objective_assessments', entry)
+        invalidate_patient_context(patient_id, section='objective_assessments')
         log_action(session.get('user_id'), 'Objective Assessment Saved', f"Saved for patient {patient_id}")
         return redirect(f'/provisional_diagnosis/{patient_id}')
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
-    existing = None
-    try:
-        docs = db.collection('objective_assessments').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing objective_assessments for {patient_id}: {e}")
+    existing = snapshot.section('objective') or None
     return render_template('objective_assessment.html', patient_id=patient_id, patho_data=patho_data,
                            plan=existing.get('plan', '') if existing else '',
                            plan_details=existing.get('plan_details', '') if existing else '')
@@ -6954,26 +6622,16 @@ def provisional_diagnosis(patient_id):
         entry = {k: result[k] for k in keys if k in result}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('provisional_diagnosis').add(entry)
+        add_section_record('provisional_diagnosis', entry)
+        invalidate_patient_context(patient_id, section='provisional_diagnosis')
         log_action(session.get('user_id'), 'Provisional Diagnosis Saved', f"Saved for patient {patient_id}")
         return redirect(f'/smart_goals/{patient_id}')
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
-    existing = None
-    try:
-        docs = db.collection('provisional_diagnosis').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing provisional_diagnosis for {patient_id}: {e}")
+    existing = snapshot.section('provisional_diagnosis') or None
     return render_template('provisional_diagnosis.html', patient_id=patient_id, patho_data=patho_data, existing=existing)
 
 
@@ -7010,26 +6668,17 @@ def smart_goals(patient_id):
         entry = {k: result.get(k, request.form[k]) for k in keys}
         entry['patient_id'] = patient_id
         entry['timestamp'] = SERVER_TIMESTAMP
-        db.collection('smart_goals').add(entry)
+        add_section_record('smart_goals', entry)
+        invalidate_patient_context(patient_id, section='smart_goals')
+        record_phrases(session.get('user_id'), {k: entry[k] for k in keys})
         log_action(session.get('user_id'), 'SMART Goals Saved', f"Saved for patient {patient_id}")
         return redirect(f'/treatment_plan/{patient_id}')
 
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    patho_data = snapshot.section('patho_mechanism')
 
-    existing = None
-    try:
-        docs = db.collection('smart_goals').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if docs:
-            existing = docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch existing smart_goals for {patient_id}: {e}")
+    existing = snapshot.section('smart_goals') or None
     return render_template('smart_goals.html', patient_id=patient_id, patho_data=patho_data, existing=existing)
 
 
@@ -7064,7 +6713,9 @@ def treatment_plan(patient_id):
             entry = {k: result.get(k, request.form.get(k, '')) for k in keys}
             entry['patient_id'] = patient_id
             entry['timestamp'] = SERVER_TIMESTAMP
-            db.collection('treatment_plan').add(entry)
+            add_section_record('treatment_plan', entry)
+            invalidate_patient_context(patient_id, section='treatment_plan')
+            record_phrases(session.get('user_id'), {k: entry[k] for k in keys})
             # Mark patient assessment as completed
             db.collection('patients').document(patient_id).update({
                 'status': 'completed',
@@ -7077,24 +6728,10 @@ def treatment_plan(patient_id):
             flash('Unable to save treatment plan. Please try again.', 'error')
             return redirect(f'/treatment_plan/{patient_id}')
 
-    # GET: Fetch saved treatment plan data
-    saved_data = {}
-    try:
-        saved_docs = db.collection('treatment_plan').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if saved_docs:
-            saved_data = saved_docs[0].to_dict()
-            logger.info(f"Loaded saved treatment plan for {patient_id}: {list(saved_data.keys())}")
-    except Exception as e:
-        logger.warning(f"Could not fetch saved treatment plan for patient {patient_id}: {e}")
-
-    # GET: Fetch pathophysiological mechanism data (NEW: for AI context)
-    patho_data = {}
-    try:
-        patho_docs = db.collection('patho_mechanism').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        if patho_docs:
-            patho_data = patho_docs[0].to_dict()
-    except Exception as e:
-        logger.warning(f"Could not fetch patho_data for patient {patient_id}: {e}")
+    # GET: latest sections from the patient's clinical record (one point read)
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+    saved_data = snapshot.section('treatment_plan')
+    patho_data = snapshot.section('patho_mechanism')
 
     quick_mode = patient.get('quick_mode_enabled', False) or (session.get('qm_active_patient') == patient_id)
     return render_template('treatment_plan.html', patient_id=patient_id, patho_data=patho_data, saved_data=saved_data, quick_mode=quick_mode)
@@ -7164,6 +6801,10 @@ def follow_ups(patient_id):
                 'timestamp':       SERVER_TIMESTAMP
             }
             db.collection('follow_ups').add(entry)
+            # Follow-ups are part of the cached patient report
+            invalidate_patient_context(patient_id)
+            record_phrases(session['user_id'], {'belief_feedback': entry['feedback'],
+                                                'plan_next': entry['treatment_plan']})
             log_action(session['user_id'], 'Add Follow-Up',
                        f"Follow-up #{entry['session_number']} for {patient_id}")
             flash('Follow-up session saved successfully', 'success')
@@ -7241,10 +6882,14 @@ def edit_patient(patient_id):
         # Use validated data
         updated_data = {
             'name': result['name'],
+            'name_sort': name_sort_key(result['name']),
             'age_sex': result['age_sex'],
             'contact': result['contact']
         }
         doc_ref.update(updated_data)
+        get_patient_search_index().upsert({**patient, **updated_data, 'id': doc.id})
+        if (patient.get('name'), patient.get('contact')) != (updated_data['name'], updated_data['contact']):
+            refresh_followup_patient(doc.id, {**patient, **updated_data})
         log_action(session['user_id'], 'Edit Patient', f"Edited patient {patient_id}")
         return redirect(url_for('view_patients'))
 
@@ -7264,143 +6909,52 @@ def patient_report(patient_id):
 
     log_action(session.get('user_id'), 'Patient Report Viewed', f"Viewed report for patient {patient_id}")
 
-    # Fetch each assessment section (latest record — sections are appended, not overwritten)
-    def fetch_one(coll):
-        d = db.collection(coll).where('patient_id', '==',
-                                      patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-        return d[0].to_dict() if d else {}
-
-    # Fetch follow-ups (can have multiple)
-    def fetch_all(coll):
-        docs = db.collection(coll).where('patient_id', '==',
-                                         patient_id).order_by('timestamp', direction='DESCENDING').get()
-        return [d.to_dict() for d in docs] if docs else []
-
-    subjective = fetch_one('subjective_examination')
-    perspectives = fetch_one('patient_perspectives')
-    initial_plan = fetch_one('initial_plan')
-    patho_mechanism = fetch_one('patho_mechanism')
-    chronic_diseases = fetch_one('chronic_diseases')
-    clinical_flags = fetch_one('clinical_flags')
-    objective = fetch_one('objective_assessments')
-    diagnosis = fetch_one('provisional_diagnosis')
-    goals = fetch_one('smart_goals')
-    treatment = fetch_one('treatment_plan')
-    follow_ups = fetch_all('follow_ups')
-
-    # Get therapist info
-    therapist_doc = db.collection('users').document(patient.get('physio_id', '')).get()
-    therapist = therapist_doc.to_dict() if therapist_doc.exists else {}
+    # Sections, follow-ups and therapist, assembled once per patient version (report_assembly)
+    report = get_patient_report(doc)
+    sections = report.sections
 
     # Get current date/time for report
     from datetime import datetime as dt
     report_date = dt.now().strftime('%d %b %Y %I:%M %p')
 
-    # Generate AI summaries for comprehensive reporting
-    from ai_prompts import (
-        get_initial_plan_summary_prompt,
-        get_smart_goals_prompt,
-        get_treatment_plan_summary_prompt
-    )
-
-    ai_initial_plan_summary = ""
-    ai_smart_goals_summary = ""
-    ai_treatment_plan_summary = ""
-
-    # Only generate AI summaries if data exists
+    # AI summaries are precomputed per section version; stale ones are
+    # shown as they are and regenerated in the background (report_summaries)
+    summary_sections = {
+        'subjective': sections['subjective'],
+        'perspectives': sections['perspectives'],
+        'initial_plan': sections['initial_plan'],
+        'provisional_diagnosis': sections['diagnosis'],
+        'smart_goals': sections['goals'],
+        'treatment_plan': sections['treatment'],
+    }
     try:
-        # 1. Initial Plan Summary
-        if initial_plan:
-            age_sex = sanitize_age_sex(patient.get("age_sex", ""))
-            present_hist = sanitize_clinical_text(patient.get("present_history", ""))
-            past_hist = sanitize_clinical_text(patient.get("past_history", ""))
-            subjective_data = sanitize_subjective_data(subjective)
-            diagnosis_text = sanitize_clinical_text(diagnosis.get("likelihood", "") if diagnosis else "")
-
-            # Format plan_fields from initial_plan data
-            plan_fields = {}
-            for field_name, field_value in initial_plan.items():
-                if field_name not in ['patient_id', 'timestamp', 'physio_id']:
-                    if field_value:
-                        plan_fields[field_name] = str(field_value)
-            plan_fields = sanitize_subjective_data(plan_fields)
-
-            prompt = get_initial_plan_summary_prompt(
-                age_sex=age_sex,
-                present_hist=present_hist,
-                past_hist=past_hist,
-                subjective=subjective_data,
-                diagnosis=diagnosis_text,
-                plan_fields=plan_fields
-            )
-            ai_initial_plan_summary = get_ai_suggestion(prompt, patient_context=age_sex)
-            logger.info(f"[Patient Report] Generated Initial Plan Summary for {patient_id}")
-
-        # 2. SMART Goals Summary
-        if goals and subjective:
-            age_sex = sanitize_age_sex(patient.get("age_sex", ""))
-            present_hist = sanitize_clinical_text(patient.get("present_history", ""))
-            past_hist = sanitize_clinical_text(patient.get("past_history", ""))
-            subjective_data = sanitize_subjective_data(subjective)
-            perspectives_data = sanitize_subjective_data(perspectives)
-            diagnosis_text = sanitize_clinical_text(diagnosis.get("likelihood", "") if diagnosis else "")
-
-            prompt = get_smart_goals_prompt(
-                age_sex=age_sex,
-                present_hist=present_hist,
-                past_hist=past_hist,
-                subjective=subjective_data,
-                perspectives=perspectives_data,
-                diagnosis=diagnosis_text
-            )
-            ai_smart_goals_summary = get_ai_suggestion(prompt, patient_context=age_sex)
-            logger.info(f"[Patient Report] Generated SMART Goals Summary for {patient_id}")
-
-        # 3. Treatment Plan Summary
-        if treatment or goals or diagnosis:
-            age_sex = sanitize_age_sex(patient.get("age_sex", ""))
-            present_hist = sanitize_clinical_text(patient.get("present_history", ""))
-            past_hist = sanitize_clinical_text(patient.get("past_history", ""))
-            subjective_data = sanitize_subjective_data(subjective)
-            diagnosis_text = sanitize_clinical_text(diagnosis.get("likelihood", "") if diagnosis else "")
-            goals_data = sanitize_subjective_data(goals)
-            treatment_fields = sanitize_subjective_data(treatment)
-
-            prompt = get_treatment_plan_summary_prompt(
-                patient_id=patient_id,
-                age_sex=age_sex,
-                present_hist=present_hist,
-                past_hist=past_hist,
-                subjective=subjective_data,
-                diagnosis=diagnosis_text,
-                goals=goals_data,
-                treatment_fields=treatment_fields
-            )
-            ai_treatment_plan_summary = get_ai_suggestion(prompt, patient_context=age_sex)
-            logger.info(f"[Patient Report] Generated Treatment Plan Summary for {patient_id}")
-
+        summary_view = get_report_summary_store(generate_report_summary).view(patient_id, patient, summary_sections)
+        ai_summaries, ai_summaries_regenerating = summary_view.texts, summary_view.regenerating
     except Exception as e:
-        logger.error(f"[Patient Report] Error generating AI summaries for {patient_id}: {str(e)}")
+        logger.error(f"[Patient Report] Error loading AI summaries for {patient_id}: {str(e)}")
         # Continue rendering report even if AI summaries fail
+        ai_summaries, ai_summaries_regenerating = {}, []
 
     return render_template('patient_report.html',
-                           patient=patient,
-                           subjective=subjective,
-                           perspectives=perspectives,
-                           initial_plan=initial_plan,
-                           patho_mechanism=patho_mechanism,
-                           chronic_diseases=chronic_diseases,
-                           clinical_flags=clinical_flags,
-                           objective=objective,
-                           diagnosis=diagnosis,
-                           goals=goals,
-                           treatment=treatment,
-                           follow_ups=follow_ups,
-                           therapist=therapist,
+                           patient_id=patient_id,
                            report_date=report_date,
-                           ai_initial_plan_summary=ai_initial_plan_summary,
-                           ai_smart_goals_summary=ai_smart_goals_summary,
-                           ai_treatment_plan_summary=ai_treatment_plan_summary)
+                           **report.template_context(),
+                           ai_initial_plan_summary=ai_summaries.get('initial_plan', ''),
+                           ai_smart_goals_summary=ai_summaries.get('smart_goals', ''),
+                           ai_treatment_plan_summary=ai_summaries.get('treatment_plan', ''),
+                           ai_summaries_regenerating=ai_summaries_regenerating)
+
+
+@app.route('/patient_report/<path:patient_id>/summaries')
+@login_required()
+def patient_report_summaries(patient_id):
+    """Stored AI summaries of the report, polled by the page while some are regenerating"""
+    doc = db.collection('patients').document(patient_id).get()
+    if not doc.exists:
+        return jsonify({'error': 'Patient not found'}), 404
+    if not patient_access_allowed(doc.to_dict()):
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify(get_report_summary_store(generate_report_summary).status(patient_id))
 
 
 @app.route('/download_report/<path:patient_id>')
@@ -7420,46 +6974,8 @@ def download_report(patient_id):
             logger.warning(f"PDF download: Unauthorized access attempt for patient {patient_id} by {session.get('user_id')}")
             return redirect(url_for('view_patients'))
 
-        # 2) Fetch all assessment sections (latest record — sections are appended, not overwritten)
-        def fetch_one(coll):
-            try:
-                result = db.collection(coll) \
-                             .where('patient_id', '==', patient_id) \
-                             .order_by('timestamp', direction='DESCENDING') \
-                             .limit(1).get()
-                return result[0].to_dict() if result else {}
-            except Exception as e:
-                logger.warning(f"PDF download: Could not fetch {coll} for patient {patient_id}: {e}")
-                return {}
-
-        def fetch_all(coll):
-            try:
-                docs = db.collection(coll).where('patient_id', '==',
-                                                 patient_id).order_by('timestamp', direction='DESCENDING').get()
-                return [d.to_dict() for d in docs] if docs else []
-            except Exception as e:
-                logger.warning(f"PDF download: Could not fetch {coll} list for patient {patient_id}: {e}")
-                return []
-
-        subjective = fetch_one('subjective_examination')
-        perspectives = fetch_one('patient_perspectives')
-        initial_plan = fetch_one('initial_plan')
-        patho_mechanism = fetch_one('patho_mechanism')
-        chronic_diseases = fetch_one('chronic_diseases')
-        clinical_flags = fetch_one('clinical_flags')
-        objective = fetch_one('objective_assessments')
-        diagnosis = fetch_one('provisional_diagnosis')
-        goals = fetch_one('smart_goals')
-        treatment = fetch_one('treatment_plan')
-        follow_ups = fetch_all('follow_ups')
-
-        # Get therapist info
-        try:
-            therapist_doc = db.collection('users').document(patient.get('physio_id', '')).get()
-            therapist = therapist_doc.to_dict() if therapist_doc.exists else {}
-        except Exception as e:
-            logger.warning(f"PDF download: Could not fetch therapist info for patient {patient_id}: {e}")
-            therapist = {}
+        # 2) Sections, follow-ups and therapist, assembled once per patient version (report_assembly)
+        report = get_patient_report(doc)
 
         # Get current date/time for report
         from datetime import datetime as dt
@@ -7469,20 +6985,8 @@ def download_report(patient_id):
         try:
             rendered = render_template(
                 'patient_report.html',
-                patient=patient,
-                subjective=subjective,
-                perspectives=perspectives,
-                initial_plan=initial_plan,
-                patho_mechanism=patho_mechanism,
-                chronic_diseases=chronic_diseases,
-                clinical_flags=clinical_flags,
-                objective=objective,
-                diagnosis=diagnosis,
-                goals=goals,
-                treatment=treatment,
-                follow_ups=follow_ups,
-                therapist=therapist,
-                report_date=report_date
+                report_date=report_date,
+                **report.template_context()
             )
         except Exception as e:
             logger.error(f"PDF download: Template rendering failed for patient {patient_id}: {e}", exc_info=True)
@@ -7544,6 +7048,7 @@ def deactivate_user(user_email):
     if not target_doc.exists or target_doc.to_dict().get('institute') != session.get('institute'):
         return "Access Denied"
     db.collection('users').document(user_email).update({'active': 0})
+    invalidate_user(user_email)
     log_action(session.get('user_id'), 'Deactivate User',
                f"User {user_email} was deactivated")
     return redirect('/manage_users')
@@ -7558,6 +7063,7 @@ def reactivate_user(user_email):
     if not target_doc.exists or target_doc.to_dict().get('institute') != session.get('institute'):
         return "Access Denied"
     db.collection('users').document(user_email).update({'active': 1})
+    invalidate_user(user_email)
     log_action(session.get('user_id'), 'Reactivate User',
                f"User {user_email} was reactivated")
     return redirect('/manage_users')
@@ -8449,20 +7955,11 @@ def provisional_diagnosis_suggest(patient_id):
                 if not firebase_patient_access_allowed(patient):
                     return jsonify({'error': 'Access denied'}), 403
 
-                # Helper to fetch the latest entry from a collection
+                # Latest sections come from the shared per-version context snapshot
+                snapshot = get_patient_context_snapshot(patient_id, doc)
+
                 def fetch_latest(collection_name):
-                    try:
-                        coll = db.collection(collection_name) \
-                                .where('patient_id', '==', patient_id) \
-                                .order_by('timestamp', direction='DESCENDING') \
-                                .limit(1) \
-                                .get()
-                        if coll and len(coll) > 0:
-                            return coll[0].to_dict()
-                        return {}
-                    except Exception as e:
-                        logger.warning(f"Could not fetch from {collection_name}: {e}")
-                        return {}
+                    return snapshot.section(COLLECTION_SECTIONS[collection_name])
 
                 # Fetch all relevant patient data (FIXED: Correct collection names)
                 subjective_data = fetch_latest('subjective_examination')
@@ -8659,14 +8156,11 @@ def treatment_plan_suggest(field):
     if not firebase_patient_access_allowed(patient_info):
         return jsonify({'error': 'Access denied'}), 403
 
-    # Helper to fetch the latest entry from a collection
+    # Latest sections come from the shared per-version context snapshot
+    snapshot = get_patient_context_snapshot(patient_id, pat_doc)
+
     def fetch_latest(collection_name):
-        coll = db.collection(collection_name) \
-                .where('patient_id', '==', patient_id) \
-                .order_by('timestamp', direction='DESCENDING') \
-                .limit(1) \
-                .get()
-        return coll[0].to_dict() if coll else {}
+        return snapshot.section(COLLECTION_SECTIONS[collection_name])
 
     # Fetch all relevant patient data
     subj = fetch_latest('subjective_examination')
@@ -8754,20 +8248,11 @@ def treatment_plan_summary(patient_id):
     if not firebase_patient_access_allowed(patient_info):
         return jsonify({'error': 'Access denied'}), 403
 
-    # Helper to fetch the latest entry from a collection
+    # Latest sections come from the shared per-version context snapshot
+    snapshot = get_patient_context_snapshot(patient_id, pat_doc)
+
     def fetch_latest(collection_name):
-        try:
-            coll = db.collection(collection_name) \
-                    .where('patient_id', '==', patient_id) \
-                    .order_by('timestamp', direction='DESCENDING') \
-                    .limit(1) \
-                    .get()
-            if coll and len(coll) > 0:
-                return coll[0].to_dict()
-            return {}
-        except Exception as e:
-            logger.warning(f"[Treatment Summary] Could not fetch from {collection_name}: {e}")
-            return {}
+        return snapshot.section(COLLECTION_SECTIONS[collection_name])
 
     # 2) Pull in each screen's data
     subj      = fetch_latest('subjective_examination')       # e.g. pain, history
@@ -8881,8 +8366,7 @@ def ai_followup_suggestion(patient_id):
     # Get diagnosis and treatment summary if available
     # provisional_diagnosis is stored as structured hypothesis-testing fields,
     # not a single "diagnosis" string - build a readable summary from them
-    prov_dx_doc = db.collection('provisional_diagnosis').where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').limit(1).get()
-    prov_dx_data = prov_dx_doc[0].to_dict() if prov_dx_doc else {}
+    prov_dx_data = get_patient_context_snapshot(patient_id, doc).section('provisional_diagnosis')
     diagnosis = sanitize_clinical_text("\n".join(
         f"- {label}: {prov_dx_data[key]}" for key, label in [
             ('structure_fault', 'Structure at Fault'),
@@ -8981,14 +8465,11 @@ def ai_followup_field(field):
     present_hist = sanitize_clinical_text(patient.get('present_complaint', '') or patient.get('present_history', ''))
     past_hist = sanitize_clinical_text(patient.get('past_history', ''))
 
-    # 4. Fetch related data from Firestore
+    # Latest sections come from the shared per-version context snapshot
+    snapshot = get_patient_context_snapshot(patient_id, doc)
+
     def fetch_latest(collection_name):
-        coll = db.collection(collection_name) \
-                .where('patient_id', '==', patient_id) \
-                .order_by('timestamp', direction='DESCENDING') \
-                .limit(1) \
-                .get()
-        return coll[0].to_dict() if coll else {}
+        return snapshot.section(COLLECTION_SECTIONS[collection_name])
 
     # Get diagnosis - provisional_diagnosis is stored as structured hypothesis-testing
     # fields, not a single "diagnosis" string - build a readable summary from them
@@ -9327,6 +8808,7 @@ def super_admin_approve_user(user_email):
                     'firebase_uid': auth_result['uid'],
                     'email_verified': True  # Auto-verify email when super admin approves
                 })
+                index_firebase_uid(auth_result['uid'], user_email)
 
                 temp_password = auth_result['temp_password']
 
@@ -9367,6 +8849,8 @@ def super_admin_approve_user(user_email):
             })
             flash(f"{approval_message}", "success")
 
+        invalidate_user(user_email)
+
         log_action(
             session.get('user_id'),
             'Super Admin Approve User',
@@ -9464,6 +8948,8 @@ def super_admin_reject_user(user_email):
 
         # Delete user from Firestore
         db.collection('users').document(user_email).delete()
+        invalidate_user(user_email)
+        forget_firebase_uid(firebase_uid)
 
         # Log the rejection
         log_action(
@@ -9555,6 +9041,7 @@ def super_admin_fix_subscription():
             }
             sub_ref.update(updates)
             flash("Updated Super Admin subscription to unlimited quotas", "success")
+        invalidate_subscription(user_email)
 
         logger.info(f"âœ… Fixed Super Admin subscription for {user_email}")
         return jsonify({'success': True, 'message': 'Subscription fixed successfully'})
@@ -9586,6 +9073,7 @@ def super_admin_deactivate_user(user_email):
             return redirect('/super_admin/users')
 
         db.collection('users').document(user_email).update({'active': 0})
+        invalidate_user(user_email)
         log_action(session.get('user_id'), 'Super Admin Deactivate', f"Super admin deactivated user {user_email}")
         flash(f"User {user_email} has been deactivated", "success")
     except Exception as e:
@@ -9610,6 +9098,7 @@ def super_admin_reactivate_user(user_email):
 
     try:
         db.collection('users').document(user_email).update({'active': 1})
+        invalidate_user(user_email)
         log_action(session.get('user_id'), 'Super Admin Reactivate', f"Super admin reactivated user {user_email}")
         flash(f"User {user_email} has been reactivated", "success")
     except Exception as e:
@@ -9727,6 +9216,42 @@ def ai_cache_statistics():
         return redirect('/super_admin_dashboard')
 
 
+@app.route('/super_admin/ai_metrics')
+@require_auth
+def ai_metrics():
+    """Rolling AI latency/token/cost metrics for this worker (Super Admin only)"""
+    if session.get('is_super_admin') != 1:
+        return jsonify({'error': 'Access denied'}), 403
+
+    minutes = request.args.get('minutes', type=int)
+    return jsonify(get_ai_metrics(minutes))
+
+
+@app.route('/super_admin/cache_stats')
+@require_auth
+def cache_stats():
+    """Hit/miss/invalidation counters of this worker's in-process caches (Super Admin only)"""
+    if session.get('is_super_admin') != 1:
+        return jsonify({'error': 'Access denied'}), 403
+
+    return jsonify({
+        'users': get_user_cache_stats(),
+        'firebase_tokens': get_token_cache_stats(),
+        'patient_context': get_patient_context_cache_stats(),
+        'subscriptions': get_subscription_cache_stats(),
+        'quota_leases': get_quota_lease_stats(),
+        'log_sink': get_log_sink().stats(),
+        'rate_limits': get_rate_limit_stats(),
+        'patient_search': get_patient_search_stats(),
+        'autocomplete_phrases': get_phrase_index_stats(),
+        'tag_dictionary': get_tag_dictionary_stats(),
+        'report_summaries': get_report_summary_stats(),
+        'patient_reports': get_report_assembly_stats(),
+        'clinical_records': get_clinical_record_stats(),
+        'patient_numbers': get_patient_number_stats(),
+    })
+
+
 @app.route('/super_admin/export_training_data')
 @require_auth
 def export_training_data():
@@ -9945,6 +9470,7 @@ def super_admin_process_deletion(user_email):
                 for doc in docs:
                     doc.reference.delete()
                     deletion_stats['assessment_documents'] += 1
+            delete_clinical_record(patient_id)
 
             # Delete all form drafts for this patient
             draft_patterns = [
@@ -9974,7 +9500,12 @@ def super_admin_process_deletion(user_email):
 
             # Finally, delete the patient record
             patient_doc.reference.delete()
+            get_patient_search_index().remove(patient_doc.id)
+            # The institute keeps its dictionary; this user's is deleted below
+            record_tag_change({'institute': patient_data.get('institute')}, patient_data.get('tags'), None)
+            unschedule_followup(patient_id, patient_data.get('next_followup_date'))
             deletion_stats['patients'] += 1
+        delete_tag_dictionary(('physio_id', user_email))
 
         # 2. Delete saved searches
         saved_searches = db.collection('saved_searches').where('user_id', '==', user_email).stream()
@@ -9985,6 +9516,7 @@ def super_admin_process_deletion(user_email):
         # 3. Delete subscription data
         try:
             db.collection('subscriptions').document(user_email).delete()
+            invalidate_subscription(user_email)
             deletion_stats['subscriptions'] = 1
         except Exception as sub_error:
             logger.warning(f"GDPR deletion: failed to delete subscription for {user_email}: {sub_error}")
@@ -10019,6 +9551,8 @@ def super_admin_process_deletion(user_email):
 
         # 8. Finally, delete user document from Firestore
         user_ref.delete()
+        invalidate_user(user_email)
+        forget_firebase_uid(user_data.get('firebase_uid'))
 
         # Log the comprehensive deletion
         log_action(
@@ -11773,12 +11307,15 @@ def set_next_followup(patient_id):
             return jsonify({'ok': False, 'error': 'Access denied'}), 403
 
         # Update patient record with next follow-up date
-        patient_ref.update({
+        followup_update = {
             'next_followup_date': next_followup_date,
             'followup_notified': False,
             'followup_notification_sent_at': None,
             'updated_at': SERVER_TIMESTAMP
-        })
+        }
+        patient_ref.update(followup_update)
+        schedule_followup(patient_id, {**patient, **followup_update}, next_followup_date,
+                          old_day=patient.get('next_followup_date'), due_time=followup_time)
 
         # Auto-create appointment in PhysioSchedule app
         try:
@@ -11863,6 +11400,8 @@ def mark_followup_notified(patient_id):
             'followup_notified_by': user_id,
             'updated_at': SERVER_TIMESTAMP
         })
+        record_followup_notified(patient_id, patient.get('next_followup_date'),
+                                 datetime.now(timezone.utc).isoformat())
 
         # Create confirmation notification
         from notification_service import notify_followup_confirmation
@@ -11892,49 +11431,14 @@ def get_upcoming_followups():
         user_id = session.get('user_id')
         days_ahead = int(request.args.get('days', 7))  # Default to 7 days
 
-        # Get all patients for this user
+        # Read the day buckets from today to the cutoff for this user (their
+        # institute, for admins), soonest first
         if session.get('is_admin') == 1:
-            query = db.collection('patients').where('institute', '==', session.get('institute'))
+            owner = ('institute', session.get('institute'))
         else:
-            query = db.collection('patients').where('physio_id', '==', user_id)
-
-        patients = query.stream()
-
-        upcoming = []
+            owner = ('physio_id', user_id)
         today = datetime.now().date()
-        cutoff_date = today + timedelta(days=days_ahead)
-
-        for doc in patients:
-            patient = doc.to_dict()
-            patient['patient_id'] = doc.id
-
-            next_followup = patient.get('next_followup_date')
-            if next_followup:
-                # Parse the date (assuming format YYYY-MM-DD)
-                try:
-                    followup_date = datetime.strptime(next_followup, '%Y-%m-%d').date()
-
-                    # Check if within the range
-                    if today <= followup_date <= cutoff_date:
-                        days_until = (followup_date - today).days
-
-                        upcoming.append({
-                            'patient_id': patient['patient_id'],
-                            'patient_name': patient.get('name', 'Unknown'),
-                            'contact': patient.get('contact', ''),
-                            'next_followup_date': next_followup,
-                            'days_until': days_until,
-                            'followup_notified': patient.get('followup_notified', False),
-                            'notification_sent_at': patient.get('followup_notification_sent_at'),
-                            'is_today': days_until == 0,
-                            'is_overdue': followup_date < today
-                        })
-                except ValueError:
-                    # Invalid date format, skip
-                    continue
-
-        # Sort by date (soonest first)
-        upcoming.sort(key=lambda x: x['days_until'])
+        upcoming = get_followup_schedule().upcoming(owner[0], owner[1], today, days_ahead)
 
         return jsonify({
             'ok': True,
@@ -11967,41 +11471,24 @@ def check_followup_reminders():
 
         notifications_sent = 0
 
-        # Query all patients
-        all_patients = db.collection('patients').stream()
-
-        for doc in all_patients:
-            patient = doc.to_dict()
-            patient_id = doc.id
-
-            next_followup = patient.get('next_followup_date')
-            if not next_followup:
+        # Only the day buckets a reminder is due for, across all tenants
+        buckets = day_buckets(today, reminder_days)
+        for entry in get_followup_schedule().due_unnotified(buckets):
+            # The physio who created this patient
+            physio_id = entry.get('physio_id')
+            if not physio_id:
                 continue
 
-            try:
-                followup_date = datetime.strptime(next_followup, '%Y-%m-%d').date()
-                days_until = (followup_date - today).days
-
-                # Check if we should send a reminder
-                if days_until in reminder_days and not patient.get('followup_notified', False):
-                    # Get the physio who created this patient
-                    physio_id = patient.get('physio_id')
-                    if physio_id:
-                        patient_name = patient.get('name', 'Patient')
-
-                        notify_upcoming_followup(
-                            physio_id,
-                            patient_name,
-                            patient_id,
-                            next_followup,
-                            days_until
-                        )
-
-                        notifications_sent += 1
+            days_until = reminder_days[buckets.index(entry['day'])]
+            notify_upcoming_followup(
+                physio_id,
+                entry.get('patient_name') or 'Patient',
+                entry.get('patient_id'),
+                entry['day'],
+                days_until
+            )
 
-            except ValueError:
-                # Invalid date format
-                continue
+            notifications_sent += 1
 
         return jsonify({
             'ok': True,
@@ -12256,16 +11743,15 @@ def get_patient_context(patient_id):
     - SMART goals (most recent)
     """
     try:
-        user_id = session.get('user_id')
-
-        # Get patient document
-        patient_ref = db.collection('patients').document(patient_id)
-        patient_doc = patient_ref.get()
-
-        if not patient_doc.exists:
+        # Patient doc + latest sections come from the shared context snapshot,
+        # which is only rebuilt when the patient or one of its sections changes
+        snapshot = get_patient_context_snapshot(
+            patient_id, db.collection('patients').document(patient_id).get()
+        )
+        if snapshot is None:
             return jsonify({'ok': False, 'error': 'Patient not found'}), 404
 
-        patient = patient_doc.to_dict()
+        patient = snapshot.patient
 
         # Access control
         if not patient_access_allowed(patient):
@@ -12284,15 +11770,9 @@ def get_patient_context(patient_id):
             'provisional_diagnosis': ''
         }
 
-        # Fetch most recent subjective examination
-        subjective_docs = db.collection('subjective_examination')\
-            .where('patient_id', '==', patient_id)\
-            .order_by('timestamp', direction='DESCENDING')\
-            .limit(1)\
-            .stream()
-
-        for doc in subjective_docs:
-            subj_data = doc.to_dict()
+        # Most recent subjective examination
+        subj_data = snapshot.section('subjective')
+        if subj_data:
             context['subjective'] = {
                 'body_structure': subj_data.get('body_structure', ''),
                 'body_function': subj_data.get('body_function', ''),
@@ -12301,17 +11781,10 @@ def get_patient_context(patient_id):
                 'contextual_environmental': subj_data.get('contextual_environmental', ''),
                 'contextual_personal': subj_data.get('contextual_personal', '')
             }
-            break  # Only need the most recent
 
-        # Fetch most recent patient perspectives
-        perspectives_docs = db.collection('patient_perspectives')\
-            .where('patient_id', '==', patient_id)\
-            .order_by('timestamp', direction='DESCENDING')\
-            .limit(1)\
-            .stream()
-
-        for doc in perspectives_docs:
-            persp_data = doc.to_dict()
+        # Most recent patient perspectives
+        persp_data = snapshot.section('perspectives')
+        if persp_data:
             context['perspectives'] = {
                 'knowledge': persp_data.get('knowledge', ''),
                 'attribution': persp_data.get('attribution', ''),
@@ -12320,17 +11793,10 @@ def get_patient_context(patient_id):
                 'locus_of_control': persp_data.get('locus_of_control', ''),
                 'affective_aspect': persp_data.get('affective_aspect', '')
             }
-            break  # Only need the most recent
-
-        # Fetch most recent initial plan assessments
-        initial_plan_docs = db.collection('initial_plan')\
-            .where('patient_id', '==', patient_id)\
-            .order_by('timestamp', direction='DESCENDING')\
-            .limit(1)\
-            .stream()
 
-        for doc in initial_plan_docs:
-            plan_data = doc.to_dict()
+        # Most recent initial plan assessments
+        plan_data = snapshot.section('initial_plan')
+        if plan_data:
             context['assessments'] = {
                 'active_movements': plan_data.get('active_movements', ''),
                 'passive_movements': plan_data.get('passive_movements', ''),
@@ -12348,33 +11814,19 @@ def get_patient_context(patient_id):
                 'special_tests_details': plan_data.get('special_tests_details', ''),
                 'neurodynamic_details': plan_data.get('neurodynamic_details', '')
             }
-            break  # Only need the most recent
 
-        # Fetch most recent SMART goals
-        smart_goals_docs = db.collection('smart_goals')\
-            .where('patient_id', '==', patient_id)\
-            .order_by('timestamp', direction='DESCENDING')\
-            .limit(1)\
-            .stream()
-
-        for doc in smart_goals_docs:
-            goals_data = doc.to_dict()
+        # Most recent SMART goals
+        goals_data = snapshot.section('smart_goals')
+        if goals_data:
             context['smart_goals'] = {
                 'smart_goal': goals_data.get('smart_goal', ''),
                 'smart_goal_details': goals_data.get('smart_goal_details', '')
             }
-            break  # Only need the most recent
 
-        # Fetch most recent provisional diagnosis
+        # Most recent provisional diagnosis
         # (stored as structured hypothesis-testing fields, not a single "diagnosis" string)
-        prov_dx_docs = db.collection('provisional_diagnosis')\
-            .where('patient_id', '==', patient_id)\
-            .order_by('timestamp', direction='DESCENDING')\
-            .limit(1)\
-            .stream()
-
-        for doc in prov_dx_docs:
-            dx_data = doc.to_dict()
+        dx_data = snapshot.section('provisional_diagnosis')
+        if dx_data:
             dx_fields = [
                 ('structure_fault', 'Structure at Fault'),
                 ('likelihood', 'Likelihood'),
@@ -12386,7 +11838,6 @@ def get_patient_context(patient_id):
             context['provisional_diagnosis'] = "\n".join(
                 f"- {label}: {dx_data[key]}" for key, label in dx_fields if dx_data.get(key)
             )
-            break  # Only need the most recent
 
         return jsonify(context), 200
 
@@ -12596,111 +12047,8 @@ def api_autocomplete_suggestions():
             # Don't suggest for very short queries
             return jsonify({'suggestions': []}), 200
 
-        # Define which fields to search in Firestore based on field name
-        field_mappings = {
-            # Chief complaints
-            'chief_complaint': ['chief_complaint'],
-            'present_history': ['present_history'],
-            'past_history': ['past_history'],
-
-            # Subjective examination
-            'impairmentBodyStructure': ['impairment_body_structure'],
-            'impairmentBodyFunction': ['impairment_body_function'],
-            'activityLimitationPerformance': ['activity_limitation_performance'],
-            'activityLimitationCapacity': ['activity_limitation_capacity'],
-            'contextualFactorsEnvironmental': ['contextual_factors_environmental'],
-            'contextualFactorsPersonal': ['contextual_factors_personal'],
-
-            # Perspectives
-            'knowledge_entry': ['knowledge_entry'],
-            'attribution_entry': ['attribution_entry'],
-            'expectation_entry': ['expectation_entry'],
-            'consequences_awareness_entry': ['consequences_awareness_entry'],
-            'locus_of_control_entry': ['locus_of_control_entry'],
-            'affective_aspect_entry': ['affective_aspect_entry'],
-
-            # Treatment plan
-            'treatment_plan': ['treatment_plan'],
-            'reasoning': ['reasoning'],
-
-            # SMART Goals
-            'patient_goal': ['patient_goal'],
-            'outcome_timeframe': ['outcome_timeframe'],
-
-            # Follow-ups
-            'belief_feedback': ['belief_feedback'],
-            'plan_next': ['plan_next', 'treatment_plan'],
-        }
-
-        # Get Firestore fields to search
-        firestore_fields = field_mappings.get(field, [field])
-
-        # Collect phrases from user's patient records
-        phrases_with_frequency = {}
-
-        # Query user's patients
-        patients_ref = db.collection('patients').where('physio_id', '==', user_id)
-        patients = patients_ref.stream()
-
-        for patient in patients:
-            patient_data = patient.to_dict()
-
-            # Check each mapped field
-            for fs_field in firestore_fields:
-                value = patient_data.get(fs_field, '')
-
-                if isinstance(value, str) and value:
-                    value_lower = value.lower()
-
-                    # Check if query matches
-                    if query in value_lower:
-                        # Extract the full sentence/phrase containing the query
-                        sentences = value.split('.')
-                        for sentence in sentences:
-                            sentence = sentence.strip()
-                            if query in sentence.lower() and len(sentence) > len(query):
-                                # Count frequency
-                                if sentence in phrases_with_frequency:
-                                    phrases_with_frequency[sentence] += 1
-                                else:
-                                    phrases_with_frequency[sentence] = 1
-
-            # Also check subjective_examination subcollection
-            if fs_field in ['impairment_body_structure', 'impairment_body_function',
-                           'activity_limitation_performance', 'activity_limitation_capacity',
-                           'contextual_factors_environmental', 'contextual_factors_personal']:
-                sub_ref = db.collection('patients').document(patient.id).collection('subjective_examination')
-                sub_docs = sub_ref.stream()
-
-                for sub_doc in sub_docs:
-                    sub_data = sub_doc.to_dict()
-                    for fs_field in firestore_fields:
-                        value = sub_data.get(fs_field, '')
-                        if isinstance(value, str) and value and query in value.lower():
-                            sentences = value.split('.')
-                            for sentence in sentences:
-                                sentence = sentence.strip()
-                                if query in sentence.lower() and len(sentence) > len(query):
-                                    if sentence in phrases_with_frequency:
-                                        phrases_with_frequency[sentence] += 1
-                                    else:
-                                        phrases_with_frequency[sentence] = 1
-
-        # Sort by frequency (most common first)
-        sorted_phrases = sorted(
-            phrases_with_frequency.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )
-
-        # Format suggestions
-        suggestions = [
-            {
-                'text': phrase,
-                'frequency': freq
-            }
-            for phrase, freq in sorted_phrases[:limit]
-        ]
+        # Phrases counted as this user's notes were saved (phrase_index.py)
+        suggestions = get_phrase_index().suggest(user_id, field, query, limit)
 
         logger.info(f"Autocomplete: user={user_id}, field={field}, query='{query}', found={len(suggestions)} suggestions")
 
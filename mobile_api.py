@@ -13,11 +13,26 @@ import os
 import uuid
 import logging
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, g
+from flask import Blueprint, request, jsonify, g, make_response
 from azure_cosmos_db import get_cosmos_db, get_patient_safe, SERVER_TIMESTAMP
-from app_auth import require_firebase_auth, require_auth
+from app_auth import require_firebase_auth, require_auth, revoke_firebase_tokens
+from user_cache import find_user_email_by_firebase_uid, forget_firebase_uid, index_firebase_uid, invalidate_user
+from log_sink import append_log
 from quota_middleware import require_patient_quota
+from assessment_progress import (
+    PROGRESS_FIELD, compute_progress, empty_progress, mobile_sections, progress_flags, record_section_saved,
+)
 from patient_access import patient_access_allowed
+from patient_list_query import PatientListFilters, PatientListQuery, PatientScope, name_sort_key
+from patient_search_index import get_patient_search_index
+from phrase_index import record_phrases
+from tag_dictionary import get_tag_dictionary, record_tag_change, set_patient_tags
+from followup_schedule import PATIENT_FIELDS as FOLLOWUP_PATIENT_FIELDS
+from followup_schedule import refresh_followup_patient, schedule_followup, unschedule_followup
+from patient_context import COLLECTION_SECTIONS, get_patient_context_snapshot
+from clinical_record import create_clinical_record, delete_clinical_record
+from report_assembly import get_patient_report
+from ttl_cache import TTLCache
 from firebase_admin import auth
 from rate_limiter import redis_client, redis_available
 from email_service import (
@@ -65,6 +80,9 @@ def compare_tos_versions(user_version, current_version):
 # Create Blueprint for mobile API routes
 mobile_api = Blueprint('mobile_api', __name__, url_prefix='/api')
 
+# Patient free-text fields whose phrases feed web autocomplete (phrase_index.py)
+_PHRASE_FIELDS = ('chief_complaint', 'medical_history')
+
 
 # Get Cosmos DB client
 db = get_cosmos_db()
@@ -110,7 +128,7 @@ def log_audit(action, details=None, user_id=None):
         if details:
             entry['details'] = details
 
-        db.collection('audit_logs').add(entry)
+        append_log('audit_logs', entry)
         logger.info(f"Audit log: {action} by {entry['user_id']}")
     except Exception as e:
         logger.error(f"Failed to log audit entry: {e}")
@@ -264,6 +282,8 @@ def api_login():
                 
                 # Update Cosmos DB with Firebase UID
                 db.collection('users').document(email).update({'firebase_uid': firebase_uid})
+                invalidate_user(email)
+                index_firebase_uid(firebase_uid, email)
         
         # Case 2: User has no Cosmos DB password hash - must be Firebase Auth only user
         else:
@@ -449,6 +469,7 @@ def api_register():
             'tos_accepted_at': SERVER_TIMESTAMP,
             'tos_version': TOS_VERSION,
         })
+        index_firebase_uid(firebase_uid, email)
 
         # Log registration action
         log_audit('mobile_register', {
@@ -522,6 +543,7 @@ def api_accept_tos():
             'tos_accepted_at': SERVER_TIMESTAMP,
             'consent_terms': 1
         })
+        invalidate_user(user_email)
 
         # Log the action
         log_audit('tos_acceptance', {
@@ -733,12 +755,17 @@ def api_list_my_patients():
     - date_from: Filter by created date from (YYYY-MM-DD)
     - date_to: Filter by created date to (YYYY-MM-DD)
     - sort: Sort order (newest, oldest, name_asc, name_desc)
+    - status: Filter by treatment status (active, completed, archived)
+    - tags: Filter by tag (repeatable; any of)
+    - limit: Page size (max 100). Without it every matching patient is returned.
+    - cursor: next_cursor from the previous page
 
     Response:
     {
         "patients": [...],
-        "total_count": 100,
-        "filtered_count": 10
+        "total_count": 100,       # first page only, otherwise null
+        "filtered_count": 10,     # first page only, otherwise null
+        "next_cursor": "..."      # null on the last page
     }
     """
     try:
@@ -759,26 +786,32 @@ def api_list_my_patients():
         # Debug logging
         logger.info(f"Fetching patients for user: {user_email} with filters: name={name_filter}, id={id_filter}, contact={contact_filter}")
 
-        # Query patients for this physiotherapist, plus any teammate's patients
-        # if this user belongs to an institute (team-wide access). Cosmos .where()
-        # only AND-chains, so this is two queries merged/deduped by doc id.
-        actor_institute = g.user.get('institute')
-        seen_ids = set()
-        patients_ref = []
-        for patient_doc in db.collection('patients').where('physio_id', '==', user_email).stream():
-            seen_ids.add(patient_doc.id)
-            patients_ref.append(patient_doc)
-        if actor_institute:
-            for patient_doc in db.collection('patients').where('institute', '==', actor_institute).stream():
-                if patient_doc.id not in seen_ids:
-                    seen_ids.add(patient_doc.id)
-                    patients_ref.append(patient_doc)
-
-        patients = []
-        for patient_doc in patients_ref:
-            patient_data = patient_doc.to_dict()
-            patient_data['id'] = patient_doc.id
+        # This physiotherapist's patients plus any teammate's patients if this
+        # user belongs to an institute (team-wide access), filtered, sorted and
+        # paginated by the query itself (see patient_list_query.py)
+        scope = PatientScope(physio_id=user_email, institute=g.user.get('institute'))
+        filters = PatientListFilters(
+            name=name_filter, patient_id=id_filter, contact=contact_filter, complaint=complaint_filter,
+            status=status_filter, tags=tags_filter, date_from=date_from, date_to=date_to,
+        )
+        engine = PatientListQuery(db.collection('patients'), search=get_patient_search_index().search)
+        page_size = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor') or None
 
+        if page_size:
+            patients, next_cursor = engine.page(scope, filters, sort_by, cursor,
+                                                page_size=min(max(page_size, 1), 100))
+        else:
+            # Clients that don't paginate get every matching patient, still
+            # filtered and sorted by the query, a page at a time
+            patients, next_cursor = [], None
+            while True:
+                batch, next_cursor = engine.page(scope, filters, sort_by, next_cursor, page_size=200)
+                patients.extend(batch)
+                if not next_cursor:
+                    break
+
+        for patient_data in patients:
             # Convert timestamp to ISO format if present
             if 'created_at' in patient_data and patient_data['created_at']:
                 try:
@@ -786,142 +819,32 @@ def api_list_my_patients():
                 except:
                     pass
 
-            patients.append(patient_data)
-
-        # Enrich patient data with assessment completion status for progress tracking.
-        # Each check queries the separate Firestore collection (web app storage path)
-        # AND falls back to reading the nested field on the patient document itself
-        # (mobile app storage path), so progress is correct for both web and mobile patients.
+        # Assessment completion flags for the progress bars, from each patient's
+        # assessment_progress summary (which also covers the nested fields mobile
+        # saves write). Patients not yet backfilled have no summary and are
+        # probed collection by collection, as before.
         for patient in patients:
-            patient_id = patient.get('patient_id')
-            if patient_id:
-                # Subjective examination
-                subj_docs = db.collection('subjective_examination') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if subj_docs or patient.get('subjectiveExamination'):
-                    patient['subjectiveExamination'] = True
-
-                # Patient perspectives
-                persp_docs = db.collection('patient_perspectives') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if persp_docs or patient.get('patientPerspectives'):
-                    patient['patientPerspectives'] = True
-
-                # Pathophysiological mechanism
-                patho_docs = db.collection('patho_mechanism') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if patho_docs or patient.get('pathoMechanism'):
-                    patient['pathoMechanism'] = True
-
-                # Chronic disease factors
-                chronic_docs = db.collection('chronic_diseases') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if chronic_docs or patient.get('chronicDiseaseFactors'):
-                    patient['chronicDiseases'] = True
-
-                # Clinical flags
-                flags_docs = db.collection('clinical_flags') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if flags_docs or patient.get('clinicalFlags'):
-                    patient['clinicalFlags'] = True
-
-                # Objective assessment
-                obj_docs = db.collection('objective_assessments') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if obj_docs or patient.get('objectiveAssessment'):
-                    patient['objectiveAssessment'] = True
-
-                # Provisional diagnosis
-                diag_docs = db.collection('provisional_diagnosis') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if diag_docs or patient.get('provisionalDiagnosis'):
-                    patient['provisionalDiagnosis'] = True
-
-                # Initial plan
-                plan_docs = db.collection('initial_plan') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if plan_docs or patient.get('initialPlan'):
-                    patient['initialPlan'] = True
-
-                # SMART goals
-                goals_docs = db.collection('smart_goals') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if goals_docs or patient.get('smartGoals'):
-                    patient['smartGoals'] = True
-
-                # Treatment plan
-                treatment_docs = db.collection('treatment_plan') \
-                    .where('patient_id', '==', patient_id).limit(1).get()
-                if treatment_docs or patient.get('treatmentPlan'):
-                    patient['treatmentPlan'] = True
-
-        # Store original count
-        total_count = len(patients)
-
-        # Apply client-side filtering
-        filtered_patients = patients
-
-        if name_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if name_filter.lower() in (p.get('name') or '').lower()]
-
-        if id_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if id_filter.lower() in (p.get('patient_id') or '').lower()]
-
-        if contact_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if contact_filter in (p.get('contact') or '')]
-
-        if complaint_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if complaint_filter.lower() in (p.get('present_history') or '').lower()]
-
-        # Filter by treatment status
-        if status_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if p.get('status', 'active') == status_filter]
-
-        # Filter by tags (patient must have at least one of the selected tags)
-        if tags_filter:
-            filtered_patients = [p for p in filtered_patients
-                                if any(tag in (p.get('tags') or []) for tag in tags_filter)]
-
-        # Date range filtering
-        if date_from:
-            try:
-                from datetime import datetime, timedelta
-                from_date = datetime.strptime(date_from, '%Y-%m-%d')
-                filtered_patients = [p for p in filtered_patients
-                                    if p.get('created_at') and datetime.fromisoformat(p['created_at'].replace('Z', '+00:00')) >= from_date]
-            except (ValueError, AttributeError) as e:
-                logger.warning(f"Invalid date_from format: {date_from}, {e}")
-
-        if date_to:
-            try:
-                from datetime import datetime, timedelta
-                to_date = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1)
-                filtered_patients = [p for p in filtered_patients
-                                    if p.get('created_at') and datetime.fromisoformat(p['created_at'].replace('Z', '+00:00')) < to_date]
-            except (ValueError, AttributeError) as e:
-                logger.warning(f"Invalid date_to format: {date_to}, {e}")
-
-        # Apply sorting
-        if sort_by == 'newest':
-            filtered_patients.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        elif sort_by == 'oldest':
-            filtered_patients.sort(key=lambda x: x.get('created_at', ''))
-        elif sort_by == 'name_asc':
-            filtered_patients.sort(key=lambda x: (x.get('name') or '').lower())
-        elif sort_by == 'name_desc':
-            filtered_patients.sort(key=lambda x: (x.get('name') or '').lower(), reverse=True)
-
-        logger.info(f"Found {total_count} patients, {len(filtered_patients)} after filtering")
+            flags = progress_flags(patient)
+            if flags is None and patient.get('patient_id'):
+                flags = progress_flags({**patient, PROGRESS_FIELD: compute_progress(db, patient)})
+            patient.update(flags or {})
+
+        # Counts come with the first page only (index-served COUNT queries)
+        total_count = filtered_count = None
+        if not cursor:
+            total_count = engine.count(scope)
+            if not page_size:
+                filtered_count = len(patients)
+            else:
+                filtered_count = engine.count(scope, filters) if filters.active() else total_count
+
+        logger.info(f"Returning {len(patients)} patients (of {total_count}), more: {bool(next_cursor)}")
 
         return jsonify({
-            'patients': filtered_patients,
+            'patients': patients,
             'total_count': total_count,
-            'filtered_count': len(filtered_patients)
+            'filtered_count': filtered_count,
+            'next_cursor': next_cursor,
         }), 200
 
     except Exception as e:
@@ -1004,10 +927,9 @@ def api_update_patient_tags(patient_id):
         # Clean and deduplicate tags
         cleaned_tags = list(set([tag.strip() for tag in tags if tag.strip()]))
 
-        # Update tags
-        patient_ref.update({
-            'tags': cleaned_tags
-        })
+        # Update tags (and the owners' tag dictionaries)
+        if not set_patient_tags(patient_ref, patient, cleaned_tags):
+            return jsonify({'success': False, 'error': 'Patient was changed or deleted, please retry'}), 409
 
         log_audit('update_patient_tags', {
             'email': user_email,
@@ -1030,26 +952,10 @@ def api_get_tag_suggestions():
         # Always use email for physio_id (consistent across auth methods)
         user_email = g.user.get('email')
 
-        # Get all patients for this user
-        patients = db.collection('patients').where('physio_id', '==', user_email).stream()
-
-        # Collect unique tags
-        all_tags = set()
-        for doc in patients:
-            patient = doc.to_dict()
-            all_tags.update(patient.get('tags') or [])
-
-        # Add default/suggested tags
-        default_tags = [
-            'Sports Injury', 'Post-Surgery', 'Chronic Pain', 'Acute Pain',
-            'Neurological', 'Orthopedic', 'Pediatric', 'Geriatric',
-            'Work-Related', 'Motor Vehicle Accident', 'Falls',
-            'Upper Extremity', 'Lower Extremity', 'Spine',
-            'High Priority', 'Follow-Up Required', 'Discharged'
-        ]
-        all_tags.update(default_tags)
+        # Tags used on this user's patients, plus the default suggestions
+        all_tags = get_tag_dictionary().tags([('physio_id', user_email)], include_defaults=True)
 
-        return jsonify({'success': True, 'tags': sorted(list(all_tags))}), 200
+        return jsonify({'success': True, 'tags': all_tags}), 200
 
     except Exception as e:
         logger.error(f"Error getting tag suggestions: {e}")
@@ -1092,91 +998,6 @@ def api_get_patient(patient_id):
         return jsonify({'error': 'Failed to fetch patient'}), 500
 
 
-# ─────────────────────────────────────────────────────────────────────────────
-# Field-name translation map: mobile camelCase → web snake_case
-# Used when falling back to the patient document for mobile-created patients.
-# Each key is the camelCase top-level field name on the patient document;
-# each value is a dict mapping mobile inner field names to their web equivalents.
-# ─────────────────────────────────────────────────────────────────────────────
-_MOBILE_FIELD_MAP = {
-    'subjectiveExamination': {
-        'impairmentBodyStructure':        'body_structure',
-        'impairmentBodyFunction':         'body_function',
-        'activityLimitationPerformance':  'activity_performance',
-        'activityLimitationCapacity':     'activity_capacity',
-        'contextualFactorsEnvironmental': 'contextual_environmental',
-        'contextualFactorsPersonal':      'contextual_personal',
-    },
-    'patientPerspectives': {
-        'knowledgeOfIllness':        'knowledge',
-        'illnessAttribution':        'attribution',
-        'expectationAboutIllness':   'expectation',
-        'awarenessOfConsequences':   'consequences_awareness',
-        'locusOfControl':            'locus_of_control',
-        'affectiveAspect':           'affective_aspect',
-    },
-    'provisionalDiagnosis': {
-        'likelihoodOfDiagnosis':         'likelihood',
-        'possibleStructureAtFault':      'structure_fault',
-        'findingsSupportingDiagnosis':   'findings_support',
-        'findingsRejectingDiagnosis':    'findings_reject',
-        'hypothesisSupported':           'hypothesis_supported',
-        # 'symptom' is identical in both — no mapping needed
-    },
-    'initialPlan': {
-        'activeMovements':        'active_movements',
-        'passiveMovements':       'passive_movements',
-        'passiveOverPressure':    'passive_over_pressure',
-        'resistedMovements':      'resisted_movements',
-        'combinedMovements':      'combined_movements',
-        'specialTests':           'special_tests',
-        'neurodynamicExamination':'neurodynamic',
-        # "Details" free-text fields (physio-entered findings) map to web's *_details.
-        # The "Suggestions" fields are read-only AI-suggestion text with no web-side
-        # equivalent — intentionally not mapped.
-        'activeMovementsObservations':         'active_movements_details',
-        'passiveMovementsObservations':        'passive_movements_details',
-        'passiveOverPressureObservations':     'passive_over_pressure_details',
-        'resistedMovementsObservations':       'resisted_movements_details',
-        'combinedMovementsObservations':       'combined_movements_details',
-        'specialTestsObservations':            'special_tests_details',
-        'neurodynamicExaminationObservations': 'neurodynamic_details',
-    },
-    'pathoMechanism': {
-        'areaInvolved':             'area_involved',
-        'presentingSymptom':        'presenting_symptom',
-        'painType':                 'pain_type',
-        'painNature':               'pain_nature',
-        'painSeverity':             'pain_severity',
-        'painIrritability':         'pain_irritability',
-        'possibleSourceOfSymptoms': 'possible_source',
-        'stageOfTissueHealing':     'stage_healing',
-    },
-    'clinicalFlags': {
-        'redFlag':    'red_flags',
-        'orangeFlag': 'orange_flags',
-        'yellowFlag': 'yellow_flags',
-        'blackFlag':  'black_flags',
-        'blueFlag':   'blue_flags',
-    },
-    'objectiveAssessment': {
-        'assessmentNotes': 'plan_details',
-        # 'plan' is present in both — no mapping needed
-    },
-    'chronicDiseaseFactors': {
-        'causeForMaintenance': 'causes',
-        'specificFactors':     'specific_factors',
-    },
-    'smartGoals': {
-        'goals':            'patient_goal',
-        'outcomeTimeframe': 'outcome_timeframe',
-    },
-    'treatmentPlan': {
-        'treatmentPlan': 'treatment_plan',
-    },
-}
-
-
 @mobile_api.route('/patients/<patient_id>/comprehensive-report', methods=['GET'])
 @require_auth
 def api_get_patient_comprehensive_report(patient_id):
@@ -1218,87 +1039,23 @@ def api_get_patient_comprehensive_report(patient_id):
         if not patient_access_allowed(patient_data, _actor_from_g_user()):
             return jsonify({'error': 'Unauthorized'}), 403
 
-        # 2. Fetch therapist info
-        therapist_doc = db.collection('users').document(patient_data.get('physio_id', '')).get()
-        therapist_data = therapist_doc.to_dict() if therapist_doc.exists else {}
-
-        # 3. Fetch all assessment sections.
-        # fetch_one checks the separate Firestore collection first (web app storage path).
-        # If empty, it falls back to the nested field on the patient document itself
-        # (mobile app storage path), so the report is populated for both web and mobile patients.
-        def fetch_one(collection_name, mobile_key=None):
-            docs = db.collection(collection_name).where('patient_id', '==', patient_id).limit(1).get()
-            if docs:
-                data = list(docs)[0].to_dict()
-                # Convert timestamps to ISO format
-                for key, value in data.items():
-                    if hasattr(value, 'isoformat'):
-                        data[key] = value.isoformat()
-                return data
-            # Fallback: read from the patient document (mobile storage path).
-            # Translate camelCase mobile field names to snake_case web field names
-            # so the comprehensive report displays correctly for mobile-created patients.
-            if mobile_key and patient_data.get(mobile_key):
-                mobile_data = patient_data[mobile_key]
-                if isinstance(mobile_data, dict):
-                    field_map = _MOBILE_FIELD_MAP.get(mobile_key, {})
-                    if field_map:
-                        translated = {}
-                        for k, v in mobile_data.items():
-                            # Use the web field name if a mapping exists; keep original otherwise
-                            translated[field_map.get(k, k)] = v
-                        return translated
-                    return mobile_data
-                # Scalar value — wrap it so callers always get a dict
-                return {mobile_key: mobile_data}
-            return {}
-
-        def fetch_all(collection_name):
-            docs = db.collection(collection_name).where('patient_id', '==', patient_id).order_by('timestamp', direction='DESCENDING').get()
-            result = []
-            for doc in docs:
-                data = doc.to_dict()
-                data['id'] = doc.id
-                # Convert timestamps to ISO format
-                for key, value in data.items():
-                    if hasattr(value, 'isoformat'):
-                        data[key] = value.isoformat()
-                result.append(data)
-            return result
-
-        assessments = {
-            'subjective': fetch_one('subjective_examination', 'subjectiveExamination'),
-            'perspectives': fetch_one('patient_perspectives', 'patientPerspectives'),
-            'initial_plan': fetch_one('initial_plan', 'initialPlan'),
-            'patho_mechanism': fetch_one('patho_mechanism', 'pathoMechanism'),
-            'chronic_diseases': fetch_one('chronic_diseases', 'chronicDiseaseFactors'),
-            'clinical_flags': fetch_one('clinical_flags', 'clinicalFlags'),
-            'objective': fetch_one('objective_assessments', 'objectiveAssessment'),
-            'diagnosis': fetch_one('provisional_diagnosis', 'provisionalDiagnosis'),
-            'goals': fetch_one('smart_goals', 'smartGoals'),
-            'treatment': fetch_one('treatment_plan', 'treatmentPlan')
-        }
-
-        follow_ups = fetch_all('follow_ups')
-
-        # Convert patient timestamps
-        for field in ['created_at', 'updated_at']:
-            if field in patient_data and patient_data[field]:
-                try:
-                    if hasattr(patient_data[field], 'isoformat'):
-                        patient_data[field] = patient_data[field].isoformat()
-                except:
-                    pass
+        # 2. Assemble (or reuse) the report for this patient version.
+        # Sections come from their collections, falling back to the camelCase
+        # fields mobile clients keep on the patient document (report_assembly).
+        report = get_patient_report(patient_doc)
 
         log_audit('view_comprehensive_report', {'patient_id': patient_id})
 
-        return jsonify({
-            'patient': patient_data,
-            'therapist': therapist_data,
-            'assessments': assessments,
-            'follow_ups': follow_ups,
-            'report_generated_at': datetime.now().isoformat()
-        }), 200
+        # The app already has this version of the report
+        if request.if_none_match.contains_weak(report.etag):
+            response = make_response('', 304)
+            response.set_etag(report.etag)
+            return response
+
+        response = jsonify(report.to_api())
+        response.set_etag(report.etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response, 200
 
     except Exception as e:
         logger.error(f"Error fetching comprehensive report: {e}")
@@ -1321,47 +1078,12 @@ def api_check_duplicate_patient():
 
         user_email = g.user.get('email')
         actor_institute = g.user.get('institute')
-        db = get_cosmos_db()
-
-        # Get all patients for this physio, plus any teammate's patients if
-        # this user belongs to an institute (team-wide access), deduped by id.
-        seen_ids = set()
-        patients = []
-        for patient in db.collection('patients').where('physio_id', '==', user_email).stream():
-            seen_ids.add(patient.id)
-            patients.append(patient)
-        if actor_institute:
-            for patient in db.collection('patients').where('institute', '==', actor_institute).stream():
-                if patient.id not in seen_ids:
-                    seen_ids.add(patient.id)
-                    patients.append(patient)
-
-        # Find exact and similar matches
-        duplicates = []
-        for patient in patients:
-            patient_data = patient.to_dict()
-            existing_name = patient_data.get('name', '').strip().lower()
-
-            # Check for exact match (case-insensitive)
-            if existing_name == patient_name:
-                duplicates.append({
-                    'patient_id': patient_data.get('patient_id'),
-                    'name': patient_data.get('name'),
-                    'age_sex': patient_data.get('age_sex'),
-                    'contact': patient_data.get('contact'),
-                    'created_at': patient_data.get('created_at'),
-                    'match_type': 'exact'
-                })
-            # Check for very similar names (contains or is contained)
-            elif (patient_name in existing_name or existing_name in patient_name) and len(patient_name) > 3:
-                duplicates.append({
-                    'patient_id': patient_data.get('patient_id'),
-                    'name': patient_data.get('name'),
-                    'age_sex': patient_data.get('age_sex'),
-                    'contact': patient_data.get('contact'),
-                    'created_at': patient_data.get('created_at'),
-                    'match_type': 'similar'
-                })
+
+        # Exact, similar (contained or fuzzy) and same-contact matches among
+        # this physio's patients, plus any teammate's patients if this user
+        # belongs to an institute (team-wide access), from the search index
+        duplicates = get_patient_search_index().find_duplicates(
+            PatientScope(physio_id=user_email, institute=actor_institute), patient_name, data.get('contact', ''))
 
         return jsonify({
             'duplicates': duplicates,
@@ -1404,6 +1126,7 @@ def api_create_patient():
             'physio_id': user_email,
             'institute': g.user.get('institute', ''),
             'name': data.get('name', ''),
+            'name_sort': name_sort_key(data.get('name', '')),
             'age_sex': data.get('age_sex', ''),
             'contact': data.get('contact', ''),
             'chief_complaint': data.get('chief_complaint', ''),
@@ -1411,7 +1134,8 @@ def api_create_patient():
             'surgical_history': data.get('surgical_history', ''),
             'occupation': data.get('occupation', ''),
             'created_at': SERVER_TIMESTAMP,
-            'updated_at': SERVER_TIMESTAMP
+            'updated_at': SERVER_TIMESTAMP,
+            PROGRESS_FIELD: empty_progress(),
         }
 
         # Add optional fields if provided
@@ -1428,6 +1152,9 @@ def api_create_patient():
 
         # Save to Cosmos DB
         db.collection('patients').document(patient_id).set(patient_data)
+        create_clinical_record(patient_id)
+        get_patient_search_index().upsert({**patient_data, 'id': patient_id})
+        record_phrases(user_email, {k: patient_data[k] for k in _PHRASE_FIELDS})
 
         log_audit('create_patient', {'patient_id': patient_id, 'patient_name': patient_data['name']})
 
@@ -1495,11 +1222,11 @@ def api_qm_prefill():
             return jsonify({'error': 'Unauthorized'}), 403
 
         # Helper: read assessment data from separate collection with patient-doc fallback
+        snapshot = get_patient_context_snapshot(patient_id, patient_doc)
+
         def fetch_assessment(collection_name, mobile_key):
-            docs = db.collection(collection_name).where('patient_id', '==', patient_id).limit(1).get()
-            if docs:
-                return list(docs)[0].to_dict()
-            return patient_data.get(mobile_key) or {}
+            return (snapshot.section(COLLECTION_SECTIONS[collection_name])
+                    or patient_data.get(mobile_key) or {})
 
         # Generate prefills for the requested step
         if step == 'patho_mechanism':
@@ -1628,8 +1355,36 @@ def api_update_patient(patient_id):
         update_data = request.get_json()
         update_data['updated_at'] = SERVER_TIMESTAMP
 
+        # Sort key and progress summary are server-maintained
+        update_data.pop('name_sort', None)
+        if 'name' in update_data:
+            update_data['name_sort'] = name_sort_key(update_data['name'])
+
+        update_data.pop(PROGRESS_FIELD, None)
+
         # Update patient
-        db.collection('patients').document(patient_id).update(update_data)
+        patient_ref = db.collection('patients').document(patient_id)
+        patient_ref.update(update_data)
+        # Mark the sections this save wrote with the same read-free patches
+        # as web saves, so a concurrent web save's bit isn't overwritten
+        # (patients not yet backfilled keep having no summary)
+        for collection in mobile_sections(update_data):
+            try:
+                record_section_saved(patient_ref, collection)
+            except Exception as e:
+                logger.warning(f"Progress update for {collection} on {patient_id} failed: {e}")
+        get_patient_search_index().upsert({**patient_data, **update_data, 'id': patient_doc.id})
+        if 'tags' in update_data:
+            record_tag_change({**patient_data, **update_data}, patient_data.get('tags'), update_data['tags'])
+        if 'next_followup_date' in update_data:
+            schedule_followup(patient_doc.id, {**patient_data, **update_data}, update_data['next_followup_date'],
+                              old_day=patient_data.get('next_followup_date'))
+        elif any(k in update_data for k in FOLLOWUP_PATIENT_FIELDS):
+            refresh_followup_patient(patient_doc.id, {**patient_data, **update_data})
+        edited = [k for k in _PHRASE_FIELDS if k in update_data]
+        if edited:
+            record_phrases(user_email, {k: update_data[k] for k in edited},
+                           old={k: patient_data.get(k) for k in edited})
 
         log_audit('update_patient', {'patient_id': patient_id})
 
@@ -1701,6 +1456,7 @@ def api_delete_patient(patient_id):
             for doc in docs:
                 doc.reference.delete()
                 assessment_count += 1
+        delete_clinical_record(patient_id)
         deletion_summary['assessment_documents_deleted'] = assessment_count
 
         # 2. Delete all form drafts for this patient
@@ -1741,6 +1497,9 @@ def api_delete_patient(patient_id):
 
         # 4. Finally, delete the patient record itself
         db.collection('patients').document(patient_id).delete()
+        get_patient_search_index().remove(patient_doc.id)
+        record_tag_change(patient_data, patient_data.get('tags'), None)
+        unschedule_followup(patient_doc.id, patient_data.get('next_followup_date'))
 
         # Log the comprehensive deletion
         log_audit('delete_patient_gdpr', deletion_summary)
@@ -1762,6 +1521,24 @@ def api_delete_patient(patient_id):
 # FOLLOW-UP MANAGEMENT ENDPOINTS
 # ─────────────────────────────────────────────────────────────────────────────
 
+def _next_followup_update(data):
+    """Patient fields for an optional nextFollowUpDate (YYYY-MM-DD) sent with a follow-up."""
+    next_date = data.get('nextFollowUpDate', data.get('next_followup_date'))
+    if not next_date:
+        return {}
+    return {
+        'next_followup_date': next_date,
+        'followup_notified': False,
+        'followup_notification_sent_at': None,
+    }
+
+
+def _schedule_next_followup(patient_id, patient_data, patient_update):
+    if 'next_followup_date' in patient_update:
+        schedule_followup(patient_id, {**patient_data, **patient_update}, patient_update['next_followup_date'],
+                          old_day=patient_data.get('next_followup_date'))
+
+
 @mobile_api.route('/patients/<patient_id>/follow-ups', methods=['POST'])
 @require_auth
 def api_create_follow_up(patient_id):
@@ -1779,6 +1556,7 @@ def api_create_follow_up(patient_id):
     perceptionOfTreatment  → perception
     feedback               → feedback
     planForNextTreatment   → treatment_plan
+    nextFollowUpDate       → patient's next_followup_date (optional)
     """
     try:
         # Verify patient exists and user has access
@@ -1822,11 +1600,14 @@ def api_create_follow_up(patient_id):
         # Save follow-up
         db.collection('follow_ups').document(follow_up_id).set(follow_up_data)
 
-        # Update patient's last_follow_up
-        db.collection('patients').document(patient_id).update({
+        # Update patient's last_follow_up (and next follow-up, if given)
+        patient_update = {
             'last_follow_up': session_date,
             'updated_at': SERVER_TIMESTAMP
-        })
+        }
+        patient_update.update(_next_followup_update(data))
+        db.collection('patients').document(patient_id).update(patient_update)
+        _schedule_next_followup(patient_doc.id, patient_data, patient_update)
 
         log_audit('create_follow_up', {'patient_id': patient_id, 'follow_up_id': follow_up_id})
 
@@ -1904,6 +1685,7 @@ def api_update_follow_up(patient_id, follow_up_id):
     perceptionOfTreatment  → perception
     feedback               → feedback
     planForNextTreatment   → treatment_plan
+    nextFollowUpDate       → patient's next_followup_date (optional)
     """
     try:
         # Verify patient exists and user has access
@@ -1954,10 +1736,13 @@ def api_update_follow_up(patient_id, follow_up_id):
         follow_up_ref.update(update_data)
 
         # Keep patient's last_follow_up in sync if this was the most recent session
-        db.collection('patients').document(patient_id).update({
+        patient_update = {
             'last_follow_up': session_date,
             'updated_at': SERVER_TIMESTAMP
-        })
+        }
+        patient_update.update(_next_followup_update(data))
+        db.collection('patients').document(patient_id).update(patient_update)
+        _schedule_next_followup(patient_doc.id, patient_data, patient_update)
 
         log_audit('update_follow_up', {'patient_id': patient_id, 'follow_up_id': follow_up_id})
 
@@ -2118,17 +1903,12 @@ def api_approve_physio_by_uid(uid):
             return jsonify({'error': 'Admin access required'}), 403
 
         # Find user by Firebase UID
-        users = db.collection('users').where('firebase_uid', '==', uid).limit(1).stream()
-        user_doc = None
-        for doc in users:
-            user_doc = doc
-            break
+        user_email = find_user_email_by_firebase_uid(uid)
+        user_doc = db.collection('users').document(user_email).get() if user_email else None
 
-        if not user_doc:
+        if not user_doc or not user_doc.exists:
             return jsonify({'error': 'User not found'}), 404
 
-        user_email = user_doc.id
-
         # Get user data before updating
         user_data = user_doc.to_dict()
 
@@ -2143,6 +1923,7 @@ def api_approve_physio_by_uid(uid):
             'approved_by': g.user.get('email'),
             'email_verified': True  # Auto-verify email when admin approves
         })
+        invalidate_user(user_email)
 
         log_audit('approve_physio', {'email': user_email, 'uid': uid})
 
@@ -2177,16 +1958,11 @@ def api_reject_physio_by_uid(uid):
             return jsonify({'error': 'Admin access required'}), 403
 
         # Find user by Firebase UID
-        users = db.collection('users').where('firebase_uid', '==', uid).limit(1).stream()
-        user_doc = None
-        for doc in users:
-            user_doc = doc
-            break
+        user_email = find_user_email_by_firebase_uid(uid)
+        user_doc = db.collection('users').document(user_email).get() if user_email else None
 
-        if not user_doc:
+        if not user_doc or not user_doc.exists:
             return jsonify({'error': 'User not found'}), 404
-
-        user_email = user_doc.id
         user_data = user_doc.to_dict()
 
         # Security: institute admins may only reject users in their own institute
@@ -2195,6 +1971,8 @@ def api_reject_physio_by_uid(uid):
 
         # Delete user
         db.collection('users').document(user_email).delete()
+        invalidate_user(user_email)
+        forget_firebase_uid(uid)
 
         log_audit('reject_physio', {'email': user_email, 'uid': uid})
 
@@ -2241,6 +2019,7 @@ def api_approve_user_by_email():
             'approved_by': g.user.get('email'),
             'email_verified': True  # Auto-verify email when admin approves
         })
+        invalidate_user(user_email)
 
         log_audit('approve_user', {'email': user_email})
 
@@ -2290,6 +2069,8 @@ def api_reject_user_by_email():
 
         # Delete user
         db.collection('users').document(user_email).delete()
+        invalidate_user(user_email)
+        forget_firebase_uid(user_data.get('firebase_uid'))
 
         log_audit('reject_user', {'email': user_email})
 
@@ -2332,16 +2113,11 @@ def api_upsert_user():
             user_data['phone'] = data['phone']
 
         # Find user by Firebase UID
-        users = db.collection('users').where('firebase_uid', '==', user_uid).limit(1).stream()
-        user_doc = None
-        for doc in users:
-            user_doc = doc
-            break
+        user_email = find_user_email_by_firebase_uid(user_uid)
 
-        if user_doc:
+        if user_email:
             # Update existing user
-            db.collection('users').document(user_doc.id).update(user_data)
-            user_email = user_doc.id
+            db.collection('users').document(user_email).update(user_data)
         else:
             # Create new user (use email from data or Firebase)
             user_email = data.get('email', '')
@@ -2354,6 +2130,8 @@ def api_upsert_user():
             user_data['active'] = 1
 
             db.collection('users').document(user_email).set(user_data)
+            index_firebase_uid(user_uid, user_email)
+        invalidate_user(user_email)
 
         log_audit('upsert_user', {'email': user_email, 'uid': user_uid})
 
@@ -3125,6 +2903,7 @@ def update_user_profile():
         # Update user document
         user_ref = db.collection('users').document(user_email)
         user_ref.update(updates)
+        invalidate_user(user_email)
 
         log_audit('Profile Update', {
             'email': user_email,
@@ -3195,6 +2974,8 @@ def change_user_password():
             except Exception as auth_error:
                 logger.error(f'Firebase Auth password update failed: {auth_error}')
                 # Continue anyway to update Cosmos DB
+            # Existing sessions must not outlive the old password
+            revoke_firebase_tokens(firebase_uid)
 
         # Update password_hash and timestamp in Cosmos DB
         user_ref = db.collection('users').document(user_email)
@@ -3459,129 +3240,86 @@ def api_export_patient_report_pdf(patient_id):
             logger.warning(f'Unauthorized PDF export attempt: {user_email} tried to export patient {patient_id}')
             return jsonify({'success': False, 'error': 'Access denied'}), 403
 
-        # 2) Fetch all assessment sections.
-        # Same fallback convention as api_get_patient_comprehensive_report: if the
-        # separate Firestore-style collection has no record (mobile storage path),
-        # fall back to the nested camelCase field on the patient document itself,
-        # translating field names via _MOBILE_FIELD_MAP so mobile-created patients
-        # don't get blank PDF sections.
-        def fetch_one(coll, mobile_key=None):
-            try:
-                result = db.collection(coll) \
-                             .where('patient_id', '==', patient_id) \
-                             .limit(1).get()
-                if result:
-                    return result[0].to_dict()
-            except Exception as e:
-                logger.warning(f"Could not fetch {coll} for patient {patient_id}: {e}")
-
-            if mobile_key and patient.get(mobile_key):
-                mobile_data = patient[mobile_key]
-                if isinstance(mobile_data, dict):
-                    field_map = _MOBILE_FIELD_MAP.get(mobile_key, {})
-                    if field_map:
-                        return {field_map.get(k, k): v for k, v in mobile_data.items()}
-                    return mobile_data
-                return {mobile_key: mobile_data}
-            return {}
-
-        def fetch_all(coll):
-            try:
-                docs = db.collection(coll).where('patient_id', '==',
-                                                 patient_id).order_by('timestamp', direction='DESCENDING').get()
-                return [d.to_dict() for d in docs] if docs else []
-            except Exception as e:
-                logger.warning(f"Could not fetch {coll} list for patient {patient_id}: {e}")
-                return []
-
-        subjective = fetch_one('subjective_examination', 'subjectiveExamination')
-        perspectives = fetch_one('patient_perspectives', 'patientPerspectives')
-        initial_plan = fetch_one('initial_plan', 'initialPlan')
-        patho_mechanism = fetch_one('patho_mechanism', 'pathoMechanism')
-        chronic_diseases = fetch_one('chronic_diseases', 'chronicDiseaseFactors')
-        clinical_flags = fetch_one('clinical_flags', 'clinicalFlags')
-        objective = fetch_one('objective_assessments', 'objectiveAssessment')
-        diagnosis = fetch_one('provisional_diagnosis', 'provisionalDiagnosis')
-        goals = fetch_one('smart_goals', 'smartGoals')
-        treatment = fetch_one('treatment_plan', 'treatmentPlan')
-        follow_ups = fetch_all('follow_ups')
-
-        # Get therapist info
-        try:
-            therapist_doc = db.collection('users').document(patient.get('physio_id', '')).get()
-            therapist = therapist_doc.to_dict() if therapist_doc.exists else {}
-        except Exception as e:
-            logger.warning(f"Could not fetch therapist info for patient {patient_id}: {e}")
-            therapist = {}
-
-        # Get current date/time for report
-        from datetime import datetime as dt
-        report_date = dt.now().strftime('%d %b %Y %I:%M %p')
-
-        # 3) Render the HTML template
-        from flask import render_template
-        try:
-            rendered = render_template(
-                'patient_report.html',
-                patient=patient,
-                subjective=subjective,
-                perspectives=perspectives,
-                initial_plan=initial_plan,
-                patho_mechanism=patho_mechanism,
-                chronic_diseases=chronic_diseases,
-                clinical_flags=clinical_flags,
-                objective=objective,
-                diagnosis=diagnosis,
-                goals=goals,
-                treatment=treatment,
-                follow_ups=follow_ups,
-                therapist=therapist,
-                report_date=report_date
-            )
-        except Exception as e:
-            logger.error(f"Template rendering failed for patient {patient_id}: {e}", exc_info=True)
-            return jsonify({'success': False, 'error': 'Error generating report template'}), 500
-
-        # 4) Generate PDF
-        import io
-        from xhtml2pdf import pisa
-        import base64
-
-        try:
-            pdf = io.BytesIO()
-            pisa_status = pisa.CreatePDF(io.StringIO(rendered), dest=pdf)
-            if pisa_status.err:
-                logger.error(f"PDF generation failed for patient {patient_id}, pisa error code: {pisa_status.err}")
-                return jsonify({'success': False, 'error': 'Error generating PDF file'}), 500
-        except Exception as e:
-            logger.error(f"PDF creation exception for patient {patient_id}: {e}", exc_info=True)
-            return jsonify({'success': False, 'error': 'Error creating PDF file'}), 500
-
-        # 5) Convert PDF to base64 for mobile transmission
-        pdf_content = pdf.getvalue()
-        pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+        # 2) Assemble (or reuse) the report for this patient version; the
+        # rendered PDF is reused too while the report's content is unchanged
+        report = get_patient_report(doc)
+        pdf_etag = f'pdf-{report.etag}'
+        if request.if_none_match.contains_weak(pdf_etag):
+            response = make_response('', 304)
+            response.set_etag(pdf_etag)
+            return response
 
         # Create filename from patient name
         patient_name = patient.get('name', 'patient').replace(' ', '_').lower()
         filename = f"patient_report_{patient_name}.pdf"
 
+        pdf_base64 = _report_pdfs.get(pdf_etag)
+        if pdf_base64 is None:
+            pdf_base64 = _render_report_pdf(patient_id, report)
+            if pdf_base64 is None:
+                return jsonify({'success': False, 'error': 'Error generating PDF file'}), 500
+            _report_pdfs.set(pdf_etag, pdf_base64)
+
         log_audit('mobile_export_patient_pdf', {
             'email': user_email,
             'patient_id': patient_id,
             'patient_name': patient.get('name')
         })
 
-        return jsonify({
+        response = jsonify({
             'success': True,
             'pdf_base64': pdf_base64,
             'filename': filename
-        }), 200
+        })
+        response.set_etag(pdf_etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response, 200
 
     except Exception as e:
         logger.error(f'Error exporting patient report PDF: {e}', exc_info=True)
         return jsonify({'success': False, 'error': 'Failed to export patient report'}), 500
 
 
+# Rendered report PDFs (base64) by content ETag, for repeat exports of an unchanged report
+_report_pdfs = TTLCache(
+    maxsize=int(os.environ.get('REPORT_PDF_CACHE_SIZE', '32')),
+    ttl=float(os.environ.get('REPORT_CACHE_TTL', '600')),
+    name='report_pdf',
+)
+
+
+def _render_report_pdf(patient_id, report):
+    """Render patient_report.html for a report as a base64 PDF (None on failure)."""
+    from datetime import datetime as dt
+    from flask import render_template
+    import io
+    import base64
+    from xhtml2pdf import pisa
+
+    try:
+        rendered = render_template(
+            'patient_report.html',
+            report_date=dt.now().strftime('%d %b %Y %I:%M %p'),
+            **report.template_context()
+        )
+    except Exception as e:
+        logger.error(f"Template rendering failed for patient {patient_id}: {e}", exc_info=True)
+        return None
+
+    try:
+        pdf = io.BytesIO()
+        pisa_status = pisa.CreatePDF(io.StringIO(rendered), dest=pdf)
+        if pisa_status.err:
+            logger.error(f"PDF generation failed for patient {patient_id}, pisa error code: {pisa_status.err}")
+            return None
+    except Exception as e:
+        logger.error(f"PDF creation exception for patient {patient_id}: {e}", exc_info=True)
+        return None
+
+    # Base64 for mobile transmission
+    return base64.b64encode(pdf.getvalue()).decode('utf-8')
+
+
 #────────────────────────────────────────────────────────────────────────────
 # GDPR DATA DELETION ENDPOINTS
 # ─────────────────────────────────────────────────────────────────────────────
@@ -3712,6 +3450,7 @@ def api_request_data_deletion():
             'deletion_reason': deletion_reason,
             'active': 0  # Deactivate account immediately
         })
+        invalidate_user(user_email)
 
         # Log the deletion request
         log_audit('request_data_deletion', {
@@ -3772,6 +3511,7 @@ def api_cancel_data_deletion():
             'deletion_cancelled_at': SERVER_TIMESTAMP,
             'active': 1  # Reactivate account
         })
+        invalidate_user(user_email)
 
         # Log the cancellation
         log_audit('cancel_data_deletion', {
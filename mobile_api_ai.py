@@ -15,7 +15,8 @@ from azure_cosmos_db import get_cosmos_db, get_patient_safe
 from app_auth import require_firebase_auth, require_auth
 from quota_middleware import require_voice_quota, require_ai_quota
 from patient_access import patient_access_allowed as _shared_patient_access_allowed
-import re
+from data_sanitization import sanitize_age_sex, sanitize_clinical_text, sanitize_subjective_data
+from patient_context import COLLECTION_SECTIONS, get_patient_context_snapshot
 
 # Import centralized AI prompts
 from ai_prompts import (
@@ -110,102 +111,6 @@ def normalize_patient_data(data):
 
     return normalized
 
-def sanitize_age_sex(age_sex_str):
-    """Convert exact age to age range to protect PHI."""
-    if not age_sex_str:
-        return "Age/Sex not specified"
-
-    # Extract age and sex (handle various formats: "35 M", "35/M", "35 / Male", etc.)
-    match = re.search(r'(\d+)\s*/?\s*([MF]|male|female)', age_sex_str.strip(), re.IGNORECASE)
-    if not match:
-        return "Demographics: Adult"
-
-    age = int(match.group(1))
-    sex = match.group(2).upper()[0]  # M or F
-
-    # Convert to age ranges
-    if age < 18:
-        age_range = "Under 18"
-    elif age < 30:
-        age_range = "20s"
-    elif age < 40:
-        age_range = "30s"
-    elif age < 50:
-        age_range = "40s"
-    elif age < 60:
-        age_range = "50s"
-    elif age < 70:
-        age_range = "60s"
-    else:
-        age_range = "70+"
-
-    return f"{age_range} {sex}"
-
-def sanitize_clinical_text(text):
-    """Remove PHI from clinical text while preserving clinical information."""
-    if not text:
-        return ""
-
-    sanitized = text
-
-    # Remove specific dates
-    sanitized = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', '[date removed]', sanitized)
-    sanitized = re.sub(r'\b(January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{1,2},?\s+\d{2,4}\b', '[date removed]', sanitized, flags=re.IGNORECASE)
-
-    # Remove proper names
-    medical_terms = {'MRI', 'CT', 'X', 'Xray', 'PT', 'OT', 'Dr', 'Hospital', 'Clinic', 'Emergency', 'Department',
-                     'Pain', 'Back', 'Knee', 'Shoulder', 'Hip', 'Neck', 'Arm', 'Leg', 'Referred', 'Patient',
-                     'Injury', 'Surgery', 'Contact', 'Office', 'Residence', 'Lives', 'Underwent', 'Scan', 'Shows',
-                     'First', 'Call', 'Flat', 'House', 'Plot', 'Apartment'}
-    words = sanitized.split()
-    sanitized_words = []
-    for word in words:
-        clean_word = re.sub(r'[^\w]', '', word)
-        # Check if word starts with capital AND is not in medical terms whitelist AND is longer than 2 chars
-        if clean_word.istitle() and clean_word not in medical_terms and len(clean_word) > 2:
-            sanitized_words.append('[name removed]')
-        else:
-            sanitized_words.append(word)
-    sanitized = ' '.join(sanitized_words)
-
-    # Remove email addresses
-    sanitized = re.sub(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b', '[email removed]', sanitized)
-
-    # Remove phone numbers (multiple formats including Indian)
-    # First remove country codes to avoid leaving them behind
-    sanitized = re.sub(r'\+\d{1,3}[-.\s]?', '', sanitized)  # Remove +91, +1, etc. with separators
-    # US format: 123-456-7890, (123) 456-7890
-    sanitized = re.sub(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', '[phone removed]', sanitized)
-    # Indian format: 9876543210, 98765 43210
-    sanitized = re.sub(r'\b\d{10}\b', '[phone removed]', sanitized)
-    sanitized = re.sub(r'\b\d{5}[-.\s]?\d{5}\b', '[phone removed]', sanitized)
-    # Generic international: 234 567 8901
-    sanitized = re.sub(r'\b\d{3}\s?\d{3}\s?\d{4}\b', '[phone removed]', sanitized)
-
-    # Remove addresses (including Indian formats)
-    sanitized = re.sub(r'\b\d+\s+\w+\s+(Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln|Marg|Nagar|Colony|Block|Sector|Phase)\b', '[address removed]', sanitized, flags=re.IGNORECASE)
-    # Flat/House numbers
-    sanitized = re.sub(r'\b(Flat|House|Plot|Apartment|Apt|Room|Unit)\s*(No\.?|Number|#)?\s*\d+\b', '[address removed]', sanitized, flags=re.IGNORECASE)
-
-    # Clean up multiple spaces
-    sanitized = re.sub(r'\s+', ' ', sanitized).strip()
-
-    return sanitized
-
-def sanitize_subjective_data(inputs_dict):
-    """Sanitize subjective examination data to remove PHI."""
-    if not inputs_dict:
-        return {}
-
-    sanitized = {}
-    for key, value in inputs_dict.items():
-        if isinstance(value, str):
-            sanitized[key] = sanitize_clinical_text(value)
-        else:
-            sanitized[key] = value
-
-    return sanitized
-
 def build_patient_context(raw: dict) -> dict:
     """
     Create a unified, sanitized, PHI-safe context object from ANY patient payload.
@@ -256,48 +161,20 @@ def fetch_patient_data_from_db(patient_id: str, user_id: str) -> dict:
             logger.warning(f"Patient {patient_id} not found (checked both document ID and patient_id field)")
             return {}
 
-        patient = patient_doc.to_dict()
+        # Latest sections come from the shared per-version context snapshot
+        snapshot = get_patient_context_snapshot(patient_id, patient_doc)
+        patient = snapshot.patient
 
         # Access control - verify user has permission
         if not patient_access_allowed(patient):
             logger.warning(f"User {user_id} attempted unauthorized access to patient {patient_id}")
             return {}
 
-        # Fetch subjective examination data
-        subjective_data = {}
-        subjective_query = db.collection('subjective_examination') \
-            .where('patient_id', '==', patient_id) \
-            .order_by('timestamp', direction='DESCENDING') \
-            .limit(1) \
-            .get()
-        if subjective_query:
-            subjective_data = subjective_query[0].to_dict() if len(subjective_query) > 0 else {}
-
-        # Fetch perspectives data
-        perspectives_data = {}
-        perspectives_query = db.collection('patient_perspectives') \
-            .where('patient_id', '==', patient_id) \
-            .order_by('timestamp', direction='DESCENDING') \
-            .limit(1) \
-            .get()
-        if perspectives_query:
-            perspectives_data = perspectives_query[0].to_dict() if len(perspectives_query) > 0 else {}
-
-        # Fetch initial plan / assessments data
-        assessments_data = {}
-        assessments_query = db.collection('initial_plan') \
-            .where('patient_id', '==', patient_id) \
-            .order_by('timestamp', direction='DESCENDING') \
-            .limit(1) \
-            .get()
-        if assessments_query:
-            assessments_data = assessments_query[0].to_dict() if len(assessments_query) > 0 else {}
-
         return {
             'patient': patient,
-            'subjective': subjective_data,
-            'perspectives': perspectives_data,
-            'assessments': assessments_data
+            'subjective': snapshot.section('subjective'),
+            'perspectives': snapshot.section('perspectives'),
+            'assessments': snapshot.section('initial_plan')
         }
 
     except Exception as e:
@@ -345,15 +222,12 @@ def get_ai_suggestion_safe(prompt, metadata=None, patient_context="", user_id=No
         return "AI service temporarily unavailable."
 
     try:
-        # Using Azure OpenAI GPT-4o
-        model = "gpt-4o"
-
+        # Deployment comes from the endpoint's model policy (ai_model_policy)
         # Use the caching system with Azure OpenAI
         from ai_cache import get_ai_suggestion_with_cache
         response = get_ai_suggestion_with_cache(
             db=db,
             prompt=prompt,
-            model=model,
             openai_client=client,
             metadata=metadata or {},
             patient_context=patient_context,  # Pass patient context for cache uniqueness
@@ -1426,14 +1300,13 @@ def api_ai_followup_field(field):
                 present_hist = sanitize_clinical_text(patient_data.get('present_complaint', '') or patient_data.get('present_history', ''))
                 past_hist = sanitize_clinical_text(patient_data.get('past_history', ''))
 
-            # Fetch related data from Cosmos DB
+            # Latest sections come from the shared per-version context snapshot
+            snapshot = get_patient_context_snapshot(patient_id, patient_doc)
+
             def fetch_latest(collection_name):
-                coll = db.collection(collection_name) \
-                        .where('patient_id', '==', patient_id) \
-                        .order_by('timestamp', direction='DESCENDING') \
-                        .limit(1) \
-                        .get()
-                return coll[0].to_dict() if coll else {}
+                if snapshot is None:
+                    return {}
+                return snapshot.section(COLLECTION_SECTIONS[collection_name])
 
             # Get diagnosis - provisional_diagnosis is stored as structured hypothesis-testing
             # fields, not a single "diagnosis" string - build a readable summary from them
@@ -0,0 +1,187 @@
+"""
+Patient clinical-context snapshots for AI endpoints.
+
+Every AI suggestion on an assessment screen needs the same context: the
+patient document plus the latest saved version of a few assessment sections
+(subjective, perspectives, initial plan, ...). Rebuilding it meant one
+`order_by('timestamp').limit(1)` query per section on every field click.
+
+A snapshot is built once per patient *version* and kept in a bounded,
+per-worker cache. The version is the patient document's Cosmos `_etag`, so
+callers still do their one point read of the patient (they need it for the
+access check anyway) and a changed document automatically misses the cache.
+Saving an assessment section doesn't touch the patient document by itself,
+so save routes call invalidate_patient_context(), which drops the local
+entry and bumps `context_version` on the patient document -- changing its
+`_etag` for every other worker too.
+
+Sections are loaded lazily, all at once, the first time a caller asks for
+one: a single point read of the patient's current clinical record
+(clinical_record.py) instead of one query per section.
+
+Usage:
+    from patient_context import get_patient_context_snapshot, invalidate_patient_context
+
+    snapshot = get_patient_context_snapshot(patient_id)
+    if snapshot and patient_access_allowed(snapshot.patient):
+        patho = snapshot.section('patho_mechanism')
+        ctx = snapshot.sanitized()
+
+    # after db.collection('subjective_examination').add(entry)
+    invalidate_patient_context(patient_id, section='subjective_examination')
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional, Sequence, Union
+
+from assessment_progress import record_section_saved
+from clinical_record import get_clinical_records
+from data_sanitization import sanitize_age_sex, sanitize_clinical_text, sanitize_subjective_data
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.patient_context")
+
+# Snapshot section name -> append-only Cosmos container holding that section
+SECTION_COLLECTIONS = {
+    'patho_mechanism': 'patho_mechanism',
+    'subjective': 'subjective_examination',
+    'perspectives': 'patient_perspectives',
+    'initial_plan': 'initial_plan',
+    'chronic_diseases': 'chronic_diseases',
+    'clinical_flags': 'clinical_flags',
+    'objective': 'objective_assessments',
+    'provisional_diagnosis': 'provisional_diagnosis',
+    'smart_goals': 'smart_goals',
+    'treatment_plan': 'treatment_plan',
+}
+COLLECTION_SECTIONS = {collection: name for name, collection in SECTION_COLLECTIONS.items()}
+
+# Bookkeeping keys on section documents that never belong in an AI prompt
+_NON_CLINICAL_KEYS = ('patient_id', 'timestamp', 'created_by', 'uid')
+
+_snapshots = TTLCache(
+    maxsize=int(os.environ.get('PATIENT_CONTEXT_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('PATIENT_CONTEXT_CACHE_TTL', '600')),
+    name='patient_context',
+)
+
+
+def patient_version(patient_doc: Any) -> str:
+    """Version of a patient document; changes whenever the document is written."""
+    etag = patient_doc.get('_etag')
+    if etag:
+        return str(etag)
+    return f"{patient_doc.get('context_version') or 0}:{patient_doc.get('updated_at') or ''}"
+
+
+class PatientContextSnapshot:
+    """Patient document plus lazily-loaded latest assessment sections, for one version."""
+
+    def __init__(self, patient_id: str, version: str, patient: Dict[str, Any]):
+        self.patient_id = patient_id
+        self.version = version
+        self._patient = patient
+        self._sections: Optional[Dict[str, Dict[str, Any]]] = None
+        self._sanitized: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def patient(self) -> Dict[str, Any]:
+        return dict(self._patient)
+
+    def section(self, name: str) -> Dict[str, Any]:
+        """Latest saved document for an assessment section ({} if none)."""
+        with self._lock:
+            if self._sections is None:
+                try:
+                    self._sections = get_clinical_records().sections(self.patient_id)
+                except Exception as e:
+                    # Not kept: the next call retries
+                    logger.warning(f"Could not load clinical record for patient context {self.patient_id}: {e}")
+                    return {}
+            return dict(self._sections.get(SECTION_COLLECTIONS[name]) or {})
+
+    def sanitized(self) -> Dict[str, Any]:
+        """
+        PHI-safe AI context (same shape as mobile_api_ai.build_patient_context),
+        built once per snapshot.
+        """
+        if self._sanitized is None:
+            patient = self._patient
+
+            def clinical(name):
+                data = self.section(name)
+                return sanitize_subjective_data(
+                    {k: v for k, v in data.items() if k not in _NON_CLINICAL_KEYS}
+                )
+
+            self._sanitized = {
+                'age_sex': sanitize_age_sex(patient.get('age_sex', '')),
+                'present_history': sanitize_clinical_text(
+                    patient.get('present_history', '') or patient.get('chief_complaint', '')),
+                'past_history': sanitize_clinical_text(
+                    patient.get('past_history', '') or patient.get('medical_history', '')),
+                'subjective': clinical('subjective'),
+                'perspectives': clinical('perspectives'),
+                'assessments': clinical('initial_plan'),
+                'smart_goals': clinical('smart_goals'),
+            }
+        return {k: (dict(v) if isinstance(v, dict) else v) for k, v in self._sanitized.items()}
+
+
+def get_patient_context_snapshot(patient_id: str,
+                                 patient_doc: Optional[Any] = None) -> Optional[PatientContextSnapshot]:
+    """
+    Return the context snapshot for a patient, or None if the patient doesn't
+    exist. Pass patient_doc when the caller has already read it, so the
+    version check costs no extra read. Access control is the caller's job.
+    """
+    if patient_doc is None:
+        from azure_cosmos_db import get_patient_safe
+        patient_doc = get_patient_safe(patient_id)
+    if not patient_doc.exists:
+        return None
+
+    version = patient_version(patient_doc)
+    snapshot = _snapshots.get(patient_id)
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    snapshot = PatientContextSnapshot(patient_id, version, patient_doc.to_dict())
+    _snapshots.set(patient_id, snapshot)
+    return snapshot
+
+
+def invalidate_patient_context(patient_id: str, db=None,
+                               section: Union[str, Sequence[str], None] = None) -> None:
+    """
+    Call after saving any assessment section for this patient. Drops this
+    worker's snapshot and bumps the patient's context_version so other
+    workers see a new version too. `section` is the collection (or
+    collections) just saved to; the same patch also records it in the
+    patient's assessment_progress.
+    Never raises -- a failed bump only means other workers serve the old
+    snapshot until it expires.
+    """
+    if not patient_id:
+        return
+    _snapshots.pop(patient_id)
+    try:
+        if db is None:
+            from azure_cosmos_db import get_cosmos_db
+            db = get_cosmos_db()
+        patient_ref = db.collection('patients').document(patient_id)
+        sections = [section] if isinstance(section, str) else list(section or ())
+        for collection in sections[:-1]:
+            record_section_saved(patient_ref, collection)
+        if sections and record_section_saved(patient_ref, sections[-1], increments={'context_version': 1}):
+            return
+        patient_ref.increment_if('context_version', 1)
+    except Exception as e:
+        logger.warning(f"Could not bump context_version for patient {patient_id}: {e}")
+
+
+def get_patient_context_cache_stats() -> Dict[str, Any]:
+    return _snapshots.stats()
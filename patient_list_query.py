@@ -0,0 +1,293 @@
+"""
+Patient list queries: filters, sort order and pagination pushed into Cosmos DB.
+
+The web and mobile patient lists used to load every patient a user can see
+(their own plus their institute's), then filter, sort and slice the whole
+list in Python, so a page of patients cost as much as the whole caseload.
+PatientListQuery builds one parameterised query per page instead:
+
+- Scope: own patients, or own plus the institute's as one OR'd predicate
+  (where() only ANDs, hence the two merged queries before). Super admins
+  see everyone.
+- Filters: status, tags (any of) and the created_at range are plain
+  predicates. Substring filters (name, patient ID, contact, complaint) are
+  answered by a search index when one is passed in (`search`), otherwise
+  they become CONTAINS predicates scoped to the user's patients.
+- Sort: ORDER BY the sort field with id as tie-breaker, served by the
+  composite indexes in azure_cosmos_db.COMPOSITE_INDEXES.
+- Keyset pagination: the cursor is the (sort value, id) of the last patient
+  on the page, and the next page is "after that key, LIMIT n" -- no OFFSET,
+  so any page costs what the first one does.
+
+Filters SQL can't express (age/sex parsing, quick filters that look at
+other collections) are `residual` Python predicates applied to fetched
+batches; the engine keeps fetching until the page is full, for at most
+MAX_BATCHES batches, and the cursor carries on from the last patient
+examined.
+
+Counts are separate COUNT(1) queries served from the index; callers only
+ask for them on the first page.
+
+Name sorting uses `name_sort` (see name_sort_key), written with the name;
+backfill_patient_sort_keys.py adds it to older patients.
+
+Usage:
+    engine = PatientListQuery(db.collection('patients'))
+    scope = PatientScope(physio_id=email, institute=institute)
+    filters = PatientListFilters(status='active', tags=['Spine'])
+    patients, next_cursor = engine.page(scope, filters, sort='newest', cursor=request.args.get('cursor'))
+"""
+
+import os
+import json
+import base64
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("app.patient_list_query")
+
+MAX_BATCHES = int(os.environ.get('PATIENT_LIST_MAX_BATCHES', '5'))
+RESIDUAL_BATCH_SIZE = int(os.environ.get('PATIENT_LIST_RESIDUAL_BATCH_SIZE', '100'))
+
+# sort name -> (field, direction)
+SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'oldest': ('created_at', 'ASC'),
+    'name_asc': ('name_sort', 'ASC'),
+    'name_desc': ('name_sort', 'DESC'),
+}
+DEFAULT_SORT = 'newest'
+
+# substring filter -> patient field
+TEXT_FILTERS = {
+    'name': 'name',
+    'patient_id': 'patient_id',
+    'contact': 'contact',
+    'complaint': 'present_history',
+}
+
+# search(scope, field, text) -> matching patient document ids, or None if it
+# can't answer (the filter then runs as a CONTAINS predicate)
+SearchFn = Callable[['PatientScope', str, str], Optional[Sequence[str]]]
+
+
+def name_sort_key(name: Optional[str]) -> str:
+    """Value stored as `name_sort` next to a patient's name."""
+    return (name or '').strip().lower()
+
+
+class PatientScope:
+    """Which patients a user may list."""
+
+    __slots__ = ('physio_id', 'institute', 'everyone')
+
+    def __init__(self, physio_id: Optional[str] = None, institute: Optional[str] = None,
+                 everyone: bool = False):
+        self.physio_id = physio_id
+        self.institute = institute
+        self.everyone = everyone
+
+    def clause(self, params: List[Dict[str, Any]]) -> Optional[str]:
+        if self.everyone:
+            return None
+        params.append({'name': '@scope_physio', 'value': self.physio_id})
+        if self.institute:
+            params.append({'name': '@scope_institute', 'value': self.institute})
+            return '(c.physio_id = @scope_physio OR c.institute = @scope_institute)'
+        return 'c.physio_id = @scope_physio'
+
+
+class PatientListFilters:
+    """Filters that run inside the query. Empty values mean "no filter"."""
+
+    __slots__ = ('text', 'status', 'tags', 'date_from', 'date_to')
+
+    def __init__(self, name: str = '', patient_id: str = '', contact: str = '', complaint: str = '',
+                 status: str = '', tags: Sequence[str] = (), date_from: str = '', date_to: str = ''):
+        self.text = {key: value.strip() for key, value in
+                     (('name', name), ('patient_id', patient_id), ('contact', contact), ('complaint', complaint))
+                     if value and value.strip()}
+        self.status = status
+        self.tags = [tag for tag in tags if tag]
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def active(self) -> bool:
+        return bool(self.text or self.status or self.tags or self.date_from or self.date_to)
+
+
+def _day_after(day: str) -> Optional[str]:
+    try:
+        return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+
+def _valid_day(day: str) -> bool:
+    return _day_after(day) is not None
+
+
+def build_filter(scope: PatientScope, filters: PatientListFilters,
+                 search: Optional[SearchFn] = None) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """SQL conditions on `c` (to be ANDed) and their parameters."""
+    params: List[Dict[str, Any]] = []
+    clauses: List[str] = []
+
+    scope_clause = scope.clause(params)
+    if scope_clause:
+        clauses.append(scope_clause)
+
+    for key, text in filters.text.items():
+        field = TEXT_FILTERS[key]
+        ids = search(scope, key, text) if search else None
+        name = f'@text_{key}'
+        if ids is not None:
+            params.append({'name': name, 'value': list(ids)})
+            clauses.append(f'ARRAY_CONTAINS({name}, c.id)')
+        else:
+            params.append({'name': name, 'value': text})
+            clauses.append(f'CONTAINS(c.{field}, {name}, true)')
+
+    if filters.status:
+        params.append({'name': '@status', 'value': filters.status})
+        if filters.status == 'active':
+            # Patients created before statuses existed count as active
+            clauses.append('(c.status = @status OR NOT IS_DEFINED(c.status))')
+        else:
+            clauses.append('c.status = @status')
+
+    if filters.tags:
+        names = []
+        for i, tag in enumerate(filters.tags):
+            params.append({'name': f'@tag{i}', 'value': tag})
+            names.append(f'ARRAY_CONTAINS(c.tags, @tag{i})')
+        clauses.append('(' + ' OR '.join(names) + ')')
+
+    # created_at is an ISO string, so a date prefix compares correctly
+    if filters.date_from and _valid_day(filters.date_from):
+        params.append({'name': '@date_from', 'value': filters.date_from})
+        clauses.append('c.created_at >= @date_from')
+    if filters.date_to and _valid_day(filters.date_to):
+        params.append({'name': '@date_to', 'value': _day_after(filters.date_to)})
+        clauses.append('c.created_at < @date_to')
+
+    return clauses, params
+
+
+def keyset_clause(sort: str, after: Tuple[Any, str], params: List[Dict[str, Any]]) -> str:
+    """Condition for "sorts after (value, id)" in the sort's order."""
+    field, direction = SORTS[sort]
+    value, last_id = after
+    beyond = '<' if direction == 'DESC' else '>'
+    params.append({'name': '@after_id', 'value': last_id})
+    if value is None:
+        # Patients without the sort field sort first ascending, last descending
+        if direction == 'DESC':
+            return f'(NOT IS_DEFINED(c.{field}) AND c.id {beyond} @after_id)'
+        return f'((NOT IS_DEFINED(c.{field}) AND c.id {beyond} @after_id) OR IS_DEFINED(c.{field}))'
+    params.append({'name': '@after_value', 'value': value})
+    clause = (f'c.{field} {beyond} @after_value '
+              f'OR (c.{field} = @after_value AND c.id {beyond} @after_id)')
+    if direction == 'DESC':
+        clause += f' OR NOT IS_DEFINED(c.{field})'
+    return f'({clause})'
+
+
+def encode_cursor(sort: str, after: Tuple[Any, str]) -> str:
+    raw = json.dumps({'s': sort, 'v': after[0], 'id': after[1]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], sort: str) -> Optional[Tuple[Any, str]]:
+    """(value, id) from a cursor, or None for a missing, garbled or other-sort cursor."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if data['s'] != sort or not isinstance(data['id'], str):
+            return None
+        return data['v'], data['id']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def collect_page(fetch: Callable[[Optional[Tuple[Any, str]], int], List[Dict[str, Any]]],
+                 sort_field: str, page_size: int, after: Optional[Tuple[Any, str]] = None,
+                 residual: Optional[Callable[[Dict[str, Any]], bool]] = None,
+                 batch_size: int = RESIDUAL_BATCH_SIZE,
+                 max_batches: int = MAX_BATCHES) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Any, str]]]:
+    """
+    Fill one page from fetch(after, limit), which returns patients in sort
+    order after the key. Returns the page and the key to continue from
+    (None once there is nothing further).
+    """
+    batch = page_size if residual is None else max(page_size, batch_size)
+    page: List[Dict[str, Any]] = []
+    for _ in range(max_batches):
+        docs = fetch(after, batch + 1)
+        more = len(docs) > batch
+        docs = docs[:batch]
+        for i, doc in enumerate(docs):
+            after = (doc.get(sort_field), doc['id'])
+            if residual is None or residual(doc):
+                page.append(doc)
+                if len(page) == page_size:
+                    return page, after if (more or i < len(docs) - 1) else None
+        if not more:
+            return page, None
+    # Scanned as far as one request may; the client continues from here
+    return page, after
+
+
+class PatientListQuery:
+    """
+    Args:
+        collection: the patients collection (CosmosDBCollection).
+        search: optional SearchFn answering substring filters from an index.
+    """
+
+    def __init__(self, collection: Any, search: Optional[SearchFn] = None,
+                 max_batches: int = MAX_BATCHES):
+        self._collection = collection
+        self._search = search
+        self.max_batches = max_batches
+
+    def page(self, scope: PatientScope, filters: PatientListFilters, sort: str = DEFAULT_SORT,
+             cursor: Optional[str] = None, page_size: int = 20,
+             residual: Optional[Callable[[Dict[str, Any]], bool]] = None
+             ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of patients (dicts with 'id') and the cursor of the next page, if any."""
+        sort = sort if sort in SORTS else DEFAULT_SORT
+        field, direction = SORTS[sort]
+        clauses, params = build_filter(scope, filters, self._search)
+        order = 'ASCENDING' if direction == 'ASC' else 'DESCENDING'
+
+        def fetch(after, limit):
+            conditions, parameters = list(clauses), list(params)
+            if after is not None:
+                conditions.append(keyset_clause(sort, after, parameters))
+            query = self._collection.query(' AND '.join(conditions) or 'true', parameters) \
+                .order_by(field, order).order_by('id', order).limit(limit)
+            docs = []
+            for doc in query.get():
+                data = doc.to_dict()
+                data['id'] = doc.id
+                docs.append(data)
+            return docs
+
+        patients, after = collect_page(fetch, field, page_size, decode_cursor(cursor, sort),
+                                       residual, max_batches=self.max_batches)
+        return patients, encode_cursor(sort, after) if after is not None else None
+
+    def count(self, scope: PatientScope, filters: Optional[PatientListFilters] = None) -> int:
+        clauses, params = build_filter(scope, filters or PatientListFilters(), self._search)
+        return self._collection.query(' AND '.join(clauses) or 'true', params).count()
+
+    def tags(self, scope: PatientScope) -> List[str]:
+        """Every tag used on the scope's patients (projected query: tags only)."""
+        clauses, params = build_filter(scope, PatientListFilters())
+        found = set()
+        for doc in self._collection.query(' AND '.join(clauses) or 'true', params).select('tags').get():
+            found.update(doc.to_dict().get('tags') or [])
+        return sorted(found)
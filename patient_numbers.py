@@ -0,0 +1,184 @@
+"""
+Per-worker blocks of patient numbers.
+
+Patient ids are `<physio prefix>-<number>`, numbered per physiotherapist by
+the patient_counters/{physio} document. Every patient creation used to read
+that document (creating it with count 0 if missing, a read-then-write race
+of its own) and then patch it, so registrations from one physio or a busy
+shared login queued on the same document. Instead, a worker now reserves a
+block of numbers with one patch (`count` += block size; Cosmos DB applies
+increments atomically, so two workers never get overlapping blocks) and
+hands them out locally.
+
+`count` keeps its meaning -- the highest number reserved -- so existing
+counters carry on where they are. The price is gaps and ordering:
+
+- A block is held for at most BLOCK_SECONDS. When it expires (or the worker
+  exits) its unused numbers go back, but only if nothing was reserved after
+  it: one conditional patch `count = first unused - 1 if count == block end`.
+  Otherwise they are skipped, and show as a gap in that physio's numbering.
+- Two workers holding blocks for the same physio issue numbers out of order
+  (e.g. 7 after 11). Numbers are unique either way.
+
+The Cosmos calls are injected (see the bottom of the module), so the
+allocator itself has no database dependency.
+
+Usage:
+    patient_count = allocate_patient_number(physio_id)
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("app.patient_numbers")
+
+BLOCK_SIZE = int(os.environ.get('PATIENT_NUMBER_BLOCK', '5'))
+BLOCK_SECONDS = float(os.environ.get('PATIENT_NUMBER_BLOCK_SECONDS', '600'))
+
+
+class _Block:
+    __slots__ = ('next', 'last', 'expires_at', 'lock')
+
+    def __init__(self):
+        self.next = 1
+        self.last = 0  # next > last: nothing in hand
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+
+
+class PatientNumberAllocator:
+    """
+    Args:
+        reserve: (physio_id, size) -> last number of the reserved block
+            (the block is last - size + 1 .. last), one atomic patch.
+        release: (physio_id, first_unused, last) -> bool, gives the unused
+            tail of a block back if nothing was reserved after it.
+    """
+
+    def __init__(self, reserve: Callable[[str, int], int],
+                 release: Callable[[str, int, int], bool],
+                 block_size: int = BLOCK_SIZE,
+                 block_seconds: float = BLOCK_SECONDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self._reserve = reserve
+        self._release = release
+        self.block_size = max(1, block_size)
+        self.block_seconds = block_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._blocks: Dict[str, _Block] = {}
+        self._stats = {'issued': 0, 'reserve_patches': 0, 'release_patches': 0, 'released': 0,
+                       'gaps': 0, 'lock_waits': 0, 'reserve_ms': 0.0}
+
+    def _count(self, key: str, n: float = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    def allocate(self, physio_id: str) -> int:
+        """Next patient number for physio_id, reserving a new block if needed."""
+        with self._lock:
+            block = self._blocks.get(physio_id)
+            if block is None:
+                block = self._blocks[physio_id] = _Block()
+
+        # Only registrations for the same physio wait on each other, and
+        # only while one of them reserves a block
+        if not block.lock.acquire(blocking=False):
+            self._count('lock_waits')
+            block.lock.acquire()
+        try:
+            if block.next <= block.last and block.expires_at <= self._clock():
+                self._give_back(physio_id, block)
+            if block.next > block.last:
+                started = time.perf_counter()
+                last = self._reserve(physio_id, self.block_size)
+                with self._lock:
+                    self._stats['reserve_patches'] += 1
+                    self._stats['reserve_ms'] += (time.perf_counter() - started) * 1000
+                block.next, block.last = last - self.block_size + 1, last
+                block.expires_at = self._clock() + self.block_seconds
+            number = block.next
+            block.next += 1
+        finally:
+            block.lock.release()
+        self._count('issued')
+        return number
+
+    def _give_back(self, physio_id: str, block: _Block) -> None:
+        """Return (or write off as a gap) the unused numbers of a block; caller holds block.lock."""
+        unused = block.last - block.next + 1
+        first, last = block.next, block.last
+        block.next, block.last = 1, 0
+        try:
+            released = self._release(physio_id, first, last)
+        except Exception as e:
+            logger.warning(f"Could not return patient numbers {first}-{last} for {physio_id}: {type(e).__name__}")
+            released = False
+        with self._lock:
+            self._stats['release_patches'] += 1
+            self._stats['released' if released else 'gaps'] += unused
+
+    def flush(self) -> None:
+        """Give back every block in hand (at worker exit)."""
+        with self._lock:
+            blocks = list(self._blocks.items())
+        for physio_id, block in blocks:
+            with block.lock:
+                if block.next <= block.last:
+                    self._give_back(physio_id, block)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            held = sum(max(0, block.last - block.next + 1) for block in self._blocks.values())
+        reserve_ms = stats.pop('reserve_ms')
+        stats['mean_reserve_ms'] = round(reserve_ms / stats['reserve_patches'], 1) if stats['reserve_patches'] else 0.0
+        stats['held'] = held
+        stats['block_size'] = self.block_size
+        return stats
+
+
+def _reserve_from_cosmos(physio_id: str, size: int) -> int:
+    from azure_cosmos_db import get_cosmos_db
+    counter_ref = get_cosmos_db().collection('patient_counters').document(physio_id)
+    for _ in range(3):
+        applied, last = counter_ref.increment_if('count', size)
+        if applied and last is not None:
+            return int(last)
+        # No counter yet: the physio's first patient. If another worker
+        # creates it first, increment that one
+        if counter_ref.create({'count': size}):
+            return size
+    raise RuntimeError(f"Could not reserve patient numbers for {physio_id}")
+
+
+def _release_to_cosmos(physio_id: str, first_unused: int, last: int) -> bool:
+    from azure_cosmos_db import get_cosmos_db
+    counter_ref = get_cosmos_db().collection('patient_counters').document(physio_id)
+    return counter_ref.patch_if({'count': first_unused - 1}, [('count', '==', last)])
+
+
+_allocator: Optional[PatientNumberAllocator] = None
+_allocator_lock = threading.Lock()
+
+
+def get_patient_number_allocator() -> PatientNumberAllocator:
+    global _allocator
+    if _allocator is None:
+        with _allocator_lock:
+            if _allocator is None:
+                _allocator = PatientNumberAllocator(_reserve_from_cosmos, _release_to_cosmos)
+                atexit.register(_allocator.flush)
+    return _allocator
+
+
+def allocate_patient_number(physio_id: str) -> int:
+    return get_patient_number_allocator().allocate(physio_id)
+
+
+def get_patient_number_stats() -> Dict[str, Any]:
+    return _allocator.stats() if _allocator is not None else {}
@@ -0,0 +1,353 @@
+"""
+In-process patient search index per physiotherapist and institute.
+
+Duplicate-patient checks (web and mobile /check-duplicate-patient) and the
+patient lists' name/ID/contact filters used to stream the user's whole
+caseload and substring-match it in Python, on every keystroke or submit.
+Each worker now keeps a small index per owner -- ('physio_id', email) or
+('institute', name) -- of just the fields these lookups need:
+
+- names: normalised (lowercase, accents and punctuation stripped,
+  whitespace collapsed), with a trigram posting list for substring and
+  fuzzy (trigram-similarity) matches;
+- patient IDs: lowercase, with trigram postings for substring matches;
+- contacts: digits only (last 10, so +91 / leading-zero variants agree),
+  with trigram postings.
+
+An owner's index is hydrated on first use from one projected query (only the
+indexed fields, never the clinical record) and kept current three ways:
+create/edit/delete routes apply their change directly (upsert/remove); at
+most every PATIENT_SEARCH_REFRESH_SECONDS a lookup pulls patients changed
+in any worker since the last sync (`_ts` delta query); and the whole index
+is rebuilt after PATIENT_SEARCH_REBUILD_SECONDS, which also drops patients
+another worker deleted. Lookups in between are in-memory set operations.
+
+search() has the SearchFn signature that PatientListQuery takes for its
+substring filters; complaint text isn't indexed and stays a query predicate.
+The ids go into the query as one array parameter, so above
+PATIENT_SEARCH_MAX_IDS matches (typically a one- or two-character filter)
+search() answers None and the filter runs as a CONTAINS predicate instead.
+
+Usage:
+    index = get_patient_search_index()
+    duplicates = index.find_duplicates(PatientScope(physio_id=email), 'Ann Lee')
+    index.upsert(patient_dict)      # after create / edit
+    index.remove(patient_id)        # after delete
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cosmos_constants import SERVER_TIMESTAMP
+from patient_list_query import PatientScope
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.patient_search_index")
+
+REFRESH_SECONDS = float(os.environ.get('PATIENT_SEARCH_REFRESH_SECONDS', '5'))
+REBUILD_SECONDS = float(os.environ.get('PATIENT_SEARCH_REBUILD_SECONDS', '600'))
+MAX_OWNERS = int(os.environ.get('PATIENT_SEARCH_MAX_OWNERS', '2000'))
+# Trigram (Jaccard) similarity above which two names count as similar
+FUZZY_THRESHOLD = float(os.environ.get('PATIENT_SEARCH_FUZZY_THRESHOLD', '0.6'))
+# Most ids search() passes to the list query as ARRAY_CONTAINS parameter
+MAX_IDS = int(os.environ.get('PATIENT_SEARCH_MAX_IDS', '300'))
+
+# Fields kept per patient (the projection used to hydrate an index), as
+# returned by find_duplicates
+RECORD_FIELDS = ('patient_id', 'name', 'age_sex', 'contact', 'created_at')
+
+Owner = Tuple[str, str]
+
+
+
+def normalize_name(name: Optional[str]) -> str:
+    decomposed = unicodedata.normalize('NFKD', name or '')
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+    return ' '.join(re.sub(r'[^\w\s]', ' ', stripped).split())
+
+
+def phone_key(contact: Optional[str]) -> str:
+    return re.sub(r'\D', '', contact or '')[-10:]
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def name_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the padded trigram sets of two normalised names."""
+    grams_a, grams_b = trigrams(f'  {a} '), trigrams(f'  {b} ')
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+# field -> normaliser; search() also answers PatientListQuery's filter of that name
+_FIELDS: Dict[str, Callable[[Optional[str]], str]] = {
+    'name': normalize_name,
+    'patient_id': lambda value: (value or '').strip().lower(),
+    'contact': phone_key,
+}
+
+
+class _FieldIndex:
+    """Normalised values of one field plus trigram postings."""
+
+    __slots__ = ('values', 'postings', 'short')
+
+    def __init__(self):
+        self.values: Dict[str, str] = {}
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        self.short: Set[str] = set()      # values too short to have a trigram
+
+    def put(self, doc_id: str, value: str) -> None:
+        self.drop(doc_id)
+        self.values[doc_id] = value
+        grams = trigrams(value)
+        for gram in grams:
+            self.postings[gram].add(doc_id)
+        if not grams:
+            self.short.add(doc_id)
+
+    def drop(self, doc_id: str) -> None:
+        old = self.values.pop(doc_id, None)
+        if old is None:
+            return
+        for gram in trigrams(old):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+        self.short.discard(doc_id)
+
+    def sharing_trigrams(self, text: str) -> Set[str]:
+        """Ids whose value shares a trigram with text, plus the short ones."""
+        found = set(self.short)
+        for gram in trigrams(text):
+            found |= self.postings.get(gram, set())
+        return found
+
+    def containing(self, text: str) -> Set[str]:
+        """Ids whose value contains text."""
+        grams = trigrams(text)
+        if not grams:
+            candidates: Iterable[str] = list(self.values)
+        else:
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+        return {doc_id for doc_id in candidates if text in self.values[doc_id]}
+
+
+class _OwnerIndex:
+    __slots__ = ('records', 'fields', 'synced_ts', 'refreshed_at', 'lock')
+
+    def __init__(self):
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.fields = {field: _FieldIndex() for field in _FIELDS}
+        self.synced_ts = 0          # highest Cosmos _ts seen
+        self.refreshed_at = 0.0
+        self.lock = threading.Lock()
+
+    def put(self, doc_id: str, patient: Dict[str, Any]) -> None:
+        self.records[doc_id] = {field: patient.get(field) for field in RECORD_FIELDS}
+        for field, normalize in _FIELDS.items():
+            self.fields[field].put(doc_id, normalize(patient.get(field)))
+        self.synced_ts = max(self.synced_ts, int(patient.get('_ts') or 0))
+
+    def drop(self, doc_id: str) -> None:
+        if self.records.pop(doc_id, None) is not None:
+            for index in self.fields.values():
+                index.drop(doc_id)
+
+
+class PatientSearchIndex:
+    """
+    Args:
+        load: load(owner_field, owner_value, since_ts) -> patient dicts
+            (with 'id', '_ts' and RECORD_FIELDS) of that owner changed after
+            since_ts (all of them for 0).
+    """
+
+    def __init__(self, load: Callable[[str, str, int], List[Dict[str, Any]]],
+                 refresh_seconds: float = REFRESH_SECONDS,
+                 rebuild_seconds: float = REBUILD_SECONDS,
+                 max_owners: int = MAX_OWNERS,
+                 max_ids: int = MAX_IDS,
+                 clock: Callable[[], float] = time.monotonic):
+        self._load = load
+        self.refresh_seconds = refresh_seconds
+        self.max_ids = max_ids
+        self._clock = clock
+        # Expiry forces the periodic full rebuild
+        self._owners = TTLCache(maxsize=max_owners, ttl=rebuild_seconds, name='patient_search')
+        self._lock = threading.Lock()
+        self.hydrations = 0
+        self.refreshes = 0
+        self.lookups = 0
+
+    # ── Lookups ──────────────────────────────────────────────────────────
+
+    def find_duplicates(self, scope: PatientScope, name: str, contact: str = '') -> List[Dict[str, Any]]:
+        """
+        Patients in scope that look like the one about to be created:
+        'exact' (same normalised name), 'similar' (one name contains the
+        other, or trigram similarity >= FUZZY_THRESHOLD; names over 3
+        characters) or 'same_contact' (same phone number).
+        """
+        query = normalize_name(name)
+        query_phone = phone_key(contact)
+        matches: Dict[str, Dict[str, Any]] = {}
+        for owner in self._scope_owners(scope):
+            names = owner.fields['name']
+            for doc_id in names.sharing_trigrams(query):
+                existing = names.values[doc_id]
+                if existing == query:
+                    match_type = 'exact'
+                elif len(query) > 3 and (query in existing or existing in query
+                                         or name_similarity(query, existing) >= FUZZY_THRESHOLD):
+                    match_type = 'similar'
+                else:
+                    continue
+                matches[doc_id] = {**owner.records[doc_id], 'match_type': match_type}
+            if len(query_phone) >= 7:
+                for doc_id in owner.fields['contact'].containing(query_phone):
+                    if owner.fields['contact'].values[doc_id] == query_phone and doc_id not in matches:
+                        matches[doc_id] = {**owner.records[doc_id], 'match_type': 'same_contact'}
+        order = {'exact': 0, 'similar': 1, 'same_contact': 2}
+        return sorted(matches.values(), key=lambda m: (order[m['match_type']], normalize_name(m.get('name'))))
+
+    def search(self, scope: PatientScope, field: str, text: str) -> Optional[List[str]]:
+        """
+        Ids of patients in scope whose `field` contains text, or None if not
+        indexed or more than max_ids match (too many for one query parameter).
+        """
+        normalize = _FIELDS.get(field)
+        if normalize is None or scope.everyone:
+            return None
+        query = normalize(text)
+        if not query:
+            return None
+        found: Set[str] = set()
+        for owner in self._scope_owners(scope):
+            found |= owner.fields[field].containing(query)
+            if len(found) > self.max_ids:
+                return None
+        return sorted(found)
+
+    # ── Maintenance ──────────────────────────────────────────────────────
+
+    def upsert(self, patient: Dict[str, Any]) -> None:
+        """
+        Apply a created or edited patient (the dict as written, with 'id') to
+        hydrated indexes. A SERVER_TIMESTAMP placeholder becomes the current time.
+        """
+        doc_id = patient.get('id') or patient.get('patient_id')
+        if not doc_id:
+            return
+        if patient.get('created_at') == SERVER_TIMESTAMP:
+            patient = {**patient, 'created_at': datetime.now(timezone.utc).isoformat()}
+        for key, owner in self._hydrated():
+            with owner.lock:
+                if patient.get(key[0]) == key[1]:
+                    owner.put(doc_id, patient)
+                else:
+                    # Moved to another physio or institute
+                    owner.drop(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        for _, owner in self._hydrated():
+            with owner.lock:
+                owner.drop(doc_id)
+
+    def _hydrated(self) -> List[Tuple[Owner, _OwnerIndex]]:
+        return self._owners.items()
+
+    def _scope_owners(self, scope: PatientScope) -> List[_OwnerIndex]:
+        with self._lock:
+            self.lookups += 1
+        owners = [('physio_id', scope.physio_id)]
+        if scope.institute:
+            owners.append(('institute', scope.institute))
+        return [self._owner(key) for key in owners if key[1]]
+
+    def _owner(self, key: Owner) -> _OwnerIndex:
+        owner = self._owners.get(key)
+        if owner is None:
+            with self._lock:
+                owner = self._owners.peek(key)
+                if owner is None:
+                    owner = _OwnerIndex()
+                    self._owners.set(key, owner)
+        now = self._clock()
+        if owner.refreshed_at and now - owner.refreshed_at < self.refresh_seconds:
+            return owner
+        with owner.lock:
+            if owner.refreshed_at and now - owner.refreshed_at < self.refresh_seconds:
+                return owner
+            # Hydrate, or pull what changed since the last sync; one second
+            # of overlap since _ts has one-second resolution
+            hydrating = not owner.refreshed_at
+            since = 0 if hydrating else max(0, owner.synced_ts - 1)
+            try:
+                changed = self._load(key[0], key[1], since)
+            except Exception as e:
+                logger.warning(f"Patient search index refresh failed: {type(e).__name__}: {e}")
+                return owner
+            for patient in changed:
+                owner.put(patient['id'], patient)
+            owner.refreshed_at = now
+        with self._lock:
+            if hydrating:
+                self.hydrations += 1
+            else:
+                self.refreshes += 1
+        return owner
+
+    def stats(self) -> Dict[str, Any]:
+        owners = self._hydrated()
+        with self._lock:
+            return {
+                'owners': len(owners),
+                'patients': sum(len(owner.records) for _, owner in owners),
+                'hydrations': self.hydrations,
+                'refreshes': self.refreshes,
+                'lookups': self.lookups,
+            }
+
+
+_index: Optional[PatientSearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def _load_from_cosmos(field: str, value: str, since_ts: int) -> List[Dict[str, Any]]:
+    from azure_cosmos_db import get_cosmos_db
+    query = get_cosmos_db().collection('patients').where(field, '==', value)
+    if since_ts:
+        query = query.where('_ts', '>', since_ts)
+    patients = []
+    for doc in query.select('_ts', *RECORD_FIELDS).stream():
+        data = doc.to_dict()
+        data['id'] = doc.id
+        patients.append(data)
+    return patients
+
+
+def get_patient_search_index() -> PatientSearchIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PatientSearchIndex(_load_from_cosmos)
+    return _index
+
+
+def get_patient_search_stats() -> Dict[str, Any]:
+    return get_patient_search_index().stats()
@@ -0,0 +1,259 @@
+"""
+Per-user clinical phrase index behind text autocomplete.
+
+/api/autocomplete/suggestions runs on every keystroke (3+ characters). It
+used to stream all of the physio's patients, split every mapped text field
+into sentences and count the ones containing the query -- a caseload-sized
+scan per keystroke, which also never saw the assessment sections (they live
+in their own collections). Phrases are now counted when they are saved:
+
+- Each save of an autocompleted field passes the field's new text (and, for
+  edits, the old text) to record_phrases(). Its sentences (split on '.')
+  become +1 / -1 counts in the user's table for that field.
+- Tables are capped at MAX_PHRASES_PER_FIELD phrases per field (the least
+  used ones are dropped; among equally used ones, the least recently saved,
+  so new wording still gets in once a table is full) and persisted as one compact document per user in
+  `autocomplete_phrases` ({'fields': {field: [[phrase, count], ...]}}),
+  updated with a version compare-and-swap so concurrent saves don't lose
+  counts.
+- Lookups read the table from an in-process cache, warmed from that document
+  on first use. A lookup is a substring match over at most
+  MAX_PHRASES_PER_FIELD phrases per field, whatever the caseload.
+
+Fields are keyed by the form field the physio types into (the textarea id
+autocomplete.js sends); FIELD_ALIASES lets one field draw on others.
+backfill_autocomplete_phrases.py builds the documents from existing
+records.
+
+Usage:
+    record_phrases(user_id, {'present_history': text})
+    record_phrases(user_id, {'chief_complaint': new}, old={'chief_complaint': previous})
+    suggestions = get_phrase_index().suggest(user_id, 'present_history', 'lower back', limit=5)
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.phrase_index")
+
+MAX_PHRASES_PER_FIELD = int(os.environ.get('AUTOCOMPLETE_MAX_PHRASES_PER_FIELD', '400'))
+MAX_PHRASE_LENGTH = int(os.environ.get('AUTOCOMPLETE_MAX_PHRASE_LENGTH', '300'))
+CACHE_SECONDS = float(os.environ.get('AUTOCOMPLETE_CACHE_SECONDS', '300'))
+CACHE_SIZE = int(os.environ.get('AUTOCOMPLETE_CACHE_SIZE', '5000'))
+CAS_ATTEMPTS = 3
+
+COLLECTION = 'autocomplete_phrases'
+
+# field the suggestions are for -> fields whose phrases it offers (default: itself)
+FIELD_ALIASES = {
+    'present_history': ['present_history', 'chief_complaint'],
+    'past_history': ['past_history', 'medical_history'],
+    'chief_complaint': ['chief_complaint', 'present_history'],
+    'plan_next': ['plan_next', 'treatment_plan'],
+    # Older camelCase field names
+    'impairmentBodyStructure': ['body_structure'],
+    'impairmentBodyFunction': ['body_function'],
+    'activityLimitationPerformance': ['activity_performance'],
+    'activityLimitationCapacity': ['activity_capacity'],
+    'contextualFactorsEnvironmental': ['contextual_environmental'],
+    'contextualFactorsPersonal': ['contextual_personal'],
+}
+
+# field -> {phrase: count}
+PhraseTable = Dict[str, Dict[str, int]]
+
+
+def split_phrases(text: Any) -> List[str]:
+    """Sentences of a saved text, as they are offered back."""
+    if not isinstance(text, str):
+        return []
+    return [s for s in (part.strip() for part in text.split('.')) if s and len(s) <= MAX_PHRASE_LENGTH]
+
+
+def phrase_deltas(new: Dict[str, Any], old: Optional[Dict[str, Any]] = None) -> PhraseTable:
+    """Count changes for a save: +1 per sentence of `new`, -1 per sentence of `old`."""
+    deltas: PhraseTable = {}
+    for values, sign in ((new, 1), (old or {}, -1)):
+        for field, text in values.items():
+            for phrase in split_phrases(text):
+                counts = deltas.setdefault(field, {})
+                counts[phrase] = counts.get(phrase, 0) + sign
+    return {field: {p: n for p, n in counts.items() if n}
+            for field, counts in deltas.items() if any(counts.values())}
+
+
+def apply_deltas(table: PhraseTable, deltas: PhraseTable,
+                 max_phrases: int = MAX_PHRASES_PER_FIELD) -> None:
+    """
+    Add deltas to table in place, dropping phrases counted down to zero and
+    the least used beyond max_phrases (ties: the least recently saved).
+    A table's order is its recency order: a saved phrase moves to the end.
+    """
+    for field, changes in deltas.items():
+        counts = table.setdefault(field, {})
+        for phrase, delta in changes.items():
+            count = counts.get(phrase, 0) + delta
+            if count <= 0:
+                counts.pop(phrase, None)
+            elif delta > 0:
+                counts.pop(phrase, None)
+                counts[phrase] = count
+            else:
+                # An edit removed one use: it keeps its place
+                counts[phrase] = count
+        if len(counts) > max_phrases:
+            ranked = sorted(enumerate(counts.items()), key=lambda item: (-item[1][1], -item[0]))
+            keep = {phrase for _, (phrase, _) in ranked[:max_phrases]}
+            table[field] = {phrase: count for phrase, count in counts.items() if phrase in keep}
+        elif not counts:
+            del table[field]
+
+
+def table_to_doc(table: PhraseTable) -> Dict[str, List[List[Any]]]:
+    return {field: [[phrase, count] for phrase, count in counts.items()] for field, counts in table.items()}
+
+
+def table_from_doc(fields: Optional[Dict[str, Any]]) -> PhraseTable:
+    table: PhraseTable = {}
+    for field, pairs in (fields or {}).items():
+        try:
+            table[field] = {str(phrase): int(count) for phrase, count in pairs if int(count) > 0}
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping malformed autocomplete phrases for field {field}")
+    return table
+
+
+class _UserPhrases:
+    """One user's table plus lowercased phrases for matching."""
+
+    __slots__ = ('table', 'folded', 'lock')
+
+    def __init__(self, table: PhraseTable):
+        self.table = table
+        self.folded = {field: {p: p.lower() for p in counts} for field, counts in table.items()}
+        self.lock = threading.Lock()
+
+    def apply(self, deltas: PhraseTable) -> None:
+        with self.lock:
+            apply_deltas(self.table, deltas)
+            self.folded = {field: {p: p.lower() for p in counts} for field, counts in self.table.items()}
+
+    def suggest(self, fields: Iterable[str], query: str, limit: int) -> List[Dict[str, Any]]:
+        query = query.lower()
+        found: Dict[str, int] = {}
+        with self.lock:
+            for field in fields:
+                counts = self.table.get(field, {})
+                for phrase, folded in self.folded.get(field, {}).items():
+                    if query in folded and len(phrase) > len(query):
+                        found[phrase] = found.get(phrase, 0) + counts[phrase]
+        ranked = sorted(found.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [{'text': phrase, 'frequency': count} for phrase, count in ranked]
+
+
+class PhraseIndex:
+    """
+    Args:
+        load: load(user_id) -> (fields dict as stored, version), or None if
+            the user has no document yet.
+        save: save(user_id, fields, expected_version) -> bool; writes the
+            document if its version is still expected_version (None: the
+            document doesn't exist yet).
+    """
+
+    def __init__(self, load: Callable[[str], Optional[tuple]],
+                 save: Callable[[str, Dict[str, Any], Optional[int]], bool],
+                 cache_seconds: float = CACHE_SECONDS, cache_size: int = CACHE_SIZE):
+        self._load = load
+        self._save = save
+        self._users = TTLCache(maxsize=cache_size, ttl=cache_seconds, name='autocomplete_phrases')
+        self._lock = threading.Lock()
+
+    def suggest(self, user_id: str, field: str, query: str, limit: int = 5) -> List[Dict[str, Any]]:
+        return self._user(user_id).suggest(FIELD_ALIASES.get(field, [field]), query, limit)
+
+    def record(self, user_id: str, new: Dict[str, Any], old: Optional[Dict[str, Any]] = None) -> None:
+        deltas = phrase_deltas(new, old)
+        if not user_id or not deltas:
+            return
+        for _ in range(CAS_ATTEMPTS):
+            stored = self._load(user_id)
+            fields, version = stored if stored is not None else ({}, None)
+            table = table_from_doc(fields)
+            apply_deltas(table, deltas)
+            if self._save(user_id, table_to_doc(table), version):
+                break
+        else:
+            logger.warning(f"Autocomplete phrases for {user_id} not saved: concurrent updates")
+        cached = self._users.peek(user_id)
+        if cached is not None:
+            cached.apply(deltas)
+
+    def _user(self, user_id: str) -> _UserPhrases:
+        user = self._users.get(user_id)
+        if user is not None:
+            return user
+        try:
+            stored = self._load(user_id)
+        except Exception as e:
+            logger.warning(f"Could not load autocomplete phrases for {user_id}: {e}")
+            return _UserPhrases({})
+        user = _UserPhrases(table_from_doc(stored[0]) if stored is not None else {})
+        self._users.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id: str) -> None:
+        self._users.pop(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._users.stats()
+
+
+_index: Optional[PhraseIndex] = None
+_index_lock = threading.Lock()
+
+
+def _load_from_cosmos(user_id: str) -> Optional[tuple]:
+    from azure_cosmos_db import get_cosmos_db
+    doc = get_cosmos_db().collection(COLLECTION).document(user_id).get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    return data.get('fields') or {}, int(data.get('version') or 0)
+
+
+def _save_to_cosmos(user_id: str, fields: Dict[str, Any], expected_version: Optional[int]) -> bool:
+    from azure_cosmos_db import get_cosmos_db, SERVER_TIMESTAMP
+    ref = get_cosmos_db().collection(COLLECTION).document(user_id)
+    if expected_version is None:
+        # First save for this user; a concurrent first save can overwrite it
+        ref.set({'fields': fields, 'version': 1, 'updated_at': SERVER_TIMESTAMP})
+        return True
+    return ref.patch_if({'fields': fields, 'updated_at': SERVER_TIMESTAMP},
+                        conditions=[('version', '==', expected_version)],
+                        increments={'version': 1})
+
+
+def get_phrase_index() -> PhraseIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = PhraseIndex(_load_from_cosmos, _save_to_cosmos)
+    return _index
+
+
+def record_phrases(user_id: Optional[str], new: Dict[str, Any], old: Optional[Dict[str, Any]] = None) -> None:
+    """Count a save's phrases for autocomplete. Never raises: a save must not fail over suggestions."""
+    try:
+        get_phrase_index().record(user_id, new, old)
+    except Exception as e:
+        logger.warning(f"Could not record autocomplete phrases: {type(e).__name__}: {e}")
+
+
+def get_phrase_index_stats() -> Dict[str, Any]:
+    return get_phrase_index().stats()
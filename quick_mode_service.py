@@ -93,6 +93,7 @@ def generate_patho_prefills(patient: Dict[str, Any]) -> Dict[str, Any]:
         raw = client.generate_json_response(
             system_prompt=PATHO_MECHANISM_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_patho_mechanism',
         )
 
         if not raw or "error" in raw:
@@ -187,6 +188,7 @@ def generate_subjective_questions(
         raw = client.generate_json_response(
             system_prompt=SUBJECTIVE_QUESTIONS_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_subjective',
         )
 
         if not raw or "error" in raw:
@@ -258,6 +260,7 @@ def generate_initial_plan_prefills(
         raw = client.generate_json_response(
             system_prompt=INITIAL_PLAN_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_initial_plan',
         )
 
         if not raw or "error" in raw:
@@ -332,6 +335,7 @@ def generate_risk_flags_prefills(
         raw = client.generate_json_response(
             system_prompt=RISK_FLAGS_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_risk_flags',
         )
 
         logger.info(f"Quick Mode risk flags: raw AI keys = {list(raw.keys()) if raw else 'None'}")
@@ -428,6 +432,7 @@ def generate_obj_assessment_prefills(
         raw = client.generate_json_response(
             system_prompt=OBJ_ASSESSMENT_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_objective',
         )
 
         if not raw or "error" in raw:
@@ -503,6 +508,7 @@ def generate_prov_diag_prefills(
         raw = client.generate_json_response(
             system_prompt=PROV_DIAG_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_provisional_diagnosis',
         )
 
         if not raw or "error" in raw:
@@ -577,6 +583,7 @@ def generate_smart_goals_prefills(
         raw = client.generate_json_response(
             system_prompt=SMART_GOALS_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_smart_goals',
         )
 
         if not raw or "error" in raw:
@@ -651,6 +658,7 @@ def generate_treatment_plan_prefills(
         raw = client.generate_json_response(
             system_prompt=TREATMENT_PLAN_SYSTEM,
             user_prompt=user_prompt,
+            endpoint='quick_mode_treatment_plan',
         )
 
         if not raw or "error" in raw:
@@ -0,0 +1,53 @@
+"""
+Threshold-crossing quota alerts.
+
+Quota warnings (80/90/100%) used to be evaluated by re-reading the whole
+subscription after every AI call, patient creation and voice deduction. The
+atomic counter functions in subscription_manager already get the counter's
+new value back from Cosmos, so they now pass (old, new) here and a warning is
+only considered when the counter actually crosses a threshold.
+
+Each (quota, threshold) pair is sent at most once per billing period: the
+sender claims a marker field on the subscription (`quota_alert_ai_90`, ...)
+with a conditional 0 -> 1 patch, so concurrent workers crossing the same
+boundary send one notification between them. Starting a new period (monthly
+reset, upgrade) clears the markers via QUOTA_ALERT_RESET.
+"""
+
+import math
+from typing import Dict, Optional
+
+QUOTA_THRESHOLDS = (80, 90, 100)
+
+# quota key -> (counter field, limit field, label used in the notification)
+QUOTA_COUNTERS = {
+    'ai': ('ai_calls_this_month', 'ai_calls_limit', 'AI Calls'),
+    'patients': ('patients_created_this_month', 'patients_limit', 'Patients'),
+    'voice': ('voice_minutes_used_this_month', 'voice_minutes_limit', 'Voice Typing Minutes'),
+}
+
+
+def alert_marker_field(quota: str, threshold: int) -> str:
+    return f'quota_alert_{quota}_{threshold}'
+
+
+# Merged into the update that starts a new billing period
+QUOTA_ALERT_RESET: Dict[str, int] = {
+    alert_marker_field(quota, threshold): 0
+    for quota in QUOTA_COUNTERS for threshold in QUOTA_THRESHOLDS
+}
+
+
+def crossed_threshold(old: float, new: float, limit: float) -> Optional[int]:
+    """
+    Highest threshold the counter crossed going from old to new, or None.
+    A threshold t is reached at usage >= limit * t / 100, the same rule the
+    per-call check used. Unlimited (-1) and zero limits never alert.
+    """
+    if not limit or limit <= 0 or new <= old:
+        return None
+    for threshold in reversed(QUOTA_THRESHOLDS):
+        boundary = math.ceil(limit * threshold / 100)
+        if old < boundary <= new:
+            return threshold
+    return None
@@ -0,0 +1,199 @@
+"""
+Local quota leases: per-worker blocks of AI-call units.
+
+reserve_ai_usage_atomic used to make one or two conditional patches on
+subscriptions/{user} per AI request, and every cache hit or failed request
+made another one to release its unit -- so even a "free" cached answer cost
+two writes. Instead, a worker now leases a small block of units for an
+active user with one conditional patch (the document's counter already
+includes the whole block, so the plan limit is enforced by Cosmos exactly
+as before), hands them out locally, and takes units back locally when a
+request turns out to be a cache hit or fails. Units still unused when the
+lease expires are returned to the document with one patch.
+
+A lease is never extended: LEASE_SECONDS after it was taken, whatever is
+left goes back, so a user's counter is at most one block per worker ahead of
+real usage, and never for longer than that. The acquire callback decides how
+many units to grant (fewer near the limit, so a worker doesn't strand the
+user's last calls).
+
+Each lease is tagged with the billing period its units were granted in
+(whatever the acquire callback reports, e.g. current_period_start), and
+units are returned with that tag. The release callback drops returns from
+an earlier period, so after a monthly reset no worker -- not just the one
+that ran the reset -- can give old-period units back to the new period.
+
+The Cosmos calls are injected (see subscription_manager), so this module
+has no database dependency.
+
+Usage:
+    leases = QuotaLeaseAllocator(acquire=grant_units, release=return_units)
+    if leases.take(user_id):
+        ...                       # run the AI call
+        leases.give_back(user_id) # cache hit or failure: no write
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("app.quota_lease")
+
+LEASE_BLOCK_SIZE = int(os.environ.get('AI_QUOTA_LEASE_BLOCK', '5'))
+LEASE_SECONDS = float(os.environ.get('AI_QUOTA_LEASE_SECONDS', '60'))
+
+
+class _Lease:
+    __slots__ = ('units', 'expires_at', 'period')
+
+    def __init__(self, units: int, expires_at: float, period: Any = None):
+        self.units = units
+        self.expires_at = expires_at
+        self.period = period
+
+
+class QuotaLeaseAllocator:
+    """
+    Args:
+        acquire: (user_id, wanted) -> (units granted (0..wanted), period),
+            applied to the shared counter with one conditional patch.
+        release: (user_id, units, period) -> None, returns unused units to
+            the shared counter unless it has moved on from that period.
+            period is None if unknown (a unit handed back after its lease
+            was swept).
+    """
+
+    def __init__(self, acquire: Callable[[str, int], Tuple[int, Any]],
+                 release: Callable[[str, int, Any], None],
+                 block_size: int = LEASE_BLOCK_SIZE,
+                 lease_seconds: float = LEASE_SECONDS,
+                 name: str = 'ai_calls',
+                 start_sweeper: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        self._acquire = acquire
+        self._release = release
+        self.block_size = max(1, block_size)
+        self.lease_seconds = lease_seconds
+        self.name = name
+        self._start_sweeper = start_sweeper
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._leases: Dict[str, _Lease] = {}
+        self._sweeper: Optional[threading.Thread] = None
+        self.local_takes = 0
+        self.local_returns = 0
+        self.acquires = 0
+        self.releases = 0
+
+    def take(self, user_id: str) -> bool:
+        """Consume one unit for user_id, leasing a new block if needed."""
+        if self._start_sweeper and self._sweeper is None:
+            self._ensure_sweeper()
+
+        taken, stale = self._take_local(user_id)
+        if taken:
+            return True
+        if stale is not None and stale.units:
+            self._return_units(user_id, stale.units, stale.period)
+
+        granted, period = self._acquire(user_id, self.block_size)
+        if granted <= 0:
+            return False
+        stale = None
+        with self._lock:
+            self.acquires += 1
+            lease = self._leases.get(user_id)
+            if lease is None or lease.period != period:
+                # Units handed back into a lease of another period go back
+                # under that period's tag
+                stale = lease
+                lease = self._leases[user_id] = _Lease(0, self._clock() + self.lease_seconds, period)
+            # One unit is this call's; the rest wait for later calls
+            lease.units += granted - 1
+        if stale is not None and stale.units:
+            self._return_units(user_id, stale.units, stale.period)
+        return True
+
+    def _take_local(self, user_id: str) -> Tuple[bool, Optional[_Lease]]:
+        """(unit taken from the lease, expired lease whose unused units are to be returned)."""
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None:
+                return False, None
+            if lease.expires_at <= self._clock():
+                del self._leases[user_id]
+                return False, lease
+            if lease.units > 0:
+                lease.units -= 1
+                self.local_takes += 1
+                return True, None
+            return False, None
+
+    def give_back(self, user_id: str) -> None:
+        """Return one unit taken by take() (cache hit, failed request) without a write."""
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None:
+                # The lease was swept meanwhile: hold the unit until the
+                # usual expiry rather than patching right away
+                lease = self._leases[user_id] = _Lease(0, self._clock() + self.lease_seconds)
+            lease.units += 1
+            self.local_returns += 1
+
+    def discard(self, user_id: str) -> None:
+        """Forget a user's lease without returning it (their counter was just reset)."""
+        with self._lock:
+            self._leases.pop(user_id, None)
+
+    def sweep(self, flush_all: bool = False) -> int:
+        """Return unused units of expired leases (or of all leases). Returns units returned."""
+        now = self._clock()
+        with self._lock:
+            due: List[Tuple[str, _Lease]] = []
+            for user_id, lease in list(self._leases.items()):
+                if flush_all or lease.expires_at <= now:
+                    del self._leases[user_id]
+                    if lease.units > 0:
+                        due.append((user_id, lease))
+        for user_id, lease in due:
+            self._return_units(user_id, lease.units, lease.period)
+        return sum(lease.units for _, lease in due)
+
+    def _return_units(self, user_id: str, units: int, period: Any) -> None:
+        try:
+            self._release(user_id, units, period)
+            with self._lock:
+                self.releases += 1
+        except Exception as e:
+            logger.warning(f"Could not return {units} leased {self.name} units for {user_id}: {type(e).__name__}")
+
+    def _ensure_sweeper(self) -> None:
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name=f'{self.name}-lease-sweeper', daemon=True)
+            self._sweeper.start()
+        atexit.register(self.sweep, True)
+
+    def _sweep_loop(self) -> None:
+        while True:
+            time.sleep(max(1.0, self.lease_seconds / 2))
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning(f"Quota lease sweep failed: {type(e).__name__}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'active_leases': len(self._leases),
+                'leased_units': sum(lease.units for lease in self._leases.values()),
+                'local_takes': self.local_takes,
+                'local_returns': self.local_returns,
+                'acquire_patches': self.acquires,
+                'release_patches': self.releases,
+            }
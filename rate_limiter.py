@@ -1,13 +1,16 @@
 """
 Rate Limiting for PhysiologicPRISM
 
-Route-level rate limiting via Flask-Limiter, backed by Redis when
-REDIS_HOST is configured (shared limits across all Gunicorn workers),
-falling back to in-memory storage otherwise (per-worker limits only --
-up to 3x looser than configured under 3 gthread workers).
-Login attempt tracking is persisted in Cosmos DB so lockouts survive
-restarts and are shared across all Gunicorn workers regardless of the
-rate limiter's storage backend.
+Route-level rate limiting via Flask-Limiter with the moving-window
+strategy on a "hybrid://" storage backend (see hybrid_rate_limit.py):
+requests are admitted from per-worker allowances, reconciled in batches
+against a GCRA in Redis when REDIS_HOST is configured (shared limits
+across all Gunicorn workers). Without Redis the GCRA is kept in-process
+(per-worker limits only -- up to 3x looser than configured under 3
+gthread workers, but without fixed-window edge bursts).
+Login lockouts are tracked in a dedicated store (see login_lockout.py):
+in memory per worker, backed by Redis when available and otherwise by the
+login_lockouts Cosmos DB container -- never on the user document.
 
 Usage:
     from rate_limiter import limiter, check_login_attempts, record_failed_login
@@ -20,15 +23,20 @@ Usage:
 """
 
 import os
+import time
 import logging
 from flask import g, request
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import MemoryStorage
 import redis
 
+from hybrid_rate_limit import HybridRateLimiter, LocalGCRAStore, RedisGCRAStore
+from login_lockout import CosmosLockoutBackend, LoginLockoutStore, RedisLockoutBackend
+
 logger = logging.getLogger("app.rate_limiter")
 
-# Login attempt tracking — state lives in Cosmos DB user documents
+# Failed logins before an account is locked (see login_lockout.py)
 MAX_LOGIN_ATTEMPTS = 3
 
 # Connect to Redis when configured, so rate limits are shared across all
@@ -37,7 +45,6 @@ MAX_LOGIN_ATTEMPTS = 3
 # unset or unreachable.
 redis_client = None
 redis_available = False
-_storage_uri = "memory://"
 
 _REDIS_HOST = os.environ.get('REDIS_HOST')
 if _REDIS_HOST:
@@ -54,7 +61,6 @@ if _REDIS_HOST:
         _test_client.ping()
         redis_client = _test_client
         redis_available = True
-        _storage_uri = _redis_uri
         logger.info(f"Rate limiter using Redis storage at {_REDIS_HOST}:{_redis_port}")
     except Exception as e:
         logger.warning(f"Redis configured but unreachable ({e}) -- falling back to in-memory rate limiting")
@@ -79,80 +85,113 @@ def get_user_identifier():
     return f"ip:{get_remote_address()}"
 
 
-# Initialize Flask-Limiter with Redis storage when available, else in-memory
+_hybrid = None
+
+
+def get_hybrid_limiter() -> HybridRateLimiter:
+    """This process's limiter, created on first use (after any Gunicorn fork)."""
+    global _hybrid
+    if _hybrid is None:
+        if redis_available:
+            _hybrid = HybridRateLimiter(RedisGCRAStore(redis_client))
+        else:
+            # Nothing shared to divide: this worker's GCRA is the whole budget
+            _hybrid = HybridRateLimiter(LocalGCRAStore(), workers=1)
+    return _hybrid
+
+
+class HybridStorage(MemoryStorage):
+    """
+    limits storage for "hybrid://". Only the moving-window entry points are
+    routed to the hybrid limiter; the rest is plain per-worker memory
+    storage, which the moving-window strategy doesn't use.
+    """
+
+    STORAGE_SCHEME = ["hybrid"]
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        return get_hybrid_limiter().hit(key, limit, expiry, amount)
+
+    def get_moving_window(self, key, limit, expiry):
+        # (window start, units used) -- only used for the X-RateLimit headers
+        return int(time.time()), limit - get_hybrid_limiter().remaining(key, limit, expiry)
+
+
+# Initialize Flask-Limiter on the hybrid storage (Redis-reconciled when available)
 limiter = Limiter(
     key_func=get_user_identifier,
     default_limits=["1000 per hour", "100 per minute"],
-    storage_uri=_storage_uri,
+    storage_uri="hybrid://",
     storage_options={},
-    strategy="fixed-window",
+    strategy="moving-window",
     headers_enabled=True,
     swallow_errors=True,
 )
 
 _backend = "Redis" if redis_available else "in-memory"
-logger.info(f"Rate limiter initialized with {_backend} storage (login lockouts use Cosmos DB)")
+_lockout_backend = "Redis" if redis_available else "Cosmos DB"
+logger.info(f"Rate limiter initialized with {_backend} storage (login lockouts use {_lockout_backend})")
 
 
-# ─── LOGIN ATTEMPT TRACKING (Cosmos DB) ─────────────────────────────
-#
-# Lockout state is stored on the user document so it survives restarts
-# and is visible to all Gunicorn workers.
+# ─── LOGIN ATTEMPT TRACKING ─────────────────────────────────────────
 #
-# Fields written: failed_login_attempts (int), account_locked (bool)
+# Lockout state lives in a LoginLockoutStore, never on the user document.
+# MAX_LOGIN_ATTEMPTS failures lock the account for an exponentially growing
+# window; a password reset or successful login clears it.
+
+_lockouts = None
+
+
+def _get_lockouts(db):
+    """This process's lockout store, created on first use. None without any backing store."""
+    global _lockouts
+    if _lockouts is None:
+        if redis_available:
+            _lockouts = LoginLockoutStore(RedisLockoutBackend(redis_client), max_failures=MAX_LOGIN_ATTEMPTS)
+        elif db is not None:
+            _lockouts = LoginLockoutStore(CosmosLockoutBackend(db), max_failures=MAX_LOGIN_ATTEMPTS)
+    return _lockouts
 
 
 def check_login_attempts(email, db=None):
     """
-    Return (is_allowed, 0).  is_allowed is False when the account is locked.
-    db is the Cosmos DB client (db.collection('users').document(...)).
+    Return (is_allowed, lockout_remaining_seconds). is_allowed is False while
+    the account is locked. db is the Cosmos DB client, used as the backing
+    store when Redis isn't configured.
     """
     if not email:
         return True, 0
-    if db is None:
-        return True, 0
 
     try:
-        doc = db.collection('users').document(email.lower()).get()
-        if doc.exists and doc.get('account_locked'):
-            logger.warning(f"Login blocked — account locked: {email}")
-            return False, 0
+        lockouts = _get_lockouts(db)
+        if lockouts is None:
+            return True, 0
+        is_allowed, remaining = lockouts.check(email)
+        if not is_allowed:
+            logger.warning(f"Login blocked — account locked for {remaining}s: {email}")
+        return is_allowed, remaining
     except Exception as e:
         logger.error(f"check_login_attempts error for {email}: {e}")
-        # Fail open so a Cosmos DB hiccup doesn't lock everyone out
+        # Fail open so a store hiccup doesn't lock everyone out
     return True, 0
 
 
 def record_failed_login(email, db=None) -> bool:
     """
-    Increment failed_login_attempts on the user document.
-    Sets account_locked=True when the count reaches MAX_LOGIN_ATTEMPTS.
-    Returns True only on the attempt that just crossed the threshold
-    (so callers send the reset email exactly once).
+    Count a failed login. Locks the account when the count reaches
+    MAX_LOGIN_ATTEMPTS. Returns True only on the attempt that just locked
+    it (so callers send the reset email once per lock).
     """
     if not email:
         return False
-    if db is None:
-        return False
 
     try:
-        ref = db.collection('users').document(email.lower())
-        doc = ref.get()
-        if not doc.exists:
-            return False
-
-        # Atomic increment closes the race where concurrent failed attempts
-        # all read the same pre-increment count and undercount the total,
-        # letting brute force exceed MAX_LOGIN_ATTEMPTS.
-        applied, new_count = ref.increment_if('failed_login_attempts', 1)
-        if not applied:
+        lockouts = _get_lockouts(db)
+        if lockouts is None:
             return False
-
-        just_locked = new_count == MAX_LOGIN_ATTEMPTS
-        if new_count >= MAX_LOGIN_ATTEMPTS:
-            ref.update({'account_locked': True})
-
-        logger.info(f"Failed login attempt {new_count}/{MAX_LOGIN_ATTEMPTS} for {email}")
+        just_locked = lockouts.record_failure(email)
+        if just_locked:
+            logger.info(f"Account locked after {MAX_LOGIN_ATTEMPTS} failed login attempts: {email}")
         return just_locked
 
     except Exception as e:
@@ -166,27 +205,32 @@ def clear_login_attempts(email, db=None):
     """
     if not email:
         return
-    if db is None:
-        return
 
     try:
-        db.collection('users').document(email.lower()).update({
-            'failed_login_attempts': 0,
-            'account_locked': False,
-        })
-        logger.info(f"Cleared login lockout for {email}")
+        lockouts = _get_lockouts(db)
+        if lockouts is not None:
+            lockouts.clear(email)
     except Exception as e:
         logger.error(f"clear_login_attempts error for {email}: {e}")
 
 
+def flush_login_lockouts():
+    """Write batched lockout state (Gunicorn worker_exit hook)."""
+    if _lockouts is not None:
+        _lockouts.flush()
+
+
 def get_rate_limit_stats():
     return {
         'redis_available': redis_available,
         'storage_type': 'redis' if redis_available else 'memory',
-        'login_lockout_backend': 'cosmos_db',
+        'strategy': 'hybrid-gcra',
+        'limiter': get_hybrid_limiter().stats(),
+        'login_lockout_backend': 'redis' if redis_available else 'cosmos_db',
+        'login_lockouts': _lockouts.stats() if _lockouts is not None else None,
     }
 
 
 def health_check():
     backend = "Redis" if redis_available else "in-memory"
-    return True, f"Rate limiter healthy ({backend} routes, Cosmos DB login lockouts)"
+    return True, f"Rate limiter healthy ({backend} routes, {_lockout_backend} login lockouts)"
@@ -0,0 +1,346 @@
+"""
+Patient report assembly, shared by every view of the comprehensive report.
+
+The web report page, the web PDF download, the mobile comprehensive-report
+API and the mobile PDF export each assembled the same report on their own:
+ten serial `order_by('timestamp').limit(1)` section queries, a follow-ups
+query and a therapist read per call, with slightly different rules (the
+mobile routes read an arbitrary section record rather than the latest one,
+the web routes ignored sections mobile clients keep on the patient
+document). They now share one canonical model:
+
+    report = get_patient_report(patient_doc)
+    report.sections['goals'], report.follow_ups, report.therapist, report.etag
+
+The sections come from the patient's current clinical record
+(clinical_record.py, one point read), fetched concurrently with the
+follow-ups and the therapist on a small shared pool. For each section the
+latest record of its container is used; if there is none, the nested
+camelCase field a mobile client saved on the patient document is translated
+through MOBILE_FIELD_MAP.
+
+Reports are cached per worker, keyed by patient id and valid for one patient
+version (patient_context.patient_version: the document's `_etag`). Section
+and follow-up saves bump the patient's context_version, so any change to the
+report's inputs gives a new version. The therapist profile is the exception:
+it comes from the user-profile cache, and a change to it shows once the
+report entry expires (REPORT_CACHE_TTL).
+
+`etag` is a hash of the report's content, so it is the same on every worker
+for the same content. Callers still do the patient point read (the access
+check and the version need it), but a conditional request whose ETag still
+matches is answered 304 without any section query.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.report_assembly")
+
+FETCH_CONCURRENCY = int(os.environ.get('REPORT_FETCH_CONCURRENCY', '16'))
+
+# Report section name -> (append-only container, camelCase field on mobile patient documents)
+REPORT_SECTIONS = {
+    'subjective': ('subjective_examination', 'subjectiveExamination'),
+    'perspectives': ('patient_perspectives', 'patientPerspectives'),
+    'initial_plan': ('initial_plan', 'initialPlan'),
+    'patho_mechanism': ('patho_mechanism', 'pathoMechanism'),
+    'chronic_diseases': ('chronic_diseases', 'chronicDiseaseFactors'),
+    'clinical_flags': ('clinical_flags', 'clinicalFlags'),
+    'objective': ('objective_assessments', 'objectiveAssessment'),
+    'diagnosis': ('provisional_diagnosis', 'provisionalDiagnosis'),
+    'goals': ('smart_goals', 'smartGoals'),
+    'treatment': ('treatment_plan', 'treatmentPlan'),
+}
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Field-name translation map: mobile camelCase → web snake_case
+# Used when falling back to the patient document for mobile-created patients.
+# Each key is the camelCase top-level field name on the patient document;
+# each value is a dict mapping mobile inner field names to their web equivalents.
+# ─────────────────────────────────────────────────────────────────────────────
+MOBILE_FIELD_MAP = {
+    'subjectiveExamination': {
+        'impairmentBodyStructure':        'body_structure',
+        'impairmentBodyFunction':         'body_function',
+        'activityLimitationPerformance':  'activity_performance',
+        'activityLimitationCapacity':     'activity_capacity',
+        'contextualFactorsEnvironmental': 'contextual_environmental',
+        'contextualFactorsPersonal':      'contextual_personal',
+    },
+    'patientPerspectives': {
+        'knowledgeOfIllness':        'knowledge',
+        'illnessAttribution':        'attribution',
+        'expectationAboutIllness':   'expectation',
+        'awarenessOfConsequences':   'consequences_awareness',
+        'locusOfControl':            'locus_of_control',
+        'affectiveAspect':           'affective_aspect',
+    },
+    'provisionalDiagnosis': {
+        'likelihoodOfDiagnosis':         'likelihood',
+        'possibleStructureAtFault':      'structure_fault',
+        'findingsSupportingDiagnosis':   'findings_support',
+        'findingsRejectingDiagnosis':    'findings_reject',
+        'hypothesisSupported':           'hypothesis_supported',
+        # 'symptom' is identical in both — no mapping needed
+    },
+    'initialPlan': {
+        'activeMovements':        'active_movements',
+        'passiveMovements':       'passive_movements',
+        'passiveOverPressure':    'passive_over_pressure',
+        'resistedMovements':      'resisted_movements',
+        'combinedMovements':      'combined_movements',
+        'specialTests':           'special_tests',
+        'neurodynamicExamination':'neurodynamic',
+        # "Details" free-text fields (physio-entered findings) map to web's *_details.
+        # The "Suggestions" fields are read-only AI-suggestion text with no web-side
+        # equivalent — intentionally not mapped.
+        'activeMovementsObservations':         'active_movements_details',
+        'passiveMovementsObservations':        'passive_movements_details',
+        'passiveOverPressureObservations':     'passive_over_pressure_details',
+        'resistedMovementsObservations':       'resisted_movements_details',
+        'combinedMovementsObservations':       'combined_movements_details',
+        'specialTestsObservations':            'special_tests_details',
+        'neurodynamicExaminationObservations': 'neurodynamic_details',
+    },
+    'pathoMechanism': {
+        'areaInvolved':             'area_involved',
+        'presentingSymptom':        'presenting_symptom',
+        'painType':                 'pain_type',
+        'painNature':               'pain_nature',
+        'painSeverity':             'pain_severity',
+        'painIrritability':         'pain_irritability',
+        'possibleSourceOfSymptoms': 'possible_source',
+        'stageOfTissueHealing':     'stage_healing',
+    },
+    'clinicalFlags': {
+        'redFlag':    'red_flags',
+        'orangeFlag': 'orange_flags',
+        'yellowFlag': 'yellow_flags',
+        'blackFlag':  'black_flags',
+        'blueFlag':   'blue_flags',
+    },
+    'objectiveAssessment': {
+        'assessmentNotes': 'plan_details',
+        # 'plan' is present in both — no mapping needed
+    },
+    'chronicDiseaseFactors': {
+        'causeForMaintenance': 'causes',
+        'specificFactors':     'specific_factors',
+    },
+    'smartGoals': {
+        'goals':            'patient_goal',
+        'outcomeTimeframe': 'outcome_timeframe',
+    },
+    'treatmentPlan': {
+        'treatmentPlan': 'treatment_plan',
+    },
+}
+
+
+def iso_timestamps(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of data with datetime values as ISO strings (JSON- and hash-safe)."""
+    return {key: value.isoformat() if hasattr(value, 'isoformat') else value for key, value in data.items()}
+
+
+def mobile_section(patient: Dict[str, Any], mobile_key: str) -> Dict[str, Any]:
+    """A section a mobile client saved on the patient document, with web field names."""
+    mobile_data = patient.get(mobile_key)
+    if not mobile_data:
+        return {}
+    if isinstance(mobile_data, dict):
+        field_map = MOBILE_FIELD_MAP.get(mobile_key, {})
+        return {field_map.get(k, k): v for k, v in mobile_data.items()}
+    # Scalar value — wrap it so callers always get a dict
+    return {mobile_key: mobile_data}
+
+
+def content_etag(content: Dict[str, Any]) -> str:
+    """Strong ETag (unquoted) of a report's content."""
+    encoded = json.dumps(content, sort_keys=True, default=str, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:40]
+
+
+class PatientReport:
+    """Canonical comprehensive report of one patient version."""
+
+    __slots__ = ('patient_id', 'version', 'patient', 'therapist', 'sections', 'follow_ups',
+                 'generated_at', 'etag', 'complete')
+
+    def __init__(self, patient_id: str, version: str, patient: Dict[str, Any], therapist: Dict[str, Any],
+                 sections: Dict[str, Dict[str, Any]], follow_ups: List[Dict[str, Any]],
+                 complete: bool = True):
+        self.patient_id = patient_id
+        self.version = version
+        self.patient = patient
+        self.therapist = therapist
+        self.sections = sections
+        self.follow_ups = follow_ups
+        self.complete = complete
+        self.generated_at = datetime.now().isoformat()
+        self.etag = content_etag({'patient': patient, 'therapist': therapist,
+                                  'sections': sections, 'follow_ups': follow_ups})
+
+    def to_api(self) -> Dict[str, Any]:
+        """The mobile comprehensive-report response body."""
+        return {
+            'patient': self.patient,
+            'therapist': self.therapist,
+            'assessments': self.sections,
+            'follow_ups': self.follow_ups,
+            'report_generated_at': self.generated_at,
+        }
+
+    def template_context(self) -> Dict[str, Any]:
+        """Keyword arguments for rendering patient_report.html."""
+        return {'patient': self.patient, 'therapist': self.therapist,
+                'follow_ups': self.follow_ups, **self.sections}
+
+
+class ReportAssembler:
+    """
+    Args:
+        latest_sections: latest_sections(patient_id, collections) -> dict of
+            collection -> latest record ({} if never saved).
+        follow_ups: follow_ups(patient_id) -> list of dicts, newest first.
+        therapist: therapist(email) -> dict or None.
+        run_all: runs a list of zero-argument callables concurrently and
+            returns their results in order (default: the shared fetch pool).
+    """
+
+    def __init__(self, latest_sections: Callable[[str, List[str]], Dict[str, Dict[str, Any]]],
+                 follow_ups: Callable[[str], List[Dict[str, Any]]],
+                 therapist: Callable[[str], Optional[Dict[str, Any]]],
+                 run_all: Optional[Callable[[List[Callable[[], Any]]], List[Any]]] = None,
+                 cache_size: int = 256, cache_ttl: float = 600.0):
+        self._latest_sections = latest_sections
+        self._follow_ups = follow_ups
+        self._therapist = therapist
+        self._run_all = run_all or _run_concurrently
+        self._reports = TTLCache(maxsize=cache_size, ttl=cache_ttl, name='patient_report')
+        self._lock = threading.Lock()
+        self._stats = {'assembled': 0, 'incomplete': 0, 'assemble_ms': 0.0}
+
+    def report(self, patient_id: str, patient: Dict[str, Any], version: str) -> PatientReport:
+        """The report for this patient version, from this worker's cache when it has it."""
+        report = self._reports.get(patient_id)
+        if report is not None and report.version == version:
+            return report
+        report = self.assemble(patient_id, patient, version)
+        if report.complete:
+            self._reports.set(patient_id, report)
+        return report
+
+    def assemble(self, patient_id: str, patient: Dict[str, Any], version: str) -> PatientReport:
+        started = time.perf_counter()
+        failed = []
+
+        def guarded(label: str, fn: Callable[[], Any], default: Any) -> Callable[[], Any]:
+            def run():
+                try:
+                    return fn()
+                except Exception as e:
+                    failed.append(label)
+                    logger.warning(f"Report: could not fetch {label} for patient {patient_id}: {e}")
+                    return default
+            return run
+
+        collections = [collection for collection, _ in REPORT_SECTIONS.values()]
+        latest, follow_ups, therapist = self._run_all([
+            guarded('sections', lambda: self._latest_sections(patient_id, collections), {}),
+            guarded('follow_ups', lambda: self._follow_ups(patient_id), []),
+            guarded('therapist', lambda: self._therapist(patient.get('physio_id', '')), None),
+        ])
+
+        sections = {}
+        for name, (collection, mobile_key) in REPORT_SECTIONS.items():
+            data = latest.get(collection)
+            sections[name] = iso_timestamps(data) if data else mobile_section(patient, mobile_key)
+        follow_ups = [iso_timestamps(entry) for entry in follow_ups or []]
+        therapist = therapist or {}
+        report = PatientReport(patient_id, version, {**iso_timestamps(patient), 'id': patient_id},
+                               therapist, sections, follow_ups, complete=not failed)
+
+        with self._lock:
+            self._stats['assembled'] += 1
+            self._stats['incomplete'] += 1 if failed else 0
+            self._stats['assemble_ms'] += (time.perf_counter() - started) * 1000
+        return report
+
+    def invalidate(self, patient_id: str) -> None:
+        self._reports.pop(patient_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        assembled = stats.pop('assemble_ms')
+        stats['mean_assemble_ms'] = round(assembled / stats['assembled'], 1) if stats['assembled'] else 0.0
+        stats['cache'] = self._reports.stats()
+        return stats
+
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _run_concurrently(jobs: List[Callable[[], Any]]) -> List[Any]:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY, thread_name_prefix='report-fetch')
+    futures = [_pool.submit(job) for job in jobs]
+    return [future.result() for future in futures]
+
+
+def _latest_from_clinical_record(patient_id: str, collections: List[str]) -> Dict[str, Dict[str, Any]]:
+    from clinical_record import latest_sections
+    return latest_sections(patient_id, collections)
+
+
+def _follow_ups_from_cosmos(patient_id: str) -> List[Dict[str, Any]]:
+    from azure_cosmos_db import get_cosmos_db
+    docs = (get_cosmos_db().collection('follow_ups').where('patient_id', '==', patient_id)
+            .order_by('timestamp', direction='DESCENDING').get())
+    return [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+
+
+def _therapist_profile(email: str) -> Optional[Dict[str, Any]]:
+    from user_cache import get_user_profile
+    return get_user_profile(email)
+
+
+_assembler: Optional[ReportAssembler] = None
+_assembler_lock = threading.Lock()
+
+
+def get_report_assembler() -> ReportAssembler:
+    global _assembler
+    if _assembler is None:
+        with _assembler_lock:
+            if _assembler is None:
+                _assembler = ReportAssembler(
+                    _latest_from_clinical_record, _follow_ups_from_cosmos, _therapist_profile,
+                    cache_size=int(os.environ.get('REPORT_CACHE_SIZE', '256')),
+                    cache_ttl=float(os.environ.get('REPORT_CACHE_TTL', '600')),
+                )
+    return _assembler
+
+
+def get_patient_report(patient_doc: Any) -> PatientReport:
+    """Report of a patient document just read (access checks are the caller's job)."""
+    from patient_context import patient_version
+    return get_report_assembler().report(patient_doc.id, patient_doc.to_dict(), patient_version(patient_doc))
+
+
+def get_report_assembly_stats() -> Dict[str, Any]:
+    return _assembler.stats() if _assembler is not None else {}
@@ -0,0 +1,307 @@
+"""
+Precomputed AI summaries for the patient report.
+
+The report page shows three AI summaries (assessment strategy from the
+initial plan, SMART goals, treatment strategy). They used to be generated
+with three synchronous completions on every view, so opening a report took
+tens of seconds and spent quota even when nothing had changed. They are now
+stored in `report_summaries`, one document per patient:
+
+    {'id': <patient id>, 'patient_id': ...,
+     'summaries': {'initial_plan': {'version': 'ab12..', 'text': ..., 'generated_at': ...}, ...},
+     'claims': {'initial_plan': {'version': 'ab12..', 'until': 1767225600}, ...}}
+
+Each summary's version is a hash of exactly the inputs its prompt is built
+from (the patient's history fields and the latest record of each section it
+reads), so editing a section changes the versions of the summaries that
+depend on it and nothing else. A view renders whatever is stored at once;
+summaries whose version no longer matches are shown as stale with a
+"regenerating" state and regenerated on a background thread. A claim with a
+conditional patch makes sure one worker regenerates a given version; a claim
+that isn't fulfilled within CLAIM_SECONDS (the worker died, the AI call
+failed) can be taken over by the next view.
+
+Usage:
+    store = get_report_summary_store()
+    view = store.view(patient_id, patient, sections)
+    view.texts['smart_goals'], view.regenerating
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from ai_prompts import (
+    get_initial_plan_summary_prompt,
+    get_smart_goals_prompt,
+    get_treatment_plan_summary_prompt,
+)
+from data_sanitization import sanitize_age_sex, sanitize_clinical_text, sanitize_subjective_data
+
+logger = logging.getLogger("app.report_summaries")
+
+COLLECTION = 'report_summaries'
+CLAIM_SECONDS = int(os.environ.get('REPORT_SUMMARY_CLAIM_SECONDS', '180'))
+WORKERS = int(os.environ.get('REPORT_SUMMARY_WORKERS', '2'))
+
+# Bump to regenerate every stored summary (e.g. after changing the prompts)
+PROMPT_REVISION = 1
+
+KINDS = ('initial_plan', 'smart_goals', 'treatment_plan')
+
+# Sections (patient_context.SECTION_COLLECTIONS names) each summary is built from
+KIND_SECTIONS = {
+    'initial_plan': ('subjective', 'provisional_diagnosis', 'initial_plan'),
+    'smart_goals': ('subjective', 'perspectives', 'provisional_diagnosis', 'smart_goals'),
+    'treatment_plan': ('subjective', 'provisional_diagnosis', 'smart_goals', 'treatment_plan'),
+}
+
+PATIENT_FIELDS = ('age_sex', 'present_history', 'past_history')
+
+_PLAN_SKIP_FIELDS = ('patient_id', 'timestamp', 'physio_id')
+
+
+def applicable(kind: str, sections: Dict[str, Dict[str, Any]]) -> bool:
+    """Whether the report shows this summary at all (same rules as before precomputing)."""
+    if kind == 'initial_plan':
+        return bool(sections.get('initial_plan'))
+    if kind == 'smart_goals':
+        return bool(sections.get('smart_goals') and sections.get('subjective'))
+    return bool(sections.get('treatment_plan') or sections.get('smart_goals')
+                or sections.get('provisional_diagnosis'))
+
+
+def input_version(kind: str, patient: Dict[str, Any], sections: Dict[str, Dict[str, Any]]) -> str:
+    """Hash of everything the kind's prompt is built from."""
+    inputs = {
+        'revision': PROMPT_REVISION,
+        'kind': kind,
+        'patient': {field: patient.get(field) for field in PATIENT_FIELDS},
+        'sections': {name: sections.get(name) or {} for name in KIND_SECTIONS[kind]},
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def build_prompt(kind: str, patient_id: str, patient: Dict[str, Any],
+                 sections: Dict[str, Dict[str, Any]]) -> str:
+    """The sanitized prompt for one summary."""
+    age_sex = sanitize_age_sex(patient.get("age_sex", ""))
+    present_hist = sanitize_clinical_text(patient.get("present_history", ""))
+    past_hist = sanitize_clinical_text(patient.get("past_history", ""))
+    subjective_data = sanitize_subjective_data(sections.get('subjective') or {})
+    diagnosis = sections.get('provisional_diagnosis') or {}
+    diagnosis_text = sanitize_clinical_text(diagnosis.get("likelihood", ""))
+
+    if kind == 'initial_plan':
+        plan_fields = {name: str(value) for name, value in (sections.get('initial_plan') or {}).items()
+                       if name not in _PLAN_SKIP_FIELDS and value}
+        return get_initial_plan_summary_prompt(
+            age_sex=age_sex,
+            present_hist=present_hist,
+            past_hist=past_hist,
+            subjective=subjective_data,
+            diagnosis=diagnosis_text,
+            plan_fields=sanitize_subjective_data(plan_fields),
+        )
+    if kind == 'smart_goals':
+        return get_smart_goals_prompt(
+            age_sex=age_sex,
+            present_hist=present_hist,
+            past_hist=past_hist,
+            subjective=subjective_data,
+            perspectives=sanitize_subjective_data(sections.get('perspectives') or {}),
+            diagnosis=diagnosis_text,
+        )
+    return get_treatment_plan_summary_prompt(
+        patient_id=patient_id,
+        age_sex=age_sex,
+        present_hist=present_hist,
+        past_hist=past_hist,
+        subjective=subjective_data,
+        diagnosis=diagnosis_text,
+        goals=sanitize_subjective_data(sections.get('smart_goals') or {}),
+        treatment_fields=sanitize_subjective_data(sections.get('treatment_plan') or {}),
+    )
+
+
+def regenerating_kinds(doc: Dict[str, Any], now: Optional[float] = None) -> List[str]:
+    """Kinds with an unexpired claim for a version that isn't stored yet."""
+    now = time.time() if now is None else now
+    summaries = doc.get('summaries') or {}
+    kinds = []
+    for kind, claim in (doc.get('claims') or {}).items():
+        stored = summaries.get(kind) or {}
+        if claim.get('version') != stored.get('version') and claim.get('until', 0) > now:
+            kinds.append(kind)
+    return kinds
+
+
+class SummaryView:
+    """What the report renders: stored texts (possibly stale) and the kinds being regenerated."""
+
+    __slots__ = ('texts', 'regenerating')
+
+    def __init__(self, texts: Dict[str, str], regenerating: List[str]):
+        self.texts = texts
+        self.regenerating = regenerating
+
+
+class ReportSummaryStore:
+    """
+    Args:
+        collection: the report_summaries collection (CosmosDBCollection).
+        generate: generate(prompt, patient_context) -> text. Should raise on
+            failure, so an error message is never stored as a summary.
+        submit: runs a background job (default: a small shared thread pool).
+    """
+
+    def __init__(self, collection: Any, generate: Callable[[str, str], str],
+                 submit: Optional[Callable[[Callable[[], None]], Any]] = None,
+                 clock: Callable[[], float] = time.time):
+        self._collection = collection
+        self._generate = generate
+        self._submit = submit or _submit_background
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = {'views': 0, 'fresh': 0, 'stale': 0, 'claimed': 0, 'generated': 0,
+                       'failed': 0, 'superseded': 0}
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    def view(self, patient_id: str, patient: Dict[str, Any],
+             sections: Dict[str, Dict[str, Any]]) -> SummaryView:
+        """
+        Stored summaries for the report, starting background regeneration of
+        the stale ones. One point read; one conditional patch per stale
+        summary that nobody is regenerating yet.
+        """
+        self._count('views')
+        versions = {kind: input_version(kind, patient, sections) for kind in KINDS if applicable(kind, sections)}
+        if not versions:
+            return SummaryView({kind: '' for kind in KINDS}, [])
+
+        ref = self._collection.document(patient_id)
+        snapshot = ref.get()
+        doc = snapshot.to_dict() if snapshot.exists else {}
+        summaries = doc.get('summaries') or {}
+        claims = doc.get('claims') or {}
+        now = self._clock()
+
+        texts = {kind: '' for kind in KINDS}
+        regenerating, to_claim = [], []
+        for kind, version in versions.items():
+            stored = summaries.get(kind) or {}
+            texts[kind] = stored.get('text') or ''
+            if stored.get('version') == version:
+                self._count('fresh')
+                continue
+            self._count('stale')
+            regenerating.append(kind)
+            claim = claims.get(kind) or {}
+            if claim.get('version') == version and claim.get('until', 0) > now:
+                continue  # another view already started this one
+            to_claim.append(kind)
+
+        if to_claim:
+            won = self._claim(ref, snapshot.exists, patient_id, {k: claims.get(k) for k in to_claim},
+                              {k: versions[k] for k in to_claim}, now)
+            age_sex = sanitize_age_sex(patient.get("age_sex", ""))
+            for kind in won:
+                prompt = build_prompt(kind, patient_id, patient, sections)
+                self._submit(lambda k=kind, p=prompt: self._regenerate(patient_id, k, versions[k], p, age_sex))
+        return SummaryView(texts, regenerating)
+
+    def _claim(self, ref: Any, exists: bool, patient_id: str, old_claims: Dict[str, Optional[Dict[str, Any]]],
+               versions: Dict[str, str], now: float) -> List[str]:
+        """Claim regeneration of these versions; returns the kinds this worker won."""
+        until = int(now) + CLAIM_SECONDS
+        if not exists and ref.create({
+                'patient_id': patient_id, 'summaries': {},
+                'claims': {kind: {'version': version, 'until': until} for kind, version in versions.items()}}):
+            won = list(versions)
+        else:
+            # Also when another first view created the document since our
+            # read: its claims (and any summary already stored) then win
+            won = []
+            for kind, version in versions.items():
+                old = old_claims.get(kind)
+                condition = (f'claims.{kind}.until', '==', old.get('until')) if old else (f'claims.{kind}', 'missing', None)
+                if ref.patch_if({f'claims.{kind}': {'version': version, 'until': until}}, [condition]):
+                    won.append(kind)
+        self._count('claimed', len(won))
+        return won
+
+    def _regenerate(self, patient_id: str, kind: str, version: str, prompt: str, patient_context: str) -> None:
+        try:
+            text = self._generate(prompt, patient_context)
+        except Exception as e:
+            # The claim expires after CLAIM_SECONDS and the next view retries
+            self._count('failed')
+            logger.warning(f"[Patient Report] {kind} summary for {patient_id} failed: {type(e).__name__}: {e}")
+            return
+
+        summary = {'version': version, 'text': text, 'generated_at': datetime.now(timezone.utc).isoformat()}
+        # Only while our claim is current: a newer version claimed meanwhile wins
+        if self._collection.document(patient_id).patch_if(
+                {f'summaries.{kind}': summary}, [(f'claims.{kind}.version', '==', version)]):
+            self._count('generated')
+            logger.info(f"[Patient Report] Generated {kind} summary for {patient_id}")
+        else:
+            self._count('superseded')
+
+    def status(self, patient_id: str) -> Dict[str, Any]:
+        """Stored texts and the kinds still regenerating (for the report page to poll)."""
+        snapshot = self._collection.document(patient_id).get()
+        doc = snapshot.to_dict() if snapshot.exists else {}
+        summaries = doc.get('summaries') or {}
+        return {
+            'summaries': {kind: (summaries.get(kind) or {}).get('text') or '' for kind in KINDS},
+            'regenerating': regenerating_kinds(doc, self._clock()),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _submit_background(job: Callable[[], None]) -> None:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='report-summary')
+    _executor.submit(job)
+
+
+_store: Optional[ReportSummaryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_report_summary_store(generate: Optional[Callable[[str, str], str]] = None) -> ReportSummaryStore:
+    """The worker's store; the first call must pass the generate function."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if generate is None:
+                    raise RuntimeError("get_report_summary_store() needs a generate function on first use")
+                from azure_cosmos_db import get_cosmos_db
+                _store = ReportSummaryStore(get_cosmos_db().collection(COLLECTION), generate)
+    return _store
+
+
+def get_report_summary_stats() -> Dict[str, Any]:
+    return _store.stats() if _store is not None else {}
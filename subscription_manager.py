@@ -17,13 +17,22 @@ import logging
 from datetime import datetime, timedelta, timezone
 # Firebase removed - using Azure Cosmos DB
 from azure_cosmos_db import get_cosmos_db, SERVER_TIMESTAMP
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, Optional, Tuple
+from subscription_state import SubscriptionStateCache, period_end_epoch
+from quota_lease import QuotaLeaseAllocator
+from log_sink import append_log
+from quota_alerts import QUOTA_ALERT_RESET, QUOTA_COUNTERS, alert_marker_field, crossed_threshold
+from user_cache import get_user_profile
 
 logger = logging.getLogger("app.subscription")
 
 # Get Cosmos DB client
 db = get_cosmos_db()
 
+# Normalised subscriptions, kept current by the atomic counter functions
+# below (see subscription_state)
+_states = SubscriptionStateCache()
+
 # ─────────────────────────────────────────────────────────────────────────────
 # PLAN CONFIGURATION
 # ─────────────────────────────────────────────────────────────────────────────
@@ -240,8 +249,8 @@ def _is_super_admin_user(user_id: str) -> bool:
     other admin check -- not a hardcoded email or an inferred quota value.
     """
     try:
-        user_doc = db.collection('users').document(user_id).get()
-        return user_doc.exists and user_doc.to_dict().get('is_super_admin') == 1
+        user_data = get_user_profile(user_id, db)
+        return user_data is not None and user_data.get('is_super_admin') == 1
     except Exception as e:
         logger.error(f"Error checking super admin status for {user_id}: {e}")
         return False
@@ -249,15 +258,44 @@ def _is_super_admin_user(user_id: str) -> bool:
 
 def get_user_subscription(user_id: str) -> Dict:
     """
-    Get user's subscription details from Cosmos DB.
+    Get user's subscription details.
     Creates a free trial subscription if none exists and free trial is enabled.
 
+    Served from the per-worker subscription state cache when possible; the
+    returned dict carries limits already corrected for the account's tier
+    and an `is_super_admin` flag.
+
     Args:
         user_id: User's email or Firebase UID
 
     Returns:
         dict: Subscription data
     """
+    subscription = _states.get(user_id)
+    if subscription is None:
+        subscription = _load_subscription(user_id)
+        subscription.setdefault('is_super_admin', _is_super_admin_user(user_id))
+        _states.put(user_id, subscription)
+    return subscription
+
+
+def invalidate_subscription(user_id: str) -> None:
+    """Drop this worker's cached subscription after a non-atomic write to it."""
+    _states.invalidate(user_id)
+
+
+def get_subscription_cache_stats() -> Dict[str, Any]:
+    return _states.stats()
+
+
+def _record_counter(user_id: str, field: str, new_value) -> None:
+    """Write a counter value returned by an atomic patch through to the cache."""
+    if new_value is not None:
+        _states.set_fields(user_id, **{field: new_value})
+
+
+def _load_subscription(user_id: str) -> Dict:
+    """Read, self-heal and expiry-check subscriptions/{user_id} (uncached)."""
     try:
         # Try to get existing subscription
         sub_doc = db.collection('subscriptions').document(user_id).get()
@@ -280,7 +318,9 @@ def get_user_subscription(user_id: str) -> Dict:
             # what let a manual patch to only ai_calls_limit leave
             # patients_limit stuck on the old free-trial default and break
             # patient creation.
-            quota_tier = 'super_admin' if _is_super_admin_user(user_id) else subscription.get('plan_type')
+            is_super_admin = _is_super_admin_user(user_id)
+            subscription['is_super_admin'] = is_super_admin
+            quota_tier = 'super_admin' if is_super_admin else subscription.get('plan_type')
             plan_def = PLANS.get(quota_tier)
 
             if plan_def:
@@ -494,13 +534,13 @@ def check_user_limit(institute_id: str) -> Tuple[bool, str, int, int]:
 
 def reserve_ai_usage_atomic(user_id: str) -> Tuple[bool, bool, str]:
     """
-    Atomically reserve one AI call before the AI work runs: increments the
-    monthly quota counter, or -- if quota is exhausted -- decrements the
-    token balance, as a single Cosmos DB conditional patch. This closes the
-    check-then-write race where multiple concurrent requests could all read
-    the same pre-increment count and all pass. Callers must roll back with
-    release_ai_usage_atomic() if the request turns out to be a cache hit or
-    the AI call fails.
+    Reserve one AI call before the AI work runs: a unit of monthly quota, or
+    -- if quota is exhausted -- one token from the balance. Units come from
+    this worker's quota lease (see quota_lease), which is filled by a single
+    conditional patch on the subscription document, so the plan limit is
+    still enforced by Cosmos DB and concurrent requests can't both pass it.
+    Callers must hand the unit back with release_ai_usage_atomic() if the
+    request turns out to be a cache hit or the AI call fails.
 
     Args:
         user_id: User's email or Firebase UID
@@ -509,42 +549,22 @@ def reserve_ai_usage_atomic(user_id: str) -> Tuple[bool, bool, str]:
         tuple: (success: bool, used_token: bool, message: str)
     """
     try:
-        # Route through get_user_subscription() first so its self-heal logic
-        # (correcting ai_calls_limit to match the account's real tier) has
-        # run before we trust the stored limit -- same fix as
-        # increment_patient_usage_atomic() below, for the same reason: this
-        # used to read the raw doc directly and skip the correction.
+        # get_user_subscription() has run its self-heal logic (correcting
+        # ai_calls_limit to match the account's real tier) before the lease
+        # trusts the stored limit.
         subscription = get_user_subscription(user_id)
 
         if subscription.get('status') != 'active':
             return False, False, "Your subscription has expired. Please upgrade to continue using AI features."
 
-        ai_calls_limit = subscription.get('ai_calls_limit', 0)
-
-        sub_ref = db.collection('subscriptions').document(user_id)
-
-        # Unlimited AI calls (-1) -- still track usage, nothing to cap
-        if ai_calls_limit == -1:
-            sub_ref.increment_if('ai_calls_this_month', 1, also_set={'updated_at': SERVER_TIMESTAMP})
-            return True, False, ""
-
-        applied, _ = sub_ref.increment_if(
-            'ai_calls_this_month', 1,
-            max_value=ai_calls_limit,
-            also_set={'updated_at': SERVER_TIMESTAMP},
-        )
-        if applied:
+        if _ai_call_leases.take(user_id):
             return True, False, ""
 
         # Monthly quota exhausted -- try to reserve a token instead
-        applied_token, _ = sub_ref.increment_if(
-            'ai_tokens_balance', -1,
-            min_value=1,
-            also_set={'updated_at': SERVER_TIMESTAMP},
-        )
-        if applied_token:
+        if _ai_token_leases.take(user_id):
             return True, True, "Using AI token from your balance"
 
+        ai_calls_limit = subscription.get('ai_calls_limit', 0)
         return False, False, f"AI quota exhausted ({ai_calls_limit} calls). Purchase tokens or upgrade your plan."
 
     except Exception as e:
@@ -554,35 +574,126 @@ def reserve_ai_usage_atomic(user_id: str) -> Tuple[bool, bool, str]:
 
 def release_ai_usage_atomic(user_id: str, used_token: bool) -> None:
     """
-    Roll back a reservation made by reserve_ai_usage_atomic() -- used when
-    the AI call turns out to be a cache hit or the request fails.
+    Hand back a unit reserved by reserve_ai_usage_atomic() -- used when the
+    AI call turns out to be a cache hit or the request fails. The unit goes
+    back into this worker's lease; the subscription document isn't touched.
     """
-    try:
-        sub_ref = db.collection('subscriptions').document(user_id)
-        if used_token:
-            sub_ref.increment_if('ai_tokens_balance', 1, also_set={'updated_at': SERVER_TIMESTAMP})
-        else:
-            sub_ref.increment_if('ai_calls_this_month', -1, also_set={'updated_at': SERVER_TIMESTAMP})
-    except Exception as e:
-        logger.error(f"Error releasing AI usage reservation for {user_id}: {e}")
+    (_ai_token_leases if used_token else _ai_call_leases).give_back(user_id)
+
+
+def _period_condition(period: Optional[str]) -> Tuple[str, str, Any]:
+    """Patch condition: the subscription is still in the billing period a lease was taken in."""
+    if period is None:
+        return ('current_period_start', 'missing', None)
+    return ('current_period_start', '==', period)
+
+
+def _grant_ai_calls(user_id: str, wanted: int) -> Tuple[int, Optional[str]]:
+    """
+    Lease up to `wanted` monthly AI calls with one conditional patch; returns
+    (units granted, billing period they were granted in).
+    """
+    sub_ref = db.collection('subscriptions').document(user_id)
+    for attempt in range(2):
+        subscription = get_user_subscription(user_id)
+        limit = subscription.get('ai_calls_limit', 0)
+        period = subscription.get('current_period_start')
+
+        # Unlimited AI calls (-1) -- still track usage, nothing to cap
+        if limit == -1:
+            _, new_count = sub_ref.increment_if('ai_calls_this_month', wanted, also_set={'updated_at': SERVER_TIMESTAMP})
+            _record_counter(user_id, 'ai_calls_this_month', new_count)
+            return wanted, period
+
+        # Lease less near the limit, so one worker can't sit on the user's last calls
+        remaining = limit - subscription.get('ai_calls_this_month', 0)
+        units = max(1, min(wanted, remaining // 4))
+        while True:
+            # counter + units <= limit in the cached period, evaluated by
+            # Cosmos DB at patch time
+            applied, new_count = sub_ref.increment_if(
+                'ai_calls_this_month', units,
+                max_value=limit - units + 1,
+                also_set={'updated_at': SERVER_TIMESTAMP},
+                conditions=[_period_condition(period)],
+            )
+            if applied:
+                _record_counter(user_id, 'ai_calls_this_month', new_count)
+                if new_count is not None:
+                    notify_quota_crossing(user_id, 'ai', new_count - units, new_count, limit)
+                return units, period
+            if units == 1:
+                break
+            units = 1
+        if remaining <= 0 or attempt:
+            break
+        # The cached counter had room: the quota was probably reset by
+        # another worker since this one cached the subscription
+        invalidate_subscription(user_id)
+    _states.at_least(user_id, 'ai_calls_this_month', limit)
+    return 0, period
+
+
+def _return_ai_calls(user_id: str, units: int, period: Optional[str]) -> None:
+    """Give unused leased calls back to the monthly counter, unless it was reset since."""
+    conditions = [] if period is None else [_period_condition(period)]
+    # min_value also guards returns of unknown period against a reset:
+    # don't push the new period negative
+    applied, new_count = db.collection('subscriptions').document(user_id).increment_if(
+        'ai_calls_this_month', -units,
+        min_value=units,
+        also_set={'updated_at': SERVER_TIMESTAMP},
+        conditions=conditions,
+    )
+    if applied:
+        _record_counter(user_id, 'ai_calls_this_month', new_count)
+    else:
+        logger.info(f"Dropped {units} leased AI calls for {user_id}: the quota was reset since")
+
+
+def _grant_ai_tokens(user_id: str, wanted: int) -> Tuple[int, None]:
+    # Purchased tokens don't reset, so their leases carry no period
+    applied, new_balance = db.collection('subscriptions').document(user_id).increment_if(
+        'ai_tokens_balance', -wanted,
+        min_value=wanted,
+        also_set={'updated_at': SERVER_TIMESTAMP},
+    )
+    if applied:
+        _record_counter(user_id, 'ai_tokens_balance', new_balance)
+        return wanted, None
+    _states.set_fields(user_id, ai_tokens_balance=0)
+    return 0, None
+
+
+def _return_ai_tokens(user_id: str, units: int, period: None) -> None:
+    _, new_balance = db.collection('subscriptions').document(user_id).increment_if(
+        'ai_tokens_balance', units, also_set={'updated_at': SERVER_TIMESTAMP})
+    _record_counter(user_id, 'ai_tokens_balance', new_balance)
+
+
+_ai_call_leases = QuotaLeaseAllocator(_grant_ai_calls, _return_ai_calls, name='ai_calls')
+# Tokens are paid for: lease them one at a time, only cache-hit returns are held locally
+_ai_token_leases = QuotaLeaseAllocator(_grant_ai_tokens, _return_ai_tokens, block_size=1, name='ai_tokens')
+
+
+def get_quota_lease_stats() -> Dict[str, Any]:
+    return {'ai_calls': _ai_call_leases.stats(), 'ai_tokens': _ai_token_leases.stats()}
 
 
 def log_ai_usage(user_id: str, used_token: bool, cache_hit: bool = False) -> None:
     """
-    Record an AI usage log entry and fire quota-threshold notifications.
-    Call this after the AI request completes, once cache_hit is known.
+    Record an AI usage log entry. Call this after the AI request completes,
+    once cache_hit is known. (Quota warnings fire when the lease crosses a
+    threshold, see notify_quota_crossing.)
     """
     try:
-        db.collection('ai_usage_logs').add({
+        append_log('ai_usage_logs', {
             'user_id': user_id,
             'charged': not cache_hit,
             'used_token': used_token,
             'cache_hit': cache_hit,
             'timestamp': SERVER_TIMESTAMP
         })
-
-        if not used_token and not cache_hit:
-            check_and_notify_quota(user_id, 'ai')
     except Exception as e:
         logger.warning(f"Failed to log AI usage for {user_id}: {e}")
 
@@ -626,16 +737,15 @@ def increment_patient_usage_atomic(user_id: str) -> Tuple[bool, int, str]:
         )
 
         if not applied:
+            _states.at_least(user_id, 'patients_created_this_month', limit)
             current_count = subscription.get('patients_created_this_month', 0)
             return False, current_count, f"Patient limit reached ({limit}). Cannot create more patients this month."
+        _record_counter(user_id, 'patients_created_this_month', new_count)
 
         logger.info(f"Incremented patient usage for {user_id}: new count = {new_count}")
 
-        # Check and send quota notifications
-        try:
-            check_and_notify_quota(user_id, 'patients')
-        except Exception as e:
-            logger.warning(f"Failed to check quota notifications: {e}")
+        if new_count is not None:
+            notify_quota_crossing(user_id, 'patients', new_count - 1, new_count, limit)
 
         return True, new_count, ""
 
@@ -672,6 +782,7 @@ def decrement_patient_usage_atomic(user_id: str) -> bool:
             'patients_created_this_month': new_count,
             'updated_at': SERVER_TIMESTAMP
         })
+        _record_counter(user_id, 'patients_created_this_month', new_count)
 
         logger.info(f"Rolled back patient usage for {user_id}: {current_count} → {new_count}")
         return True
@@ -756,34 +867,31 @@ def deduct_voice_usage(user_id: str, duration_seconds: float) -> bool:
             minutes_used = 1
 
         sub_ref = db.collection('subscriptions').document(user_id)
-        sub_doc = sub_ref.get()
-
-        if not sub_doc.exists:
-            return False
 
         # Atomic increment: closes the race where two concurrent deductions
         # both read the same pre-update total and one silently overwrites
-        # the other's write.
-        _, new_total = sub_ref.increment_if(
+        # the other's write. Not applied if there is no subscription document.
+        applied, new_total = sub_ref.increment_if(
             'voice_minutes_used_this_month', minutes_used,
             also_set={'updated_at': SERVER_TIMESTAMP},
         )
+        if not applied:
+            return False
+        _record_counter(user_id, 'voice_minutes_used_this_month', new_total)
 
         logger.info(f"Deducted {minutes_used} minutes of voice typing for {user_id}: total={new_total}")
 
         # Log usage
-        db.collection('voice_usage_logs').add({
+        append_log('voice_usage_logs', {
             'user_id': user_id,
             'duration_seconds': duration_seconds,
             'minutes_charged': minutes_used,
             'timestamp': SERVER_TIMESTAMP
         })
 
-        # Check and send quota notifications
-        try:
-            check_and_notify_quota(user_id, 'voice')
-        except Exception as e:
-            logger.warning(f"Failed to check quota notifications: {e}")
+        if new_total is not None:
+            voice_limit = get_user_subscription(user_id).get('voice_minutes_limit', 0)
+            notify_quota_crossing(user_id, 'voice', new_total - minutes_used, new_total, voice_limit)
 
         return True
 
@@ -838,6 +946,7 @@ def upgrade_subscription(user_id: str, plan_type: str, subscription_id: str = No
             'voice_minutes_used_this_month': 0,
             'voice_minutes_limit': plan.get('voice_minutes_limit', 0),
             'max_users': plan.get('max_users', 1),
+            **QUOTA_ALERT_RESET,
             'updated_at': SERVER_TIMESTAMP
         }
 
@@ -900,6 +1009,7 @@ def upgrade_subscription(user_id: str, plan_type: str, subscription_id: str = No
                 # Don't raise - subscription is already created/updated
                 logger.warning(f"[UPGRADE] Transaction logging failed but subscription was updated")
 
+        invalidate_subscription(user_id)
         logger.info(f"[UPGRADE SUCCESS] {user_id} upgraded to {plan_type} plan")
         return True
 
@@ -934,6 +1044,7 @@ def cancel_subscription(user_id: str, reason: str = None, feedback: str = None)
             update_data['cancellation_feedback'] = feedback
 
         db.collection('subscriptions').document(user_id).update(update_data)
+        invalidate_subscription(user_id)
 
         logger.info(f"Cancelled subscription for {user_id} (reason: {reason})")
         return True
@@ -1050,6 +1161,7 @@ def purchase_ai_calls(user_id: str, package: str, payment_id: str = None,
                 'ai_tokens_purchased_total': total_purchased + calls_to_add,
                 'updated_at': SERVER_TIMESTAMP
             })
+        invalidate_subscription(user_id)
 
         # Log AI call pack purchase
         db.collection('ai_call_purchases').add({
@@ -1120,8 +1232,11 @@ def reset_monthly_quota(user_id: str) -> bool:
                 'voice_minutes_used_this_month': 0,
                 'current_period_start': now.isoformat(),  # Convert to ISO string for JSON serialization
                 'current_period_end': period_end.isoformat(),  # Convert to ISO string for JSON serialization
+                **QUOTA_ALERT_RESET,
                 'updated_at': SERVER_TIMESTAMP
             })
+            invalidate_subscription(user_id)
+            _ai_call_leases.discard(user_id)
 
             logger.info(f"Reset monthly quota for {user_id}")
 
@@ -1246,165 +1361,197 @@ def get_token_packages() -> Dict:
 # NOTIFICATION TRIGGERS
 # ─────────────────────────────────────────────────────────────────────────────
 
+def notify_quota_crossing(user_id: str, quota: str, old: float, new: float, limit: float) -> None:
+    """
+    Send a quota warning if a counter update from `old` to `new` crossed an
+    80/90/100% threshold, at most once per threshold per billing period
+    (see quota_alerts). Called by the atomic counter functions with the
+    value Cosmos returned, so nothing is read here. Never raises.
+    """
+    threshold = crossed_threshold(old, new, limit)
+    if threshold is None:
+        return
+    try:
+        # Claim the per-period marker: only one worker gets 0 -> 1
+        claimed, _ = db.collection('subscriptions').document(user_id).increment_if(
+            alert_marker_field(quota, threshold), 1, max_value=1)
+        if not claimed:
+            return
+
+        from notification_service import notify_quota_warning
+        label = QUOTA_COUNTERS[quota][2]
+        notify_quota_warning(user_id, label, threshold, new, limit)
+        logger.info(f"Sent {threshold}% {label} quota notification to {user_id}")
+    except Exception as e:
+        logger.warning(f"Failed to send {quota} quota notification for {user_id}: {e}")
+
+
 def check_and_notify_quota(user_id: str, quota_type: str = 'all') -> None:
     """
-    Check usage thresholds and create notifications if needed.
+    Evaluate current usage against the thresholds and send any warning not
+    yet sent this period (e.g. after a plan change lowered a limit). Normal
+    usage is covered by notify_quota_crossing.
 
     Args:
         user_id: User's email or Firebase UID
         quota_type: 'ai', 'patients', 'voice', or 'all'
     """
     try:
-        from notification_service import notify_quota_warning
-
         subscription = get_user_subscription(user_id)
 
         if subscription.get('status') != 'active':
             return
 
-        # Check AI quota
-        if quota_type in ['ai', 'all']:
-            ai_calls_used = subscription.get('ai_calls_this_month', 0)
-            ai_calls_limit = subscription.get('ai_calls_limit', 0)
-
-            if ai_calls_limit > 0:
-                ai_percent = (ai_calls_used / ai_calls_limit) * 100
-
-                # Create notification at 80%, 90%, and 100% thresholds.
-                # Uses >= rather than exact == -- a counter that jumps by
-                # more than 1 between checks (e.g. concurrent requests)
-                # could otherwise step over the exact threshold value and
-                # never match, silently skipping the notification.
-                if ai_percent >= 100 and ai_calls_used >= ai_calls_limit:
-                    notify_quota_warning(user_id, 'AI Calls', 100, ai_calls_used, ai_calls_limit)
-                    logger.info(f"Sent 100% AI quota notification to {user_id}")
-                elif ai_percent >= 90 and ai_calls_used >= int(ai_calls_limit * 0.9):
-                    notify_quota_warning(user_id, 'AI Calls', 90, ai_calls_used, ai_calls_limit)
-                    logger.info(f"Sent 90% AI quota notification to {user_id}")
-                elif ai_percent >= 80 and ai_calls_used >= int(ai_calls_limit * 0.8):
-                    notify_quota_warning(user_id, 'AI Calls', 80, ai_calls_used, ai_calls_limit)
-                    logger.info(f"Sent 80% AI quota notification to {user_id}")
-
-        # Check patient quota
-        if quota_type in ['patients', 'all']:
-            patients_used = subscription.get('patients_created_this_month', 0)
-            patients_limit = subscription.get('patients_limit', 0)
-
-            if patients_limit > 0 and patients_limit != -1:  # -1 means unlimited
-                patients_percent = (patients_used / patients_limit) * 100
-
-                # Create notification at 80%, 90%, and 100% thresholds.
-                # Uses >= rather than exact == -- see AI quota section above.
-                if patients_percent >= 100 and patients_used >= patients_limit:
-                    notify_quota_warning(user_id, 'Patients', 100, patients_used, patients_limit)
-                    logger.info(f"Sent 100% patient quota notification to {user_id}")
-                elif patients_percent >= 90 and patients_used >= int(patients_limit * 0.9):
-                    notify_quota_warning(user_id, 'Patients', 90, patients_used, patients_limit)
-                    logger.info(f"Sent 90% patient quota notification to {user_id}")
-                elif patients_percent >= 80 and patients_used >= int(patients_limit * 0.8):
-                    notify_quota_warning(user_id, 'Patients', 80, patients_used, patients_limit)
-                    logger.info(f"Sent 80% patient quota notification to {user_id}")
-
-        # Check voice typing quota
-        if quota_type in ['voice', 'all']:
-            voice_minutes_used = subscription.get('voice_minutes_used_this_month', 0)
-            voice_minutes_limit = subscription.get('voice_minutes_limit', 0)
-
-            if voice_minutes_limit > 0 and voice_minutes_limit != -1:  # -1 means unlimited
-                voice_percent = (voice_minutes_used / voice_minutes_limit) * 100
-
-                # Create notification at 80%, 90%, and 100% thresholds
-                if voice_percent >= 100 and voice_minutes_used >= voice_minutes_limit:
-                    notify_quota_warning(user_id, 'Voice Typing Minutes', 100, voice_minutes_used, voice_minutes_limit)
-                    logger.info(f"Sent 100% voice typing quota notification to {user_id}")
-                elif voice_percent >= 90 and voice_minutes_used >= int(voice_minutes_limit * 0.9):
-                    notify_quota_warning(user_id, 'Voice Typing Minutes', 90, voice_minutes_used, voice_minutes_limit)
-                    logger.info(f"Sent 90% voice typing quota notification to {user_id}")
-                elif voice_percent >= 80 and voice_minutes_used >= int(voice_minutes_limit * 0.8):
-                    notify_quota_warning(user_id, 'Voice Typing Minutes', 80, voice_minutes_used, voice_minutes_limit)
-                    logger.info(f"Sent 80% voice typing quota notification to {user_id}")
+        for quota, (used_field, limit_field, _) in QUOTA_COUNTERS.items():
+            if quota_type in (quota, 'all'):
+                notify_quota_crossing(user_id, quota, 0, subscription.get(used_field, 0),
+                                      subscription.get(limit_field, 0))
 
     except Exception as e:
         logger.error(f"Error checking quota notifications for {user_id}: {e}")
 
 
-def check_subscription_reminders() -> Dict:
-    """
-    Check all subscriptions and send renewal/expiry reminders.
-    Should be called daily by a scheduled job.
+SWEEP_PAGE_SIZE = int(os.environ.get('SUBSCRIPTION_SWEEP_PAGE_SIZE', '100'))
+REMINDER_DAYS = (7, 3, 1)  # Days before expiry to send reminders
 
-    Returns:
-        dict: Summary of notifications sent
-    """
-    try:
-        from notification_service import notify_renewal_reminder, notify_trial_expiring
+# Buckets of active subscriptions the nightly sweep walks: (action, kind, days)
+_SWEEP_BUCKETS = [('expire', kind, None) for kind in ('trial', 'paid')] + [
+    ('remind', kind, days) for days in REMINDER_DAYS for kind in ('trial', 'paid')
+]
 
-        summary = {
-            'renewal_reminders': 0,
-            'trial_expiring': 0,
-            'errors': 0
-        }
 
-        # Get all active subscriptions
-        subscriptions = db.collection('subscriptions').where('status', '==', 'active').stream()
+def _bucket_name(action: str, kind: str, days: Optional[int]) -> str:
+    return f"{action}:{kind}" + (f":{days}" if days is not None else '')
 
-        now = datetime.now(timezone.utc)
-        reminder_days = [7, 3, 1]  # Days before expiry to send reminders
 
-        for sub_doc in subscriptions:
-            try:
-                subscription = sub_doc.to_dict()
-                user_id = sub_doc.id
-                plan_type = subscription.get('plan_type')
+def _end_field(kind: str) -> str:
+    return 'trial_end_date' if kind == 'trial' else 'current_period_end'
 
-                if plan_type == 'free_trial':
-                    # Check trial expiry
-                    trial_end = subscription.get('trial_end_date')
-                    if trial_end:
-                        # Handle both datetime objects and ISO strings
-                        if isinstance(trial_end, str):
-                            try:
-                                trial_end = datetime.fromisoformat(trial_end)
-                            except (ValueError, AttributeError):
-                                trial_end = None
 
-                        if trial_end and isinstance(trial_end, datetime):
-                            # Make trial_end timezone-aware if it isn't already
-                            if trial_end.tzinfo is None:
-                                trial_end = trial_end.replace(tzinfo=timezone.utc)
-                            days_remaining = (trial_end - now).days
+def _sweep_bucket_query(bucket: Tuple[str, str, Optional[int]], day_start: datetime, cutoff: str):
+    """
+    Query for one bucket. Expiry buckets hold everything that ended before
+    the run's cutoff; reminder buckets hold subscriptions ending on calendar
+    day today + N (UTC). End dates are stored as UTC ISO strings, so range
+    conditions on the strings match range conditions on the dates.
+    """
+    action, kind, days = bucket
+    query = db.collection('subscriptions').where('status', '==', 'active')
+    query = query.where('plan_type', '==' if kind == 'trial' else '!=', 'free_trial')
+    field = _end_field(kind)
+    if action == 'expire':
+        return query.where(field, '<', cutoff)
+    window_start = day_start + timedelta(days=days)
+    return (query.where(field, '>=', window_start.isoformat())
+                 .where(field, '<', (window_start + timedelta(days=1)).isoformat()))
+
+
+def _sweep_subscription(bucket: Tuple[str, str, Optional[int]], sub_doc, cutoff: str) -> str:
+    """
+    Expire or remind one subscription. Every write is a conditional patch
+    re-checking the bucket's condition on the stored document, so a page
+    processed twice (resume, overlapping runs) changes nothing the second time.
+    """
+    from notification_service import notify_renewal_reminder, notify_trial_expiring
+
+    action, kind, days = bucket
+    user_id = sub_doc.id
+    subscription = sub_doc.to_dict()
+    field = _end_field(kind)
+    end = period_end_epoch(subscription)
+    if end is None:
+        return 'skipped'
+    sub_ref = db.collection('subscriptions').document(user_id)
+
+    if action == 'expire':
+        if not sub_ref.patch_if({'status': 'expired', 'updated_at': SERVER_TIMESTAMP},
+                                [('status', '==', 'active'), (field, '<', cutoff)]):
+            return 'skipped'
+        invalidate_subscription(user_id)
+        logger.info(f"Expired {kind} subscription for {user_id}")
+        return 'expired'
+
+    # At most one reminder per (period end, day): claim it before sending
+    marker = f"{subscription.get(field)}|{days}"
+    if not sub_ref.patch_if({'last_reminder': marker},
+                            [('status', '==', 'active'), ('last_reminder', '!=', marker)]):
+        return 'skipped'
+    if kind == 'trial':
+        notify_trial_expiring(user_id, days)
+        logger.info(f"Sent trial expiring notification to {user_id} ({days} days)")
+        return 'trial_expiring'
+    plan_type = subscription.get('plan_type')
+    plan_name = PLANS.get(plan_type, {}).get('name', plan_type)
+    renewal_date = datetime.fromtimestamp(end, timezone.utc).strftime('%B %d, %Y')
+    notify_renewal_reminder(user_id, plan_name, days, renewal_date)
+    logger.info(f"Sent renewal reminder to {user_id} ({days} days)")
+    return 'renewal_reminders'
 
-                            if days_remaining in reminder_days:
-                                notify_trial_expiring(user_id, days_remaining)
-                                summary['trial_expiring'] += 1
-                                logger.info(f"Sent trial expiring notification to {user_id} ({days_remaining} days)")
-                else:
-                    # Check subscription renewal
-                    period_end = subscription.get('current_period_end')
-                    if period_end:
-                        # Handle both datetime objects and ISO strings
-                        if isinstance(period_end, str):
-                            try:
-                                period_end = datetime.fromisoformat(period_end)
-                            except (ValueError, AttributeError):
-                                period_end = None
 
-                        if period_end and isinstance(period_end, datetime):
-                            # Make period_end timezone-aware if it isn't already
-                            if period_end.tzinfo is None:
-                                period_end = period_end.replace(tzinfo=timezone.utc)
-                            days_remaining = (period_end - now).days
+def check_subscription_reminders() -> Dict:
+    """
+    Nightly subscription sweep: expire lapsed trials and paid periods and
+    send renewal/expiry reminders. Should be called daily by a scheduled job.
 
-                            if days_remaining in reminder_days:
-                                plan_name = PLANS.get(plan_type, {}).get('name', plan_type)
-                                renewal_date = period_end.strftime('%B %d, %Y')
-                                notify_renewal_reminder(user_id, plan_name, days_remaining, renewal_date)
-                                summary['renewal_reminders'] += 1
-                                logger.info(f"Sent renewal reminder to {user_id} ({days_remaining} days)")
+    Only subscriptions due for something are read: each bucket (see
+    _SWEEP_BUCKETS) is a query paged with continuation tokens, processed with
+    bounded parallelism by SweepEngine, and checkpointed per page in
+    maintenance_checkpoints/subscription_sweep_{date}, so a rerun on the same
+    day resumes instead of starting over. Items are processed with
+    sweep_engine.SWEEP_PARALLELISM threads. Paid renewals (quota reset) still
+    happen in the subscription.charged webhook via reset_monthly_quota().
 
-            except Exception as e:
-                logger.error(f"Error processing subscription for {sub_doc.id}: {e}")
-                summary['errors'] += 1
+    A subscription read after its end date is still expired on load by
+    _load_subscription, so access stops on time; the sweep covers the
+    accounts nobody reads and sends the reminders.
+
+    Returns:
+        dict: Summary of notifications sent, expiries and sweep throughput
+    """
+    try:
+        from sweep_engine import SweepEngine
+
+        now = datetime.now(timezone.utc)
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        checkpoint_ref = db.collection('maintenance_checkpoints').document(
+            f"subscription_sweep_{day_start.strftime('%Y%m%d')}")
+        checkpoint_doc = checkpoint_ref.get()
+        checkpoint = checkpoint_doc.to_dict() if checkpoint_doc.exists else None
+        # Keep the first run's cutoff so resumed continuation tokens match their query
+        cutoff = (checkpoint or {}).get('cutoff') or now.isoformat()
+
+        buckets = {_bucket_name(*bucket): bucket for bucket in _SWEEP_BUCKETS}
+
+        def fetch_page(name, token):
+            return _sweep_bucket_query(buckets[name], day_start, cutoff).page(SWEEP_PAGE_SIZE, token)
+
+        def save_checkpoint(state):
+            checkpoint_ref.set({**state, 'cutoff': cutoff, 'updated_at': SERVER_TIMESTAMP})
+
+        engine = SweepEngine(
+            'subscription_sweep', list(buckets),
+            fetch_page=fetch_page,
+            process=lambda name, sub_doc: _sweep_subscription(buckets[name], sub_doc, cutoff),
+            load_checkpoint=lambda: checkpoint,
+            save_checkpoint=save_checkpoint,
+        )
+        report = engine.run()
+
+        counts = report['counts']
+        summary = {
+            'renewal_reminders': counts.get('renewal_reminders', 0),
+            'trial_expiring': counts.get('trial_expiring', 0),
+            'expired': counts.get('expired', 0),
+            'skipped': counts.get('skipped', 0),
+            'errors': counts.get('errors', 0),
+            'subscriptions_swept': report['items'],
+            'pages': report['pages'],
+            'seconds': report['seconds'],
+            'items_per_second': report['items_per_second'],
+            'resumed': report['resumed'],
+        }
+        if report.get('already_completed'):
+            summary['already_completed'] = True
 
         logger.info(f"Subscription reminder check complete: {summary}")
         return summary
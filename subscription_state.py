@@ -0,0 +1,126 @@
+"""
+Per-worker cache of normalised subscription state for the quota gatekeepers.
+
+get_user_subscription() reads subscriptions/{user} and users/{user} and may
+write self-heal fixes; require_ai_quota, require_patient_quota,
+require_voice_quota, check_subscription_status and add_usage_info_to_response
+used to run it (again) on every request. subscription_manager now keeps the
+normalised result -- limits already resolved from PLANS for the account's
+quota tier, `is_super_admin` included -- in this cache, and the atomic
+reserve/release/increment functions write the counter values Cosmos returns
+from their patches straight back into it (write-through). A warm
+gatekeeping check therefore costs no reads.
+
+The counters are still enforced by the conditional patches themselves; the
+cached copy only has to be good enough for advisory checks and display, and
+it is at most SUBSCRIPTION_CACHE_TTL seconds behind writes made on other
+workers. Entries of active subscriptions also drop out once their trial or
+billing period ends, so expiry is never served from cache.
+
+Usage:
+    from subscription_state import SubscriptionStateCache
+
+    _states = SubscriptionStateCache()
+    subscription = _states.get(user_id)
+    if subscription is None:
+        subscription = load_and_normalise(user_id)
+        _states.put(user_id, subscription)
+
+    applied, new_value = sub_ref.increment_if('ai_calls_this_month', 1, ...)
+    if applied:
+        _states.set_fields(user_id, ai_calls_this_month=new_value)
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from ttl_cache import TTLCache
+
+SUBSCRIPTION_CACHE_SIZE = int(os.environ.get('SUBSCRIPTION_CACHE_SIZE', '4096'))
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get('SUBSCRIPTION_CACHE_TTL', '30'))
+
+
+def period_end_epoch(subscription: Dict[str, Any]) -> Optional[float]:
+    """
+    Epoch seconds at which an active subscription lapses (trial end for free
+    trials, current_period_end otherwise), or None if it has no end date.
+    """
+    field = 'trial_end_date' if subscription.get('plan_type') == 'free_trial' else 'current_period_end'
+    end = subscription.get(field)
+    if isinstance(end, str):
+        try:
+            end = datetime.fromisoformat(end)
+        except ValueError:
+            return None
+    if not isinstance(end, datetime):
+        return None
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    return end.timestamp()
+
+
+class _Entry:
+    __slots__ = ('data', 'ends_at')
+
+    def __init__(self, data: Dict[str, Any], ends_at: Optional[float]):
+        self.data = data
+        self.ends_at = ends_at
+
+
+class SubscriptionStateCache:
+    """Thread-safe user_id -> normalised subscription dict, with write-through updates."""
+
+    def __init__(self, maxsize: int = SUBSCRIPTION_CACHE_SIZE, ttl: float = SUBSCRIPTION_CACHE_TTL,
+                 clock: Callable[[], float] = time.time):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl, name='subscription_state')
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.write_throughs = 0
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Copy of the cached subscription, or None on a miss."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        with self._lock:
+            lapsed = (entry.ends_at is not None and entry.data.get('status') == 'active'
+                      and self._clock() >= entry.ends_at)
+            if not lapsed:
+                return dict(entry.data)
+        # Lapsed since it was cached: reload so the expiry gets applied
+        self._entries.pop(user_id)
+        return None
+
+    def put(self, user_id: str, subscription: Dict[str, Any]) -> None:
+        self._entries.set(user_id, _Entry(dict(subscription), period_end_epoch(subscription)))
+
+    def set_fields(self, user_id: str, **fields: Any) -> None:
+        """Apply values just written to Cosmos (no-op if the user isn't cached)."""
+        entry = self._entries.peek(user_id)
+        if entry is None:
+            return
+        with self._lock:
+            entry.data.update(fields)
+            self.write_throughs += 1
+
+    def at_least(self, user_id: str, field: str, value: float) -> None:
+        """Record that a counter is known to be >= value (e.g. a capped increment was rejected)."""
+        entry = self._entries.peek(user_id)
+        if entry is None:
+            return
+        with self._lock:
+            if (entry.data.get(field) or 0) < value:
+                entry.data[field] = value
+                self.write_throughs += 1
+
+    def invalidate(self, user_id: str) -> None:
+        self._entries.pop(user_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._entries.stats(), 'write_throughs': self.write_throughs}
@@ -0,0 +1,140 @@
+"""
+Resumable, paged sweeps over query buckets.
+
+The daily subscription job used to stream every active subscription into
+memory and walk it one document at a time, so it slowed down linearly with
+the user base and a crash or request timeout meant starting over. A sweep
+instead walks a fixed list of buckets (e.g. "trials ending in 3 days"), each
+read one page at a time with a continuation token. Items of a page are
+processed with bounded parallelism, and after every page the position
+(bucket index + continuation token) and running counts are checkpointed,
+so a rerun the same day picks up after the last finished page.
+
+Processing must be idempotent: a page interrupted halfway is processed
+again on resume.
+
+The query, the per-item work and the checkpoint store are injected (see
+subscription_manager.check_subscription_reminders), so this module has no
+database dependency.
+
+Usage:
+    engine = SweepEngine('subscriptions', buckets, fetch_page, process,
+                         load_checkpoint, save_checkpoint)
+    report = engine.run()
+"""
+
+import os
+import time
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("app.sweep_engine")
+
+SWEEP_PARALLELISM = int(os.environ.get('SWEEP_PARALLELISM', '8'))
+
+# (items, continuation token of the next page or None)
+Page = Tuple[List[Any], Optional[str]]
+
+
+class SweepEngine:
+    """
+    Args:
+        buckets: bucket names, swept in order.
+        fetch_page: (bucket, continuation_token) -> (items, next_token).
+        process: (bucket, item) -> outcome name; outcomes are counted in the
+            report. Exceptions are counted as 'errors'.
+        load_checkpoint: () -> checkpoint dict or None.
+        save_checkpoint: checkpoint dict -> None.
+    """
+
+    def __init__(self, job: str, buckets: Sequence[str],
+                 fetch_page: Callable[[str, Optional[str]], Page],
+                 process: Callable[[str, Any], str],
+                 load_checkpoint: Callable[[], Optional[Dict[str, Any]]],
+                 save_checkpoint: Callable[[Dict[str, Any]], None],
+                 parallelism: int = SWEEP_PARALLELISM,
+                 clock: Callable[[], float] = time.monotonic):
+        self.job = job
+        self.buckets = list(buckets)
+        self._fetch_page = fetch_page
+        self._process = process
+        self._load_checkpoint = load_checkpoint
+        self._save_checkpoint = save_checkpoint
+        self.parallelism = max(1, parallelism)
+        self._clock = clock
+
+    def run(self) -> Dict[str, Any]:
+        """Sweep every bucket, resuming from the checkpoint. Returns a report."""
+        checkpoint = self._load_checkpoint() or {}
+        resumed = bool(checkpoint) and not checkpoint.get('completed')
+        if checkpoint.get('completed'):
+            logger.info(f"Sweep {self.job}: already completed")
+            return self._report(checkpoint, 0.0, resumed=False, skipped=True)
+
+        bucket_index = checkpoint.get('bucket', 0)
+        token = checkpoint.get('token')
+        counts = Counter(checkpoint.get('counts', {}))
+        pages = checkpoint.get('pages', 0)
+        items = checkpoint.get('items', 0)
+        if resumed:
+            logger.info(f"Sweep {self.job}: resuming at bucket {bucket_index} after {items} items")
+
+        items_before = items
+        started = self._clock()
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            while bucket_index < len(self.buckets):
+                bucket = self.buckets[bucket_index]
+                page, token = self._fetch_page(bucket, token)
+                for outcome in pool.map(lambda item: self._process_one(bucket, item), page):
+                    counts[outcome] += 1
+                pages += 1
+                items += len(page)
+                if token is None:
+                    bucket_index += 1
+                self._checkpoint(bucket_index, token, counts, pages, items, completed=False)
+
+        state = self._checkpoint(bucket_index, None, counts, pages, items, completed=True)
+        return self._report(state, self._clock() - started, resumed=resumed,
+                            swept=items - items_before)
+
+    def _process_one(self, bucket: str, item: Any) -> str:
+        try:
+            return self._process(bucket, item)
+        except Exception as e:
+            logger.error(f"Sweep {self.job}: item in {bucket} failed: {type(e).__name__}: {e}")
+            return 'errors'
+
+    def _checkpoint(self, bucket_index: int, token: Optional[str], counts: Counter,
+                    pages: int, items: int, completed: bool) -> Dict[str, Any]:
+        state = {
+            'bucket': bucket_index,
+            'token': token,
+            'counts': dict(counts),
+            'pages': pages,
+            'items': items,
+            'completed': completed,
+        }
+        try:
+            self._save_checkpoint(state)
+        except Exception as e:
+            # Losing a checkpoint only costs repeated (idempotent) work on rerun
+            logger.warning(f"Sweep {self.job}: could not save checkpoint: {type(e).__name__}")
+        return state
+
+    def _report(self, state: Dict[str, Any], seconds: float, resumed: bool,
+                swept: int = 0, skipped: bool = False) -> Dict[str, Any]:
+        report = {
+            'job': self.job,
+            'counts': dict(state.get('counts', {})),
+            'items': state.get('items', 0),
+            'pages': state.get('pages', 0),
+            'seconds': round(seconds, 3),
+            # Throughput of this run only (a resumed run skips finished pages)
+            'items_per_second': round(swept / seconds, 1) if seconds > 0 else None,
+            'resumed': resumed,
+        }
+        if skipped:
+            report['already_completed'] = True
+        return report
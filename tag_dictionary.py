@@ -0,0 +1,234 @@
+"""
+Tag dictionaries: the tags in use per physiotherapist and per institute.
+
+Tag suggestions (web /tags/suggestions, mobile /api/tags/suggestions) and
+the patient list's tag filter used to rebuild the vocabulary by streaming
+every patient of the user or institute and collecting `tags`. Each owner --
+('physio_id', email) and ('institute', name) of the patient -- now has one
+document in `tag_dictionaries`:
+
+    {'id': 'physio_id:ann@x.com', 'tags': {'Spine': {'count': 12, 'last_used': '...'}}, 'version': 7}
+
+where count is the number of the owner's patients carrying the tag and
+last_used is when it was last added to one of them.
+
+- Writes: set_patient_tags() replaces a patient's tags with a conditional
+  patch on the patient's _etag, so the tags it diffs against are exactly the
+  ones it replaced (a concurrent edit makes it re-read and retry). The
+  difference is then applied to both owners' dictionaries with a version
+  compare-and-swap. Creating and deleting a patient go through
+  record_tag_change() the same way.
+- Reads: dictionaries are cached per worker for TAG_DICTIONARY_CACHE_SECONDS
+  (this worker's own writes update the cached copy), so suggestions cost at
+  most one point read.
+
+backfill_tag_dictionaries.py builds the documents from the patients
+container, and can be re-run to correct drift.
+
+Usage:
+    set_patient_tags(patient_ref, patient, ['Spine', 'Acute Pain'])
+    tags = get_tag_dictionary().tags([('physio_id', email)])
+"""
+
+import os
+import re
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.tag_dictionary")
+
+CACHE_SECONDS = float(os.environ.get('TAG_DICTIONARY_CACHE_SECONDS', '60'))
+CACHE_SIZE = int(os.environ.get('TAG_DICTIONARY_CACHE_SIZE', '5000'))
+CAS_ATTEMPTS = 3
+
+COLLECTION = 'tag_dictionaries'
+
+# Offered to everyone alongside their own tags
+DEFAULT_TAGS = [
+    'Sports Injury', 'Post-Surgery', 'Chronic Pain', 'Acute Pain',
+    'Neurological', 'Orthopedic', 'Pediatric', 'Geriatric',
+    'Work-Related', 'Motor Vehicle Accident', 'Falls',
+    'Upper Extremity', 'Lower Extremity', 'Spine',
+    'High Priority', 'Follow-Up Required', 'Discharged'
+]
+
+Owner = Tuple[str, str]
+# tag -> {'count': int, 'last_used': iso str}
+TagTable = Dict[str, Dict[str, Any]]
+
+
+def document_id(owner: Owner) -> str:
+    # '/', '\\', '?' and '#' aren't allowed in Cosmos DB ids
+    return re.sub(r'[/\\?#]', '_', f'{owner[0]}:{owner[1]}')
+
+
+def patient_owners(patient: Dict[str, Any]) -> List[Owner]:
+    """Dictionaries a patient's tags count towards."""
+    return [(field, patient[field]) for field in ('physio_id', 'institute') if patient.get(field)]
+
+
+def tag_deltas(old: Optional[Iterable[str]], new: Optional[Iterable[str]]) -> Dict[str, int]:
+    old_set, new_set = set(old or []), set(new or [])
+    deltas = {tag: 1 for tag in new_set - old_set}
+    deltas.update({tag: -1 for tag in old_set - new_set})
+    return deltas
+
+
+def apply_tag_deltas(table: TagTable, deltas: Dict[str, int], at: str) -> None:
+    """Add deltas to table in place; tags counted down to zero are dropped."""
+    for tag, delta in deltas.items():
+        entry = table.get(tag) or {'count': 0, 'last_used': None}
+        count = int(entry.get('count') or 0) + delta
+        if count <= 0:
+            table.pop(tag, None)
+            continue
+        table[tag] = {'count': count, 'last_used': at if delta > 0 else entry.get('last_used')}
+
+
+class TagDictionary:
+    """
+    Args:
+        load: load(owner) -> (tags table as stored, version), or None if the
+            owner has no document yet.
+        save: save(owner, table, expected_version) -> bool; writes the
+            document if its version is still expected_version (None: the
+            document doesn't exist yet).
+    """
+
+    def __init__(self, load: Callable[[Owner], Optional[Tuple[TagTable, int]]],
+                 save: Callable[[Owner, TagTable, Optional[int]], bool],
+                 cache_seconds: float = CACHE_SECONDS, cache_size: int = CACHE_SIZE,
+                 now: Callable[[], str] = lambda: datetime.now(timezone.utc).isoformat()):
+        self._load = load
+        self._save = save
+        self._now = now
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_seconds, name='tag_dictionary')
+
+    def table(self, owner: Owner) -> TagTable:
+        table = self._cache.get(owner)
+        if table is None:
+            stored = self._load(owner)
+            table = dict(stored[0]) if stored is not None else {}
+            self._cache.set(owner, table)
+        return table
+
+    def tags(self, owners: Sequence[Owner], include_defaults: bool = False) -> List[str]:
+        """Sorted tags in use by any of the owners."""
+        found = set(DEFAULT_TAGS) if include_defaults else set()
+        for owner in owners:
+            if owner[1]:
+                found.update(self.table(owner))
+        return sorted(found)
+
+    def apply(self, owner: Owner, deltas: Dict[str, int]) -> bool:
+        if not deltas:
+            return True
+        at = self._now()
+        for _ in range(CAS_ATTEMPTS):
+            stored = self._load(owner)
+            table, version = (dict(stored[0]), stored[1]) if stored is not None else ({}, None)
+            apply_tag_deltas(table, deltas, at)
+            if self._save(owner, table, version):
+                self._cache.set(owner, table)
+                return True
+        logger.warning(f"Tag dictionary {document_id(owner)} not updated: concurrent updates")
+        self._cache.pop(owner)
+        return False
+
+    def record(self, patient: Dict[str, Any], old_tags: Optional[Iterable[str]],
+               new_tags: Optional[Iterable[str]]) -> None:
+        deltas = tag_deltas(old_tags, new_tags)
+        for owner in patient_owners(patient):
+            self.apply(owner, deltas)
+
+    def forget(self, owner: Owner) -> None:
+        self._cache.pop(owner)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+_dictionary: Optional[TagDictionary] = None
+_dictionary_lock = threading.Lock()
+
+
+def _load_from_cosmos(owner: Owner) -> Optional[Tuple[TagTable, int]]:
+    from azure_cosmos_db import get_cosmos_db
+    doc = get_cosmos_db().collection(COLLECTION).document(document_id(owner)).get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    return data.get('tags') or {}, int(data.get('version') or 0)
+
+
+def _save_to_cosmos(owner: Owner, table: TagTable, expected_version: Optional[int]) -> bool:
+    from azure_cosmos_db import get_cosmos_db, SERVER_TIMESTAMP
+    ref = get_cosmos_db().collection(COLLECTION).document(document_id(owner))
+    if expected_version is None:
+        # First write for this owner; if another one created it first,
+        # apply() re-reads and retries against that document
+        return ref.create({'owner_field': owner[0], 'owner': owner[1], 'tags': table,
+                           'version': 1, 'updated_at': SERVER_TIMESTAMP})
+    return ref.patch_if({'tags': table, 'updated_at': SERVER_TIMESTAMP},
+                        conditions=[('version', '==', expected_version)],
+                        increments={'version': 1})
+
+
+def get_tag_dictionary() -> TagDictionary:
+    global _dictionary
+    if _dictionary is None:
+        with _dictionary_lock:
+            if _dictionary is None:
+                _dictionary = TagDictionary(_load_from_cosmos, _save_to_cosmos)
+    return _dictionary
+
+
+def record_tag_change(patient: Dict[str, Any], old_tags: Optional[Iterable[str]],
+                      new_tags: Optional[Iterable[str]]) -> None:
+    """
+    Count a patient's tags changing from old_tags to new_tags (None/[] for a
+    created or deleted patient). Never raises: the patient write already
+    happened, and the backfill corrects a missed update.
+    """
+    try:
+        get_tag_dictionary().record(patient, old_tags, new_tags)
+    except Exception as e:
+        logger.warning(f"Could not update tag dictionaries: {type(e).__name__}: {e}")
+
+
+def set_patient_tags(patient_ref: Any, patient: Dict[str, Any], tags: List[str]) -> bool:
+    """
+    Replace a patient's tags and count the change. patient is the document
+    as read (with _etag); on a concurrent edit it is re-read and the swap
+    retried. Returns False if the patient was deleted or kept changing.
+    """
+    for _ in range(CAS_ATTEMPTS):
+        etag = patient.get('_etag')
+        if etag:
+            replaced = patient_ref.patch_if({'tags': tags}, conditions=[('_etag', '==', etag)])
+        else:
+            patient_ref.update({'tags': tags})
+            replaced = True
+        if replaced:
+            record_tag_change(patient, patient.get('tags'), tags)
+            return True
+        current = patient_ref.get()
+        if not current.exists:
+            return False
+        patient = current.to_dict()
+    return False
+
+
+def delete_tag_dictionary(owner: Owner) -> None:
+    """Delete an owner's dictionary (its account is being deleted)."""
+    from azure_cosmos_db import get_cosmos_db
+    get_cosmos_db().collection(COLLECTION).document(document_id(owner)).delete()
+    get_tag_dictionary().forget(owner)
+
+
+def get_tag_dictionary_stats() -> Dict[str, Any]:
+    return get_tag_dictionary().stats()
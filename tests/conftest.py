@@ -66,6 +66,12 @@ def app(test_env):
     """
     # Import here to avoid issues with environment variables
     from main import app as flask_app
+    from user_cache import clear_user_cache
+    from subscription_manager import _states as subscription_states
+
+    # Per-worker caches must not carry users over between tests
+    clear_user_cache()
+    subscription_states.clear()
 
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_ENABLED'] = False  # Disable CSRF for tests
@@ -0,0 +1,162 @@
+"""
+Tests for per-endpoint AI model policies (ai_model_policy.py).
+
+A fake client stands in for AzureOpenAIClient; deployments are switched by
+monkeypatching the module-level configuration.
+"""
+
+import time
+
+import pytest
+import ai_model_policy
+from ai_cache import get_ai_suggestion_with_cache
+from ai_model_policy import DEFAULT_POLICY, get_model_policy, run_chat_completion
+
+
+class FakeClient:
+    def __init__(self, fail_models=()):
+        self.calls = []
+        self.fail_models = set(fail_models)
+
+    def create_chat_completion(self, model, messages, temperature, max_tokens, response_format):
+        self.calls.append({'model': model, 'temperature': temperature,
+                           'max_tokens': max_tokens, 'response_format': response_format})
+        if model in self.fail_models:
+            raise RuntimeError('deployment unavailable')
+        return {'text': f'answer from {model}', 'model': model, 'usage': {}}
+
+
+class FakeCacheDB:
+    """ai_cache / ai_analytics / ai_training_data containers for AICache."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def collection(self, name):
+        docs = self.docs.setdefault(name, {})
+
+        class Ref:
+            def __init__(self, doc_id):
+                self.id = doc_id
+
+            def get(self):
+                data = docs.get(self.id)
+                return type('Doc', (), {'exists': data is not None, 'to_dict': lambda _: dict(data)})()
+
+            def set(self, data):
+                docs[self.id] = dict(data)
+
+            def update(self, data):
+                docs[self.id].update(data)
+
+        class Collection:
+            def document(self, doc_id):
+                return Ref(doc_id)
+
+            def add(self, data):
+                docs[len(docs)] = dict(data)
+
+        return Collection()
+
+
+MESSAGES = [{'role': 'user', 'content': 'classify'}]
+
+
+@pytest.fixture(autouse=True)
+def no_overrides(monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'TEMPERATURE_OVERRIDE', None)
+    monkeypatch.setattr(ai_model_policy, 'MAX_TOKENS_OVERRIDE', None)
+
+
+@pytest.fixture
+def small_deployment(monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'PRIMARY_DEPLOYMENT', 'gpt-4o')
+    monkeypatch.setattr(ai_model_policy, 'SMALL_DEPLOYMENT', 'gpt-4o-mini')
+    monkeypatch.setattr(ai_model_policy, 'DOWNGRADE_ENABLED', True)
+    monkeypatch.setattr(ai_model_policy, 'SHADOW_EVAL_RATE', 0.0)
+
+
+@pytest.mark.unit
+def test_policy_lookup_first_match_wins():
+    assert get_model_policy('quick_mode_patho_mechanism').json_mode is True
+    assert get_model_policy('clinical_flags_suggest').downgrade is True
+    assert get_model_policy('treatment_plan_summary') == DEFAULT_POLICY
+    assert get_model_policy('subjective_present_history') == DEFAULT_POLICY
+
+
+@pytest.mark.unit
+def test_without_small_deployment_everything_stays_on_primary(monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'SMALL_DEPLOYMENT', '')
+    client = FakeClient()
+    run_chat_completion(client, MESSAGES, endpoint='clinical_flags')
+    assert client.calls[0]['model'] == ai_model_policy.PRIMARY_DEPLOYMENT
+    assert client.calls[0]['max_tokens'] == 1500
+
+
+@pytest.mark.unit
+def test_short_structured_endpoints_downgrade(small_deployment):
+    client = FakeClient()
+    resp = run_chat_completion(client, MESSAGES, endpoint='quick_mode_risk_flags')
+    assert resp['model'] == 'gpt-4o-mini'
+    assert client.calls[0]['response_format'] == {'type': 'json_object'}
+
+    run_chat_completion(client, MESSAGES, endpoint='treatment_plan_summary')
+    assert client.calls[1]['model'] == 'gpt-4o'
+    assert client.calls[1]['max_tokens'] == 3500
+
+
+@pytest.mark.unit
+def test_failed_small_deployment_retries_on_primary(small_deployment):
+    client = FakeClient(fail_models={'gpt-4o-mini'})
+    resp = run_chat_completion(client, MESSAGES, endpoint='clinical_flags')
+    assert [c['model'] for c in client.calls] == ['gpt-4o-mini', 'gpt-4o']
+    assert resp['model'] == 'gpt-4o'
+
+
+@pytest.mark.unit
+def test_downgrade_can_be_switched_off(small_deployment, monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'DOWNGRADE_ENABLED', False)
+    client = FakeClient()
+    run_chat_completion(client, MESSAGES, endpoint='clinical_flags')
+    assert client.calls[0]['model'] == 'gpt-4o'
+
+
+@pytest.mark.unit
+def test_shadow_eval_replays_on_other_tier(small_deployment, monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'SHADOW_EVAL_RATE', 1.0)
+    shadowed = []
+    monkeypatch.setattr(ai_model_policy, '_shadow_eval',
+                        lambda client, endpoint, kwargs, served, shadow_model: shadowed.append(shadow_model))
+    run_chat_completion(FakeClient(), MESSAGES, endpoint='clinical_flags')
+    # the thread runs the patched function; give it a moment
+    for _ in range(50):
+        if shadowed:
+            break
+        time.sleep(0.01)
+    assert shadowed == ['gpt-4o']
+
+
+@pytest.mark.unit
+def test_environment_overrides_take_precedence(monkeypatch):
+    monkeypatch.setattr(ai_model_policy, 'TEMPERATURE_OVERRIDE', 0.0)
+    monkeypatch.setattr(ai_model_policy, 'MAX_TOKENS_OVERRIDE', 1000)
+    client = FakeClient()
+    run_chat_completion(client, MESSAGES, endpoint='treatment_plan_summary')
+    assert client.calls[0]['temperature'] == 0.0 and client.calls[0]['max_tokens'] == 1000
+    policy = get_model_policy('quick_mode_risk_flags')
+    assert policy.json_mode is True and policy.max_tokens == 1000
+
+
+@pytest.mark.unit
+def test_fallback_answer_is_cached_under_the_primary(small_deployment):
+    db, client = FakeCacheDB(), FakeClient(fail_models={'gpt-4o-mini'})
+    metadata = {'endpoint': 'clinical_flags'}
+    assert get_ai_suggestion_with_cache(db, 'classify', openai_client=client,
+                                        metadata=metadata) == 'answer from gpt-4o'
+    assert [doc['model'] for doc in db.docs['ai_cache'].values()] == ['gpt-4o']
+
+    # Once the small deployment is back, its answer isn't shadowed by the primary's
+    client.fail_models.clear()
+    assert get_ai_suggestion_with_cache(db, 'classify', openai_client=client,
+                                        metadata=metadata) == 'answer from gpt-4o-mini'
+    assert sorted(doc['model'] for doc in db.docs['ai_cache'].values()) == ['gpt-4o', 'gpt-4o-mini']
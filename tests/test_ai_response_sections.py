@@ -0,0 +1,43 @@
+"""
+Tests for AI response section parsing in ai_prompts.py.
+
+split_ai_response() is a pure string function, so these are plain unit
+tests.
+"""
+
+import pytest
+from ai_prompts import split_ai_response
+
+
+RESPONSE = (
+    "Questions:\n1. Any night pain?\n2. Numbness in the hand?\n\n"
+    "Clinical Reasoning:\n- Night pain screens for serious pathology\n"
+    "- **Rationale:** numbness suggests radicular involvement\n\n"
+    "References:\nNICE NG59\n"
+)
+
+
+@pytest.mark.unit
+def test_split_ai_response_splits_on_first_line_start_marker():
+    result = split_ai_response(RESPONSE)
+    assert result['visible_text'] == "Questions:\n1. Any night pain?\n2. Numbness in the hand?"
+    assert result['reasoning_text'].startswith("- Night pain screens")
+    # inline bold "Rationale:" and the trailing references stay in reasoning
+    assert "**Rationale:**" in result['reasoning_text']
+    assert result['reasoning_text'].endswith("NICE NG59")
+
+
+@pytest.mark.unit
+def test_split_ai_response_without_reasoning_marker():
+    assert split_ai_response("1. Suggestion A\n2. Suggestion B\n") == {
+        'visible_text': "1. Suggestion A\n2. Suggestion B",
+        'reasoning_text': None,
+    }
+    assert split_ai_response("") == {'visible_text': "", 'reasoning_text': None}
+    assert split_ai_response(None) == {'visible_text': "", 'reasoning_text': None}
+
+
+@pytest.mark.unit
+def test_split_ai_response_longest_marker_wins():
+    result = split_ai_response("A\nclinical reasoning summary: because\n")
+    assert result == {'visible_text': "A", 'reasoning_text': "because"}
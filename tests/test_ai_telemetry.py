@@ -0,0 +1,90 @@
+"""
+Tests for the in-process AI telemetry aggregator (ai_telemetry.py).
+
+AITelemetry takes an injectable clock and db, so rolling windows and hourly
+flushes are tested without Cosmos or real time.
+"""
+
+from unittest.mock import MagicMock
+
+import pytest
+from ai_telemetry import AITelemetry, LatencyHistogram, ai_endpoint, current_endpoint, estimate_cost_usd
+
+
+class FakeClock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.mark.unit
+def test_cost_uses_model_pricing():
+    assert estimate_cost_usd('gpt-4o', 1_000_000, 0) == pytest.approx(2.50)
+    assert estimate_cost_usd('gpt-4o-mini', 0, 1_000_000) == pytest.approx(0.60)
+
+
+@pytest.mark.unit
+def test_histogram_percentiles_use_bucket_bounds():
+    hist = LatencyHistogram()
+    for latency in (80, 90, 300, 1500, 70000):
+        hist.add(latency, latency, 10, 5, 0.0, 'ok', 'none')
+    assert hist.percentile(0.5) == 500.0
+    assert hist.percentile(0.99) == 120000.0
+    assert hist.to_dict()['latency_max_ms'] == 70000
+
+
+@pytest.mark.unit
+def test_metrics_aggregate_per_endpoint_and_model():
+    clock = FakeClock()
+    telemetry = AITelemetry(window_minutes=60, flush_seconds=10_000, db=MagicMock(), clock=clock)
+    telemetry.record('subjective', 'gpt-4o', 1000, 200, 1200.0)
+    telemetry.record('subjective', 'gpt-4o', 0, 0, 15.0, cache_tier='cosmos')
+    telemetry.record('treatment_plan', 'gpt-4o', 3000, 900, 9000.0, outcome='length')
+
+    metrics = telemetry.metrics()
+    assert metrics['total']['calls'] == 3
+    assert metrics['total']['errors'] == 1
+    rows = {row['endpoint']: row for row in metrics['endpoints']}
+    assert rows['subjective']['cache_tiers'] == {'none': 1, 'cosmos': 1}
+    assert rows['subjective']['cost_usd'] == pytest.approx(estimate_cost_usd('gpt-4o', 1000, 200))
+    # most expensive endpoint first
+    assert metrics['endpoints'][0]['endpoint'] == 'treatment_plan'
+
+
+@pytest.mark.unit
+def test_rolling_window_drops_old_minutes():
+    clock = FakeClock()
+    telemetry = AITelemetry(window_minutes=5, flush_seconds=10_000, db=MagicMock(), clock=clock)
+    telemetry.record('a', 'gpt-4o', latency_ms=100)
+    clock.now += 3 * 60
+    telemetry.record('a', 'gpt-4o', latency_ms=200)
+    assert telemetry.metrics()['total']['calls'] == 2
+    assert telemetry.metrics(minutes=2)['total']['calls'] == 1
+    clock.now += 10 * 60
+    assert telemetry.metrics()['total']['calls'] == 0
+
+
+@pytest.mark.unit
+def test_flush_writes_cumulative_hour_document():
+    db = MagicMock()
+    clock = FakeClock(1_700_000_000.0)
+    telemetry = AITelemetry(window_minutes=60, flush_seconds=10_000, db=db, clock=clock)
+    telemetry.record('a', 'gpt-4o', 100, 50, 500.0)
+    telemetry.flush()
+
+    db.collection.assert_called_with('ai_telemetry_hourly')
+    doc_id = db.collection.return_value.document.call_args[0][0]
+    assert doc_id.startswith('2023111422_')
+    written = db.collection.return_value.document.return_value.set.call_args[0][0]
+    assert written['hour'] == '2023111422'
+    assert written['total']['prompt_tokens'] == 100
+
+
+@pytest.mark.unit
+def test_endpoint_label_is_scoped():
+    assert current_endpoint() == 'background'
+    with ai_endpoint('subjective_present_history'):
+        assert current_endpoint() == 'subjective_present_history'
+    assert current_endpoint() == 'background'
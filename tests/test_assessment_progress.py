@@ -0,0 +1,117 @@
+"""
+Tests for the per-patient assessment progress summary (assessment_progress.py).
+"""
+
+import pytest
+from assessment_progress import (
+    PROGRESS_FIELD, SECTION_BITS, empty_progress, merge_progress, mobile_sections,
+    progress_flags, progress_mismatches, record_section_saved,
+)
+
+
+class FakePatientRef:
+    """Applies patch_if like Cosmos DB does, against an in-memory document."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.patches = 0
+
+    def _lookup(self, path):
+        node = self.doc
+        for part in path.split('.'):
+            if not isinstance(node, dict) or part not in node:
+                return False, None
+            node = node[part]
+        return True, node
+
+    def _parent(self, path):
+        node = self.doc
+        *parents, leaf = path.split('.')
+        for part in parents:
+            node = node[part]
+        return node, leaf
+
+    def patch_if(self, fields, conditions=(), increments=None):
+        self.patches += 1
+        for field, op, value in conditions:
+            exists, current = self._lookup(field)
+            if (op == 'exists' and not exists) or (op == 'missing' and exists) \
+                    or (op == '==' and current != value):
+                return False
+        for path, value in fields.items():
+            node, leaf = self._parent(path)
+            node[leaf] = value
+        for path, delta in (increments or {}).items():
+            node, leaf = self._parent(path)
+            node[leaf] = node.get(leaf, 0) + delta
+        return True
+
+
+@pytest.mark.unit
+def test_merge_sets_bits_and_keeps_latest_timestamp():
+    progress = merge_progress(empty_progress(), ['smart_goals', 'not_a_section'], '2026-01-02')
+    progress = merge_progress(progress, ['smart_goals', 'initial_plan'], '2026-01-01')
+    assert progress['mask'] == SECTION_BITS['smart_goals'] | SECTION_BITS['initial_plan']
+    assert progress['updated'] == {'smart_goals': '2026-01-02', 'initial_plan': '2026-01-01'}
+
+
+@pytest.mark.unit
+def test_flags_come_from_summary_and_mobile_fields():
+    patient = {PROGRESS_FIELD: merge_progress(None, ['chronic_diseases']),
+               'treatmentPlan': {'plan': 'x'}}
+    assert progress_flags(patient) == {'chronicDiseases': True, 'treatmentPlan': True}
+    # Not backfilled yet: caller has to probe the collections
+    assert progress_flags({'treatmentPlan': {'plan': 'x'}}) is None
+
+
+@pytest.mark.unit
+def test_mobile_sections_uses_mobile_keys():
+    assert mobile_sections({'chronicDiseaseFactors': {'a': 1}, 'smartGoals': {}, 'name': 'x'}) \
+        == ['chronic_diseases']
+
+
+@pytest.mark.unit
+def test_first_save_sets_bit_and_resave_moves_timestamp():
+    ref = FakePatientRef({PROGRESS_FIELD: empty_progress(), 'context_version': 0})
+
+    assert record_section_saved(ref, 'clinical_flags', '2026-01-01', increments={'context_version': 1})
+    assert ref.patches == 1
+    assert record_section_saved(ref, 'clinical_flags', '2026-01-05', increments={'context_version': 1})
+
+    assert ref.doc[PROGRESS_FIELD] == {'mask': SECTION_BITS['clinical_flags'],
+                                       'updated': {'clinical_flags': '2026-01-05'}}
+    assert ref.doc['context_version'] == 2
+
+
+@pytest.mark.unit
+def test_mobile_and_web_saves_of_different_sections_both_stick():
+    ref = FakePatientRef({PROGRESS_FIELD: empty_progress()})
+    mobile_update = {'clinicalFlags': {'red': 'none'}, 'smartGoals': {'goal': 'walk'}}
+
+    # A web save lands while the mobile request is between its read and its update
+    record_section_saved(ref, 'treatment_plan', '2026-01-01')
+    for collection in mobile_sections(mobile_update):
+        record_section_saved(ref, collection, '2026-01-02')
+
+    assert ref.doc[PROGRESS_FIELD]['mask'] == (SECTION_BITS['treatment_plan'] | SECTION_BITS['clinical_flags']
+                                              | SECTION_BITS['smart_goals'])
+
+
+@pytest.mark.unit
+def test_save_never_creates_a_partial_summary():
+    ref = FakePatientRef({'context_version': 0})
+    assert not record_section_saved(ref, 'smart_goals', increments={'context_version': 1})
+    assert ref.doc == {'context_version': 0}
+
+
+@pytest.mark.unit
+def test_mismatches_report_missing_unexpected_and_stale():
+    expected = merge_progress(None, ['initial_plan'], '2026-01-02')
+    expected = merge_progress(expected, ['smart_goals'], '2026-01-01')
+    stored = merge_progress(None, ['initial_plan'], '2026-01-01')
+    stored = merge_progress(stored, ['treatment_plan'], '2026-01-01')
+
+    assert progress_mismatches(stored, expected) == [
+        ('initial_plan', 'stale'), ('smart_goals', 'missing'), ('treatment_plan', 'unexpected')]
+    assert progress_mismatches(expected, expected) == []
+    assert progress_mismatches(None, expected) == [('*', 'no summary')]
@@ -0,0 +1,228 @@
+"""
+Tests for the per-patient current clinical record (clinical_record.py).
+"""
+
+import copy
+
+import pytest
+from clinical_record import SECTION_COLLECTIONS, ClinicalRecords, resolve_timestamps
+
+
+class FakeDoc:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+def _resolve(doc, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+class FakeRef:
+    """create / patch_if with dotted paths, conditions and increments like Cosmos DB."""
+
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        return FakeDoc(self.collection.docs.get(self.id))
+
+    def create(self, data):
+        if self.id in self.collection.docs:
+            return False
+        self.collection.docs[self.id] = copy.deepcopy(data)
+        return True
+
+    def delete(self):
+        self.collection.docs.pop(self.id, None)
+
+    def patch_if(self, fields, conditions=(), increments=None):
+        self.collection.before_patch(self)
+        doc = self.collection.docs.get(self.id)
+        if doc is None:
+            return False
+        for field, op, value in conditions:
+            current, defined = _resolve(doc, field)
+            if op == 'missing':
+                ok = not defined
+            elif op == '==':
+                ok = defined and current == value
+            elif op == '<=':
+                ok = defined and current <= value
+            else:
+                raise AssertionError(op)
+            if not ok:
+                return False
+        for key, value in list(fields.items()) + [(k, None) for k in (increments or {})]:
+            *parents, last = key.split('.')
+            target = doc
+            for part in parents:
+                target = target.setdefault(part, {})
+            if key in (increments or {}):
+                target[last] = target.get(last, 0) + increments[key]
+            else:
+                target[last] = copy.deepcopy(value)
+        return True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.before_patch = lambda ref: None
+
+    def document(self, doc_id):
+        return FakeRef(self, doc_id)
+
+
+class History:
+    """The append-only containers, for completing records."""
+
+    def __init__(self, latest=None):
+        self.latest = latest or {}
+        self.queries = []
+
+    def __call__(self, collection, patient_id):
+        self.queries.append(collection)
+        return self.latest.get(collection)
+
+
+def _entry(timestamp, **fields):
+    return {'patient_id': 'p1', 'timestamp': timestamp, **fields}
+
+
+@pytest.mark.unit
+def test_new_patient_reads_without_queries():
+    collection, history = FakeCollection(), History()
+    records = ClinicalRecords(collection, history)
+    assert records.create('p1')
+    assert not records.create('p1')
+
+    assert records.record('p1', 'smart_goals', _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'))
+    sections = records.sections('p1', ['smart_goals', 'treatment_plan'])
+    assert sections == {'smart_goals': _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'),
+                        'treatment_plan': {}}
+    assert history.queries == []
+    assert collection.docs['p1']['version'] == 1
+
+
+@pytest.mark.unit
+def test_older_save_does_not_replace_newer():
+    collection = FakeCollection()
+    records = ClinicalRecords(collection, History())
+    records.create('p1')
+    assert records.record('p1', 'initial_plan', _entry('2026-03-01T10:05:00', active_movements='B'))
+    # A slower request that started earlier arrives last
+    assert not records.record('p1', 'initial_plan', _entry('2026-03-01T10:00:00', active_movements='A'))
+
+    assert records.sections('p1', ['initial_plan'])['initial_plan']['active_movements'] == 'B'
+    assert records.stats()['older_skipped'] == 1
+    assert collection.docs['p1']['version'] == 1
+
+
+@pytest.mark.unit
+def test_first_save_of_a_legacy_patient_creates_an_incomplete_record():
+    collection = FakeCollection()
+    history = History({'subjective_examination': _entry('2025-11-02T09:00:00', body_structure='knee')})
+    records = ClinicalRecords(collection, history)
+
+    records.record('p1', 'smart_goals', _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'))
+    assert collection.docs['p1']['complete'] is False
+
+    sections = records.sections('p1')
+    assert sections['subjective_examination']['body_structure'] == 'knee'
+    assert sections['smart_goals']['patient_goal'] == 'Walk 2 km'
+    # Only the sections the record lacked were queried, and only once
+    assert 'smart_goals' not in history.queries
+    assert len(history.queries) == len(SECTION_COLLECTIONS) - 1
+    assert collection.docs['p1']['complete'] is True
+    records.sections('p1')
+    assert len(history.queries) == len(SECTION_COLLECTIONS) - 1
+
+
+@pytest.mark.unit
+def test_completion_yields_to_a_concurrent_save():
+    collection = FakeCollection()
+    history = History({'treatment_plan': _entry('2026-01-01T00:00:00', treatment_plan='old plan')})
+    records = ClinicalRecords(collection, history)
+    records.record('p1', 'smart_goals', _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'))
+
+    # A save lands between the completion's read and its patch
+    def save_first(ref):
+        collection.before_patch = lambda ref: None
+        records.record('p1', 'treatment_plan', _entry('2026-03-02T10:00:00', treatment_plan='new plan'))
+    collection.before_patch = save_first
+
+    records.sections('p1')
+    stored = collection.docs['p1']
+    assert stored['sections']['treatment_plan']['treatment_plan'] == 'new plan'
+    assert stored['complete'] is False
+    assert records.sections('p1')['treatment_plan']['treatment_plan'] == 'new plan'
+    assert collection.docs['p1']['complete'] is True
+
+
+@pytest.mark.unit
+def test_lost_create_race_patches_the_winner():
+    collection = FakeCollection()
+    records = ClinicalRecords(collection, History())
+
+    # Another save creates the record after this one's first patch missed
+    def create_first(ref):
+        collection.before_patch = lambda ref: None
+        collection.docs['p1'] = {'patient_id': 'p1', 'version': 1, 'complete': False,
+                                 'sections': {'initial_plan': _entry('2026-03-01T09:00:00')}}
+    collection.before_patch = create_first
+
+    assert records.record('p1', 'smart_goals', _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'))
+    assert set(collection.docs['p1']['sections']) == {'initial_plan', 'smart_goals'}
+    assert collection.docs['p1']['version'] == 2
+
+
+@pytest.mark.unit
+def test_server_timestamps_are_resolved_once():
+    entry = resolve_timestamps({'patient_id': 'p1', 'timestamp': 'SERVER_TIMESTAMP', 'note': 'x'},
+                               now='2026-03-01T10:00:00+00:00')
+    assert entry == {'patient_id': 'p1', 'timestamp': '2026-03-01T10:00:00+00:00', 'note': 'x'}
+
+
+@pytest.mark.unit
+def test_failed_record_update_is_retried_then_marks_the_record_stale():
+    collection = FakeCollection()
+    history = History({'smart_goals': _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km')})
+    records = ClinicalRecords(collection, history)
+    records.create('p1')
+    records.record('p1', 'smart_goals', _entry('2026-03-01T10:00:00', patient_goal='Walk 2 km'))
+
+    def failing(times):
+        calls = []
+
+        def before_patch(ref):
+            calls.append(ref)
+            if len(calls) <= times:
+                raise ConnectionError('timeout')
+        return before_patch
+
+    # One failure: the retry writes the section
+    collection.before_patch = failing(1)
+    records.save('p1', 'smart_goals', _entry('2026-03-02T10:00:00', patient_goal='Walk 3 km'))
+    assert collection.docs['p1']['sections']['smart_goals']['patient_goal'] == 'Walk 3 km'
+    assert collection.docs['p1']['complete'] is True
+
+    # Both attempts fail: the history has the save, the record is marked stale
+    history.latest['smart_goals'] = _entry('2026-03-03T10:00:00', patient_goal='Walk 5 km')
+    collection.before_patch = failing(2)
+    records.save('p1', 'smart_goals', history.latest['smart_goals'])
+    assert collection.docs['p1']['stale'] is True and collection.docs['p1']['complete'] is False
+    assert records.stats()['marked_stale'] == 1
+
+    assert records.sections('p1', ['smart_goals'])['smart_goals']['patient_goal'] == 'Walk 5 km'
+    assert len(history.queries) == len(SECTION_COLLECTIONS)
+    assert collection.docs['p1']['stale'] is False and collection.docs['p1']['complete'] is True
+    assert collection.docs['p1']['sections']['smart_goals']['patient_goal'] == 'Walk 5 km'
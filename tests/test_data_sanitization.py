@@ -0,0 +1,176 @@
+"""
+Tests for the shared PHI sanitizer in data_sanitization.py.
+
+Pure functions (str in, str out) with no Cosmos/Flask dependency, so these
+are plain unit tests. The throughput benchmark runs the sanitizer over the
+free-text fields of the clinical scenarios against the implementation it
+replaced; run it with `pytest -m slow -s` to see the numbers.
+"""
+
+import re
+import time
+
+import pytest
+from data_sanitization import (
+    Redaction,
+    sanitize_age_sex,
+    sanitize_clinical_text,
+    sanitize_clinical_text_with_spans,
+    sanitize_subjective_data,
+)
+
+
+@pytest.mark.unit
+def test_names_dates_phones_emails_and_addresses_removed():
+    text = ("Patient John Smith seen 12/03/2024, phone 9876543210, "
+            "email john.smith@gmail.com, lives at 12 Baker Street")
+    result = sanitize_clinical_text(text)
+    assert 'John' not in result and 'Smith' not in result
+    assert '12/03/2024' not in result
+    assert '9876543210' not in result
+    assert 'gmail' not in result
+    assert 'Baker' not in result
+    assert result.startswith('Patient [name removed] [name removed] seen [date removed]')
+
+
+@pytest.mark.unit
+def test_names_with_non_ascii_letters_removed():
+    text = 'seen by José Müller and Élodie, ref. Jose\u0301 Zoë-Ann'
+    assert sanitize_clinical_text(text) == ('seen by [name removed] [name removed] and [name removed], '
+                                            'ref. [name removed] [name removed]')
+    assert sanitize_clinical_text('élodie ÉLODIE') == 'élodie ÉLODIE'
+
+
+@pytest.mark.unit
+def test_indian_phone_formats_with_country_code():
+    assert sanitize_clinical_text('call +91 98765 43210') == 'call [phone removed]'
+    assert sanitize_clinical_text('call +919876543210') == 'call [phone removed]'
+    assert sanitize_clinical_text('call 123-456-7890') == 'call [phone removed]'
+
+
+@pytest.mark.unit
+def test_clinical_vocabulary_and_measurements_preserved():
+    text = 'Right shoulder pain 6/10 NRS, MRI shows L4-L5 Disc bulge, grade 3/5 abduction'
+    assert sanitize_clinical_text(text) == text
+
+
+@pytest.mark.unit
+def test_month_name_dates_removed_case_insensitively():
+    assert sanitize_clinical_text('onset march 3, 2024') == 'onset [date removed]'
+
+
+@pytest.mark.unit
+def test_fast_path_only_collapses_whitespace():
+    text, spans = sanitize_clinical_text_with_spans('  dull   ache\n worse overhead ')
+    assert text == 'dull ache worse overhead'
+    assert spans == []
+
+
+@pytest.mark.unit
+def test_redaction_spans_index_the_original_text():
+    text = 'Seen by Priya on 01/02/2024'
+    _, spans = sanitize_clinical_text_with_spans(text)
+    assert spans == [
+        Redaction(0, 4, 'name'),
+        Redaction(8, 13, 'name'),
+        Redaction(17, 27, 'date'),
+    ]
+    assert text[spans[1].start:spans[1].end] == 'Priya'
+
+
+@pytest.mark.unit
+def test_empty_input():
+    assert sanitize_clinical_text('') == ''
+    assert sanitize_clinical_text(None) == ''
+    assert sanitize_clinical_text_with_spans('') == ('', [])
+
+
+@pytest.mark.unit
+def test_age_sex_ranges():
+    assert sanitize_age_sex('45/M') == '40s M'
+    assert sanitize_age_sex('72 female') == '70+ F'
+    assert sanitize_age_sex('') == 'Age/Sex not specified'
+    assert sanitize_age_sex('unknown') == 'Demographics: Adult'
+
+
+@pytest.mark.unit
+def test_subjective_data_recurses_into_nested_values():
+    data = {'notes': 'seen by Priya', 'sub': {'text': 'Call 9876543210'}, 'list': ['Ravi'], 'score': 4}
+    result = sanitize_subjective_data(data)
+    assert result == {
+        'notes': 'seen by [name removed]',
+        'sub': {'text': 'Call [phone removed]'},
+        'list': ['[name removed]'],
+        'score': 4,
+    }
+
+
+def _scenario_texts():
+    from tests.clinical_scenarios import ALL_SCENARIOS
+
+    texts = []
+    for scenario in ALL_SCENARIOS:
+        for section in (
+            scenario.patient_data, scenario.patho_mechanism_data, scenario.subjective_data,
+            scenario.perspectives_data, scenario.initial_plan_data, scenario.chronic_disease_data,
+            scenario.clinical_flags_data, scenario.objective_data, scenario.provisional_diagnosis_data,
+            scenario.smart_goals_data, scenario.treatment_plan_data,
+        ):
+            texts.extend(v for v in section.values() if isinstance(v, str))
+    return texts
+
+
+_PREVIOUS_MEDICAL_TERMS = {
+    'mri', 'ct', 'x-ray', 'pt', 'ot', 'dr', 'hospital', 'clinic', 'emergency', 'department',
+    'pain', 'back', 'knee', 'shoulder', 'hip', 'neck', 'arm', 'leg', 'ankle', 'foot', 'hand',
+    'wrist', 'elbow', 'spine', 'lumbar', 'thoracic', 'cervical', 'chest', 'abdomen', 'head',
+    'finger', 'thumb', 'toe', 'heel', 'calf', 'thigh', 'forearm', 'pelvis', 'groin', 'buttock',
+    'right', 'left', 'bilateral', 'anterior', 'posterior', 'lateral', 'medial', 'upper', 'lower',
+    'proximal', 'distal', 'superior', 'inferior', 'dorsal', 'ventral', 'superficial', 'deep',
+    'sacral', 'coccyx', 'sacrum', 'vertebral', 'intervertebral', 'disc',
+    'joint', 'muscle', 'tendon', 'ligament', 'bone', 'tissue', 'nerve', 'fascia',
+}
+
+
+def _previous_sanitize_clinical_text(text):
+    """The per-pattern, per-word sanitizer the engine replaced, for the benchmark."""
+    if not text:
+        return ""
+    sanitized = re.sub(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b', '[date removed]', text)
+    sanitized = re.sub(r'\b(January|February|March|April|May|June|July|August|September|October|November'
+                       r'|December)\s+\d{1,2},?\s+\d{2,4}\b', '[date removed]', sanitized, flags=re.IGNORECASE)
+    words = []
+    for word in sanitized.split():
+        clean_word = re.sub(r'[^\w]', '', word)
+        if clean_word.istitle() and clean_word.lower() not in _PREVIOUS_MEDICAL_TERMS and len(clean_word) > 2:
+            words.append('[name removed]')
+        else:
+            words.append(word)
+    sanitized = ' '.join(words)
+    sanitized = re.sub(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', '[phone removed]', sanitized)
+    sanitized = re.sub(r'\b\d+\s+\w+\s+(Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Drive|Dr|Lane|Ln)\b',
+                       '[address removed]', sanitized, flags=re.IGNORECASE)
+    return re.sub(r'\s+', ' ', sanitized).strip()
+
+
+@pytest.mark.slow
+def test_sanitizer_throughput_on_assessment_text():
+    """Reports timings only: wall-clock comparisons are too noisy to assert on."""
+    texts = _scenario_texts()
+    total_chars = sum(len(t) for t in texts)
+    rounds = 200
+
+    def run(sanitize):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                sanitize(text)
+        return time.perf_counter() - start
+
+    previous_s = run(_previous_sanitize_clinical_text)
+    engine_s = run(sanitize_clinical_text)
+
+    chars = total_chars * rounds
+    print(f"\n{len(texts) * rounds} fields, {chars:,} chars: previous {previous_s:.3f}s "
+          f"({chars / previous_s / 1_000_000:.1f} MB/s), engine {engine_s:.3f}s "
+          f"({chars / engine_s / 1_000_000:.1f} MB/s)")
@@ -0,0 +1,112 @@
+"""
+Tests for the verified Firebase ID token cache (firebase_token_cache.py).
+
+Signature verification and the Firebase user lookup are injected, so these
+run without firebase_admin or network access.
+"""
+
+import pytest
+from firebase_token_cache import FirebaseTokenCache, TokenRevokedError, UserDisabledError
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeFirebase:
+    def __init__(self, clock):
+        self.clock = clock
+        self.verify_calls = 0
+        self.fetch_calls = []
+        self.states = {'uid-1': (0, False)}
+
+    def verify(self, id_token):
+        self.verify_calls += 1
+        if id_token == 'bad':
+            raise ValueError('invalid token')
+        return {'uid': 'uid-1', 'iat': self.clock.now - 10, 'exp': self.clock.now + 3600}
+
+    def fetch(self, uids):
+        self.fetch_calls.append(list(uids))
+        return {uid: self.states[uid] for uid in uids if uid in self.states}
+
+
+@pytest.fixture
+def setup():
+    clock = FakeClock()
+    firebase = FakeFirebase(clock)
+    cache = FirebaseTokenCache(firebase.verify, firebase.fetch, start_poller=False,
+                               max_staleness=300, clock=clock)
+    return clock, firebase, cache
+
+
+@pytest.mark.unit
+def test_repeat_requests_skip_verification_and_lookup(setup):
+    clock, firebase, cache = setup
+    for _ in range(5):
+        assert cache.verify('token-a')['uid'] == 'uid-1'
+    assert firebase.verify_calls == 1
+    assert firebase.fetch_calls == [['uid-1']]
+
+
+@pytest.mark.unit
+def test_expired_cached_token_is_verified_again(setup):
+    clock, firebase, cache = setup
+    cache.verify('token-a')
+    clock.now += 3601
+    cache.verify('token-a')
+    assert firebase.verify_calls == 2
+
+
+@pytest.mark.unit
+def test_invalid_token_is_not_cached(setup):
+    _, firebase, cache = setup
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.verify('bad')
+    assert firebase.verify_calls == 2
+
+
+@pytest.mark.unit
+def test_mark_revoked_rejects_cached_token_immediately(setup):
+    clock, firebase, cache = setup
+    cache.verify('token-a')
+    cache.mark_revoked('uid-1')
+    with pytest.raises(TokenRevokedError):
+        cache.verify('token-a')
+
+
+@pytest.mark.unit
+def test_poll_picks_up_revocation_and_disable(setup):
+    clock, firebase, cache = setup
+    cache.verify('token-a')
+    firebase.states['uid-1'] = (clock.now, False)
+    cache.poll_once()
+    with pytest.raises(TokenRevokedError):
+        cache.verify('token-a')
+
+    firebase.states['uid-1'] = (0, True)
+    cache.poll_once()
+    with pytest.raises(UserDisabledError):
+        cache.verify('token-a')
+
+
+@pytest.mark.unit
+def test_stale_state_refreshed_inline(setup):
+    clock, firebase, cache = setup
+    cache.verify('token-a')
+    clock.now += 301
+    cache.verify('token-a')
+    assert len(firebase.fetch_calls) == 2
+
+
+@pytest.mark.unit
+def test_deleted_user_treated_as_revoked(setup):
+    _, firebase, cache = setup
+    firebase.states.clear()
+    with pytest.raises(TokenRevokedError):
+        cache.verify('token-a')
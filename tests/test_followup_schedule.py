@@ -0,0 +1,137 @@
+"""
+Tests for the day-bucketed follow-up schedule index (followup_schedule.py).
+"""
+
+from datetime import date, datetime, timezone
+
+import pytest
+from followup_schedule import FollowupSchedule, day_buckets, entry_id, expiry_seconds, make_entry, parse_day
+
+OPS = {
+    '==': lambda a, b: a == b,
+    '>=': lambda a, b: a is not None and a >= b,
+    '<=': lambda a, b: a is not None and a <= b,
+    'in': lambda a, b: a in b,
+}
+
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters):
+        self.collection = collection
+        self.filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self.collection, self.filters + [(field, op, value)])
+
+    def stream(self):
+        self.collection.queries.append(self.filters)
+        for doc_id, data in self.collection.docs.items():
+            if all(OPS[op](data.get(field), value) for field, op, value in self.filters):
+                yield FakeDoc(doc_id, data)
+
+
+class FakeRef:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data):
+        self.collection.docs[self.id] = dict(data)
+
+    def delete(self):
+        self.collection.docs.pop(self.id, None)
+
+    def patch_if(self, fields):
+        if self.id not in self.collection.docs:
+            return False
+        self.collection.docs[self.id].update(fields)
+        return True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.queries = []
+
+    def document(self, doc_id):
+        return FakeRef(self, doc_id)
+
+    def where(self, field, op, value):
+        return FakeQuery(self, [(field, op, value)])
+
+
+TODAY = date(2026, 3, 10)
+ANN = {'physio_id': 'a@x.com', 'institute': 'Clinic', 'name': 'Ann', 'contact': '98'}
+BEN = {'physio_id': 'b@x.com', 'institute': 'Clinic', 'name': 'Ben', 'contact': '97'}
+
+
+@pytest.mark.unit
+def test_days_and_expiry():
+    assert parse_day('2026-03-10') == TODAY
+    assert parse_day('10/03/2026') is None and parse_day(None) is None
+    assert day_buckets(TODAY, [0, 1, 7]) == ['2026-03-10', '2026-03-11', '2026-03-17']
+    now = datetime(2026, 3, 10, tzinfo=timezone.utc)
+    assert expiry_seconds(TODAY, now) == 30 * 86400
+    assert make_entry('p1', ANN, TODAY, '10:00', now)['ttl'] == 30 * 86400
+
+
+@pytest.mark.unit
+def test_rescheduling_moves_the_entry_between_buckets():
+    collection = FakeCollection()
+    schedule = FollowupSchedule(collection)
+
+    schedule.schedule('p1', ANN, '2026-03-12', due_time='09:30')
+    schedule.schedule('p1', ANN, '2026-03-14', old_day='2026-03-12')
+    assert list(collection.docs) == [entry_id('2026-03-14', 'p1')]
+
+    # An unparseable date only clears the old entry
+    assert not schedule.schedule('p1', ANN, 'next week', old_day='2026-03-14')
+    assert collection.docs == {}
+
+
+@pytest.mark.unit
+def test_upcoming_reads_only_the_window_for_one_owner():
+    collection = FakeCollection()
+    schedule = FollowupSchedule(collection)
+    schedule.schedule('p1', ANN, '2026-03-12')
+    schedule.schedule('p2', BEN, '2026-03-10')
+    schedule.schedule('p3', ANN, '2026-03-30')
+    schedule.schedule('p4', ANN, '2026-03-09')
+
+    mine = schedule.upcoming('physio_id', 'a@x.com', TODAY, days_ahead=7)
+    assert [(i['patient_id'], i['days_until']) for i in mine] == [('p1', 2)]
+    assert collection.queries[-1] == [('physio_id', '==', 'a@x.com'), ('day', '>=', '2026-03-10'),
+                                      ('day', '<=', '2026-03-17')]
+
+    institute = schedule.upcoming('institute', 'Clinic', TODAY, days_ahead=7)
+    assert [i['patient_id'] for i in institute] == ['p2', 'p1']
+    assert institute[0]['is_today'] and not institute[0]['is_overdue']
+
+
+@pytest.mark.unit
+def test_reminders_skip_notified_and_see_renames():
+    collection = FakeCollection()
+    schedule = FollowupSchedule(collection)
+    schedule.schedule('p1', ANN, '2026-03-11')
+    schedule.schedule('p2', BEN, '2026-03-13')
+    schedule.schedule('p3', ANN, '2026-03-12')
+
+    schedule.mark_notified('p2', '2026-03-13', '2026-03-10T08:00:00+00:00')
+    schedule.refresh_patient('p1', {**ANN, 'name': 'Ann Lee', 'next_followup_date': '2026-03-11'})
+
+    due = schedule.due_unnotified(day_buckets(TODAY, [0, 1, 3, 7]))
+    assert [(e['patient_id'], e['patient_name']) for e in due] == [('p1', 'Ann Lee')]
+
+    # Refreshing a patient with no entry doesn't create one
+    schedule.refresh_patient('p9', {**BEN, 'next_followup_date': '2026-03-11'})
+    assert entry_id('2026-03-11', 'p9') not in collection.docs
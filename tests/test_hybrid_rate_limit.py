@@ -0,0 +1,164 @@
+"""
+Tests for hybrid rate limiting (hybrid_rate_limit.py).
+
+Three HybridRateLimiter instances sharing one LocalGCRAStore stand in for
+three Gunicorn workers sharing Redis; the store counts round trips.
+"""
+
+import threading
+import time
+
+import pytest
+from hybrid_rate_limit import HybridRateLimiter, LocalGCRAStore, gcra_reserve
+
+
+class CountingStore(LocalGCRAStore):
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.calls = 0
+        self.latency = latency
+        self.fail = False
+
+    def reserve(self, reservations, now, workers):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError('redis down')
+        if self.latency:
+            time.sleep(self.latency)
+        return super().reserve(reservations, now, workers)
+
+
+def _workers(store, n=3, clock=lambda: 1000.0):
+    return [HybridRateLimiter(store, workers=n, start_syncer=False, clock=clock) for _ in range(n)]
+
+
+@pytest.mark.unit
+def test_gcra_allows_burst_then_one_unit_per_interval():
+    tat, grant = gcra_reserve(None, 0.0, 10, 60.0, refund=0, want=10, workers=1)
+    assert grant == (10, 0, 60.0)
+    _, grant = gcra_reserve(tat, 3.0, 10, 60.0, refund=0, want=1, workers=1)
+    assert grant == (0, 0, 3.0)
+    # One unit back every 6 seconds, no window edge
+    _, grant = gcra_reserve(tat, 6.0, 10, 60.0, refund=0, want=1, workers=1)
+    assert grant[0] == 1
+
+
+@pytest.mark.unit
+def test_reservation_shares_and_refunds():
+    tat, grant = gcra_reserve(None, 0.0, 90, 60.0, refund=0, want=1, workers=3)
+    assert grant[:2] == (15, 75)
+    _, grant = gcra_reserve(tat, 0.0, 90, 60.0, refund=15, want=0, workers=3)
+    assert grant[:2] == (0, 90)
+
+
+@pytest.mark.unit
+def test_limit_holds_across_workers():
+    store = CountingStore()
+    workers = _workers(store)
+
+    admitted = sum(workers[i % 3].hit('user:a', 100, 60) for i in range(300))
+    for worker in workers:
+        worker.sync()
+
+    assert admitted == 100
+
+
+@pytest.mark.unit
+def test_small_limits_are_exact():
+    store = CountingStore()
+    workers = _workers(store)
+    admitted = [w.hit('ip:1', 3, 900) for w in workers + workers]
+    assert sum(admitted) == 3
+
+
+@pytest.mark.unit
+def test_busy_worker_converges_on_whole_budget():
+    store = CountingStore()
+    busy, _, _ = _workers(store)
+    admitted = sum(busy.hit('user:a', 100, 60) for _ in range(150))
+    assert admitted == 100
+    assert store.calls < 30
+
+
+@pytest.mark.unit
+def test_over_limit_is_denied_without_store_round_trips():
+    store = CountingStore()
+    worker = _workers(store, n=1)[0]
+    for _ in range(10):
+        worker.hit('ip:1', 10, 60)
+    calls = store.calls
+    assert not any(worker.hit('ip:1', 10, 60) for _ in range(50))
+    assert store.calls == calls + 1
+
+
+@pytest.mark.unit
+def test_units_come_back_over_time():
+    now = [1000.0]
+    store = CountingStore()
+    worker = _workers(store, n=1, clock=lambda: now[0])[0]
+    assert sum(worker.hit('ip:1', 10, 60) for _ in range(20)) == 10
+    now[0] += 12
+    assert sum(worker.hit('ip:1', 10, 60) for _ in range(20)) == 2
+
+
+@pytest.mark.unit
+def test_store_failure_fails_open_to_local_share():
+    store = CountingStore()
+    store.fail = True
+    worker = _workers(store)[0]
+    assert sum(worker.hit('user:a', 90, 60) for _ in range(100)) == 30
+    assert worker.stats()['store_errors'] >= 1
+
+
+@pytest.mark.unit
+def test_fairness_across_three_concurrent_workers():
+    limit = 300
+    store = CountingStore(latency=0.0005)
+    workers = _workers(store)
+    admitted = [0, 0, 0]
+    lock = threading.Lock()
+    start = threading.Barrier(9)
+
+    def client(index):
+        worker = workers[index % 3]
+        start.wait()
+        for _ in range(200):
+            if worker.hit('user:shared', limit, 60):
+                with lock:
+                    admitted[index % 3] += 1
+            time.sleep(0.0002)   # request handling
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sum(admitted) == limit
+    # Equal demand: no worker is starved below half its fair share
+    assert min(admitted) >= limit // 6
+
+
+@pytest.mark.slow
+def test_benchmark_per_request_overhead():
+    """Fast path vs asking the store on every request (1 ms simulated Redis RTT)."""
+    requests = 2000
+
+    store = CountingStore(latency=0.001)
+    worker = HybridRateLimiter(store, workers=3, start_syncer=False)
+    started = time.perf_counter()
+    for i in range(requests):
+        worker.hit(f'user:{i % 20}', 1000, 3600)
+    hybrid_us = (time.perf_counter() - started) / requests * 1e6
+    hybrid_calls = store.calls
+
+    store = CountingStore(latency=0.001)
+    started = time.perf_counter()
+    for i in range(requests):
+        store.reserve([(f'user:{i % 20}', 1000, 3600, 0, 1)], time.time(), 1)
+    direct_us = (time.perf_counter() - started) / requests * 1e6
+
+    print(f"\nhybrid: {hybrid_us:.1f} us/request, {hybrid_calls} store calls; "
+          f"per-request store: {direct_us:.1f} us/request, {requests} store calls")
+    assert hybrid_calls < requests / 10
+    assert hybrid_us < direct_us
@@ -0,0 +1,260 @@
+"""
+Tests for login lockout tracking (login_lockout.py).
+"""
+
+import time
+
+import pytest
+from login_lockout import CosmosLockoutBackend, LoginLockoutStore, LockoutState, lockout_key, register_failure
+
+
+class FakeBatchedBackend:
+    """Stands in for the login_lockouts container; counts calls."""
+
+    atomic_updates = False
+
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, key):
+        self.reads += 1
+        data = self.docs.get(key)
+        return LockoutState.from_dict(data) if data else None
+
+    def update(self, key, apply):
+        self.writes += 1
+        state, just_locked, ttl = apply(self.get(key))
+        self.docs[key] = {**state.to_dict(), 'ttl': ttl}
+        return state, just_locked
+
+    def delete(self, key):
+        self.writes += 1
+        self.docs.pop(key, None)
+
+
+class FakeAtomicBackend(FakeBatchedBackend):
+    """Stands in for Redis: every failure is applied to the shared copy."""
+
+    atomic_updates = True
+
+
+class FakeLockoutDocs:
+    """login_lockouts documents with create / conditional patch, like the Cosmos wrapper."""
+
+    def __init__(self):
+        self.docs = {}
+        self.before_patch = lambda: None
+        self.fallback_queries = 0  # reads/deletes allowed to fall back to a cross-partition query
+
+    def collection(self, name):
+        return self
+
+    def document(self, key):
+        docs = self
+
+        class Ref:
+            def get(self, id_is_partition_key=False):
+                if key not in docs.docs and not id_is_partition_key:
+                    docs.fallback_queries += 1
+                data = docs.docs.get(key)
+                return type('Doc', (), {'exists': data is not None, 'to_dict': lambda self: dict(data)})()
+
+            def create(self, data):
+                if key in docs.docs:
+                    return False
+                docs.docs[key] = dict(data)
+                return True
+
+            def patch_if(self, fields, conditions=()):
+                docs.before_patch()
+                stored = docs.docs.get(key)
+                if stored is None:
+                    return False
+                for field, op, value in conditions:
+                    if (op == 'missing' and field in stored) or (op == '==' and stored.get(field) != value):
+                        return False
+                stored.update(fields)
+                return True
+
+            def delete(self, id_is_partition_key=False):
+                if key not in docs.docs and not id_is_partition_key:
+                    docs.fallback_queries += 1
+                docs.docs.pop(key, None)
+
+        return Ref()
+
+
+def _store(backend, now, **kwargs):
+    return LoginLockoutStore(backend, max_failures=3, base_seconds=900, max_seconds=3600,
+                             memory_seconds=86400, start_flusher=False, clock=lambda: now[0], **kwargs)
+
+
+@pytest.mark.unit
+def test_lock_windows_grow_exponentially_up_to_cap():
+    state, windows = None, []
+    now = 0.0
+    for _ in range(4):
+        for _ in range(3):
+            state, just_locked = register_failure(state, now, 3, base_seconds=900, max_seconds=3600)
+        assert just_locked
+        windows.append(state.locked_until - now)
+        now = state.locked_until
+    assert windows == [900, 1800, 3600, 3600]
+
+
+@pytest.mark.unit
+def test_failures_while_locked_do_not_count():
+    state, _ = register_failure(LockoutState(failures=2), 0.0, 3)
+    locked_until = state.locked_until
+    state, just_locked = register_failure(state, 10.0, 3)
+    assert not just_locked
+    assert state.locked_until == locked_until
+
+
+@pytest.mark.unit
+def test_strikes_are_forgotten_after_quiet_period():
+    state = LockoutState(strikes=3, updated_at=0.0)
+    state, _ = register_failure(state, 86400 * 2, 3)
+    assert state.strikes == 0 and state.failures == 1
+
+
+@pytest.mark.unit
+def test_locked_account_rejected_from_memory():
+    now = [1000.0]
+    backend = FakeBatchedBackend()
+    lockouts = _store(backend, now)
+
+    assert lockouts.check('a@x.com') == (True, 0)
+    assert [lockouts.record_failure('a@x.com') for _ in range(3)] == [False, False, True]
+    # The lock is written right away, not left for the next batch
+    assert backend.docs[lockout_key('a@x.com')]['locked_until'] == 1900.0
+
+    reads, writes = backend.reads, backend.writes
+    for _ in range(100):
+        assert lockouts.check('A@x.com ') == (False, 900)
+        lockouts.record_failure('a@x.com')
+    assert (backend.reads, backend.writes) == (reads, writes)
+
+    now[0] = 1901.0
+    assert lockouts.check('a@x.com') == (True, 0)
+
+
+@pytest.mark.unit
+def test_failures_are_coalesced_into_one_write_per_account():
+    now = [1000.0]
+    backend = FakeBatchedBackend()
+    lockouts = _store(backend, now)
+
+    for email in ('a@x.com', 'b@x.com', 'c@x.com'):
+        lockouts.record_failure(email)
+        lockouts.record_failure(email)
+    assert backend.writes == 0
+    assert lockouts.flush() == 3
+    assert backend.writes == 3
+    assert backend.docs[lockout_key('b@x.com')]['failures'] == 2
+
+
+@pytest.mark.unit
+def test_batched_failures_from_workers_add_up():
+    now = [1000.0]
+    backend = CosmosLockoutBackend(FakeLockoutDocs())
+    one, other = _store(backend, now), _store(backend, now)
+
+    one.record_failure('a@x.com')
+    one.record_failure('a@x.com')
+    other.record_failure('a@x.com')
+    one.flush()
+    other.flush()
+    assert backend.get(lockout_key('a@x.com')).locked_until == 1900.0
+
+    # The second lock escalates, whichever worker counts the failures
+    now[0] = 2000.0
+    for worker in (one, other, one):
+        worker.record_failure('a@x.com')
+        worker.flush()
+    state = backend.get(lockout_key('a@x.com'))
+    assert state.strikes == 2 and state.locked_until == 2000.0 + 1800
+
+
+@pytest.mark.unit
+def test_cosmos_update_retries_on_a_concurrent_write():
+    docs = FakeLockoutDocs()
+    backend = CosmosLockoutBackend(docs)
+    key = lockout_key('a@x.com')
+    docs.docs[key] = LockoutState(failures=1, updated_at=1000.0).to_dict()
+
+    def concurrent_failure():
+        docs.before_patch = lambda: None
+        docs.docs[key] = LockoutState(failures=2, updated_at=1001.0).to_dict()
+    docs.before_patch = concurrent_failure
+
+    state, just_locked = backend.update(
+        key, lambda state: (*register_failure(state, 1002.0, 3), 60))
+    assert just_locked and state.strikes == 1
+    assert docs.docs[key]['strikes'] == 1
+
+
+@pytest.mark.unit
+def test_reset_on_one_worker_unlocks_the_others():
+    now = [1000.0]
+    backend = CosmosLockoutBackend(FakeLockoutDocs())
+    locking, resetting = _store(backend, now, cache_seconds=0.05), _store(backend, now, cache_seconds=0.05)
+
+    assert resetting.check('a@x.com') == (True, 0)  # caches "clean"
+    for _ in range(3):
+        locking.record_failure('a@x.com')
+    assert locking.check('a@x.com') == (False, 900)
+
+    resetting.clear('a@x.com')
+    assert backend.get(lockout_key('a@x.com')) is None
+    time.sleep(0.1)
+    assert locking.check('a@x.com') == (True, 0)
+
+
+@pytest.mark.unit
+def test_clean_account_login_uses_point_operations_only():
+    now = [1000.0]
+    docs = FakeLockoutDocs()
+    lockouts = _store(CosmosLockoutBackend(docs), now)
+
+    assert lockouts.check('a@x.com') == (True, 0)
+    lockouts.clear('a@x.com')  # successful login of an account with no document
+    lockouts.record_failure('b@x.com')
+    lockouts.flush()
+    assert docs.fallback_queries == 0
+
+
+@pytest.mark.unit
+def test_clear_forgets_failures():
+    now = [1000.0]
+    backend = FakeBatchedBackend()
+    lockouts = _store(backend, now)
+
+    lockouts.record_failure('a@x.com')
+    lockouts.clear('a@x.com')
+    assert lockouts.flush() == 0
+    assert lockout_key('a@x.com') not in backend.docs
+    assert lockouts.check('a@x.com') == (True, 0)
+
+
+@pytest.mark.unit
+def test_workers_count_together_with_atomic_backend():
+    now = [1000.0]
+    backend = FakeAtomicBackend()
+    workers = [_store(backend, now) for _ in range(3)]
+
+    results = [w.record_failure('a@x.com') for w in workers]
+    assert results == [False, False, True]
+    assert all(not w.check('a@x.com')[0] for w in workers[2:])
+
+
+@pytest.mark.unit
+def test_store_outage_fails_open():
+    class Down(FakeBatchedBackend):
+        def get(self, key):
+            raise ConnectionError('down')
+
+    lockouts = _store(Down(), [1000.0])
+    assert lockouts.check('a@x.com') == (True, 0)
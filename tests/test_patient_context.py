@@ -0,0 +1,126 @@
+"""
+Tests for the per-version patient context snapshots (patient_context.py).
+"""
+
+import pytest
+import patient_context
+from patient_context import get_patient_context_snapshot, invalidate_patient_context, patient_version
+
+
+class FakePatientDoc:
+    def __init__(self, patient_id, data, etag):
+        self.id = patient_id
+        self.exists = True
+        self._data = {**data, '_etag': etag}
+
+    def get(self, field):
+        return self._data.get(field)
+
+    def to_dict(self):
+        return {k: v for k, v in self._data.items() if not k.startswith('_')}
+
+
+class FakeRecords:
+    """get_clinical_records() stand-in: latest sections per patient, counting reads."""
+
+    def __init__(self, sections):
+        self.latest = sections
+        self.reads = 0
+
+    def sections(self, patient_id):
+        self.reads += 1
+        return {collection: dict(entry) for collection, entry in self.latest.items()}
+
+
+class FakePatients:
+    """patients container: the patient has no progress summary, so only context_version moves."""
+
+    def __init__(self):
+        self.bumps = []
+
+    def collection(self, name):
+        return self
+
+    def document(self, patient_id):
+        patients = self
+
+        class Ref:
+            def patch_if(self, fields, conditions=(), increments=None):
+                return False
+
+            def increment_if(self, field, delta=1):
+                patients.bumps.append((patient_id, field, delta))
+                return True, len(patients.bumps)
+
+        return Ref()
+
+
+PATIENT = {'name': 'Ann', 'age_sex': '45/F', 'present_history': 'Neck pain for 2 weeks'}
+
+
+@pytest.fixture
+def records(monkeypatch):
+    records = FakeRecords({'smart_goals': {'patient_id': 'p1', 'patient_goal': 'Walk 2 km'}})
+    monkeypatch.setattr(patient_context, 'get_clinical_records', lambda: records)
+    patient_context._snapshots.clear()
+    yield records
+    patient_context._snapshots.clear()
+
+
+@pytest.mark.unit
+def test_same_version_is_served_from_the_cache(records):
+    doc = FakePatientDoc('p1', PATIENT, '"etag-1"')
+    snapshot = get_patient_context_snapshot('p1', doc)
+    assert snapshot.version == patient_version(doc) == '"etag-1"'
+    assert snapshot.section('smart_goals')['patient_goal'] == 'Walk 2 km'
+    assert snapshot.section('treatment_plan') == {}
+
+    again = get_patient_context_snapshot('p1', FakePatientDoc('p1', PATIENT, '"etag-1"'))
+    assert again is snapshot
+    again.section('subjective')
+    assert records.reads == 1
+
+
+@pytest.mark.unit
+def test_section_save_drops_the_snapshot_and_bumps_the_version(records):
+    doc = FakePatientDoc('p1', PATIENT, '"etag-1"')
+    snapshot = get_patient_context_snapshot('p1', doc)
+    snapshot.section('smart_goals')
+
+    patients = FakePatients()
+    records.latest['smart_goals'] = {'patient_id': 'p1', 'patient_goal': 'Walk 5 km'}
+    invalidate_patient_context('p1', db=patients, section='smart_goals')
+    assert patients.bumps == [('p1', 'context_version', 1)]
+
+    # This worker rebuilds even before it sees the new _etag
+    rebuilt = get_patient_context_snapshot('p1', doc)
+    assert rebuilt is not snapshot
+    assert rebuilt.section('smart_goals')['patient_goal'] == 'Walk 5 km'
+
+
+@pytest.mark.unit
+def test_another_workers_save_is_seen_through_the_new_version(records):
+    records.latest['smart_goals'] = {'patient_id': 'p1', 'patient_goal': 'walk 2 km'}
+    first = get_patient_context_snapshot('p1', FakePatientDoc('p1', PATIENT, '"etag-1"'))
+    assert first.sanitized()['smart_goals'] == {'patient_goal': 'walk 2 km'}
+
+    # The bump made on another worker changed the document's _etag
+    records.latest['smart_goals'] = {'patient_id': 'p1', 'patient_goal': 'walk 5 km'}
+    second = get_patient_context_snapshot('p1', FakePatientDoc('p1', PATIENT, '"etag-2"'))
+    assert second is not first and second.version == '"etag-2"'
+    assert second.sanitized()['smart_goals'] == {'patient_goal': 'walk 5 km'}
+    assert records.reads == 2
+
+
+@pytest.mark.unit
+def test_failed_section_load_is_retried(records, monkeypatch):
+    class Down:
+        def sections(self, patient_id):
+            raise ConnectionError('down')
+
+    monkeypatch.setattr(patient_context, 'get_clinical_records', lambda: Down())
+    snapshot = get_patient_context_snapshot('p1', FakePatientDoc('p1', PATIENT, '"etag-1"'))
+    assert snapshot.section('smart_goals') == {}
+
+    monkeypatch.setattr(patient_context, 'get_clinical_records', lambda: records)
+    assert snapshot.section('smart_goals')['patient_goal'] == 'Walk 2 km'
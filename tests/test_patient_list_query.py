@@ -0,0 +1,138 @@
+"""
+Tests for server-side patient list queries (patient_list_query.py).
+"""
+
+import pytest
+from patient_list_query import (
+    PatientListFilters, PatientScope, build_filter, collect_page, decode_cursor,
+    encode_cursor, keyset_clause, name_sort_key,
+)
+
+
+def _params(params):
+    return {p['name']: p['value'] for p in params}
+
+
+class FakePatients:
+    """Keyset fetches over an in-memory list sorted by (field, id) descending."""
+
+    def __init__(self, count, field='created_at'):
+        self.field = field
+        self.docs = sorted(({'id': f'p{i:05d}', field: f'2026-01-{i % 28 + 1:02d}', 'n': i}
+                            for i in range(count)),
+                           key=lambda d: (d[field], d['id']), reverse=True)
+        self.fetched = 0
+
+    def fetch(self, after, limit):
+        docs = self.docs
+        if after is not None:
+            docs = [d for d in docs if (d[self.field], d['id']) < after]
+        self.fetched += min(limit, len(docs))
+        return docs[:limit]
+
+
+@pytest.mark.unit
+def test_scope_is_one_ored_predicate():
+    clauses, params = build_filter(PatientScope('a@x.com', 'Clinic'), PatientListFilters())
+    assert clauses == ['(c.physio_id = @scope_physio OR c.institute = @scope_institute)']
+    assert _params(params) == {'@scope_physio': 'a@x.com', '@scope_institute': 'Clinic'}
+
+    clauses, _ = build_filter(PatientScope(everyone=True), PatientListFilters())
+    assert clauses == []
+
+
+@pytest.mark.unit
+def test_filters_are_parameterised_predicates():
+    filters = PatientListFilters(name=' Ann ', status='active', tags=['Spine', 'Acute Pain'],
+                                 date_from='2026-01-01', date_to='2026-01-31')
+    clauses, params = build_filter(PatientScope('a@x.com'), filters)
+
+    assert 'CONTAINS(c.name, @text_name, true)' in clauses
+    assert '(c.status = @status OR NOT IS_DEFINED(c.status))' in clauses
+    assert '(ARRAY_CONTAINS(c.tags, @tag0) OR ARRAY_CONTAINS(c.tags, @tag1))' in clauses
+    values = _params(params)
+    assert values['@text_name'] == 'Ann'
+    assert values['@date_to'] == '2026-02-01'
+    # No user input in the SQL text itself
+    assert not any('Ann' in clause or 'Spine' in clause for clause in clauses)
+
+
+@pytest.mark.unit
+def test_invalid_dates_are_ignored():
+    clauses, _ = build_filter(PatientScope('a@x.com'), PatientListFilters(date_from='yesterday'))
+    assert clauses == ['c.physio_id = @scope_physio']
+
+
+@pytest.mark.unit
+def test_search_index_answers_text_filters():
+    def search(scope, field, text):
+        return ['p1', 'p2'] if field == 'name' else None
+
+    filters = PatientListFilters(name='ann', contact='98')
+    clauses, params = build_filter(PatientScope('a@x.com'), filters, search)
+    assert 'ARRAY_CONTAINS(@text_name, c.id)' in clauses
+    assert 'CONTAINS(c.contact, @text_contact, true)' in clauses
+    assert _params(params)['@text_name'] == ['p1', 'p2']
+
+
+@pytest.mark.unit
+def test_keyset_clause_follows_sort_direction():
+    params = []
+    clause = keyset_clause('name_asc', ('ann', 'p7'), params)
+    assert clause == '(c.name_sort > @after_value OR (c.name_sort = @after_value AND c.id > @after_id))'
+    assert _params(params) == {'@after_id': 'p7', '@after_value': 'ann'}
+
+    clause = keyset_clause('newest', ('2026-01-01', 'p7'), [])
+    assert 'c.created_at < @after_value' in clause and 'NOT IS_DEFINED(c.created_at)' in clause
+
+
+@pytest.mark.unit
+def test_cursor_round_trip_and_rejection():
+    cursor = encode_cursor('newest', ('2026-01-01T00:00:00+00:00', 'p1'))
+    assert decode_cursor(cursor, 'newest') == ('2026-01-01T00:00:00+00:00', 'p1')
+    assert decode_cursor(cursor, 'name_asc') is None
+    assert decode_cursor('not-a-cursor', 'newest') is None
+    assert decode_cursor(None, 'newest') is None
+
+
+@pytest.mark.unit
+def test_keyset_pages_cover_every_patient_once():
+    patients = FakePatients(95)
+    seen, after = [], None
+    while True:
+        page, after = collect_page(patients.fetch, 'created_at', 20, after)
+        seen.extend(d['id'] for d in page)
+        if after is None:
+            break
+    assert seen == [d['id'] for d in patients.docs]
+
+
+@pytest.mark.unit
+def test_page_cost_does_not_grow_with_caseload():
+    costs = []
+    for count in (50, 50000):
+        patients = FakePatients(count)
+        _, after = collect_page(patients.fetch, 'created_at', 20)
+        patients.fetched = 0
+        collect_page(patients.fetch, 'created_at', 20, after)
+        costs.append(patients.fetched)
+    assert costs == [21, 21]
+
+
+@pytest.mark.unit
+def test_residual_filter_fills_page_and_stops_at_batch_limit():
+    patients = FakePatients(1000)
+    page, after = collect_page(patients.fetch, 'created_at', 5, residual=lambda d: d['n'] % 10 == 0,
+                               batch_size=20)
+    assert len(page) == 5 and all(d['n'] % 10 == 0 for d in page)
+
+    page, after = collect_page(patients.fetch, 'created_at', 5, residual=lambda d: False,
+                               batch_size=20, max_batches=3)
+    assert page == []
+    assert after == (patients.docs[59]['created_at'], patients.docs[59]['id'])
+
+
+@pytest.mark.unit
+def test_name_sort_key():
+    assert name_sort_key('  Ann Lee ') == 'ann lee'
+    assert name_sort_key(None) == ''
@@ -0,0 +1,171 @@
+"""
+Tests for the per-worker patient-number blocks (patient_numbers.py).
+
+The patient_counters document is simulated by a lock-protected counter with
+the same semantics as CosmosDBDocumentReference.increment_if / create /
+patch_if: writes to one document are applied one at a time.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from patient_numbers import PatientNumberAllocator
+
+
+class FakeCounters:
+    """patient_counters documents; latency simulates the round trip of each call."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        self.calls += 1
+
+    def reserve(self, physio_id, size):
+        with self._lock:
+            self._call()
+            self.counts[physio_id] = self.counts.get(physio_id, 0) + size
+            return self.counts[physio_id]
+
+    def release(self, physio_id, first_unused, last):
+        with self._lock:
+            self._call()
+            if self.counts.get(physio_id) != last:
+                return False
+            self.counts[physio_id] = first_unused - 1
+            return True
+
+    def next_number_per_creation(self, physio_id):
+        """What add_patient did before: read the counter, then increment it by one."""
+        with self._lock:
+            self._call()
+            exists = physio_id in self.counts
+        if not exists:
+            with self._lock:
+                self._call()
+                self.counts.setdefault(physio_id, 0)
+        with self._lock:
+            self._call()
+            self.counts[physio_id] += 1
+            return self.counts[physio_id]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _allocator(counters, **kwargs):
+    kwargs.setdefault('block_size', 5)
+    return PatientNumberAllocator(counters.reserve, counters.release, **kwargs)
+
+
+@pytest.mark.unit
+def test_block_is_reserved_with_one_patch_and_handed_out_locally():
+    counters = FakeCounters()
+    numbers = _allocator(counters)
+    assert [numbers.allocate('a@x.com') for _ in range(7)] == [1, 2, 3, 4, 5, 6, 7]
+    assert counters.calls == 2
+    assert counters.counts['a@x.com'] == 10
+
+    stats = numbers.stats()
+    assert stats['issued'] == 7 and stats['reserve_patches'] == 2 and stats['held'] == 3
+
+
+@pytest.mark.unit
+def test_existing_counter_carries_on():
+    counters = FakeCounters()
+    counters.counts['a@x.com'] = 41
+    assert _allocator(counters).allocate('a@x.com') == 42
+
+
+@pytest.mark.unit
+def test_expired_block_goes_back_when_nothing_was_reserved_after_it():
+    counters, clock = FakeCounters(), Clock()
+    numbers = _allocator(counters, block_seconds=60, clock=clock)
+    numbers.allocate('a@x.com')
+
+    clock.now += 61
+    # 2-5 go back, and the new block starts right after the last issued number
+    assert numbers.allocate('a@x.com') == 2
+    stats = numbers.stats()
+    assert stats['released'] == 4 and stats['gaps'] == 0
+
+
+@pytest.mark.unit
+def test_unused_numbers_are_a_gap_once_another_worker_reserved_after_them():
+    counters = FakeCounters()
+    one, other = _allocator(counters), _allocator(counters)
+    assert one.allocate('a@x.com') == 1
+    assert other.allocate('a@x.com') == 6
+
+    one.flush()
+    other.flush()
+    assert one.stats()['gaps'] == 4
+    assert other.stats()['released'] == 4
+    assert counters.counts['a@x.com'] == 6
+
+
+@pytest.mark.unit
+def test_concurrent_registrations_across_workers_get_unique_numbers():
+    counters = FakeCounters()
+    workers = [_allocator(counters) for _ in range(4)]
+
+    def register(i):
+        return workers[i % len(workers)].allocate('a@x.com')
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        issued = list(pool.map(register, range(400)))
+    assert len(set(issued)) == 400
+    assert sum(worker.stats()['reserve_patches'] for worker in workers) <= 400 // 5 + len(workers)
+
+
+@pytest.mark.slow
+def test_benchmark_simultaneous_registrations():
+    """Block allocator vs a counter read + increment per creation (2 ms simulated RTT)."""
+    registrations, threads, physios = 400, 64, 4
+
+    def run(allocate):
+        barrier = threading.Barrier(threads)
+        issued, lock = [], threading.Lock()
+
+        def register(t):
+            barrier.wait()
+            for i in range(t, registrations, threads):
+                number = allocate(f'physio{i % physios}@x.com')
+                with lock:
+                    issued.append((i % physios, number))
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(register, range(threads)))
+        assert len(set(issued)) == registrations
+        return time.perf_counter() - started
+
+    counters = FakeCounters(latency=0.002)
+    per_creation_s = run(counters.next_number_per_creation)
+    per_creation_calls = counters.calls
+
+    counters = FakeCounters(latency=0.002)
+    workers = [PatientNumberAllocator(counters.reserve, counters.release, block_size=10) for _ in range(4)]
+    block_s = run(lambda physio_id: workers[threading.get_ident() % len(workers)].allocate(physio_id))
+    waits = sum(worker.stats()['lock_waits'] for worker in workers)
+    for worker in workers:
+        worker.flush()
+    gaps = sum(worker.stats()['gaps'] for worker in workers)
+
+    print(f"\nper creation: {per_creation_s * 1000:.0f} ms, {per_creation_calls} counter calls; "
+          f"blocks: {block_s * 1000:.0f} ms, {counters.calls} counter calls, "
+          f"{waits} lock waits, {gaps} numbers skipped")
+    assert counters.calls < per_creation_calls / 5
+    assert block_s < per_creation_s
@@ -0,0 +1,158 @@
+"""
+Tests for the per-owner patient search index (patient_search_index.py).
+"""
+
+import time
+
+import pytest
+from patient_list_query import PatientScope
+from patient_search_index import PatientSearchIndex, name_similarity, normalize_name, phone_key
+
+
+class FakePatients:
+    """load(field, value, since_ts) over an in-memory patients container."""
+
+    def __init__(self, docs):
+        self.docs = {doc['id']: {'_ts': 1, **doc} for doc in docs}
+        self.loads = []
+
+    def load(self, field, value, since_ts):
+        self.loads.append((field, value, since_ts))
+        return [dict(doc) for doc in self.docs.values()
+                if doc.get(field) == value and doc['_ts'] > since_ts]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+PATIENTS = [
+    {'id': 'p1', 'patient_id': 'PT-0001', 'name': 'Anjali Sharma', 'contact': '+91 98765 43210',
+     'physio_id': 'a@x.com', 'institute': 'Clinic'},
+    {'id': 'p2', 'patient_id': 'PT-0002', 'name': 'Anjalee Sharma', 'contact': '044-2222333',
+     'physio_id': 'a@x.com'},
+    {'id': 'p3', 'patient_id': 'PT-0003', 'name': 'Ravi Kumar', 'contact': '9876543210',
+     'physio_id': 'b@x.com', 'institute': 'Clinic'},
+    {'id': 'p4', 'patient_id': 'PT-0004', 'name': 'Ann', 'contact': '',
+     'physio_id': 'c@x.com'},
+]
+
+
+def _index(clock=None, **kwargs):
+    patients = FakePatients(PATIENTS)
+    return PatientSearchIndex(patients.load, clock=clock or Clock(), **kwargs), patients
+
+
+@pytest.mark.unit
+def test_normalisers():
+    assert normalize_name('  José  O\'Brien ') == 'jose o brien'
+    assert phone_key('+91 98765-43210') == phone_key('098765 43210') == '9876543210'
+    assert name_similarity('anjali sharma', 'anjalee sharma') > 0.6
+    assert name_similarity('anjali sharma', 'ravi kumar') < 0.2
+
+
+@pytest.mark.unit
+def test_duplicates_exact_similar_and_same_contact():
+    index, _ = _index()
+    scope = PatientScope('a@x.com', 'Clinic')
+
+    matches = {m['patient_id']: m['match_type'] for m in
+               index.find_duplicates(scope, 'anjali  SHARMA', contact='98765 43210')}
+    # p2 is a fuzzy match, p3 a teammate's patient with the same number
+    assert matches == {'PT-0001': 'exact', 'PT-0002': 'similar', 'PT-0003': 'same_contact'}
+
+    # Another physio's patients are out of scope
+    assert index.find_duplicates(PatientScope('a@x.com'), 'Ravi Kumar') == []
+
+
+@pytest.mark.unit
+def test_short_names_only_match_exactly():
+    index, _ = _index()
+    scope = PatientScope('c@x.com')
+    assert [m['match_type'] for m in index.find_duplicates(scope, 'ann')] == ['exact']
+    assert index.find_duplicates(scope, 'an') == []
+
+
+@pytest.mark.unit
+def test_search_answers_substring_filters():
+    index, _ = _index()
+    scope = PatientScope('a@x.com', 'Clinic')
+    assert index.search(scope, 'name', 'SHARMA') == ['p1', 'p2']
+    assert index.search(scope, 'patient_id', '0003') == ['p3']
+    assert index.search(scope, 'contact', '43210') == ['p1', 'p3']
+    assert index.search(scope, 'name', 'a') == ['p1', 'p2', 'p3']
+    # Not indexed or not scoped: the caller falls back to a query predicate
+    assert index.search(scope, 'complaint', 'knee') is None
+    assert index.search(PatientScope(everyone=True), 'name', 'ann') is None
+
+
+@pytest.mark.unit
+def test_upsert_and_remove_apply_to_hydrated_owners():
+    index, patients = _index()
+    scope = PatientScope('a@x.com')
+    index.search(scope, 'name', 'x')
+
+    index.upsert({'id': 'p9', 'patient_id': 'PT-0009', 'name': 'Meera Iyer',
+                  'physio_id': 'a@x.com', 'created_at': 'SERVER_TIMESTAMP'})
+    [match] = index.find_duplicates(scope, 'Meera Iyer')
+    assert match['created_at'] != 'SERVER_TIMESTAMP'
+
+    # Renamed, then moved to another physio
+    index.upsert({**PATIENTS[1], 'name': 'Priya Nair'})
+    assert index.search(scope, 'name', 'anjalee') == []
+    index.upsert({**PATIENTS[1], 'physio_id': 'b@x.com'})
+    assert index.search(scope, 'name', 'priya') == []
+
+    index.remove('p1')
+    assert index.search(scope, 'name', 'sharma') == []
+    assert len(patients.loads) == 1
+
+
+@pytest.mark.unit
+def test_changes_from_other_workers_arrive_by_delta_refresh():
+    clock = Clock()
+    index, patients = _index(clock, refresh_seconds=5)
+    scope = PatientScope('a@x.com')
+    assert index.search(scope, 'name', 'meera') == []
+
+    patients.docs['p9'] = {'id': 'p9', '_ts': 7, 'name': 'Meera Iyer', 'physio_id': 'a@x.com'}
+    assert index.search(scope, 'name', 'meera') == []       # within the refresh interval
+    clock.now += 5
+    assert index.search(scope, 'name', 'meera') == ['p9']
+    assert patients.loads == [('physio_id', 'a@x.com', 0), ('physio_id', 'a@x.com', 0)]
+
+    clock.now += 5
+    index.search(scope, 'name', 'meera')
+    assert patients.loads[-1] == ('physio_id', 'a@x.com', 6)
+    assert index.stats()['refreshes'] == 2
+
+
+@pytest.mark.unit
+def test_short_filter_over_big_index_falls_back_to_the_query():
+    docs = [{'id': f'p{i}', 'patient_id': f'PT-{i:05d}', 'name': f'Patient {i}', 'physio_id': 'a@x.com'}
+            for i in range(1000)]
+    index = PatientSearchIndex(FakePatients(docs).load, clock=Clock(), max_ids=300)
+    scope = PatientScope('a@x.com')
+
+    # 'pa' matches every patient: too many ids for one query parameter
+    assert index.search(scope, 'name', 'pa') is None
+    assert index.search(scope, 'name', 'patient 99') == ['p99'] + [f'p{i}' for i in range(990, 1000)]
+
+
+@pytest.mark.slow
+def test_lookup_is_sub_millisecond_on_large_caseload():
+    docs = [{'id': f'p{i}', 'patient_id': f'PT-{i:05d}', 'name': f'Patient {i} Surname{i % 97}',
+             'contact': f'98{i:08d}', 'physio_id': 'a@x.com'} for i in range(20000)]
+    index = PatientSearchIndex(FakePatients(docs).load, clock=Clock())
+    scope = PatientScope('a@x.com')
+    index.find_duplicates(scope, 'warm up')
+
+    start = time.perf_counter()
+    for _ in range(100):
+        index.search(scope, 'patient_id', '12345')
+        index.search(scope, 'contact', '0001234')
+    assert (time.perf_counter() - start) / 200 < 0.001
@@ -0,0 +1,115 @@
+"""
+Tests for the per-user autocomplete phrase index (phrase_index.py).
+"""
+
+import pytest
+from phrase_index import PhraseIndex, apply_deltas, phrase_deltas, split_phrases
+
+
+class FakeStore:
+    """load/save over in-memory documents with a version compare-and-swap."""
+
+    def __init__(self):
+        self.docs = {}
+        self.loads = 0
+        self.conflicts = 0
+
+    def load(self, user_id):
+        self.loads += 1
+        doc = self.docs.get(user_id)
+        return (doc['fields'], doc['version']) if doc else None
+
+    def save(self, user_id, fields, expected_version):
+        current = self.docs.get(user_id)
+        if (current['version'] if current else None) != expected_version:
+            return False
+        self.docs[user_id] = {'fields': fields, 'version': (expected_version or 0) + 1}
+        return True
+
+
+@pytest.mark.unit
+def test_split_phrases():
+    assert split_phrases(' Lower back pain. Worse in the morning.. ') == ['Lower back pain', 'Worse in the morning']
+    assert split_phrases(None) == []
+
+
+@pytest.mark.unit
+def test_edit_moves_counts_from_old_to_new_text():
+    deltas = phrase_deltas({'f': 'Knee pain. Swelling'}, old={'f': 'Knee pain. Stiffness'})
+    assert deltas == {'f': {'Swelling': 1, 'Stiffness': -1}}
+    assert phrase_deltas({'f': 'Same'}, old={'f': 'Same'}) == {}
+
+
+@pytest.mark.unit
+def test_table_drops_zero_counts_and_least_used_beyond_cap():
+    table = {}
+    apply_deltas(table, {'f': {'a': 3, 'b': 1, 'c': 2}}, max_phrases=2)
+    assert table == {'f': {'a': 3, 'c': 2}}
+    apply_deltas(table, {'f': {'a': -3, 'c': -2}})
+    assert table == {}
+
+
+@pytest.mark.unit
+def test_new_phrase_gets_into_a_full_table():
+    table = {}
+    apply_deltas(table, {'f': {'b knee pain': 1, 'c hip pain': 1}}, max_phrases=2)
+    # Sorts after both kept phrases, but is the most recent of the equally used
+    apply_deltas(table, {'f': {'z new wording': 1}}, max_phrases=2)
+    assert table == {'f': {'c hip pain': 1, 'z new wording': 1}}
+
+    # More uses still beat recency
+    apply_deltas(table, {'f': {'c hip pain': 1}}, max_phrases=2)
+    apply_deltas(table, {'f': {'y newer wording': 1}}, max_phrases=2)
+    assert table == {'f': {'c hip pain': 2, 'y newer wording': 1}}
+
+
+@pytest.mark.unit
+def test_suggestions_ranked_by_frequency_across_aliases():
+    store = FakeStore()
+    index = PhraseIndex(store.load, store.save)
+    for text in ('Lower back pain radiating to left leg', 'Lower back pain radiating to left leg',
+                 'Lower back pain with morning stiffness'):
+        index.record('a@x.com', {'present_history': text})
+    index.record('a@x.com', {'chief_complaint': 'Lower back pain with morning stiffness. Neck pain'})
+
+    assert index.suggest('a@x.com', 'present_history', 'LOWER back') == [
+        {'text': 'Lower back pain radiating to left leg', 'frequency': 2},
+        {'text': 'Lower back pain with morning stiffness', 'frequency': 2},
+    ]
+    assert index.suggest('a@x.com', 'present_history', 'neck pain') == []    # not longer than the query
+    assert index.suggest('b@x.com', 'present_history', 'lower') == []
+
+
+@pytest.mark.unit
+def test_lookups_are_served_from_memory_and_see_own_saves():
+    store = FakeStore()
+    index = PhraseIndex(store.load, store.save)
+    index.record('a@x.com', {'treatment_plan': 'Core strengthening'})
+    loads = store.loads
+
+    for _ in range(5):
+        index.suggest('a@x.com', 'plan_next', 'core')
+    assert store.loads == loads + 1
+
+    index.record('a@x.com', {'treatment_plan': 'Core stability'})
+    assert [s['text'] for s in index.suggest('a@x.com', 'plan_next', 'core')] == [
+        'Core stability', 'Core strengthening']
+
+
+@pytest.mark.unit
+def test_concurrent_save_is_retried_not_lost():
+    store = FakeStore()
+    PhraseIndex(store.load, store.save).record('a@x.com', {'f': 'First'})
+
+    def load_then_race(user_id):
+        loaded = FakeStore.load(store, user_id)
+        if store.loads == 2:
+            # Another worker saves between our load and save
+            store.save(user_id, {**loaded[0], 'g': [['Other', 1]]}, loaded[1])
+        return loaded
+
+    PhraseIndex(load_then_race, store.save).record('a@x.com', {'f': 'Second'})
+
+    fields = store.docs['a@x.com']['fields']
+    assert fields['g'] == [['Other', 1]]
+    assert sorted(fields['f']) == [['First', 1], ['Second', 1]]
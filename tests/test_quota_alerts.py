@@ -0,0 +1,30 @@
+"""
+Tests for threshold-crossing quota alerts (quota_alerts.py).
+"""
+
+import pytest
+from quota_alerts import QUOTA_ALERT_RESET, alert_marker_field, crossed_threshold
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('old, new, limit, expected', [
+    (19, 20, 25, 80),      # 80% of 25 = 20
+    (20, 21, 25, None),    # already past 80, not yet 90
+    (22, 23, 25, 90),      # 90% of 25 = 22.5 -> 23
+    (24, 25, 25, 100),
+    (10, 25, 25, 100),     # a jump reports only the highest threshold crossed
+    (0, 5, 250, None),
+    (199, 204, 250, 80),   # leased block straddling the boundary
+    (25, 24, 25, None),    # counter going down (returned lease)
+    (0, 10, -1, None),     # unlimited
+    (0, 10, 0, None),
+])
+def test_crossed_threshold(old, new, limit, expected):
+    assert crossed_threshold(old, new, limit) == expected
+
+
+@pytest.mark.unit
+def test_period_reset_clears_every_marker():
+    assert QUOTA_ALERT_RESET[alert_marker_field('ai', 90)] == 0
+    assert QUOTA_ALERT_RESET[alert_marker_field('voice', 100)] == 0
+    assert len(QUOTA_ALERT_RESET) == 9
@@ -0,0 +1,186 @@
+"""
+Tests for local AI quota leases (quota_lease.py).
+
+The shared subscription counter is simulated by a lock-protected counter with
+the same conditional-increment semantics as CosmosDBDocumentReference.increment_if,
+and the grant policy mirrors subscription_manager._grant_ai_calls, including
+the billing-period condition.
+"""
+
+import random
+import threading
+
+import pytest
+from quota_lease import QuotaLeaseAllocator
+
+
+class FakeSubscription:
+    """Shared ai_calls_this_month counter with a server-side limit check."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.count = 0
+        self.peak = 0
+        self.patches = 0
+        self.period = 'p1'
+        self._lock = threading.Lock()
+
+    def increment_if(self, delta, max_value=None, min_value=None, period=None):
+        with self._lock:
+            self.patches += 1
+            if period is not None and period != self.period:
+                return False, None
+            if max_value is not None and self.count >= max_value:
+                return False, None
+            if min_value is not None and self.count < min_value:
+                return False, None
+            self.count += delta
+            self.peak = max(self.peak, self.count)
+            return True, self.count
+
+    def grant(self, user_id, wanted):
+        period = self.period
+        units = max(1, min(wanted, (self.limit - self.count) // 4))
+        while True:
+            applied, _ = self.increment_if(units, max_value=self.limit - units + 1, period=period)
+            if applied:
+                return units, period
+            if units == 1:
+                return 0, period
+            units = 1
+
+    def give_back(self, user_id, units, period):
+        self.increment_if(-units, min_value=units, period=period)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.period = 'p2'
+
+
+def _allocator(sub, **kwargs):
+    kwargs.setdefault('block_size', 5)
+    kwargs.setdefault('lease_seconds', 60)
+    return QuotaLeaseAllocator(sub.grant, sub.give_back, start_sweeper=False, **kwargs)
+
+
+@pytest.mark.unit
+def test_block_is_leased_with_one_patch_and_consumed_locally():
+    sub = FakeSubscription(limit=100)
+    leases = _allocator(sub)
+
+    assert all(leases.take('u') for _ in range(5))
+    assert sub.patches == 1
+    assert sub.count == 5
+    assert leases.stats()['local_takes'] == 4
+
+
+@pytest.mark.unit
+def test_cache_hit_returns_unit_without_touching_subscription():
+    sub = FakeSubscription(limit=100)
+    leases = _allocator(sub)
+
+    leases.take('u')
+    patches = sub.patches
+    for _ in range(20):
+        leases.take('u')
+        leases.give_back('u')   # cache hit
+    assert sub.patches == patches
+    assert leases.stats()['release_patches'] == 0
+
+
+@pytest.mark.unit
+def test_unused_units_returned_on_expiry():
+    now = [0.0]
+    sub = FakeSubscription(limit=100)
+    leases = _allocator(sub, lease_seconds=60, clock=lambda: now[0])
+
+    leases.take('u')
+    leases.take('u')
+    assert sub.count == 5
+
+    assert leases.sweep() == 0
+    now[0] = 61
+    assert leases.sweep() == 3
+    assert sub.count == 2
+    assert leases.stats()['active_leases'] == 0
+
+
+@pytest.mark.unit
+def test_expired_lease_is_not_reused():
+    now = [0.0]
+    sub = FakeSubscription(limit=100)
+    leases = _allocator(sub, lease_seconds=60, clock=lambda: now[0])
+
+    leases.take('u')
+    now[0] = 61
+    leases.take('u')            # returns the 4 stale units, leases a new block
+    assert sub.count == 2 + 4
+    assert leases.stats()['release_patches'] == 1
+
+
+@pytest.mark.unit
+def test_blocks_shrink_near_limit():
+    sub = FakeSubscription(limit=7)
+    leases = _allocator(sub)
+
+    taken = sum(leases.take('u') for _ in range(10))
+    assert taken == 7
+    assert sub.count == 7
+    assert not leases.take('u')
+
+
+@pytest.mark.unit
+def test_plan_limit_never_exceeded_across_concurrent_workers():
+    limit = 250
+    sub = FakeSubscription(limit=limit)
+    workers = [_allocator(sub) for _ in range(3)]
+    charged = []
+    charged_lock = threading.Lock()
+
+    def client(worker, seed):
+        rng = random.Random(seed)
+        misses = 0
+        while misses < 3:
+            if not worker.take('u'):
+                misses += 1
+                continue
+            if rng.random() < 0.3:
+                worker.give_back('u')   # cache hit: free
+            else:
+                with charged_lock:
+                    charged.append(1)
+
+    threads = [threading.Thread(target=client, args=(workers[i % 3], i)) for i in range(24)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sub.peak <= limit
+    assert len(charged) <= limit
+    for worker in workers:
+        worker.sweep(flush_all=True)
+    # Once every lease is returned the counter is exactly the charged calls
+    assert sub.count == len(charged)
+
+
+@pytest.mark.unit
+def test_old_period_units_are_not_returned_after_a_reset_on_another_worker():
+    now = [0.0]
+    sub = FakeSubscription(limit=100)
+    resetting, other = (_allocator(sub, clock=lambda: now[0]) for _ in range(2))
+    resetting.take('u')
+    other.take('u')
+    assert sub.count == 10
+
+    # The monthly reset runs on the first worker only
+    sub.reset()
+    resetting.discard('u')
+    assert all(resetting.take('u') for _ in range(5))
+    assert sub.count == 5
+
+    # The other worker's expired old-period lease doesn't reach the new period
+    now[0] = 61
+    assert other.sweep() == 4
+    assert sub.count == 5
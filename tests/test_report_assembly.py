@@ -0,0 +1,126 @@
+"""
+Tests for the shared patient report assembly (report_assembly.py).
+"""
+
+import threading
+from datetime import datetime
+
+import pytest
+from report_assembly import REPORT_SECTIONS, ReportAssembler, mobile_section
+
+
+class FakeSource:
+    """Section, follow-up and therapist lookups over in-memory data, counting calls."""
+
+    def __init__(self, sections=None, follow_ups=None, fail=()):
+        self.sections = sections or {}
+        self.follow_up_list = follow_ups or []
+        self.fail = set(fail)
+        self.calls = 0
+        self.threads = set()
+        self._lock = threading.Lock()
+
+    def _note(self):
+        with self._lock:
+            self.calls += 1
+            self.threads.add(threading.get_ident())
+
+    def latest_sections(self, patient_id, collections):
+        self._note()
+        if self.fail & set(collections):
+            raise RuntimeError('read failed')
+        return {collection: dict(self.sections.get(collection) or {}) for collection in collections}
+
+    def follow_ups(self, patient_id):
+        self._note()
+        return list(self.follow_up_list)
+
+    def therapist(self, email):
+        self._note()
+        return {'name': 'Dr Rao', 'email': email}
+
+    def assembler(self, **kwargs):
+        return ReportAssembler(self.latest_sections, self.follow_ups, self.therapist, **kwargs)
+
+
+PATIENT = {'name': 'Ann', 'physio_id': 'a@x.com', 'created_at': datetime(2026, 1, 5, 9, 30)}
+
+
+@pytest.mark.unit
+def test_assembles_all_sections_in_one_pass():
+    source = FakeSource(
+        sections={'smart_goals': {'patient_goal': 'Walk 2 km', 'timestamp': datetime(2026, 2, 1)}},
+        follow_ups=[{'session_number': 2}, {'session_number': 1}],
+    )
+    report = source.assembler().report('p1', PATIENT, 'v1')
+
+    # One clinical-record read, the follow-ups and the therapist
+    assert source.calls == 3
+    assert report.sections['goals'] == {'patient_goal': 'Walk 2 km', 'timestamp': '2026-02-01T00:00:00'}
+    assert report.sections['treatment'] == {}
+    assert report.patient['id'] == 'p1' and report.patient['created_at'] == '2026-01-05T09:30:00'
+    assert report.therapist['name'] == 'Dr Rao'
+
+    body = report.to_api()
+    assert set(body['assessments']) == set(REPORT_SECTIONS)
+    assert [f['session_number'] for f in body['follow_ups']] == [2, 1]
+    context = report.template_context()
+    assert context['goals'] is report.sections['goals'] and context['follow_ups'] == body['follow_ups']
+
+
+@pytest.mark.unit
+def test_sections_are_fetched_concurrently_on_the_shared_pool():
+    source = FakeSource()
+    source.assembler().assemble('p1', PATIENT, 'v1')
+    assert threading.get_ident() not in source.threads
+
+
+@pytest.mark.unit
+def test_mobile_sections_fall_back_to_the_patient_document():
+    patient = {**PATIENT, 'smartGoals': {'goals': 'Return to running', 'outcomeTimeframe': '6 weeks'},
+               'treatmentPlan': 'Manual therapy'}
+    assert mobile_section(patient, 'smartGoals') == {'patient_goal': 'Return to running',
+                                                      'outcome_timeframe': '6 weeks'}
+
+    report = FakeSource().assembler().report('p1', patient, 'v1')
+    assert report.sections['goals']['patient_goal'] == 'Return to running'
+    assert report.sections['treatment'] == {'treatmentPlan': 'Manual therapy'}
+
+
+@pytest.mark.unit
+def test_cached_per_patient_version():
+    source = FakeSource(sections={'smart_goals': {'patient_goal': 'Walk 2 km'}})
+    assembler = source.assembler()
+    first = assembler.report('p1', PATIENT, 'v1')
+    calls = source.calls
+
+    assert assembler.report('p1', PATIENT, 'v1') is first
+    assert source.calls == calls
+
+    source.sections['smart_goals'] = {'patient_goal': 'Walk 5 km'}
+    second = assembler.report('p1', PATIENT, 'v2')
+    assert source.calls == calls * 2
+    assert second.sections['goals']['patient_goal'] == 'Walk 5 km'
+    assert second.etag != first.etag
+
+
+@pytest.mark.unit
+def test_etag_depends_only_on_content():
+    source = FakeSource(sections={'initial_plan': {'active_movements': 'Mandatory assessment'}})
+    # Two workers assembling the same content at different times agree on the ETag
+    one = source.assembler().assemble('p1', PATIENT, 'v1')
+    other = source.assembler().assemble('p1', PATIENT, 'v2')
+    assert one.etag == other.etag
+    assert source.assembler().assemble('p1', {**PATIENT, 'name': 'Ann Lee'}, 'v3').etag != one.etag
+
+
+@pytest.mark.unit
+def test_incomplete_report_is_served_but_not_cached():
+    source = FakeSource(fail={'treatment_plan'})
+    assembler = source.assembler()
+    report = assembler.report('p1', PATIENT, 'v1')
+    assert not report.complete and report.sections['treatment'] == {}
+
+    source.fail.clear()
+    assert assembler.report('p1', PATIENT, 'v1').complete
+    assert assembler.stats()['incomplete'] == 1
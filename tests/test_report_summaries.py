@@ -0,0 +1,206 @@
+"""
+Tests for the precomputed patient-report AI summaries (report_summaries.py).
+"""
+
+import pytest
+from report_summaries import CLAIM_SECONDS, KINDS, ReportSummaryStore, input_version, regenerating_kinds
+
+
+class FakeDoc:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def _resolve(doc, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+class FakeRef:
+    """patch_if with dotted paths and conditions like Cosmos DB."""
+
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        return FakeDoc(self.collection.docs.get(self.id))
+
+    def create(self, data):
+        self.collection.before_create()
+        if self.id in self.collection.docs:
+            return False
+        self.collection.docs[self.id] = dict(data)
+        return True
+
+    def patch_if(self, fields, conditions=()):
+        doc = self.collection.docs.get(self.id)
+        if doc is None:
+            return False
+        for field, op, value in conditions:
+            current, defined = _resolve(doc, field)
+            if (op == 'missing' and defined) or (op == '==' and current != value):
+                return False
+        for key, value in fields.items():
+            *parents, last = key.split('.')
+            target = doc
+            for part in parents:
+                target = target[part]
+            target[last] = value
+        return True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.before_create = lambda: None
+
+    def document(self, doc_id):
+        return FakeRef(self, doc_id)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+PATIENT = {'age_sex': '45/M', 'present_history': 'Low back pain for 3 weeks', 'past_history': ''}
+SECTIONS = {
+    'subjective': {'body_structure': 'lumbar spine'},
+    'provisional_diagnosis': {'likelihood': 'Mechanical LBP'},
+    'initial_plan': {'active_movements': 'Mandatory assessment'},
+    'smart_goals': {'patient_goal': 'Walk 2 km'},
+}
+
+
+def _store(collection, prompts, clock=None, jobs=None, fail=False):
+    def generate(prompt, patient_context):
+        if fail:
+            raise RuntimeError('AI down')
+        prompts.append(prompt)
+        return f'summary {len(prompts)}'
+
+    submit = jobs.append if jobs is not None else (lambda job: job())
+    return ReportSummaryStore(collection, generate, submit=submit, clock=clock or Clock())
+
+
+@pytest.mark.unit
+def test_versions_follow_only_the_inputs_of_each_summary():
+    base = {kind: input_version(kind, PATIENT, SECTIONS) for kind in KINDS}
+    changed = {**SECTIONS, 'initial_plan': {'active_movements': 'Mandatory assessment with precautions'}}
+    assert input_version('initial_plan', PATIENT, changed) != base['initial_plan']
+    assert input_version('smart_goals', PATIENT, changed) == base['smart_goals']
+    assert input_version('treatment_plan', PATIENT, changed) == base['treatment_plan']
+    assert input_version('smart_goals', {**PATIENT, 'age_sex': '46/M'}, SECTIONS) != base['smart_goals']
+
+
+@pytest.mark.unit
+def test_first_view_generates_in_background_then_serves_stored():
+    collection, prompts, jobs = FakeCollection(), [], []
+    store = _store(collection, prompts, jobs=jobs)
+
+    view = store.view('p1', PATIENT, SECTIONS)
+    assert set(view.regenerating) == set(KINDS)
+    assert view.texts == {kind: '' for kind in KINDS}
+    assert prompts == []  # nothing generated inside the view
+
+    # A second view while the jobs are queued doesn't claim again
+    assert len(jobs) == 3
+    store.view('p1', PATIENT, SECTIONS)
+    assert len(jobs) == 3
+
+    for job in jobs:
+        job()
+    view = store.view('p1', PATIENT, SECTIONS)
+    assert view.regenerating == []
+    assert sorted(view.texts.values()) == ['summary 1', 'summary 2', 'summary 3']
+    assert len(prompts) == 3
+
+
+@pytest.mark.unit
+def test_racing_first_views_generate_once():
+    collection, prompts = FakeCollection(), []
+    store, other = _store(collection, prompts), _store(collection, prompts)
+
+    # The other view creates the document, claims and stores the summaries
+    # between this view's read and its create
+    def other_first():
+        collection.before_create = lambda: None
+        other.view('p1', PATIENT, SECTIONS)
+    collection.before_create = other_first
+
+    view = store.view('p1', PATIENT, SECTIONS)
+    assert set(view.regenerating) == set(KINDS)  # from its stale read
+    assert len(prompts) == 3
+    stored = store.view('p1', PATIENT, SECTIONS)
+    assert stored.regenerating == [] and sorted(stored.texts.values()) == ['summary 1', 'summary 2', 'summary 3']
+
+
+@pytest.mark.unit
+def test_editing_a_section_regenerates_only_dependent_summaries():
+    collection, prompts = FakeCollection(), []
+    store = _store(collection, prompts)
+    store.view('p1', PATIENT, SECTIONS)
+    assert len(prompts) == 3
+
+    jobs = []
+    store = _store(collection, prompts, jobs=jobs)
+    edited = {**SECTIONS, 'smart_goals': {'patient_goal': 'Walk 5 km'}}
+    view = store.view('p1', PATIENT, edited)
+    # Stale texts are still shown while regenerating
+    assert sorted(view.regenerating) == ['smart_goals', 'treatment_plan']
+    assert all(view.texts.values())
+    assert regenerating_kinds(collection.docs['p1'], Clock()()) == view.regenerating
+
+    for job in jobs:
+        job()
+    assert len(prompts) == 5
+    assert store.view('p1', PATIENT, edited).regenerating == []
+
+
+@pytest.mark.unit
+def test_failed_generation_is_retried_after_the_claim_expires():
+    collection, clock = FakeCollection(), Clock()
+    store = _store(collection, [], clock=clock, fail=True)
+    store.view('p1', PATIENT, SECTIONS)
+    assert store.stats()['failed'] == 3
+    assert collection.docs['p1']['summaries'] == {}
+
+    prompts = []
+    retry = _store(collection, prompts, clock=clock)
+    retry.view('p1', PATIENT, SECTIONS)
+    assert prompts == []  # still claimed by the failed attempt
+
+    clock.now += CLAIM_SECONDS + 1
+    retry.view('p1', PATIENT, SECTIONS)
+    assert len(prompts) == 3
+
+
+@pytest.mark.unit
+def test_superseded_result_is_not_stored():
+    collection, prompts, jobs = FakeCollection(), [], []
+    store = _store(collection, prompts, jobs=jobs)
+    only_plan = {'initial_plan': {'active_movements': 'Mandatory assessment'}}
+    store.view('p1', PATIENT, only_plan)
+    old_job = jobs.pop()
+
+    # The plan is edited and re-viewed after the claim expired; the newer version wins
+    store._clock.now += CLAIM_SECONDS + 1
+    newer = {'initial_plan': {'active_movements': 'Assessment with precautions'}}
+    store.view('p1', PATIENT, newer)
+    jobs.pop()()
+    old_job()
+
+    stored = collection.docs['p1']['summaries']['initial_plan']
+    assert stored['version'] == input_version('initial_plan', PATIENT, newer)
+    assert store.stats()['superseded'] == 1
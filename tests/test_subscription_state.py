@@ -0,0 +1,96 @@
+"""
+Tests for the per-worker subscription state cache (subscription_state.py).
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from subscription_state import SubscriptionStateCache, period_end_epoch
+
+
+def _subscription(**overrides):
+    sub = {
+        'plan_type': 'solo',
+        'status': 'active',
+        'current_period_end': (datetime.now(timezone.utc) + timedelta(days=10)).isoformat(),
+        'ai_calls_this_month': 3,
+        'ai_calls_limit': 250,
+        'ai_tokens_balance': 0,
+        'is_super_admin': False,
+    }
+    sub.update(overrides)
+    return sub
+
+
+@pytest.mark.unit
+def test_get_returns_copies():
+    states = SubscriptionStateCache(maxsize=8, ttl=60)
+    assert states.get('a@x.com') is None
+    states.put('a@x.com', _subscription())
+
+    first = states.get('a@x.com')
+    first['ai_calls_this_month'] = 999
+    assert states.get('a@x.com')['ai_calls_this_month'] == 3
+    assert states.stats()['hits'] == 2
+
+
+@pytest.mark.unit
+def test_write_through_updates_cached_counters_without_lookups():
+    states = SubscriptionStateCache(maxsize=8, ttl=60)
+    states.put('a@x.com', _subscription())
+
+    states.set_fields('a@x.com', ai_calls_this_month=4)
+    states.at_least('a@x.com', 'ai_calls_this_month', 2)   # already higher: no change
+    states.at_least('a@x.com', 'ai_tokens_balance', 0)
+    states.set_fields('b@x.com', ai_calls_this_month=1)    # not cached: ignored
+
+    stats = states.stats()
+    assert (stats['hits'], stats['misses'], stats['write_throughs']) == (0, 0, 1)
+    assert states.get('a@x.com')['ai_calls_this_month'] == 4
+    assert states.get('b@x.com') is None
+
+
+@pytest.mark.unit
+def test_rejected_increment_raises_counter_to_limit():
+    states = SubscriptionStateCache(maxsize=8, ttl=60)
+    states.put('a@x.com', _subscription(ai_calls_this_month=100))
+    states.at_least('a@x.com', 'ai_calls_this_month', 250)
+    assert states.get('a@x.com')['ai_calls_this_month'] == 250
+
+
+@pytest.mark.unit
+def test_lapsed_active_subscription_is_not_served():
+    now = [datetime.now(timezone.utc).timestamp()]
+    states = SubscriptionStateCache(maxsize=8, ttl=3600, clock=lambda: now[0])
+    end = datetime.now(timezone.utc) + timedelta(seconds=30)
+    states.put('a@x.com', _subscription(plan_type='free_trial', trial_end_date=end.isoformat()))
+    assert states.get('a@x.com') is not None
+
+    now[0] += 60
+    assert states.get('a@x.com') is None
+    assert states.stats()['invalidations'] == 1
+
+
+@pytest.mark.unit
+def test_expired_subscription_stays_cached():
+    now = [datetime.now(timezone.utc).timestamp() + 86400 * 365]
+    states = SubscriptionStateCache(maxsize=8, ttl=3600, clock=lambda: now[0])
+    states.put('a@x.com', _subscription(status='expired'))
+    assert states.get('a@x.com')['status'] == 'expired'
+
+
+@pytest.mark.unit
+def test_period_end_epoch():
+    end = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert period_end_epoch({'plan_type': 'solo', 'current_period_end': end.isoformat()}) == end.timestamp()
+    assert period_end_epoch({'plan_type': 'free_trial', 'trial_end_date': end.replace(tzinfo=None)}) == end.timestamp()
+    assert period_end_epoch({'plan_type': 'solo', 'current_period_end': 'not a date'}) is None
+    assert period_end_epoch({'plan_type': 'solo'}) is None
+
+
+@pytest.mark.unit
+def test_invalidate():
+    states = SubscriptionStateCache(maxsize=8, ttl=60)
+    states.put('a@x.com', _subscription())
+    states.invalidate('a@x.com')
+    assert states.get('a@x.com') is None
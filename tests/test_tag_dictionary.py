@@ -0,0 +1,144 @@
+"""
+Tests for the per-physio and per-institute tag dictionaries (tag_dictionary.py).
+"""
+
+import pytest
+from tag_dictionary import (
+    DEFAULT_TAGS, TagDictionary, apply_tag_deltas, document_id, patient_owners, set_patient_tags, tag_deltas,
+)
+import tag_dictionary
+
+
+class FakeStore:
+    """load/save over in-memory dictionaries with a version compare-and-swap."""
+
+    def __init__(self):
+        self.docs = {}
+        self.loads = 0
+        self.before_save = lambda owner: None
+
+    def load(self, owner):
+        self.loads += 1
+        doc = self.docs.get(owner)
+        return (doc['tags'], doc['version']) if doc else None
+
+    def save(self, owner, table, expected_version):
+        self.before_save(owner)
+        current = self.docs.get(owner)
+        if (current['version'] if current else None) != expected_version:
+            return False
+        self.docs[owner] = {'tags': table, 'version': (expected_version or 0) + 1}
+        return True
+
+
+class FakeDoc:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakePatientRef:
+    """patch_if on _etag like Cosmos DB; the etag changes on every write."""
+
+    def __init__(self, doc):
+        self.doc = {**doc, '_etag': '"1"'}
+
+    def get(self):
+        return FakeDoc(self.doc)
+
+    def patch_if(self, fields, conditions=()):
+        if any(self.doc.get(field) != value for field, _, value in conditions):
+            return False
+        self.doc.update(fields)
+        self.doc['_etag'] = f'"{int(self.doc["_etag"].strip(chr(34))) + 1}"'
+        return True
+
+
+def _dictionary(store):
+    return TagDictionary(store.load, store.save, now=lambda: '2026-01-01T00:00:00+00:00')
+
+
+@pytest.mark.unit
+def test_deltas_and_counts():
+    assert tag_deltas(['Spine', 'Acute'], ['Spine', 'Falls']) == {'Falls': 1, 'Acute': -1}
+    table = {}
+    apply_tag_deltas(table, {'Spine': 1}, 't1')
+    apply_tag_deltas(table, {'Spine': 1}, 't2')
+    apply_tag_deltas(table, {'Spine': -1}, 't3')
+    assert table == {'Spine': {'count': 1, 'last_used': 't2'}}
+    apply_tag_deltas(table, {'Spine': -1}, 't4')
+    assert table == {}
+
+
+@pytest.mark.unit
+def test_racing_first_writes_both_count():
+    store = FakeStore()
+    dictionary = _dictionary(store)
+    owner = ('physio_id', 'a@x.com')
+
+    # Another worker creates the dictionary between this one's read and its create
+    def create_first(_):
+        store.before_save = lambda _: None
+        _dictionary(store).apply(owner, {'Falls': 1})
+    store.before_save = create_first
+
+    assert dictionary.apply(owner, {'Spine': 1})
+    assert set(store.docs[owner]['tags']) == {'Falls', 'Spine'}
+
+
+@pytest.mark.unit
+def test_owners_and_document_ids():
+    assert patient_owners({'physio_id': 'a@x.com', 'institute': ''}) == [('physio_id', 'a@x.com')]
+    assert document_id(('institute', 'Bone/Joint #1')) == 'institute:Bone_Joint _1'
+
+
+@pytest.mark.unit
+def test_suggestions_come_from_cached_dictionaries():
+    store = FakeStore()
+    dictionary = _dictionary(store)
+    dictionary.record({'physio_id': 'a@x.com', 'institute': 'Clinic'}, None, ['Spine', 'Custom'])
+    dictionary.record({'physio_id': 'b@x.com', 'institute': 'Clinic'}, None, ['Falls'])
+    loads = store.loads
+
+    for _ in range(3):
+        assert dictionary.tags([('physio_id', 'a@x.com')]) == ['Custom', 'Spine']
+    assert dictionary.tags([('institute', 'Clinic')]) == ['Custom', 'Falls', 'Spine']
+    # This worker's writes left the tables cached
+    assert store.loads == loads
+
+    assert set(dictionary.tags([('physio_id', 'c@x.com')], include_defaults=True)) == set(DEFAULT_TAGS)
+    dictionary.tags([('physio_id', 'c@x.com')])
+    assert store.loads == loads + 1
+
+
+@pytest.mark.unit
+def test_set_patient_tags_diffs_against_the_tags_it_replaced(monkeypatch):
+    store = FakeStore()
+    dictionary = _dictionary(store)
+    monkeypatch.setattr(tag_dictionary, '_dictionary', dictionary)
+
+    ref = FakePatientRef({'physio_id': 'a@x.com', 'tags': ['Spine']})
+    dictionary.record(ref.doc, None, ['Spine'])
+    stale = ref.get().to_dict()
+
+    # Another request changes the tags after we read the patient
+    assert set_patient_tags(ref, ref.get().to_dict(), ['Spine', 'Falls'])
+    assert set_patient_tags(ref, stale, ['Acute'])
+
+    assert ref.doc['tags'] == ['Acute']
+    assert store.docs[('physio_id', 'a@x.com')]['tags'] == {
+        'Acute': {'count': 1, 'last_used': '2026-01-01T00:00:00+00:00'}}
+
+
+@pytest.mark.unit
+def test_deleting_patient_releases_its_tags(monkeypatch):
+    store = FakeStore()
+    dictionary = _dictionary(store)
+    monkeypatch.setattr(tag_dictionary, '_dictionary', dictionary)
+    patient = {'physio_id': 'a@x.com', 'institute': 'Clinic', 'tags': ['Spine']}
+    tag_dictionary.record_tag_change(patient, None, patient['tags'])
+    tag_dictionary.record_tag_change(patient, patient['tags'], None)
+    assert dictionary.tags([('physio_id', 'a@x.com'), ('institute', 'Clinic')]) == []
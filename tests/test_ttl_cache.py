@@ -0,0 +1,52 @@
+"""
+Tests for the shared in-process TTLCache (ttl_cache.py).
+"""
+
+import time
+
+import pytest
+from ttl_cache import TTLCache
+
+
+@pytest.mark.unit
+def test_get_set_and_hit_miss_counters():
+    cache = TTLCache(maxsize=4, ttl=60, name='t')
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+
+
+@pytest.mark.unit
+def test_entries_expire():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('a', 'gone') == 'gone'
+    assert len(cache) == 0
+
+
+@pytest.mark.unit
+def test_least_recently_used_entry_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+@pytest.mark.unit
+def test_pop_and_clear_count_invalidations():
+    cache = TTLCache(maxsize=4, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.stats()['invalidations'] == 2
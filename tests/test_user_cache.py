@@ -0,0 +1,173 @@
+"""
+Tests for the cached user lookups behind the auth decorators (user_cache.py).
+"""
+
+import pytest
+import user_cache
+from user_cache import (
+    UID_INDEX_COLLECTION, find_user_email_by_firebase_uid, forget_firebase_uid, invalidate_user,
+    resolve_firebase_user,
+)
+
+
+class FakeDoc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def get(self, field):
+        return self._data.get(field)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeDB:
+    """users and firebase_uid_index containers, counting point reads and queries."""
+
+    def __init__(self, users=None, index=None):
+        self.docs = {'users': dict(users or {}), UID_INDEX_COLLECTION: dict(index or {})}
+        self.reads = []
+        self.queries = 0
+
+    def collection(self, name):
+        db = self
+
+        class Collection:
+            def document(self, doc_id):
+                class Ref:
+                    def get(self):
+                        db.reads.append((name, doc_id))
+                        return FakeDoc(doc_id, db.docs[name].get(doc_id))
+
+                    def set(self, data):
+                        db.docs[name][doc_id] = dict(data)
+
+                    def delete(self):
+                        db.docs[name].pop(doc_id, None)
+
+                return Ref()
+
+            def where(self, field, op, value):
+                db.queries += 1
+                matches = [FakeDoc(doc_id, data) for doc_id, data in db.docs[name].items()
+                           if data.get(field) == value]
+
+                class Query:
+                    def limit(self, n):
+                        return self
+
+                    def stream(self):
+                        return iter(matches)
+
+                return Query()
+
+        return Collection()
+
+
+USERS = {
+    'ann@x.com': {'name': 'Ann', 'firebase_uid': 'uid-ann', 'approved': 1},
+    'old@x.com': {'name': 'Legacy', 'firebase_uid': 'uid-legacy', 'approved': 1},
+}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    user_cache.clear_user_cache()
+    yield
+    user_cache.clear_user_cache()
+
+
+@pytest.mark.unit
+def test_indexed_uid_resolves_with_point_reads_then_from_memory():
+    db = FakeDB(USERS, index={'uid-ann': {'email': 'ann@x.com'}})
+    # Signed in with a different address than the document id
+    assert resolve_firebase_user('uid-ann', 'ann.other@gmail.com', db)['name'] == 'Ann'
+    assert db.queries == 0
+    assert (UID_INDEX_COLLECTION, 'uid-ann') in db.reads
+
+    reads = len(db.reads)
+    assert resolve_firebase_user('uid-ann', 'ann.other@gmail.com', db)['name'] == 'Ann'
+    assert len(db.reads) == reads
+
+
+@pytest.mark.unit
+def test_unindexed_uid_is_found_by_the_legacy_query_and_indexed():
+    db = FakeDB(USERS)
+    assert find_user_email_by_firebase_uid('uid-legacy', db) == 'old@x.com'
+    assert db.queries == 1
+    assert db.docs[UID_INDEX_COLLECTION]['uid-legacy']['email'] == 'old@x.com'
+
+    # Another worker (empty cache) uses the index, not the query
+    user_cache.clear_user_cache()
+    assert resolve_firebase_user('uid-legacy', 'someone@gmail.com', db)['name'] == 'Legacy'
+    assert db.queries == 1
+
+
+@pytest.mark.unit
+def test_uid_without_a_document_falls_back_to_the_token_email():
+    users = {'new@x.com': {'name': 'New'}}  # no firebase_uid on the document yet
+    db = FakeDB(users)
+    assert resolve_firebase_user('uid-new', 'new@x.com', db)['name'] == 'New'
+    assert db.queries == 1
+
+    # '' is cached: no second cross-partition query
+    assert resolve_firebase_user('uid-new', 'new@x.com', db)['name'] == 'New'
+    assert db.queries == 1
+    assert resolve_firebase_user('uid-nobody', 'nobody@x.com', db) is None
+
+
+@pytest.mark.unit
+def test_invalidate_and_forget():
+    db = FakeDB(USERS, index={'uid-ann': {'email': 'ann@x.com'}})
+    resolve_firebase_user('uid-ann', None, db)
+
+    db.docs['users']['ann@x.com'] = {**USERS['ann@x.com'], 'approved': 0}
+    assert resolve_firebase_user('uid-ann', None, db)['approved'] == 1  # cached
+    invalidate_user('ann@x.com')
+    assert resolve_firebase_user('uid-ann', None, db)['approved'] == 0
+
+    forget_firebase_uid('uid-ann', db)
+    assert 'uid-ann' not in db.docs[UID_INDEX_COLLECTION]
+    del db.docs['users']['ann@x.com']
+    invalidate_user('ann@x.com')
+    assert find_user_email_by_firebase_uid('uid-ann', db) is None
+
+
+@pytest.mark.unit
+def test_profile_is_cached_for_web_sessions():
+    db = FakeDB(USERS)
+    assert user_cache.get_user_profile('ann@x.com', db)['name'] == 'Ann'
+    assert user_cache.get_user_profile('ann@x.com', db)['name'] == 'Ann'
+    assert db.reads == [('users', 'ann@x.com')]
+
+    assert user_cache.get_user_profile('missing@x.com', db) is None
+    assert user_cache.get_user_profile('', db) is None
+
+
+@pytest.mark.unit
+def test_callers_get_a_copy_of_the_cached_profile():
+    users = {'ann@x.com': {**USERS['ann@x.com'], 'settings': {'theme': 'light'}}}
+    db = FakeDB(users)
+    profile = user_cache.get_user_profile('ann@x.com', db)
+    profile['approved'] = 0
+    profile['settings']['theme'] = 'dark'
+    assert user_cache.get_user_profile('ann@x.com', db) == {**USERS['ann@x.com'], 'settings': {'theme': 'light'}}
+
+
+@pytest.mark.unit
+def test_stats_report_hit_and_miss_timings():
+    db = FakeDB(USERS)
+    stats = user_cache.get_user_cache_stats()['profile_lookup_ms']
+    assert stats['hit'] == {'count': 0, 'avg_ms': None} and stats['saved_per_hit'] is None
+
+    user_cache.get_user_profile('ann@x.com', db)
+    for _ in range(3):
+        user_cache.get_user_profile('ann@x.com', db)
+    stats = user_cache.get_user_cache_stats()
+    lookups = stats['profile_lookup_ms']
+    assert lookups['miss']['count'] == 1 and lookups['hit']['count'] == 3
+    assert lookups['hit']['avg_ms'] >= 0 and lookups['miss']['avg_ms'] >= 0
+    assert lookups['saved_per_hit'] == round(lookups['miss']['avg_ms'] - lookups['hit']['avg_ms'], 3)
+    assert stats['profiles']['hits'] >= 3
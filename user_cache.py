@@ -0,0 +1,207 @@
+"""
+Cached user-record lookups for the auth decorators.
+
+Every authenticated mobile request used to run a cross-partition
+`users.where('firebase_uid', '==', uid)` query and then a point read by email.
+Now:
+
+- `firebase_uid_index` (partitioned by id = uid) maps a Firebase uid to the
+  id (email) of its `users` document. It is written wherever a user document
+  gets a firebase_uid and backfilled lazily from the legacy query the first
+  time an unindexed uid is seen.
+- uid -> email is cached per worker for an hour (it practically never
+  changes); user documents are cached per worker for USER_PROFILE_CACHE_TTL
+  seconds, so approval/role changes made on another worker apply within that
+  window. Routes that change a user call invalidate_user() so the change is
+  immediate on the worker that made it.
+
+A warm request resolves its user with no reads; after the profile entry
+expires, with one point read. The web session branch of require_auth uses
+the same profile cache (get_user_profile), so the dashboard, assessment forms
+and AJAX AI calls no longer re-read users/{email} on every request.
+
+get_user_cache_stats() reports hit/miss/invalidation counts plus the mean
+lookup time of hits and misses, i.e. what the cache takes off each request.
+
+Usage:
+    from user_cache import resolve_firebase_user, index_firebase_uid, invalidate_user
+
+    user_data = resolve_firebase_user(uid, token_email)   # None if no user
+    index_firebase_uid(uid, email)                      # after setting firebase_uid
+    invalidate_user(email)                              # after approve/reject/update
+"""
+
+import os
+import copy
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from cosmos_constants import SERVER_TIMESTAMP
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("app.user_cache")
+
+UID_INDEX_COLLECTION = 'firebase_uid_index'
+
+
+_profiles = TTLCache(
+    maxsize=int(os.environ.get('USER_PROFILE_CACHE_SIZE', '4096')),
+    ttl=float(os.environ.get('USER_PROFILE_CACHE_TTL', '30')),
+    name='user_profile',
+)
+# uid -> users document id ('' = no document carries this uid)
+_uid_emails = TTLCache(maxsize=_profiles.maxsize, ttl=3600, name='firebase_uid_email')
+
+# 'hit' / 'miss' -> [lookups, total seconds] for get_user_profile
+_lookup_times = {'hit': [0, 0.0], 'miss': [0, 0.0]}
+_lookup_lock = threading.Lock()
+
+
+def _db(db=None):
+    if db is not None:
+        return db
+    from azure_cosmos_db import get_cosmos_db
+    return get_cosmos_db()
+
+
+def _record_lookup(outcome: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    with _lookup_lock:
+        entry = _lookup_times[outcome]
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def get_user_profile(email: str, db=None) -> Optional[Dict[str, Any]]:
+    """users/{email} as a dict (cached), or None if there is no such user."""
+    if not email:
+        return None
+    started = time.perf_counter()
+    data = _profiles.get(email)
+    if data is not None:
+        _record_lookup('hit', started)
+        # A deep copy: callers may modify what they get (nested fields too)
+        return copy.deepcopy(data)
+    doc = _db(db).collection('users').document(email).get()
+    _record_lookup('miss', started)
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    _profiles.set(email, data)
+    return copy.deepcopy(data)
+
+
+def find_user_email_by_firebase_uid(uid: str, db=None) -> Optional[str]:
+    """Id (email) of the users document carrying this firebase_uid, or None."""
+    if not uid:
+        return None
+    email = _uid_emails.get(uid)
+    if email is None:
+        email = _load_uid_email(uid, db)
+    return email or None
+
+
+def _load_uid_email(uid: str, db=None) -> str:
+    db = _db(db)
+    index_doc = db.collection(UID_INDEX_COLLECTION).document(uid).get()
+    if index_doc.exists:
+        email = index_doc.get('email') or ''
+    else:
+        # Not indexed yet: fall back to the legacy cross-partition query once
+        email = ''
+        for doc in db.collection('users').where('firebase_uid', '==', uid).limit(1).stream():
+            email = doc.id
+            break
+        if email:
+            index_firebase_uid(uid, email, db)
+    # '' is cached too, so legacy users without an indexed uid don't repeat
+    # the cross-partition query; resolve_firebase_user then uses their email
+    _uid_emails.set(uid, email)
+    return email
+
+
+def resolve_firebase_user(uid: str, email: Optional[str] = None, db=None) -> Optional[Dict[str, Any]]:
+    """
+    User document for a Firebase identity: the document carrying this
+    firebase_uid, else the one keyed by the token's email. None if neither.
+    """
+    doc_email = _uid_emails.get(uid) if uid else None
+    if doc_email:
+        data = get_user_profile(doc_email, db)
+        if data is not None:
+            return data
+
+    # Usually the token email *is* the document id: one point read, no index
+    if email and doc_email is None:
+        data = get_user_profile(email, db)
+        if data is not None and data.get('firebase_uid') == uid:
+            _uid_emails.set(uid, email)
+            return data
+
+    if doc_email is None and uid:
+        doc_email = _load_uid_email(uid, db)
+        if doc_email:
+            data = get_user_profile(doc_email, db)
+            if data is not None:
+                return data
+    # No (live) document for this uid: the one keyed by the token's email
+    return get_user_profile(email, db)
+
+
+def index_firebase_uid(uid: str, email: str, db=None) -> None:
+    """Record uid -> email in the index container. Never raises."""
+    if not uid or not email:
+        return
+    _uid_emails.set(uid, email)
+    try:
+        _db(db).collection(UID_INDEX_COLLECTION).document(uid).set({
+            'email': email,
+            'updated_at': SERVER_TIMESTAMP,
+        })
+    except Exception as e:
+        logger.warning(f"Could not index firebase_uid for {email}: {e}")
+
+
+def forget_firebase_uid(uid: str, db=None) -> None:
+    """Drop a uid from the index (user deleted). Never raises."""
+    if not uid:
+        return
+    _uid_emails.pop(uid)
+    try:
+        _db(db).collection(UID_INDEX_COLLECTION).document(uid).delete()
+    except Exception as e:
+        logger.warning(f"Could not remove firebase_uid index entry: {e}")
+
+
+def invalidate_user(email: Optional[str] = None, uid: Optional[str] = None) -> None:
+    """Drop cached state for a user after it changes on this worker."""
+    if email:
+        _profiles.pop(email)
+    if uid:
+        _uid_emails.pop(uid)
+
+
+def clear_user_cache() -> None:
+    _profiles.clear()
+    _uid_emails.clear()
+    with _lookup_lock:
+        for entry in _lookup_times.values():
+            entry[0], entry[1] = 0, 0.0
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    with _lookup_lock:
+        lookups = {outcome: {'count': n, 'avg_ms': round(total * 1000 / n, 3) if n else None}
+                   for outcome, (n, total) in _lookup_times.items()}
+    hit_ms, miss_ms = lookups['hit']['avg_ms'], lookups['miss']['avg_ms']
+    saved_ms = None
+    if hit_ms is not None and miss_ms is not None:
+        # Per-request time the cache took off, on average, for a cached user
+        saved_ms = round(miss_ms - hit_ms, 3)
+    return {
+        'profiles': _profiles.stats(),
+        'uid_index': _uid_emails.stats(),
+        'profile_lookup_ms': {**lookups, 'saved_per_hit': saved_ms},
+    }